@@ -1,4 +1,6 @@
 from .. auxiliary_code.reffile_test import create_rfile_test
+from .. import core_utils
+from .. auxiliary_code import run_manifest
 
 """
 This file contains the functions which will be used to test the wcs_assign step
@@ -10,13 +12,15 @@ Selected keywords are checked to verify that the step ran through successfully.
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero & Gray Kanarek"
-__version__ = "2.1"
+__version__ = "2.3"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # May 2018 - Version 2.0: Gray added routine to generalize reference file check
 # Jul 2018 - Version 2.1: Maria removed the function to specifically create the full_run_map file, now this txt file
 #                         has the same format and information as the True_steps_map.txt file
+# Oct 2026 - Version 2.2: creating the map starts a new run manifest, and the total times are recorded in it
+# Oct 2026 - Version 2.3: the map and times are not written by the validation processes of overlapped runs
 
 
 def create_completed_steps_txtfile(txt_suffix_map, step_input_file):
@@ -29,6 +33,10 @@ def create_completed_steps_txtfile(txt_suffix_map, step_input_file):
     Returns:
         Nothing. A text file will be created in the pytests directory where all steps will be added
     """
+    if not core_utils.records_run():
+        return
+    # remove the records of previous runs from the manifest of the map
+    run_manifest.get_run_manifest(txt_suffix_map, new_run=True)
     # name of the text file to collect the step name and suffix
     #print ("Map created at: ", txt_suffix_map)
     line0 = "# {:<20}".format("Input file: "+step_input_file)
@@ -51,6 +59,9 @@ def print_time2file(txt_name, end_time, string2print):
     Returns:
         nothing
     """
+    if not core_utils.records_run():
+        return
+    run_manifest.get_run_manifest(txt_name).record_time(string2print, end_time)
     if float(end_time) > 60.0:
         total_time_min = repr(round(float(end_time)/60.0, 1))   # in minutes
         total_time = total_time_min+'min'
@@ -8,7 +8,6 @@ import subprocess
 import time
 import pytest
 import logging
-from astropy.io import fits
 from glob import glob
 from jwst.assign_wcs.assign_wcs_step import AssignWcsStep
 from jwst.pipeline.calwebb_spec2 import Spec2Pipeline
@@ -16,6 +15,7 @@ from jwst.pipeline.calwebb_image2 import Image2Pipeline
 
 from . import assign_wcs_utils
 from .. import core_utils
+from .. auxiliary_code import model_store
 from .. auxiliary_code import change_filter_opaque2science
 from .. auxiliary_code import compare_wcs_ifu
 from .. auxiliary_code import compare_wcs_fs
@@ -30,7 +30,7 @@ print(pipeline_version)
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero & Gray Kanarek"
-__version__ = "2.3"
+__version__ = "2.9"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -38,6 +38,12 @@ __version__ = "2.3"
 # Feb 2019 - Version 2.1: Maria made changes to be able to process 491 and 492 files in the same directory
 # Apr 2019 - Version 2.2: implemented logging capability
 # Dec 2019 - Version 2.3: implemented image processing and text file name handling
+# Oct 2026 - Version 2.4: the WCS validation can be run with several worker processes (wcs_n_workers)
+# Oct 2026 - Version 2.5: headers and keywords are read through the header cache
+# Oct 2026 - Version 2.6: the WCS validation takes the session observation context
+# Oct 2026 - Version 2.7: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 2.8: the map is not removed by the validation processes of overlapped runs (see run_PTT.py)
+# Oct 2026 - Version 2.9: the step is not run again if its inputs did not change (incremental_steps)
 
 
 
@@ -58,7 +64,7 @@ def set_inandout_filenames(config):
         print("\n Taking initial file from working_directory: ")
     print(" Initial input file = ", initial_input_file , "\n")
     # Get the detector used
-    detector = fits.getval(initial_input_file, "DETECTOR", 0)
+    detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     True_steps_suffix_map = "True_steps_suffix_map_"+detector+".txt"
     pytests_directory = os.getcwd()
     True_steps_suffix_map = os.path.join(pytests_directory, True_steps_suffix_map)
@@ -86,7 +92,7 @@ def output_hdul(set_inandout_filenames, config):
     # determine if the pipeline is to be run in full
     run_calwebb_spec2 = config.getboolean("run_calwebb_spec2_in_full", "run_calwebb_spec2")
     # determine which steps are to be run, if not run in full
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     assign_wcs_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     assign_wcs_reffile_tests = config.getboolean("run_pytest", "_".join((step, "reffile", "tests")))
@@ -97,10 +103,11 @@ def output_hdul(set_inandout_filenames, config):
     esa_files_path = config.get("esa_intermediary_products", "esa_files_path")
     wcs_threshold_diff = config.get("additional_arguments", "wcs_threshold_diff")
     save_wcs_plots = config.getboolean("additional_arguments", "save_wcs_plots")
+    wcs_n_workers = config.getint("additional_arguments", "wcs_n_workers", fallback=1)
     working_directory = config.get("calwebb_spec2_input_file", "working_directory")
 
     # Get the detector used
-    detector = fits.getval(step_input_file, "DETECTOR", 0)
+    detector = core_utils.get_keywd_val(step_input_file, "DETECTOR")
 
     # get main header from input file
     inhdu = core_utils.read_hdrfits(step_input_file, info=False, show_hdr=False)
@@ -112,9 +119,9 @@ def output_hdul(set_inandout_filenames, config):
     # Check if data is IFU that the Image Model keyword is correct
     mode_used = config.get("calwebb_spec2_input_file", "mode_used").lower()
     if mode_used == "ifu":
-        DATAMODL = fits.getval(step_input_file, "DATAMODL", 0)
+        DATAMODL = core_utils.get_keywd_val(step_input_file, "DATAMODL")
         if DATAMODL != "IFUImageModel":
-            fits.setval(step_input_file, "DATAMODL", 0, value="IFUImageModel")
+            core_utils.set_keywd_val(step_input_file, "DATAMODL", "IFUImageModel")
             print("DATAMODL keyword changed to IFUImageModel.")
 
     # get the shutter configuration file for MOS data only
@@ -123,10 +130,10 @@ def output_hdul(set_inandout_filenames, config):
         msa_shutter_conf = config.get("esa_intermediary_products", "msa_conf_name")
 
         # check if the configuration shutter file name is in the header of the fits file and if not add it
-        msametfl = fits.getval(step_input_file, "MSAMETFL", 0)
+        msametfl = core_utils.get_keywd_val(step_input_file, "MSAMETFL")
         if os.path.basename(msa_shutter_conf) != msametfl:
             msametfl = os.path.basename(msa_shutter_conf)
-            fits.setval(step_input_file, "MSAMETFL", 0, value=msametfl)
+            core_utils.set_keywd_val(step_input_file, "MSAMETFL", msametfl)
 
     # check if processing an image, then set proper variables
     imaging_mode = False
@@ -160,7 +167,7 @@ def output_hdul(set_inandout_filenames, config):
 
         # create the map
         txt_name = "full_run_map_"+detector+".txt"
-        if os.path.isfile(txt_name):
+        if os.path.isfile(txt_name) and core_utils.records_run():
             os.remove(txt_name)
         assign_wcs_utils.create_completed_steps_txtfile(txt_name, step_input_file)
 
@@ -269,12 +276,12 @@ def output_hdul(set_inandout_filenames, config):
             print('\nPTT finished processing imaging mode. \n')
             pytest.exit("Skipping pytests for now because they need to be written for imaging mode.")
 
-        return hdul, step_output_file, msa_shutter_conf, esa_files_path, wcs_threshold_diff, save_wcs_plots, run_pytests, mode_used
+        return hdul, step_output_file, msa_shutter_conf, esa_files_path, wcs_threshold_diff, save_wcs_plots, run_pytests, mode_used, wcs_n_workers
 
     else:
 
         # create the map but remove a previous one if it exists
-        if os.path.isfile(txt_name):
+        if os.path.isfile(txt_name) and core_utils.records_run():
             os.remove(txt_name)
         assign_wcs_utils.create_completed_steps_txtfile(txt_name, step_input_file)
 
@@ -304,7 +311,7 @@ def output_hdul(set_inandout_filenames, config):
             # check that previous pipeline steps were run up to this point
             core_utils.check_completed_steps(step, step_input_file)
 
-            if os.path.isfile(step_input_file):
+            if model_store.exists(step_input_file):
                 msg = " *** Step "+step+" set to True"
                 print(msg)
                 logging.info(msg)
@@ -321,10 +328,10 @@ def output_hdul(set_inandout_filenames, config):
                 print("running pipeline...")
                 start_time = time.time()
                 if local_pipe_cfg_path == "pipe_source_tree_code":
-                    result = stp.call(step_input_file)
+                    result = stp.call(model_store.get_step_input(step_input_file))
                 else:
-                    result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/assign_wcs.cfg')
-                result.save(step_output_file)
+                    result = stp.call(model_store.get_step_input(step_input_file), config_file=local_pipe_cfg_path+'/assign_wcs.cfg')
+                model_store.save_step_output(result, step_output_file)
 
                 # end the timer to compute the step running time
                 end_time = repr(time.time() - start_time)   # this is in seconds
@@ -360,12 +367,12 @@ def output_hdul(set_inandout_filenames, config):
             # add the running time for this step
             end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
 
-        if os.path.isfile(step_output_file):
+        if model_store.exists(step_output_file):
             hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
             step_completed = True
             # add the running time for this step
             core_utils.add_completed_steps(txt_name, step, outstep_file_suffix, step_completed, end_time)
-            return hdul, step_output_file, msa_shutter_conf, esa_files_path, wcs_threshold_diff, save_wcs_plots, run_pytests, mode_used
+            return hdul, step_output_file, msa_shutter_conf, esa_files_path, wcs_threshold_diff, save_wcs_plots, run_pytests, mode_used, wcs_n_workers
         else:
             step_completed = False
             # add the running time for this step
@@ -379,13 +386,15 @@ def output_hdul(set_inandout_filenames, config):
 
 # fixture to validate the WCS
 @pytest.fixture(scope="module")
-def validate_wcs(output_hdul):
+def validate_wcs(output_hdul, obs_context):
     # get the input information for the wcs routine
     hdu = output_hdul[0]
     infile_name = output_hdul[1]
     msa_conf_name = output_hdul[2]
     esa_files_path = output_hdul[3]
     mode_used = output_hdul[7]
+    # the validation reads the file, make sure it has been written
+    model_store.ensure_saved(infile_name)
 
     # define the threshold difference between the pipeline output and the ESA files for the pytest to pass or fail
     threshold_diff = float(output_hdul[4])
@@ -396,22 +405,28 @@ def validate_wcs(output_hdul):
     # show the figures
     show_figs = False
 
+    # number of processes to validate the slits, slitlets, or slices
+    n_workers = output_hdul[8]
+
     msg = "\n Performing WCS validation test... "
     print(msg)
     logging.info(msg)
     log_msgs = None
     if core_utils.check_FS_true(hdu):
         result, log_msgs = compare_wcs_fs.compare_wcs(infile_name, esa_files_path=esa_files_path, show_figs=show_figs,
-                                            save_figs=save_wcs_plots, threshold_diff=threshold_diff, debug=False)
+                                            save_figs=save_wcs_plots, threshold_diff=threshold_diff, debug=False,
+                                            n_workers=n_workers, obs_context=obs_context)
 
     elif core_utils.check_MOS_true(hdu)  and  mode_used != "MOS_sim":
         result, log_msgs = compare_wcs_mos.compare_wcs(infile_name, esa_files_path=esa_files_path, msa_conf_name=msa_conf_name,
                                              show_figs=show_figs, save_figs=save_wcs_plots,
-                                             threshold_diff=threshold_diff, debug=False)
+                                             threshold_diff=threshold_diff, debug=False, n_workers=n_workers,
+                                             obs_context=obs_context)
 
     elif core_utils.check_IFU_true(hdu):
         result, log_msgs = compare_wcs_ifu.compare_wcs(infile_name, esa_files_path=esa_files_path, show_figs=show_figs,
-                                            save_figs=save_wcs_plots, threshold_diff=threshold_diff, debug=False)
+                                            save_figs=save_wcs_plots, threshold_diff=threshold_diff, debug=False,
+                                            n_workers=n_workers, obs_context=obs_context)
 
     else:#if core_utils.check_BOTS_true(hdu):
         #pytest.skip("Skipping pytest: BOTS files at the moment are not being compared against an ESA intermediary product.")
@@ -8,22 +8,25 @@ import os
 import time
 import logging
 from glob import glob
-from astropy.io import fits
 from jwst.background.background_step import BackgroundStep
 
 from .. import core_utils
+from .. auxiliary_code import model_store
 from . import bkg_subtract_utils
 
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.5"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Mar 2019 - Version 1.1: separated completion from numerical tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: headers and keywords are read through the header cache
+# Oct 2026 - Version 1.4: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 1.5: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -43,7 +46,7 @@ def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
     # determine which steps are to be run, if not run in full
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     bkg_subtract_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     #bkg_subtract_numerical_tests = config.getboolean("run_pytest", "_".join((step, "numerical", "tests")))
@@ -58,7 +61,7 @@ def output_hdul(set_inandout_filenames, config):
     working_directory = config.get("calwebb_spec2_input_file", "working_directory")
     initial_input_file = config.get("calwebb_spec2_input_file", "input_file")
     initial_input_file = os.path.join(working_directory, initial_input_file)
-    detector = fits.getval(initial_input_file, "DETECTOR", 0)
+    detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     calspec2_pilelog = "calspec2_pipeline_" + step + "_" + detector + ".log"
     pytest_workdir = os.getcwd()
 
@@ -70,7 +73,7 @@ def output_hdul(set_inandout_filenames, config):
     if not core_utils.check_BOTS_true(inhdu):
 
         if run_calwebb_spec2:
-            if os.path.isfile(step_output_file):
+            if model_store.exists(step_output_file):
                 hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
             else:
                 pytest.skip("Skipping "+step+" because the output file does not exist.")
@@ -94,7 +97,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(pipeline_version)
                 logging.info(pipeline_version)
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
                     msg = " The input file "+step_input_file+" exists... will run step "+step
                     print(msg)
                     logging.info(msg)
@@ -126,12 +129,12 @@ def output_hdul(set_inandout_filenames, config):
                         start_time = time.time()
                         print("running pipeline...")
                         if local_pipe_cfg_path == "pipe_source_tree_code":
-                            result = stp.call(step_input_file, bkg_list)
+                            result = stp.call(model_store.get_step_input(step_input_file), bkg_list)
                         else:
-                            result = stp.call(step_input_file, bkg_list, config_file=local_pipe_cfg_path+'/background.cfg')
+                            result = stp.call(model_store.get_step_input(step_input_file), bkg_list, config_file=local_pipe_cfg_path+'/background.cfg')
 
                         if result is not None:
-                            result.save(step_output_file)
+                            model_store.save_step_output(result, step_output_file)
                             # end the timer to compute the step running time
                             end_time = repr(time.time() - start_time)   # this is in seconds
                             msg = "Step "+step+" took "+end_time+" seconds to finish"
@@ -161,7 +164,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(msg)
                 logging.info(msg)
                 end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
                     # add the running time for this step
@@ -14,18 +14,22 @@ from astropy.io import fits
 from jwst.imprint.imprint_step import ImprintStep
 
 from .. import core_utils
+from .. auxiliary_code import model_store
 from . import imprint_subtract_utils
 
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.5"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Mar 2019 - Version 1.1: separated completion from numerical tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: headers and keywords are read through the header cache
+# Oct 2026 - Version 1.4: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 1.5: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -46,7 +50,7 @@ def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
     # determine which steps are to be run, if not run in full
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     imprint_subtract_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     imprint_subtract_numerical_tests = config.getboolean("run_pytest", "_".join((step, "numerical", "tests")))
@@ -59,7 +63,7 @@ def output_hdul(set_inandout_filenames, config):
     working_directory = config.get("calwebb_spec2_input_file", "working_directory")
     initial_input_file = config.get("calwebb_spec2_input_file", "input_file")
     initial_input_file = os.path.join(working_directory, initial_input_file)
-    detector = fits.getval(initial_input_file, "DETECTOR", 0)
+    detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     calspec2_pilelog = "calspec2_pipeline_" + step + "_" + detector + ".log"
     pytest_workdir = os.getcwd()
 
@@ -73,7 +77,7 @@ def output_hdul(set_inandout_filenames, config):
         # if run_calwebb_spec2 is True calwebb_spec2 will be called, else individual steps will be ran
         step_completed = False
         if run_calwebb_spec2:
-            if os.path.isfile(step_output_file):
+            if model_store.exists(step_output_file):
                 hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
             else:
                 pytest.skip("Skipping "+step+" because the output file does not exist.")
@@ -97,7 +101,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(pipeline_version)
                 logging.info(pipeline_version)
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
                     msg = " The input file "+step_input_file+" exists... will run step "+step
                     print(msg)
                     logging.info(msg)
@@ -126,12 +130,12 @@ def output_hdul(set_inandout_filenames, config):
                         # start the timer to compute the step running time
                         start_time = time.time()
                         if local_pipe_cfg_path == "pipe_source_tree_code":
-                            result = stp.call(step_input_file, msa_imprint_structure)
+                            result = stp.call(model_store.get_step_input(step_input_file), msa_imprint_structure)
                         else:
-                            result = stp.call(step_input_file, msa_imprint_structure,
+                            result = stp.call(model_store.get_step_input(step_input_file), msa_imprint_structure,
                                               config_file=local_pipe_cfg_path+'/imprint.cfg')
                         if result is not None:
-                            result.save(step_output_file)
+                            model_store.save_step_output(result, step_output_file)
                             # end the timer to compute the step running time
                             end_time = repr(time.time() - start_time)   # this is in seconds
                             msg = "Step "+step+" took "+end_time+" seconds to finish"
@@ -165,7 +169,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(msg)
                 logging.info(msg)
                 end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
                     # add the running time for this step
@@ -196,12 +200,15 @@ def check_output_is_zero(output_hdul):
     if core_utils.check_IFU_true(inhdu) or core_utils.check_MOS_true(inhdu):
         if run_step:
             # set specifics for the test
+            # the input file is also used as the imprint structure, make sure it has been written
+            model_store.ensure_saved(step_input_file)
             msa_imprint_structure = copy.deepcopy(step_input_file)
             result_to_check = step_output_file.replace(".fits", "_zerotest.fits")
             # run the step with the specifics
             stp = ImprintStep()
-            res = stp.call(step_input_file, msa_imprint_structure)
+            res = stp.call(model_store.get_step_input(step_input_file), msa_imprint_structure)
             res.save(result_to_check)
+            core_utils.clear_header_cache(result_to_check)
             # check that the end product of image - image is zero
             c = fits.getdata(result_to_check)
             substraction = sum(c.flatten())
@@ -8,21 +8,24 @@ import os
 import time
 import logging
 from glob import glob
-from astropy.io import fits
 from jwst.msaflagopen.msaflagopen_step import MSAFlagOpenStep
 
 from .. import core_utils
+from .. auxiliary_code import model_store
 from . import msa_flagging_utils
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.5"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Mar 2019 - Version 1.1: separated completion tests from future tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: headers and keywords are read through the header cache
+# Oct 2026 - Version 1.4: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 1.5: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -47,7 +50,7 @@ def output_hdul(set_inandout_filenames, config):
     #msa_flagging_validation_tests = config.getboolean("run_pytest", "_".join((step, "validation", "tests")))
     run_pytests = [msa_flagging_completion_tests]#, msa_flagging_reffile_tests, msa_flagging_validation_tests]
     # determine which steps are to be run, if not run in full
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
 
     end_time = '0.0'
 
@@ -57,7 +60,7 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
         inhdu = core_utils.read_hdrfits(initial_input_file, info=False, show_hdr=False)
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
 
@@ -72,7 +75,7 @@ def output_hdul(set_inandout_filenames, config):
         else:
             if run_pipe_step:
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
 
                     msg = " The input file "+step_input_file+" exists... will run step "+step
                     print(msg)
@@ -101,10 +104,10 @@ def output_hdul(set_inandout_filenames, config):
                     # start the timer to compute the step running time
                     start_time = time.time()
                     #if local_pipe_cfg_path == "pipe_source_tree_code":
-                    result = stp.call(step_input_file)
+                    result = stp.call(model_store.get_step_input(step_input_file))
                     #else:
                     #    result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/NOCONFIGFI.cfg')
-                    result.save(step_output_file)
+                    model_store.save_step_output(result, step_output_file)
                     # end the timer to compute the step running time
                     end_time = repr(time.time() - start_time)   # this is in seconds
                     msg = "Step "+step+" took "+end_time+" seconds to finish"
@@ -137,7 +140,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(msg)
                 logging.info(msg)
                 end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
                     # add the running time for this step
@@ -4,16 +4,23 @@ import math
 from collections import OrderedDict
 from astropy.io import fits
 from ..auxiliary_code import auxiliary_functions as auxfunc
+from ..auxiliary_code import esa_trace_reader
+from ..auxiliary_code import header_cache
+from ..auxiliary_code import phase_timing
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.6"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Jan 2019 - Version 1.1: Maria modified and added Gray's code for validation tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: ESA trace files are opened once and shared through esa_trace_reader.
+# Oct 2026 - Version 1.4: the headers are read through the header cache
+# Oct 2026 - Version 1.5: the raw data file name is read once per test, or taken from the observation context
+# Oct 2026 - Version 1.6: the time of each phase of the corner tests is recorded per slit (see phase_timing.py)
 
 
 """
@@ -39,13 +46,16 @@ def s_ext2d_exists(output_hdul):
     return result
 
 
-def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=4):
+@phase_timing.timed("extract_2d_fs")
+def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=4, obs_context=None):
     """
     Find the slits corners of pipeline and ESA file and determine if they match.
     Args:
         infile_name - string, name of the input pipeline fits file
         esa_files_path - string, path to locate esa files
         extract_2d_threshold_diff - integer, maximum allowed difference tolerance in pixels
+        obs_context - ObservationContext object (see observation_context.py), if given the raw data file name is
+                      taken from it instead of the configuration file
 
     Returns:
         result - string or dictionary
@@ -58,16 +68,20 @@ def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=
     log_msgs = []
 
     # iterate over slits
+    phase_timing.start_phase("file_read")
     sci_dict = auxfunc.get_sci_extensions(infile_name)
 
-    primary_header = fits.getheader(infile_name, ext=0)
+    primary_header = header_cache.get_header(infile_name, 0)
     detector = primary_header["DETECTOR"]
     #grating = primary_header["GRATING"]
+    _, raw_data_root_file = auxfunc.get_modeused_and_rawdatrt_PTT_cfg_file(obs_context)
 
     for i, s_ext in enumerate(sci_dict):
         s_ext_number = sci_dict[s_ext]
+        phase_timing.set_slit(s_ext)
+        phase_timing.start_phase("file_read")
         print('Working on slit ', s_ext)
-        sci_header = fits.getheader(infile_name, ext=s_ext_number)
+        sci_header = header_cache.get_header(infile_name, s_ext_number)
 
         # grab corners of extracted subwindow
         px0 = sci_header["SLTSTRT1"] + primary_header["SUBSTRT1"] - 1
@@ -81,8 +95,8 @@ def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=
         pipeline_corners = [px0, py0, px1, py1]
 
         # Find esafile (most of this copy-pasted from compare_wcs_fs)
+        phase_timing.start_phase("esa_lookup")
         sltname = sci_header["SLTNAME"]
-        _, raw_data_root_file = auxfunc.get_modeused_and_rawdatrt_PTT_cfg_file()
         specifics = [sltname]
         # check if ESA data is not in the regular directory tree
         NIDs = ["30055", "30055", "30205", "30133", "30133"]
@@ -135,7 +149,8 @@ def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=
 
             if slit in esafile:
                 print("Using this ESA file: \n", esafile)
-                with fits.open(esafile) as esahdulist:
+                phase_timing.start_phase("esa_read")
+                with esa_trace_reader.open_esa_trace(esafile) as esahdulist:
                     # Find corners from ESA file
                     #print(esahdulist.info())
                     if detector == "NRS1" or "NRS1" in infile_name  or  "491" in infile_name:
@@ -153,10 +168,10 @@ def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=
                     for ext in esahdulist:
                         enext.append(ext)
                     if detector == "NRS1":
-                        eflux = fits.getdata(esafile, "DATA1")
+                        eflux = esahdulist.get_data("DATA1")
                     if detector == "NRS2":
                         try:
-                            eflux = fits.getdata(esafile, "DATA2")
+                            eflux = esahdulist.get_data("DATA2")
                         except:
                             IndexError
                             msg1 = " * Exiting extract_2d test because there are no extensions that match detector NRS2 in the ESA file."
@@ -183,6 +198,7 @@ def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=
                     esa_corners = [ex0, ey0, ex1, ey1]
 
                     # Pytest pass/fail criterion: if esa corners match pipeline corners then True, else False
+                    phase_timing.start_phase("statistics")
                     result[sltname], msgs = esa_corners_in_pipeline_corners(esa_corners, pipeline_corners,
                                                                    extract_2d_threshold_diff=extract_2d_threshold_diff)
                     for msg in msgs:
@@ -211,6 +227,7 @@ def find_FSwindowcorners(infile_name, esa_files_path, extract_2d_threshold_diff=
                         # Record all the corners that have points larger than threshold
                         large_diff_corners_dict[sltname] = [esa_corners, pipeline_corners]
 
+    phase_timing.set_slit(None)
     # If all tests passed then pytest will be marked as PASSED, else it will be FAILED
     print('\nSummary of test results: \n', result)
     FINAL_TEST_RESULT = False
@@ -279,7 +296,8 @@ def esa_corners_in_pipeline_corners(esa_corners, pipeline_corners, extract_2d_th
     return result, msgs
 
 
-def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d_threshold_diff=4):
+@phase_timing.timed("extract_2d_mos")
+def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d_threshold_diff=4, obs_context=None):
     """
     Find the slitlet corners of pipeline and ESA files and determine if they match.
     Args:
@@ -287,6 +305,8 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
         msa_conf_name - string, path and name of the MSA configuration file
         esa_files_path - string, path to locate esa files
         extract_2d_threshold_diff - integer, maximum allowed difference tolerance in pixels
+        obs_context - ObservationContext object (see observation_context.py), if given the raw data file name is
+                      taken from it instead of the configuration file
     Retrurs:
         result - string or dictionary
                 if string, test is set to skip
@@ -299,9 +319,11 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
     log_msgs = []
 
     # Grab initial metadata
-    primary_header = fits.getheader(infile_name, ext=0)
+    phase_timing.start_phase("file_read")
+    primary_header = header_cache.get_header(infile_name, 0)
     msametfl = primary_header["MSAMETFL"]
     detector = primary_header["DETECTOR"]
+    _, raw_data_root_file = auxfunc.get_modeused_and_rawdatrt_PTT_cfg_file(obs_context)
 
     # check that shutter configuration file in header is the same as given in PTT_config file
     if msametfl != os.path.basename(msa_conf_name):
@@ -338,8 +360,10 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
     # Iterate over sci extensions
     for i, s_ext in enumerate(sci_ext_dict):
         s_ext_number = sci_ext_dict[s_ext]
-        sci_header = fits.getheader(infile_name, ext=s_ext_number)
+        sci_header = header_cache.get_header(infile_name, s_ext_number)
         name = sci_header['SLTNAME']
+        phase_timing.set_slit(name)
+        phase_timing.start_phase("file_read")
         msg = "\nWorking with slit: "+name
         print(msg)
         log_msgs.append(msg)
@@ -359,7 +383,7 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
         pipeline_corners = [px0, py0, px1, py1]
 
         # Identify the associated ESA file
-        _, raw_data_root_file = auxfunc.get_modeused_and_rawdatrt_PTT_cfg_file()
+        phase_timing.start_phase("esa_lookup")
         msg = "Using this raw data file to find the corresponding ESA file: "+raw_data_root_file
         print(msg)
         log_msgs.append(msg)
@@ -385,7 +409,8 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
             continue
 
         # Open esafile and grab subarray coordinates
-        with fits.open(esafile) as esahdulist:
+        phase_timing.start_phase("esa_read")
+        with esa_trace_reader.open_esa_trace(esafile) as esahdulist:
             if "NRS1" in detector  or  "491" in detector:
                 dat = "DATA1"
             else:
@@ -443,6 +468,7 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
 
             esa_corners = [ex0, ey0, ex1, ey1]
 
+            phase_timing.start_phase("statistics")
             result[name], msgs = esa_corners_in_pipeline_corners(esa_corners, pipeline_corners,
                                                                  extract_2d_threshold_diff=extract_2d_threshold_diff)
             for msg in msgs:
@@ -471,6 +497,7 @@ def find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path, extract_2d
                 # Record all the corners that have points larger than threshold
                 large_diff_corners_dict[name] = [esa_corners, pipeline_corners]
 
+    phase_timing.set_slit(None)
     # If all tests passed then pytest will be marked as PASSED, else it will be FAILED
     FINAL_TEST_RESULT = False
     for t, v in result.items():
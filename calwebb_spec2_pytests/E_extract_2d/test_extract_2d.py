@@ -8,23 +8,27 @@ import os
 import time
 import logging
 from glob import glob
-from astropy.io import fits
 
 from jwst.extract_2d.extract_2d_step import Extract2dStep
 from .. import core_utils
+from .. auxiliary_code import model_store
 from . import extract_2d_utils
 from .. auxiliary_code import compare_wcs_mos
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero & G. Kanarek"
-__version__ = "2.2"
+__version__ = "2.6"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Jan 2019 - Version 2.0: test separated from assign_wcs
 # Mar 2019 - Version 2.1: separated completion from validation tests
 # Apr 2019 - Version 2.2: implemented logging capability
+# Oct 2026 - Version 2.3: headers and keywords are read through the header cache
+# Oct 2026 - Version 2.4: the validations take the session observation context
+# Oct 2026 - Version 2.5: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 2.6: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -43,7 +47,7 @@ def set_inandout_filenames(request, config):
 def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     extract_2d_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     extract_2d_validation_tests = config.getboolean("run_pytest", "_".join((step, "validation", "tests")))
@@ -69,7 +73,7 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
         inhdu = core_utils.read_hdrfits(initial_input_file, info=False, show_hdr=False)
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
 
@@ -95,7 +99,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(pipeline_version)
                 logging.info(pipeline_version)
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
                     msg = " The input file "+step_input_file+" exists... will run step "+step
                     print(msg)
                     logging.info(msg)
@@ -110,10 +114,10 @@ def output_hdul(set_inandout_filenames, config):
                     # start the timer to compute the step running time
                     start_time = time.time()
                     if local_pipe_cfg_path == "pipe_source_tree_code":
-                        result = stp.call(step_input_file)
+                        result = stp.call(model_store.get_step_input(step_input_file))
                     else:
-                        result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/extract_2d.cfg')
-                    result.save(step_output_file)
+                        result = stp.call(model_store.get_step_input(step_input_file), config_file=local_pipe_cfg_path+'/extract_2d.cfg')
+                    model_store.save_step_output(result, step_output_file)
                     step_completed = True
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
 
@@ -149,7 +153,7 @@ def output_hdul(set_inandout_filenames, config):
                 logging.info(msg)
                 end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
 
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
                     # add the running time for this step
@@ -172,12 +176,14 @@ def output_hdul(set_inandout_filenames, config):
 
 # fixture to validate the WCS and extract 2d steps only for MOS simulations
 @pytest.fixture(scope="module")
-def validate_MOSsim_wcs_extract2d(output_hdul):
+def validate_MOSsim_wcs_extract2d(output_hdul, obs_context):
     # get the input information for the wcs routine
     infile_name = output_hdul[1]
     msa_conf_name = output_hdul[2]
     esa_files_path = output_hdul[3]
     mode_used = output_hdul[5]
+    # the validation reads the file, make sure it has been written
+    model_store.ensure_saved(infile_name)
     
     # define the threshold difference between the pipeline output and the ESA files for the pytest to pass or fail
     threshold_diff = float(output_hdul[6])
@@ -194,7 +200,8 @@ def validate_MOSsim_wcs_extract2d(output_hdul):
     if mode_used == "mos_sim":
         result, log_msgs = compare_wcs_mos.compare_wcs(infile_name, esa_files_path=esa_files_path, msa_conf_name=msa_conf_name,
                                              show_figs=show_figs, save_figs=save_wcs_plots,
-                                             threshold_diff=threshold_diff, mode_used=mode_used, debug=False)
+                                             threshold_diff=threshold_diff, mode_used=mode_used, debug=False,
+                                             obs_context=obs_context)
         for msg in log_msgs:
             logging.info(msg)
 
@@ -209,19 +216,23 @@ def validate_MOSsim_wcs_extract2d(output_hdul):
 
 # fixture to validate extract 2d step
 @pytest.fixture(scope="module")
-def validate_extract2d(output_hdul):
+def validate_extract2d(output_hdul, obs_context):
     # get the input information for the wcs routine
     hdu, infile_name, msa_conf_name, esa_files_path, _, _, _, _, extract_2d_threshold_diff = output_hdul
+    # the validation reads the file, make sure it has been written
+    model_store.ensure_saved(infile_name)
     print('Will be using this number of pixels as threshold for extract_2d test: ', extract_2d_threshold_diff)
 
     msg = "\n Performing extract_2d validation test... "
     print(msg)
     logging.info(msg)
     if core_utils.check_FS_true(hdu):
-        result, log_msgs = extract_2d_utils.find_FSwindowcorners(infile_name, esa_files_path)
+        result, log_msgs = extract_2d_utils.find_FSwindowcorners(infile_name, esa_files_path,
+                                                                  obs_context=obs_context)
 
     elif core_utils.check_MOS_true(hdu):
-        result, log_msgs = extract_2d_utils.find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path)
+        result, log_msgs = extract_2d_utils.find_MOSwindowcorners(infile_name, msa_conf_name, esa_files_path,
+                                                                   obs_context=obs_context)
         
     else:
         pytest.skip("Skipping pytest: The fits file is not FS or MOS.")
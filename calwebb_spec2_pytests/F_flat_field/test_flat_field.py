@@ -9,27 +9,34 @@ import time
 import pytest
 import logging
 from glob import glob
-from astropy.io import fits
 
 from jwst.flatfield.flat_field_step import FlatFieldStep
 
 from . import flat_field_utils
 from .. import core_utils
+from .. auxiliary_code import model_store
 from .. auxiliary_code import flattest_fs
 from .. auxiliary_code import flattest_ifu
 from .. auxiliary_code import flattest_mos
+from .. auxiliary_code import reference_flat_cache
 from .. auxiliary_code import change_filter_opaque2science
 
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.8"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Mar 2019 - Version 1.1: modified reference file tests and separated completion from validation tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: added switch to calculate the flat with array operations instead of the pixel loop
+# Oct 2026 - Version 1.4: added memory budget for the cache of reference flats
+# Oct 2026 - Version 1.5: headers and keywords are read through the header cache
+# Oct 2026 - Version 1.6: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 1.7: the step is not run again if its inputs did not change (incremental_steps)
+# Oct 2026 - Version 1.8: the step output is written before it is validated, also with background writing
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -56,9 +63,13 @@ def output_hdul(set_inandout_filenames, config):
     flattest_threshold_diff = config.get("additional_arguments", "flattest_threshold_diff")
     save_flattest_plot = config.getboolean("additional_arguments", "save_flattest_plot")
     write_flattest_files = config.getboolean("additional_arguments", "write_flattest_files")
+    flattest_vectorized = config.getboolean("additional_arguments", "flattest_vectorized", fallback=True)
+    flattest_cache_mbytes = config.getfloat("additional_arguments", "flattest_cache_mbytes",
+                                            fallback=reference_flat_cache.default_max_cache_mbytes)
+    reference_flat_cache.set_max_cache_size(flattest_cache_mbytes)
     flattest_paths = [step_output_file, msa_shutter_conf, dflat_path, sflat_path, fflat_path]
-    flattest_switches = [flattest_threshold_diff, save_flattest_plot, write_flattest_files]
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    flattest_switches = [flattest_threshold_diff, save_flattest_plot, write_flattest_files, flattest_vectorized]
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     flat_field_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     flat_field_reffile_tests = config.getboolean("run_pytest", "_".join((step, "reffile", "tests")))
@@ -85,7 +96,7 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
         inhdu = core_utils.read_hdrfits(initial_input_file, info=False, show_hdr=False)
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
 
@@ -112,7 +123,7 @@ def output_hdul(set_inandout_filenames, config):
             if change_filter_opaque:
                 logging.info(filter_opaque_msg)
 
-            if os.path.isfile(step_input_file):
+            if model_store.exists(step_input_file):
                 msg = " *** Step "+step+" set to True"
                 print(msg)
                 logging.info(msg)
@@ -137,13 +148,14 @@ def output_hdul(set_inandout_filenames, config):
                 # start the timer to compute the step running time
                 start_time = time.time()
                 if local_pipe_cfg_path == "pipe_source_tree_code":
-                    stp.call(step_input_file, output_file=step_output_file, save_interpolated_flat=True)
+                    result = stp.call(model_store.get_step_input(step_input_file), output_file=step_output_file,
+                                      save_interpolated_flat=True)
                               #override_dflat="/grp/crds/jwst/references/jwst/jwst_nirspec_dflat_0001.fits",
                               #override_fflat="/grp/crds/jwst/references/jwst/jwst_nirspec_fflat_0015.fits",
                               #override_sflat="/grp/crds/jwst/references/jwst/jwst_nirspec_sflat_0034.fits")
                 else:
-                    stp.call(step_input_file, output_file=step_output_file, save_interpolated_flat=True,
-                             config_file=local_pipe_cfg_path+'/flat_field.cfg')
+                    result = stp.call(model_store.get_step_input(step_input_file), output_file=step_output_file,
+                                      save_interpolated_flat=True, config_file=local_pipe_cfg_path+'/flat_field.cfg')
                 # end the timer to compute the step running time
                 end_time = repr(time.time() - start_time)   # this is in seconds
                 msg = "Step "+step+" took "+end_time+" seconds to finish"
@@ -154,6 +166,8 @@ def output_hdul(set_inandout_filenames, config):
                 # raname and move the flat_field output
                 subprocess.run(["mv", os.path.basename(step_output_file).replace("_flat_field.fits", "_flatfieldstep.fits"),
                                 step_output_file])
+                # the step wrote the output file, keep its model for the next step
+                model_store.keep_model(result, step_output_file)
                 if core_utils.check_MOS_true(inhdu):
                     # remove the copy of the MSA shutter configuration file
                     subprocess.run(["rm", msametfl])
@@ -186,7 +200,7 @@ def output_hdul(set_inandout_filenames, config):
             print(msg)
             logging.info(msg)
             end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
-            if os.path.isfile(step_output_file):
+            if model_store.exists(step_output_file):
                 hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                 step_completed = True
                 # add the running time for this step
@@ -205,7 +219,9 @@ def output_hdul(set_inandout_filenames, config):
 def validate_flat_field(output_hdul):
     hdu = output_hdul[0]
     step_output_file, msa_shutter_conf, dflatref_path, sfile_path, fflat_path = output_hdul[2]
-    flattest_threshold_diff, save_flattest_plot, write_flattest_files = output_hdul[3]
+    flattest_threshold_diff, save_flattest_plot, write_flattest_files, flattest_vectorized = output_hdul[3]
+    # the validation reads the file, make sure it has been written
+    model_store.ensure_saved(step_output_file)
 
     # show the figures
     show_figs = False
@@ -216,21 +232,24 @@ def validate_flat_field(output_hdul):
         median_diff, result_msg, log_msgs = flattest_fs.flattest(step_output_file, dflatref_path=dflatref_path, sfile_path=sfile_path,
                                                 fflat_path=fflat_path, writefile=write_flattest_files,
                                                 show_figs=show_figs, save_figs=save_flattest_plot, plot_name=None,
-                                                threshold_diff=flattest_threshold_diff, debug=False)
+                                                threshold_diff=flattest_threshold_diff,
+                                                vectorized=flattest_vectorized, debug=False)
 
     elif core_utils.check_MOS_true(hdu):
         median_diff, result_msg, log_msgs = flattest_mos.flattest(step_output_file, dflatref_path=dflatref_path, sfile_path=sfile_path,
                                                fflat_path=fflat_path, msa_shutter_conf=msa_shutter_conf,
                                                writefile=write_flattest_files,
                                                show_figs=show_figs, save_figs=save_flattest_plot, plot_name=None,
-                                               threshold_diff=flattest_threshold_diff, debug=False)
+                                               threshold_diff=flattest_threshold_diff,
+                                               vectorized=flattest_vectorized, debug=False)
 
     elif core_utils.check_IFU_true(hdu):
         median_diff, result_msg, log_msgs = flattest_ifu.flattest(step_output_file, dflatref_path=dflatref_path, sfile_path=sfile_path,
                                                 fflat_path=fflat_path, writefile=write_flattest_files,
                                                 mk_all_slices_plt=False, show_figs=show_figs,
                                                 save_figs=save_flattest_plot, plot_name=None,
-                                                threshold_diff=flattest_threshold_diff, debug=False)
+                                                threshold_diff=flattest_threshold_diff,
+                                                vectorized=flattest_vectorized, debug=False)
 
     else:
         pytest.skip("Skipping pytest: The input fits file is not FS, MOS, or IFU. This tool does not yet include the "
@@ -8,24 +8,27 @@ import time
 import pytest
 import logging
 from glob import glob
-from astropy.io import fits
 
 from jwst.pathloss.pathloss_step import PathLossStep
 
 from . import pathloss_utils
 from .. import core_utils
+from .. auxiliary_code import model_store
 from .. auxiliary_code import change_filter_opaque2science
 
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero & Gray Kanarek"
-__version__ = "2.1"
+__version__ = "2.4"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # May 2018 - Version 2.0: Gray added routine to generalize reference file check
 # Mar 2019 - Version 2.1: Maria separated completion from validation tests
+# Oct 2026 - Version 2.2: headers and keywords are read through the header cache
+# Oct 2026 - Version 2.3: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 2.4: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -44,7 +47,7 @@ def set_inandout_filenames(request, config):
 def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     pathloss_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     pathloss_reffile_tests = config.getboolean("run_pytest", "_".join((step, "reffile", "tests")))
@@ -71,7 +74,7 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
         inhdu = core_utils.read_hdrfits(initial_input_file, info=False, show_hdr=False)
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
 
@@ -100,7 +103,7 @@ def output_hdul(set_inandout_filenames, config):
                 if change_filter_opaque:
                     logging.info(filter_opaque_msg)
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
                     msg = " *** Step "+step+" set to True"
                     print(msg)
                     logging.info(msg)
@@ -115,10 +118,10 @@ def output_hdul(set_inandout_filenames, config):
                     # start the timer to compute the step running time
                     start_time = time.time()
                     if local_pipe_cfg_path == "pipe_source_tree_code":
-                        result = stp.call(step_input_file)
+                        result = stp.call(model_store.get_step_input(step_input_file))
                     else:
-                        result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/pathloss.cfg')
-                    result.save(step_output_file)
+                        result = stp.call(model_store.get_step_input(step_input_file), config_file=local_pipe_cfg_path+'/pathloss.cfg')
+                    model_store.save_step_output(result, step_output_file)
 
                     # end the timer to compute calwebb_spec2 running time
                     end_time = repr(time.time() - start_time)   # this is in seconds
@@ -153,7 +156,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(msg)
                 logging.info(msg)
                 end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
                     # add the running time for this step
@@ -8,11 +8,11 @@ import time
 import pytest
 import logging
 from glob import glob
-from astropy.io import fits
 from jwst.barshadow.barshadow_step import BarShadowStep
 
 from . import barshadow_utils
 from .. import core_utils
+from .. auxiliary_code import model_store
 from .. auxiliary_code import change_filter_opaque2science
 from .. auxiliary_code import barshadow_testing
 
@@ -20,12 +20,16 @@ from .. auxiliary_code import barshadow_testing
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.6"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Mar 2019 - Version 1.1: separated completion from other tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: the barshadow validation can be run with several worker processes (barshadow_n_workers)
+# Oct 2026 - Version 1.4: headers and keywords are read through the header cache
+# Oct 2026 - Version 1.5: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 1.6: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -44,7 +48,7 @@ def set_inandout_filenames(request, config):
 def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     barshadow_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     barshadow_validation_tests = config.getboolean("run_pytest", "_".join((step, "validation", "tests")))
@@ -53,7 +57,9 @@ def output_hdul(set_inandout_filenames, config):
     save_barshadow_final_plot = config.getboolean("additional_arguments", "save_barshadow_final_plot")
     save_barshadow_intermediary_plots = config.getboolean("additional_arguments", "save_barshadow_intermediary_plots")
     write_barshadow_files = config.getboolean("additional_arguments", "write_barshadow_files")
-    barshadow_switches = [barshadow_threshold_diff, save_barshadow_final_plot, save_barshadow_intermediary_plots, write_barshadow_files]
+    barshadow_n_workers = config.getint("additional_arguments", "barshadow_n_workers", fallback=1)
+    barshadow_switches = [barshadow_threshold_diff, save_barshadow_final_plot, save_barshadow_intermediary_plots, write_barshadow_files,
+                          barshadow_n_workers]
 
     end_time = '0.0'
 
@@ -63,7 +69,7 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
         inhdu = core_utils.read_hdrfits(initial_input_file, info=False, show_hdr=False)
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
 
@@ -105,7 +111,7 @@ def output_hdul(set_inandout_filenames, config):
                 if change_filter_opaque:
                     logging.info(filter_opaque_msg)
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
                     msg = " *** Step "+step+" set to True"
                     print(msg)
                     logging.info(msg)
@@ -119,10 +125,10 @@ def output_hdul(set_inandout_filenames, config):
                     # start the timer to compute the step running time
                     start_time = time.time()
                     #if local_pipe_cfg_path == "pipe_source_tree_code":
-                    result = stp.call(step_input_file)
+                    result = stp.call(model_store.get_step_input(step_input_file))
                     #else:
                     #    result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/NOCONFIGFILE.cfg')
-                    result.save(step_output_file)
+                    model_store.save_step_output(result, step_output_file)
                     # end the timer to compute calwebb_spec2 running time
                     end_time = repr(time.time() - start_time)   # this is in seconds
                     msg = " * calwebb_spec2 took "+end_time+" seconds to finish."
@@ -156,7 +162,7 @@ def output_hdul(set_inandout_filenames, config):
                 print(msg)
                 logging.info(msg)
                 end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
                     # add the running time for this step
@@ -192,7 +198,10 @@ def validate_barshadow(output_hdul):
 
         plfile = output_hdul[1].replace('_barshadow', '_pathloss')
         bsfile = output_hdul[1]
-        barshadow_threshold_diff, save_barshadow_final_plot, save_barshadow_intermediary_plots, write_barshadow_files = output_hdul[2]
+        # the validation reads the files, make sure they have been written
+        model_store.ensure_saved(plfile)
+        model_store.ensure_saved(bsfile)
+        barshadow_threshold_diff, save_barshadow_final_plot, save_barshadow_intermediary_plots, write_barshadow_files, barshadow_n_workers = output_hdul[2]
         barshadow_testresult, result_msg, log_msgs = barshadow_testing.run_barshadow_tests(plfile, bsfile,
                                                         barshadow_threshold_diff=float(barshadow_threshold_diff),
                                                         save_final_figs=save_barshadow_final_plot,
@@ -200,7 +209,7 @@ def validate_barshadow(output_hdul):
                                                         save_intermediary_figs=save_barshadow_intermediary_plots,
                                                         show_intermediary_figs=show_figs,
                                                         write_barshadow_files = write_barshadow_files,
-                                                        debug=False)
+                                                        debug=False, n_workers=barshadow_n_workers)
 
     else:
         pytest.skip("Skipping pytest: The input fits file is not MOS.")
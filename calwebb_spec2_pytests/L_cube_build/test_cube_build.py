@@ -9,23 +9,26 @@ import logging
 from glob import glob
 
 import pytest
-from astropy.io import fits
 from jwst.cube_build.cube_build_step import CubeBuildStep
 
 from .. auxiliary_code import change_filter_opaque2science
 from . import cube_build_utils
 from .. import core_utils
+from .. auxiliary_code import model_store
 
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.5"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Mar 2019 - Version 1.1: separated completion from other tests
 # Apr 2019 - Version 1.2: implemented logging capability
+# Oct 2026 - Version 1.3: headers and keywords are read through the header cache
+# Oct 2026 - Version 1.4: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 1.5: the step is not run again if its inputs did not change (incremental_steps)
 
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
@@ -44,7 +47,7 @@ def set_inandout_filenames(request, config):
 def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     cube_build_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     #cube_build_reffile_tests = config.getboolean("run_pytest", "_".join((step, "reffile", "tests")))
@@ -57,9 +60,9 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
         inhdu = core_utils.read_hdrfits(initial_input_file, info=False, show_hdr=False)
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
-        filt = fits.getval(initial_input_file, 'filter')
-        grat = fits.getval(initial_input_file, 'grating')
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
+        filt = core_utils.get_keywd_val(initial_input_file, 'filter')
+        grat = core_utils.get_keywd_val(initial_input_file, 'grating')
         gratfilt = grat + "-" + filt + "_s3d"
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
@@ -102,7 +105,7 @@ def output_hdul(set_inandout_filenames, config):
                 if change_filter_opaque:
                     logging.info(filter_opaque_msg)
 
-                if os.path.isfile(step_input_file):
+                if model_store.exists(step_input_file):
 
                     msg = " *** Step "+step+" set to True"
                     print(msg)
@@ -117,10 +120,10 @@ def output_hdul(set_inandout_filenames, config):
                     # start the timer to compute the step running time
                     start_time = time.time()
                     if local_pipe_cfg_path == "pipe_source_tree_code":
-                        result = stp.call(step_input_file)
+                        result = stp.call(model_store.get_step_input(step_input_file))
                     else:
-                        result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/cube_build.cfg')
-                    result.save(step_output_file)
+                        result = stp.call(model_store.get_step_input(step_input_file), config_file=local_pipe_cfg_path+'/cube_build.cfg')
+                    model_store.save_step_output(result, step_output_file)
                     # end the timer to compute the step running time
                     end_time = repr(time.time() - start_time)   # this is in seconds
                     msg = "Step "+step+" took "+end_time+" seconds to finish"
@@ -164,7 +167,7 @@ def output_hdul(set_inandout_filenames, config):
                 # record info
                 # specific cube step suffix
                 cube_suffix = "_s3d"
-                if os.path.isfile(step_output_file):
+                if model_store.exists(step_output_file):
 
                     hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
                     step_completed = True
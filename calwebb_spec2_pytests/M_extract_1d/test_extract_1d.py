@@ -7,18 +7,18 @@ import os
 import time
 import pytest
 import logging
-from astropy.io import fits
 from glob import glob
 from jwst.extract_1d.extract_1d_step import Extract1dStep
 
 from .. auxiliary_code import change_filter_opaque2science
 from . import extract_1d_utils
 from .. import core_utils
+from .. auxiliary_code import model_store
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero & Gray Kanarek"
-__version__ = "2.3"
+__version__ = "2.7"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -26,6 +26,10 @@ __version__ = "2.3"
 # Mar 2019 - Version 2.1: Maria added infrastructure to separate completion from other tests.
 # Apr 2019 - Version 2.2: implemented logging capability
 # Dec 2019 - Version 2.3: implemented imaging text file name handling capability
+# Oct 2026 - Version 2.4: headers and keywords are read through the header cache
+# Oct 2026 - Version 2.5: the step output can be chained in memory to the next step (chain_models_in_memory)
+# Oct 2026 - Version 2.6: the map is not written by the validation processes of overlapped runs (see run_PTT.py)
+# Oct 2026 - Version 2.7: the step is not run again if its inputs did not change (incremental_steps)
 
 # Set up the fixtures needed for all of the tests, i.e. open up all of the FITS files
 
@@ -44,7 +48,7 @@ def output_hdul(set_inandout_filenames, config):
     set_inandout_filenames_info = core_utils.read_info4outputhdul(config, set_inandout_filenames)
     step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix = set_inandout_filenames_info
     working_directory = config.get("calwebb_spec2_input_file", "working_directory")
-    run_pipe_step = config.getboolean("run_pipe_steps", step)
+    run_pipe_step = core_utils.get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file)
     # determine which tests are to be run
     extract_1d_completion_tests = config.getboolean("run_pytest", "_".join((step, "completion", "tests")))
     extract_1d_reffile_tests = config.getboolean("run_pytest", "_".join((step, "reffile", "tests")))
@@ -73,7 +77,7 @@ def output_hdul(set_inandout_filenames, config):
     initial_input_file = config.get("calwebb_spec2_input_file", "input_file")
     initial_input_file = os.path.join(working_directory, initial_input_file)
     if os.path.isfile(initial_input_file):
-        detector = fits.getval(initial_input_file, "DETECTOR", 0)
+        detector = core_utils.get_keywd_val(initial_input_file, "DETECTOR")
     else:
         pytest.skip("Skipping "+step+" because the initial input file given in PTT_config.cfg does not exist.")
 
@@ -125,7 +129,7 @@ def output_hdul(set_inandout_filenames, config):
             if change_filter_opaque:
                 logging.info(filter_opaque_msg)
 
-            if os.path.isfile(step_input_file):
+            if model_store.exists(step_input_file):
 
                 msg = " *** Step "+step+" set to True"
                 print(msg)
@@ -140,10 +144,10 @@ def output_hdul(set_inandout_filenames, config):
                 # start the timer to compute the step running time
                 start_time = time.time()
                 if local_pipe_cfg_path == "pipe_source_tree_code":
-                    result = stp.call(step_input_file)
+                    result = stp.call(model_store.get_step_input(step_input_file))
                 else:
-                    result = stp.call(step_input_file, config_file=local_pipe_cfg_path+'/extract_1d.cfg')
-                result.save(step_output_file)
+                    result = stp.call(model_store.get_step_input(step_input_file), config_file=local_pipe_cfg_path+'/extract_1d.cfg')
+                model_store.save_step_output(result, step_output_file)
                 # end the timer to compute the step running time
                 end_time = repr(time.time() - start_time)   # this is in seconds
                 msg = "Step "+step+" took "+end_time+" seconds to finish"
@@ -180,7 +184,7 @@ def output_hdul(set_inandout_filenames, config):
             end_time = core_utils.get_stp_run_time_from_screenfile(step, detector, working_directory)
 
         # add the running time for this step
-        if os.path.isfile(step_output_file):
+        if model_store.exists(step_output_file):
             hdul = core_utils.read_hdrfits(step_output_file, info=False, show_hdr=False)
             step_completed = True
             core_utils.add_completed_steps(txt_name, step, outstep_file_suffix, step_completed, end_time)
@@ -201,8 +205,9 @@ def output_hdul(set_inandout_filenames, config):
         line2write = "{:<20} {:<20} {:<20} {:<20}".format('', '', 'total_time  ', total_time+'  ='+total_time_min+'min')
         print(line2write)
         logging.info(line2write)
-        with open(txt_name, "a") as tf:
-            tf.write(line2write+"\n")
+        if core_utils.records_run():
+            with open(txt_name, "a") as tf:
+                tf.write(line2write+"\n")
 
         # convert the html report into a pdf file
         #core_utils.convert_html2pdf()
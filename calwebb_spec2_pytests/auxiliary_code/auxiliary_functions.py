@@ -1,15 +1,24 @@
 import numpy as np
 import os
+import configparser
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from scipy import integrate
 from scipy import interpolate
 from astropy.io import fits
-from glob import glob
 import matplotlib
 matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
 from decimal import Decimal
 
+from . import esa_file_index
+from . import header_cache
+from . import model_store
+from . import phase_timing
+from . import memory_tracking
+from . import observation_context
+
 
 """
 This script contains the auxiliary functions that the wcs FS, MOS, and IFU WCS scripts use.
@@ -18,7 +27,7 @@ This script contains the auxiliary functions that the wcs FS, MOS, and IFU WCS s
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "2.2"
+__version__ = "3.2"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -26,6 +35,22 @@ __version__ = "2.2"
 #                         the datamodel instead of the compute_world_coordinates script.
 # Aug 2018 - Version 2.1: Added case to catch simulation rawdataroot names for the ESA files
 # Sep 2019 - Version 2.2: Modified function to identify science extensions to work with build 7.3
+# Oct 2026 - Version 2.3: The ESA files are now found through the on-disk index of the ESA directories.
+# Oct 2026 - Version 2.4: Added functions to run the per-slit validations in parallel processes.
+# Oct 2026 - Version 2.5: The mode and raw data root file are read from the configuration file only when it changes,
+#                         and they can be taken from the observation context.
+# Oct 2026 - Version 2.6: The data models of the step outputs kept in memory are used by get_cached_datamodel.
+# Oct 2026 - Version 2.7: The phase times of the per-slit validations ran in worker processes are given back to the
+#                         main process (see phase_timing.py).
+# Oct 2026 - Version 2.8: The memory peaks of the per-slit validations ran in worker processes are also given back
+#                         (see memory_tracking.py).
+# Oct 2026 - Version 2.9: The ESA file index can be set in the PTT configuration file.
+# Oct 2026 - Version 3.0: The worker processes of run_per_slit are started with spawn instead of fork, since the
+#                         background writers and the memory sampler may hold locks when the process forks.
+# Oct 2026 - Version 3.1: The header keywords of get_observation_info are taken from the file also when the
+#                         observation context is given, since FILTER may have been changed from OPAQUE.
+# Oct 2026 - Version 3.2: The worker processes of run_per_slit use the Agg backend of matplotlib, since they only
+#                         save their figures and may run on nodes without a display.
 
 
 def find_nearest(arr, value):
@@ -119,29 +144,166 @@ def do_idl_rebin(a, *args):
     return eval(''.join(evList))
 
 
-def get_modeused_and_rawdatrt_PTT_cfg_file():
+# values read by get_modeused_and_rawdatrt_PTT_cfg_file, with the modification time of the configuration file
+_PTT_cfg_values = {}
+
+
+def get_modeused_and_rawdatrt_PTT_cfg_file(obs_context=None):
+    """
+    This function gets the mode used and the raw data root file name from the PTT configuration file. The file is
+    only read again when it is modified. If the observation context is given the values are taken from it.
+    Args:
+        obs_context: ObservationContext object (see observation_context.py)
+
+    Returns:
+        mode_used: string, mode set in the configuration file
+        raw_data_root_file: string, name of the raw data file
+    """
+    if obs_context is not None:
+        return obs_context.mode_used, obs_context.raw_data_root_file
     # get script directory and config name
     utils_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
     PPT_cfg_file = utils_dir.replace("auxiliary_code", "/PTT_config.cfg")
-    with open(PPT_cfg_file, "r") as cfg:
-        for i, line in enumerate(cfg.readlines()):
-            if "#" not in line:
-                if "mode_used" in line:
-                    mode_used = line.split()[2]
-                if "raw_data_root_file" in line:
-                    raw_data_root_file = line.split()[2]
-    return mode_used, raw_data_root_file
+    cfg_mtime = os.path.getmtime(PPT_cfg_file)
+    if _PTT_cfg_values.get("mtime") != cfg_mtime:
+        config = configparser.ConfigParser()
+        config.read(PPT_cfg_file)
+        _PTT_cfg_values["values"] = (config.get("calwebb_spec2_input_file", "mode_used"),
+                                     config.get("calwebb_spec2_input_file", "raw_data_root_file"))
+        _PTT_cfg_values["mtime"] = cfg_mtime
+    return _PTT_cfg_values["values"]
 
 
-def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None):
+def get_observation_info(infile_name, obs_context=None):
     """
-    This function gets the ESA file corresponding to the input given.
+    This function gets the detector, grating, filter, and lamp from the header of the file, and the raw data root file
+    name from the PTT configuration file, or from the observation context if it is given. The header keywords are
+    always the ones of the file, since the filter of the input file of the run may have been changed.
+    Args:
+        infile_name: str, name of the fits file (with full path)
+        obs_context: ObservationContext object (see observation_context.py)
+
+    Returns:
+        det: str, detector
+        grat: str, grating
+        filt: str, filter
+        lamp: str, lamp
+        raw_data_root_file: str, name of the raw data file
+    """
+    if obs_context is not None:
+        obs_context = observation_context.for_file(obs_context, infile_name)
+        return (obs_context.detector, obs_context.grating, obs_context.filter, obs_context.lamp,
+                obs_context.raw_data_root_file)
+    header = header_cache.get_header(infile_name, 0)
+    _, raw_data_root_file = get_modeused_and_rawdatrt_PTT_cfg_file()
+    return header["DETECTOR"], header["GRATING"], header["FILTER"], header["LAMP"], raw_data_root_file
+
+
+# data models read by get_cached_datamodel, one copy per process
+_cached_datamodels = {}
+
+
+def get_cached_datamodel(file_name, model_class):
+    """
+    This function returns the data model of the given file, reading it only the first time it is requested in
+    the process. It allows the per-slit functions to run in worker processes without passing the model around.
+    Args:
+        file_name: str, name of the fits file (with full path)
+        model_class: data model class to open the file with, e.g. datamodels.ImageModel
+
+    Returns:
+        model: data model object
+    """
+    key = (file_name, model_class.__name__)
+    if key not in _cached_datamodels:
+        # use the output of the step if it is still in memory (see model_store.py)
+        model = model_store.get_model(file_name, model_class)
+        if model is None:
+            model = model_class(model_store.ensure_saved(file_name))
+        _cached_datamodels[key] = model
+    return _cached_datamodels[key]
+
+
+def release_cached_datamodel(file_name):
+    """
+    This function removes the data models of the given file from the cache of get_cached_datamodel.
+    Args:
+        file_name: str, name of the fits file (with full path)
+
+    Returns:
+        nothing
+    """
+    for key in [k for k in _cached_datamodels if k[0] == file_name]:
+        del _cached_datamodels[key]
+
+
+def run_timed_in_worker(func, args, memory_configuration=None):
+    """
+    This function calls func in a worker process, and gives back its result with the phase times and memory peaks of
+    the call. The worker does not inherit the memory ceilings of the main process, so they are given in
+    memory_configuration (see memory_tracking.get_configuration).
+    """
+    # the figures of the worker processes are only saved, so they do not need a display
+    if plt.get_backend().lower() != "agg":
+        plt.switch_backend("Agg")
+    if memory_configuration is not None:
+        memory_tracking.configure(**memory_configuration)
+    phase_timing.clear_phase_records()
+    memory_tracking.clear_memory_records()
+    result = func(*args)
+    return result, phase_timing.get_phase_records(), memory_tracking.get_memory_records()
+
+
+def run_per_slit(func, args_list, n_workers=1):
+    """
+    This function calls func for each set of arguments in args_list, serially or distributed over n_workers
+    processes. The results are given back in the order of args_list in both cases, and the calls that are still
+    pending are cancelled if the caller stops reading the results (e.g. because the test has to be skipped).
+    Args:
+        func: function to call, it must be defined at module level so that it can be sent to other processes
+        args_list: list of tuples, arguments for each call
+        n_workers: integer, number of processes to use, 1 (or less) runs the calls in this process
+
+    The workers are started with spawn, so they only see the files on disk: the step outputs that are still in
+    memory or being written are saved before the workers start.
+
+    Returns:
+        generator of the results of func
+    """
+    if n_workers is None or n_workers <= 1 or len(args_list) <= 1:
+        for args in args_list:
+            yield func(*args)
+        return
+    model_store.flush()
+    executor = ProcessPoolExecutor(max_workers=min(n_workers, len(args_list)),
+                                   mp_context=multiprocessing.get_context("spawn"))
+    memory_configuration = memory_tracking.get_configuration()
+    futures = []
+    try:
+        futures = [executor.submit(run_timed_in_worker, func, args, memory_configuration) for args in args_list]
+        for future in futures:
+            result, phase_records, memory_records = future.result()
+            phase_timing.merge_phase_records(phase_records)
+            memory_tracking.merge_memory_records(memory_records)
+            yield result
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None, index_file=None):
+    """
+    This function gets the ESA file corresponding to the input given. The directory listings and the header
+    keywords needed are taken from the on-disk index of the ESA directories (see esa_file_index.py).
     Args:
         esa_files_path: str, top level of where the regression test data lives
         rawdatroot: str, name of the raw data file (the file ran in create_data)
         mode: string, either 'MOS', 'FS', or 'IFU'
         specifics: list, specific parameters needed for each mode
         nid: string, ESA NID of the raw data file used for the create_data script
+        index_file: str, full path of the SQLite index of the ESA directories, if None the one set in the PTT
+                    configuration file (esa_file_index) or the default is used
 
     Returns:
         esafile: str, full path of the ESA file corresponding to input given
@@ -227,9 +389,13 @@ def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None):
 
     log_msgs = []
 
+    # the listings and header keywords of the ESA directories are recorded in the index by a single scan
+    esa_index = esa_file_index.get_index(index_file)
+    esa_index.build(esa_files_path)
+
     # go into the esa_files_path directory and enter the the mode to get the right esafile
     # get all subdirectories within esa_files_path
-    subdir_list = glob(esa_files_path+"/*")
+    subdir_list = esa_index.list_dir(esa_files_path)
     # check if there are subdirectories or not
     dirs_not_in_list = []
     for i, item in enumerate(subdir_list):
@@ -252,7 +418,7 @@ def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None):
         for item in subdir_list:
             if raw_file_name in item:
                 if "List" not in item:
-                    nidrawfile = fits.getval(item, "GS_JOBID", 0).split("_")[1].replace("000", "")
+                    nidrawfile = esa_index.get_keyword(item, "GS_JOBID").split("_")[1].replace("000", "")
                     #print("nidrawfile =", nidrawfile)
                     same_nid_files.append(item)
         nid = nidrawfile
@@ -262,7 +428,7 @@ def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None):
             # check if the file is at the first level using the NID
             if nid is not None:
                 if ".fits" in item  and  "List" not in item:
-                    nid2compare = fits.getval(item, "GS_JOBID", 0).split("_")[1].replace("000", "")
+                    nid2compare = esa_index.get_keyword(item, "GS_JOBID").split("_")[1].replace("000", "")
                     #print("NID_raw_data_file =", nid, "    nid2compare =", nid2compare)
                     if nid == nid2compare:
                         # collect all files with the same NID
@@ -298,11 +464,11 @@ def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None):
             if not isinstance(esafile_basename, list):
                 esafile = os.path.join(mode_dir, esafile_basename)
                 # check if we got the right esafile
-                if not os.path.isfile(esafile):
+                if not esa_index.is_file(esafile):
                     esafile = "ESA file not found"
                     break
                 try:
-                    root_filename = fits.getval(esafile, "FILENAME", 0)
+                    root_filename = esa_index.get_keyword(esafile, "FILENAME")
                     if rawdatroot.replace(".fits", "") in root_filename:
                         print (" * File name matches raw file used for create_data.")
                     else:
@@ -318,7 +484,7 @@ def get_esafile(esa_files_path, rawdatroot, mode, specifics, nid=None):
                     esaf = os.path.join(mode_dir, esabase)
                     esafile.append(esaf)
                     # check if we got the right esafile
-                    root_filename = fits.getval(esaf, "FILENAME", 0)
+                    root_filename = esa_index.get_keyword(esaf, "FILENAME")
                     root_filename_msg = "root_filename = "+root_filename
                     rawdatroot_msg = "rawdatroot = "+rawdatroot
                     print(root_filename_msg)
@@ -0,0 +1,217 @@
+import os
+import atexit
+import threading
+from concurrent import futures
+
+from . import header_cache
+
+
+"""
+This script writes the files produced by PTT (the step output data models and the HDU lists of the validation
+scripts, e.g. the _flat_calc.fits and _flat_comp.fits files) in background threads, so that the tests do not wait
+for the files to be written.
+
+The number of objects waiting to be written is bounded (queue_size): when the queue is full, submit waits until a
+write finishes, so that the memory held by the objects waiting to be written does not grow without limit. Each write
+has a future, and the code that needs the file has to call wait_for before reading it. All the writes are finished
+by flush, which is called at the end of the pytest session (and at the exit of the interpreter).
+
+If the number of threads is 0 (the default) the files are written when they are submitted, as before.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.0"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+
+
+# default maximum number of objects waiting to be written (or being written)
+default_queue_size = 4
+
+# future and object of the files waiting to be written or being written
+_writing = {}
+_writer_lock = threading.RLock()
+_writer_state = {"executor": None, "n_threads": 0, "slots": None, "errors": []}
+
+
+def configure(n_threads=0, queue_size=default_queue_size):
+    """
+    This function sets the number of threads used to write the files. The writes already submitted are finished first.
+    Args:
+        n_threads: integer, number of writing threads; 0 writes the files when they are submitted
+        queue_size: integer, maximum number of objects waiting to be written (at least 1)
+
+    Returns:
+        nothing
+    """
+    shutdown()
+    n_threads = max(int(n_threads), 0)
+    with _writer_lock:
+        _writer_state["n_threads"] = n_threads
+        if n_threads > 0:
+            _writer_state["executor"] = futures.ThreadPoolExecutor(max_workers=n_threads)
+            _writer_state["slots"] = threading.BoundedSemaphore(max(int(queue_size), 1))
+
+
+def is_enabled():
+    """
+    This function returns True if the files are written in background threads.
+    """
+    return _writer_state["executor"] is not None
+
+
+def _get_key(file_name):
+    return os.path.abspath(file_name)
+
+
+def _write(obj, file_name, overwrite):
+    """
+    This function writes the data model (with save) or the HDU list (with writeto) into the file.
+    """
+    if hasattr(obj, "writeto"):
+        obj.writeto(file_name, overwrite=overwrite)
+    else:
+        # the data models always overwrite the file
+        obj.save(file_name)
+    header_cache.invalidate_header(file_name)
+    return file_name
+
+
+def submit(obj, file_name, overwrite=True):
+    """
+    This function sends the object to be written into the file. If the writer is not enabled the file is written now.
+    Args:
+        obj: data model or HDU list to be written
+        file_name: string, path and name of the file
+        overwrite: boolean, if True an existing file is overwritten (only for HDU lists)
+
+    Returns:
+        future: concurrent.futures.Future object, its result is the file name (or the exception of the write)
+    """
+    key = _get_key(file_name)
+    # a file written again has to wait for its previous write
+    wait_for(key)
+    with _writer_lock:
+        executor, slots = _writer_state["executor"], _writer_state["slots"]
+    if executor is None:
+        future = futures.Future()
+        try:
+            future.set_result(_write(obj, file_name, overwrite))
+        except Exception as err:
+            future.set_exception(err)
+            raise
+        return future
+    # wait for a place in the queue
+    slots.acquire()
+
+    def _write_done(done_future):
+        slots.release()
+        with _writer_lock:
+            if key in _writing and _writing[key][0] is done_future:
+                del _writing[key]
+            if done_future.exception() is not None:
+                _writer_state["errors"].append((file_name, done_future.exception()))
+
+    # the future is registered before its callback can remove it
+    with _writer_lock:
+        future = executor.submit(_write, obj, file_name, overwrite)
+        _writing[key] = (future, obj)
+        future.add_done_callback(_write_done)
+    return future
+
+
+def is_writing(file_name):
+    """
+    This function returns True if the file is waiting to be written or being written.
+    """
+    with _writer_lock:
+        return _get_key(file_name) in _writing
+
+
+def get_future(file_name):
+    """
+    This function returns the future of the write of the file.
+    Args:
+        file_name: string, path and name of the file
+
+    Returns:
+        future: concurrent.futures.Future object, None if the file is not waiting to be written or being written
+    """
+    with _writer_lock:
+        writing = _writing.get(_get_key(file_name))
+    if writing is None:
+        return None
+    return writing[0]
+
+
+def get_object(file_name):
+    """
+    This function returns the object (data model or HDU list) that is being written into the file. It should only
+    be read, since it may be being written.
+    Args:
+        file_name: string, path and name of the file
+
+    Returns:
+        object, None if the file is not waiting to be written or being written
+    """
+    with _writer_lock:
+        writing = _writing.get(_get_key(file_name))
+    if writing is None:
+        return None
+    return writing[1]
+
+
+def wait_for(file_name):
+    """
+    This function waits until the file is written, i.e. it has to be called before the file is read from disk.
+    Args:
+        file_name: string, path and name of the file
+
+    Returns:
+        file_name: string, the same file name; the exception of the write is raised if it failed
+    """
+    future = get_future(file_name)
+    if future is not None:
+        future.result()
+    return file_name
+
+
+def flush():
+    """
+    This function waits until all the submitted files are written.
+    Returns:
+        errors: list of tuples (file name, exception) of the writes that failed since the last flush
+    """
+    with _writer_lock:
+        pending_futures = [writing[0] for writing in _writing.values()]
+    futures.wait(pending_futures)
+    with _writer_lock:
+        errors = _writer_state["errors"]
+        _writer_state["errors"] = []
+    for file_name, err in errors:
+        print(" * WARNING: Unable to write file ", file_name, ": ", repr(err))
+    return errors
+
+
+def shutdown():
+    """
+    This function finishes all the writes and stops the writing threads, i.e. the files are written when they are
+    submitted after this call.
+    Returns:
+        errors: list of tuples (file name, exception) of the writes that failed since the last flush
+    """
+    errors = flush()
+    with _writer_lock:
+        executor = _writer_state["executor"]
+        _writer_state["executor"] = None
+        _writer_state["slots"] = None
+        _writer_state["n_threads"] = 0
+    if executor is not None:
+        executor.shutdown(wait=True)
+    return errors
+
+
+atexit.register(shutdown)
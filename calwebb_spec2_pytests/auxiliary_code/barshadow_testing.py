@@ -12,10 +12,12 @@ import matplotlib
 matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 
-from scipy.interpolate import griddata
+from scipy.interpolate import LinearNDInterpolator, RegularGridInterpolator
 from gwcs import wcstools
 
 from . import auxiliary_functions as auxfunc
+from . import background_writer
+from . import phase_timing
 
 
 """
@@ -26,16 +28,484 @@ jupyter notebook barshadow.ipynb written by James Muzerolle in August of 2019.
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero & J. Muzerolle"
-__version__ = "1.0"
+__version__ = "1.6"
 
 # HISTORY
 # Nov 2019 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: The reference bar shadow is interpolated with a regular grid interpolator that is built
+#                         once per reference file, instead of triangulating the reference grid for every slitlet.
+# Oct 2026 - Version 1.2: Moved the slitlet test to its own function so that the slitlets can be tested in
+#                         parallel processes.
+# Oct 2026 - Version 1.3: The calculated and comparison fits files are now written, in the background (see
+#                         background_writer.py).
+# Oct 2026 - Version 1.4: The time of each phase of the test is recorded per slitlet (see phase_timing.py).
+# Oct 2026 - Version 1.5: The cached data models are released also when the test of a slitlet fails.
+# Oct 2026 - Version 1.6: The switch to the Agg backend in the worker processes is now done by run_per_slit (see
+#                         auxiliary_functions.run_timed_in_worker).
 
 
+# interpolators of the bar shadow reference files, keyed by (file path, modification time)
+_reference_interpolators = {}
 
+
+class BarshadowReference(object):
+    """
+    This class holds the correction values of a bar shadow reference file (e.g. mos1x1 or mos1x3) and interpolates
+    them at given wavelengths and slit_y positions. The reference image has a linear WCS, i.e. the wavelength only
+    changes along x and slit_y only along y, so the values are on a regular grid and a bilinear interpolation over
+    its axes is used. If the WCS is not separable, the values are interpolated over the triangulated grid (as
+    griddata does), but the triangulation is built only once.
+    """
+
+    def __init__(self, ref_file):
+        """
+        Args:
+            ref_file: string, full path of the bar shadow reference file
+        """
+        self.ref_file = ref_file
+        with fits.open(ref_file) as hdul:
+            self.header = hdul[1].header.copy()
+            bscor_ref = np.array(hdul[1].data, dtype=float)
+        w = wcs.WCS(self.header)
+        y1, x1 = np.mgrid[:bscor_ref.shape[0], : bscor_ref.shape[1]]
+        lam_ref, slity_ref = w.all_pix2world(x1, y1, 0)
+        lam_axis, slity_axis = lam_ref[0, :], slity_ref[:, 0]
+        separable = (np.allclose(lam_ref, lam_axis[np.newaxis, :], rtol=0.0, atol=1e-12*np.abs(lam_axis).max())
+                     and np.allclose(slity_ref, slity_axis[:, np.newaxis], rtol=0.0,
+                                     atol=1e-12*np.abs(slity_axis).max()))
+        lam_steps, slity_steps = np.diff(lam_axis), np.diff(slity_axis)
+        monotonic = (np.all(lam_steps > 0) or np.all(lam_steps < 0)) and (np.all(slity_steps > 0) or
+                                                                           np.all(slity_steps < 0))
+        if separable and monotonic:
+            # the interpolator needs ascending axes
+            if lam_steps[0] < 0:
+                lam_axis, bscor_ref = lam_axis[::-1], bscor_ref[:, ::-1]
+            if slity_steps[0] < 0:
+                slity_axis, bscor_ref = slity_axis[::-1], bscor_ref[::-1, :]
+            self.interpolator = RegularGridInterpolator((slity_axis, lam_axis), bscor_ref, method="linear",
+                                                        bounds_error=False, fill_value=np.nan)
+            self.regular_grid = True
+        else:
+            pixels_ref = np.column_stack((lam_ref.ravel(), slity_ref.ravel()))
+            self.interpolator = LinearNDInterpolator(pixels_ref, bscor_ref.ravel(), fill_value=np.nan)
+            self.regular_grid = False
+
+    def __call__(self, wave, slity):
+        """
+        This function interpolates the reference correction at all the given points at once.
+        Args:
+            wave: numpy array, wavelength of each pixel
+            slity: numpy array, slit_y of each pixel (same shape as wave)
+
+        Returns:
+            bscor: numpy array with the shape of wave, NaN where wave is NaN or outside of the reference grid
+        """
+        wave, slity = np.asarray(wave, dtype=float), np.asarray(slity, dtype=float)
+        bscor = np.full(wave.shape, np.nan)
+        indxs = ~np.isnan(wave)
+        if self.regular_grid:
+            bscor[indxs] = self.interpolator(np.column_stack((slity[indxs], wave[indxs])))
+        else:
+            bscor[indxs] = self.interpolator(np.column_stack((wave[indxs], slity[indxs])))
+        return bscor
+
+
+def get_barshadow_reference(ref_file):
+    """
+    This function returns the interpolator of the given bar shadow reference file, building it only the first time
+    the file is used (or if the file changed on disk).
+    Args:
+        ref_file: string, full path of the bar shadow reference file
+
+    Returns:
+        BarshadowReference object
+    """
+    key = (os.path.abspath(ref_file), os.path.getmtime(ref_file))
+    if key not in _reference_interpolators:
+        for stale_key in [k for k in _reference_interpolators if k[0] == key[0]]:
+            del _reference_interpolators[stale_key]
+        _reference_interpolators[key] = BarshadowReference(ref_file)
+    return _reference_interpolators[key]
+
+
+@phase_timing.timed("barshadow_testing", "slit_total")
+def barshadow_slitlet_test(slit_idx, plfile, bsfile, barshadow_threshold_diff, save_final_figs, show_final_figs,
+                           save_intermediary_figs, show_intermediary_figs, write_barshadow_files, debug):
+    """
+    This function does the bar shadow test of one slitlet. It is run by run_barshadow_tests for each slitlet, either
+    in the same process or in a worker process, so it reads the data models itself (once per process).
+
+    Args:
+        slit_idx: integer, index of the slitlet in the slits of both data models
+        plfile: string, 2D spectra output prior to the bar shadow step (e.g., extract_2d or pathloss product)
+        bsfile: string, read in 2D spectra output from the bar shadow step
+        barshadow_threshold_diff: float, threshold for the median of the relative differences
+        save_final_figs: boolean, if True the final figures with corresponding histograms will be saved
+        show_final_figs: boolean, if True the final figures with corresponding histograms will be shown
+        save_intermediary_figs: boolean, if True the intermediary figures with corresponding histograms will be saved
+        show_intermediary_figs: boolean, if True the intermediary figures with corresponding histograms will be shown
+        write_barshadow_files: boolean, if True the corrected data and relative differences are returned
+        debug: boolean
+
+    Returns:
+        slit_id: string, name of the slitlet
+        slitlet_test_result_list: list, dictionary with the result of each test, None if the test has to be skipped
+        corrected: numpy array, data corrected with the calculated correction (None if not writing files)
+        reldiff: numpy array, relative differences with the pipeline correction (None if not writing files)
+        log_msgs: list, all print statements captured in this variable
+        skip_msg: string, reason to skip the whole test, None if the slitlet was tested
+    """
+
+    log_msgs = []
+
+    # get the slitlet from the pathloss or extract_2d and the barshadow datamodels
+    plslit = auxfunc.get_cached_datamodel(plfile, datamodels.open).slits[slit_idx]
+    bsslit = auxfunc.get_cached_datamodel(bsfile, datamodels.open).slits[slit_idx]
+
+    # check that slitlet name of the data from the pathloss or extract_2d and the barshadow datamodels are the same
+    slit_id = bsslit.name
+    phase_timing.set_slit(slit_id)
+    print('Working with slitlet ', slit_id)
+    if plslit.name == bsslit.name:
+        msg = 'Slitlet name in fits file previous to barshadow and in barshadow output file are the same.'
+        log_msgs.append(msg)
+        print(msg)
+    else:
+        msg = '* Missmatch of slitlet names in fits file previous to barshadow and in barshadow output file. Skipping test.'
+        log_msgs.append(msg)
+        return slit_id, None, None, None, log_msgs, msg
+
+
+    # obtain the data from the pathloss or extract_2d and the barshadow datamodels
+    plsci = plslit.data
+    bssci = bsslit.data
+
+    if debug:
+        print('plotting the data for both input files...')
+
+    # set up generals for all the plots
+    phase_timing.start_phase("plotting")
+    font = {  # 'family' : 'normal',
+            'weight': 'normal',
+            'size': 16}
+    matplotlib.rc('font', **font)
+
+    plt.figure(figsize=(12, 10))
+    # Top figure
+    plt.subplot(211)
+    norm = ImageNormalize(plsci,vmin=0.,vmax=500.,stretch=AsinhStretch())
+    plt.imshow(plsci, norm=norm, aspect=10.0, origin='lower', cmap='viridis')
+    plt.title('Normalized science data before barshadow step for slitlet '+slit_id)
+    # Bottom figure
+    plt.subplot(212)
+    norm=ImageNormalize(bssci,vmin=0.,vmax=500.,stretch=AsinhStretch())
+    plt.imshow(bssci,norm=norm,aspect=10.0,origin='lower',cmap='viridis')
+    plt.title('Normalized barshadow science data for slitlet '+slit_id)
+    # Show and/or save figures
+    file_path = bsfile.replace(os.path.basename(bsfile), "")
+    file_basename = os.path.basename(bsfile.replace("_barshadow.fits", ""))
+    if save_intermediary_figs:
+        t = (file_basename, "Barshadowtest_NormSciData_slitlet" + slit_id + ".pdf")
+        plt_name = "_".join(t)
+        plt_name = os.path.join(file_path, plt_name)
+        plt.savefig(plt_name)
+        print('Figure saved as: ', plt_name)
+    if show_intermediary_figs:
+        plt.show()
+    plt.close()
+
+    # calculate spatial profiles for both products
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(9,9))
+    plt.subplots_adjust(hspace=0.5)
+    fig.subplots_adjust(wspace=0.6)
+    point1 = [355, 375]
+    plprof1 = np.median(plsci[:,point1[0]:point1[1]],1)
+    bsprof1 = np.median(bssci[:,point1[0]:point1[1]],1)
+    # only use pixels that are not NaN
+    x1 = np.squeeze(np.nonzero(~np.isnan(bsprof1)))
+    ax1.plot(x1,plprof1[x1])
+    ax1.set_title('Before barshadow array slice 1')
+    ax1.set_xlabel('x (pixels)')
+    ax1.set_ylabel('y (pixels)')
+    if debug:
+        print('ax1 std_dev/mean = ', np.nanstd(plprof1[x1])/np.nanmean(plprof1[x1]))
+
+    point2 = [1190, 1210]
+    plprof2 = np.median(plsci[:,point2[0]:point2[1]],1)
+    bsprof2 = np.median(bssci[:,point2[0]:point2[1]],1)
+    x2 = np.squeeze(np.nonzero(~np.isnan(bsprof2)))
+    ax2.plot(x2,plprof2[x2])
+    ax2.set_title('Before barshadow array slice 2')
+    ax2.set_xlabel('x (pixels)')
+    ax2.set_ylabel('y (pixels)')
+    if debug:
+        print('ax2 std_dev/mean = ', np.nanstd(plprof2[x2])/np.nanmean(plprof2[x2]))
+
+    ax3.plot(x1,bsprof1[x1])
+    ax3.set_title('Barshadow array slice 1')
+    ax3.set_xlabel('x (pixels)')
+    ax3.set_ylabel('y (pixels)')
+    if debug:
+        print('ax3 std_dev/mean = ', np.nanstd(bsprof1)/np.nanmean(bsprof1[x1]))
+
+    ax4.plot(x2,bsprof2[x2])
+    if debug:
+        print('ax4 std_dev/mean = ', np.nanstd(bsprof2)/np.nanmean(bsprof2[x2]))
+    ax4.set_title('Barshadow array slice 2')
+    ax4.set_xlabel('x (pixels)')
+    ax4.set_ylabel('y (pixels)')
+
+    fig.suptitle('Spatial profiles before correction for slitlet '+slit_id, fontsize=20)
+
+    # Show and/or save figures
+    if save_intermediary_figs:
+        t = (file_basename, "Barshadowtest_SpatialProfilesBe4correction_slitlet" + slit_id + ".pdf")
+        plt_name = "_".join(t)
+        plt_name = os.path.join(file_path, plt_name)
+        plt.savefig(plt_name)
+        print('Figure saved as: ', plt_name)
+    if show_intermediary_figs:
+        plt.show()
+    plt.close()
+
+
+    ### compare pipeline correction values with independent calculation
+
+    # get the bar shadow corrections from the step product
+    phase_timing.start_phase("wcs_evaluation")
+    bscor_pipe = bsslit.barshadow
+
+    # get correction from independent calculation
+    msg = 'Calculating barshadow correction...'
+    log_msgs.append(msg)
+    print(msg)
+    # Create x, y indices using the Trace WCS
+    x, y = wcstools.grid_from_bounding_box(bsslit.meta.wcs.bounding_box, step=(1, 1))
+    if debug:
+        print('x = ', x)
+
+    # derive the slity_y values per pixel
+    wcsobj = bsslit.meta.wcs
+    det2slit = wcsobj.get_transform('detector','slit_frame')
+    bsslitx, bsslity, bswave = det2slit(x,y)
+    # scale the slit_y values by 1.15 to take into account the shutter pitch
+    bsslity = bsslity/1.15
+
+    # compute bar shadow corrections independently, given the wavelength and slit_y from the data model
+    # get the reference file (need the mos1x1 for this internal lamp case, where each shutter was extracted separately)
+    #if bsslit.shutter_state == 'x':
+    ref_file = '/grp/jwst/wit4/nirspec/CDP3/05_Other_Calibrations/5.3_BarShadow/referenceFilesBS-20160401/jwst-nirspec-mos1x1.bsrf.fits'
+    if bsslit.shutter_state == '1':
+        ref_file = '/grp/jwst/wit4/nirspec/CDP3/05_Other_Calibrations/5.3_BarShadow/referenceFilesBS-20160401/jwst-nirspec-mos1x3.bsrf.fits'
+    if debug:
+        '''    shutter_state : str ----- ``Slit.shutter_state`` attribute - a combination of
+                                possible values: ``1`` - open shutter, ``0`` - closed shutter, ``x`` - main shutter
+        '''
+        print('slit.shutter_state = ', bsslit.shutter_state)
+    msg = 'Reference file used for barshadow calculation: '+ref_file
+    log_msgs.append(msg)
+    print(msg)
+    phase_timing.start_phase("reference_read")
+    bs_reference = get_barshadow_reference(ref_file)
+
+    # for slit wcs, interpolate over the reference file values
+    phase_timing.start_phase("correction_calculation")
+    bscor = bs_reference(bswave, bsslity)
+    if debug:
+        print('bscor.shape = ', bscor.shape)
+    msg = 'Calculation of barshadow correction done.'
+    log_msgs.append(msg)
+    print(msg)
+
+    shutter_status = bsslit.shutter_state
+    if bsslit.shutter_state == 'x':
+        fi = shutter_status.find('x')
+    if bsslit.shutter_state == '1':
+        fi = shutter_status.find('1')
+    if debug:
+        print('fi = ', fi)
+    nax2 = bs_reference.header['NAXIS2']
+    cv1 = bs_reference.header['CRVAL1']
+    cd1 = bs_reference.header['CDELT1']
+    cd2 = bs_reference.header['CDELT2']
+    shutter_height = 1./cd2
+    fi2 = nax2-shutter_height*(1+fi)
+    if debug:
+        print('nax2, fi2, shutter_height:', nax2, fi2, shutter_height)
+    yrow = fi2 + bsslity*shutter_height
+    wcol = (bswave-cv1)/cd1
+    #print(yrow[9,1037],wcol[9,1037])
+    if debug:
+        print('np.shape(yrow)=', np.shape(yrow))
+    point3 = [10, np.shape(yrow)[1]-50]
+    print(yrow[point3[0], point3[1]],wcol[point3[0], point3[1]])
+
+    phase_timing.start_phase("plotting")
+    fig = plt.figure(figsize=(12, 10))
+    # Top figure
+    plt.subplot(211)
+    plt.imshow(bscor,vmin=0.,vmax=1.,aspect=10.0,origin='lower',cmap='viridis')
+    plt.title('Calculated Correction')
+    plt.colorbar()
+    # Bottom figure
+    plt.subplot(212)
+    plt.imshow(bscor_pipe,vmin=0.,vmax=1.,aspect=10.0,origin='lower',cmap='viridis')
+    plt.title('Pipeline Correction')
+    plt.colorbar()
+
+    fig.suptitle('Barshadow correction comparison for slitlet '+slit_id, fontsize=20)
+
+    # Show and/or save figures
+    if save_intermediary_figs:
+        t = (file_basename, "Barshadowtest_CorrectionComparison_slitlet" + slit_id + ".pdf")
+        plt_name = "_".join(t)
+        plt_name = os.path.join(file_path, plt_name)
+        plt.savefig(plt_name)
+        print('Figure saved as: ', plt_name)
+    if show_intermediary_figs:
+        plt.show()
+    plt.close()
+
+    if debug:
+        #print('bscor_pipe[9,1037],bswave[9,1037],bsslity[9,1037],bscor[9,1037]: ',
+        #      bscor_pipe[9,1037],bswave[9,1037],bsslity[9,1037],bscor[9,1037])
+        print('bscor_pipe[point3[0], point3[1]],bswave[point3[0], point3[1]],bsslity[point3[0], point3[1]],bscor[point3[0], point3[1]]: ',
+              bscor_pipe[point3[0], point3[1]],bswave[point3[0], point3[1]],bsslity[point3[0], point3[1]],bscor[point3[0], point3[1]])
+
+
+    print('Creating final barshadow test plot...')
+    reldiff = (bscor_pipe-bscor)/bscor
+    if debug:
+        print('np.nanmean(reldiff),np.nanstd(reldiff) : ', np.nanmean(reldiff),np.nanstd(reldiff))
+    fig = plt.figure(figsize=(12, 10))
+    # Top figure - 2D plot
+    plt.subplot(211)
+    plt.imshow(reldiff,vmin=-0.01,vmax=0.01,aspect=10.0,origin='lower',cmap='viridis')
+    plt.colorbar()
+    plt.title('Relative differences')
+    plt.xlabel('x (pixels)')
+    plt.ylabel('y (pixels)')
+    # Bottom figure - histogram
+    ax = plt.subplot(212)
+    plt.hist(reldiff[~np.isnan(reldiff)],bins=100,range=(-0.1,0.1))
+    plt.xlabel('(Pipeline_correction - Calculated_correction) / Calculated_correction')
+    plt.ylabel('N')
+    # add vertical line at mean and median
+    nanind = np.isnan(reldiff)  # get all the nan indexes
+    notnan = ~nanind  # get all the not-nan indexes
+    arr_mean = np.mean(reldiff[notnan])
+    arr_median = np.median(reldiff[notnan])
+    arr_stddev = np.std(reldiff[notnan])
+    plt.axvline(arr_mean, label="mean = %0.3e" % (arr_mean), color="g")
+    plt.axvline(arr_median, label="median = %0.3e" % (arr_median), linestyle="-.", color="b")
+    str_arr_stddev = "stddev = {:0.3e}".format(arr_stddev)
+    ax.text(0.73, 0.67, str_arr_stddev, transform=ax.transAxes, fontsize=16)
+    plt.legend()
+    plt.minorticks_on()
+
+    fig.suptitle('Barshadow correction relative differences for slitlet '+slit_id, fontsize=20)
+
+    # Show and/or save figures
+    if save_final_figs:
+        t = (file_basename, "Barshadowtest_RelDifferences_slitlet" + slit_id + ".pdf")
+        plt_name = "_".join(t)
+        plt_name = os.path.join(file_path, plt_name)
+        plt.savefig(plt_name)
+        print('Figure saved as: ', plt_name)
+    if show_final_figs:
+        plt.show()
+    plt.close()
+
+    # Determine if median test is passed
+    phase_timing.start_phase("statistics")
+    slitlet_test_result_list = []
+    tested_quantity = 'barshadow_correction'
+    stats = auxfunc.print_stats(reldiff[notnan], tested_quantity, barshadow_threshold_diff, abs=False, return_percentages=True)
+    _, stats_print_strings, percentages = stats
+    result = auxfunc.does_median_pass_tes(arr_median, barshadow_threshold_diff)
+    slitlet_test_result_list.append({tested_quantity: result})
+    for line in stats_print_strings:
+        log_msgs.append(line)
+    msg = " * Result of median test for slit "+slit_id+": "+result+"\n"
+    print(msg)
+    log_msgs.append(msg)
+
+    tested_quantity = "percentage_greater_3threshold"
+    result = auxfunc.does_median_pass_tes(percentages[1], 10)
+    slitlet_test_result_list.append({tested_quantity: result})
+    msg = " * Result of number of points greater than 3*threshold greater than 10%: "+result+"\n"
+    print(msg)
+    log_msgs.append(msg)
+
+    tested_quantity = "percentage_greater_5threshold"
+    result = auxfunc.does_median_pass_tes(percentages[2], 10)
+    slitlet_test_result_list.append({tested_quantity: result})
+    msg = " * Result of number of points greater than 5*threshold greater than 10%: "+result+"\n"
+    print(msg)
+    log_msgs.append(msg)
+
+    # Make plots of normalized corrected data
+    phase_timing.start_phase("plotting")
+    corrected = plsci/bscor
+    plt.figure(figsize=(12, 10))
+    norm=ImageNormalize(corrected,vmin=0.,vmax=500.,stretch=AsinhStretch())
+    plt.imshow(corrected, norm=norm, aspect=10.0, origin='lower', cmap='viridis')
+    plt.title('Normalized data before barshadow step with correction applied')
+    plt.xlabel('Sci_data_before_barshadow / barshadow_calculated_correction')
+    plt.ylabel('Normalized data')
+    # Show and/or save figures
+    if save_intermediary_figs:
+        t = (file_basename, "Barshadowtest_CorrectedData_slitlet" + slit_id + ".pdf")
+        plt_name = "_".join(t)
+        plt_name = os.path.join(file_path, plt_name)
+        plt.savefig(plt_name)
+        print('Figure saved as: ', plt_name)
+    if show_intermediary_figs:
+        plt.show()
+    plt.close()
+
+
+    # calculate spatial profiles for both products
+    fig, ((ax1, ax2)) = plt.subplots(1, 2, figsize=(19,9))
+    prof = np.median(corrected[:,point1[0]:point1[1]],1)
+    x = np.arange(corrected.shape[0])
+    ax1.plot(x,prof)
+    ax1.set_title('Before barshadow array slice 1')
+    ax1.set_xlabel('x (pixels)')
+    ax1.set_ylabel('y (pixels)')
+    if debug:
+        print('np.nanstd(prof)/np.nanmean(prof) = ', np.nanstd(prof)/np.nanmean(prof))
+    prof = np.median(corrected[:,point2[0]:point2[1]],1)
+    x = np.arange(corrected.shape[0])
+    ax2.plot(x,prof)
+    ax2.set_title('Before barshadow array slice 2')
+    ax2.set_xlabel('x (pixels)')
+    ax2.set_ylabel('y (pixels)')
+    if debug:
+        print('np.nanstd(prof)/np.nanmean(prof) = ', np.nanstd(prof)/np.nanmean(prof))
+    fig.suptitle('Corrected spatial profiles for slitlet '+slit_id, fontsize=20)
+    # Show and/or save figures
+    if save_intermediary_figs:
+        t = (file_basename, "Barshadowtest_CorrectedSpatialProfiles_slitlet" + slit_id + ".pdf")
+        plt_name = "_".join(t)
+        plt_name = os.path.join(file_path, plt_name)
+        plt.savefig(plt_name)
+        print('Figure saved as: ', plt_name)
+    if show_intermediary_figs:
+        plt.show()
+    plt.close()
+
+    # the images are only sent back if they are going to be written
+    if not write_barshadow_files:
+        corrected, reldiff = None, None
+
+    return slit_id, slitlet_test_result_list, corrected, reldiff, log_msgs, None
+
+
+@phase_timing.timed("barshadow_testing")
 def run_barshadow_tests(plfile, bsfile, barshadow_threshold_diff=0.05, save_final_figs=False, show_final_figs=False,
                         save_intermediary_figs=False, show_intermediary_figs=False, write_barshadow_files=False,
-                        debug=False):
+                        debug=False, n_workers=1):
     """
 
     Args:
@@ -48,7 +518,9 @@ def run_barshadow_tests(plfile, bsfile, barshadow_threshold_diff=0.05, save_fina
         show_final_figs: boolean, if True the final figures with corresponding histograms will be shown
         save_intermediary_figs: boolean, if True the intermediary figures with corresponding histograms will be saved
         show_intermediary_figs: boolean, if True the intermediary figures with corresponding histograms will be shown
+        write_barshadow_files: boolean, if True the calculated and comparison fits files will be written
         debug: boolean
+        n_workers: integer, number of processes to test the slitlets in parallel (1 = serial)
 
     Returns:
 
@@ -72,7 +544,8 @@ def run_barshadow_tests(plfile, bsfile, barshadow_threshold_diff=0.05, save_fina
         return result, result_msg, log_msgs
 
     # get the data model
-    pl = datamodels.open(plfile)
+    phase_timing.start_phase("file_read")
+    pl = auxfunc.get_cached_datamodel(plfile, datamodels.open)
     if debug:
         print('got extract_2d datamodel!')
 
@@ -86,12 +559,14 @@ def run_barshadow_tests(plfile, bsfile, barshadow_threshold_diff=0.05, save_fina
         result = 'skip'
         return result, result_msg, log_msgs
 
-    bs = datamodels.open(bsfile)
+    bs = auxfunc.get_cached_datamodel(bsfile, datamodels.open)
     if debug:
         print('got barshadow datamodel!')
 
     # list to determine if pytest is passed or not
     total_test_result = OrderedDict()
+    # the time of the slitlets is recorded by barshadow_slitlet_test
+    phase_timing.end_phase()
 
     if write_barshadow_files:
         # create the fits list to hold the image of the correction values
@@ -104,369 +579,68 @@ def run_barshadow_tests(plfile, bsfile, barshadow_threshold_diff=0.05, save_fina
         complfile = fits.HDUList()
         complfile.append(hdu0)
 
-    # loop over the slitlets in both files
-    print('Looping over open slitlets...')
-    for plslit, bsslit in zip(pl.slits, bs.slits):
-        # check that slitlet name of the data from the pathloss or extract_2d and the barshadow datamodels are the same
-        slit_id = bsslit.name
-        print('Working with slitlet ', slit_id)
-        if plslit.name == bsslit.name:
-            msg = 'Slitlet name in fits file previous to barshadow and in barshadow output file are the same.'
-            log_msgs.append(msg)
-            print(msg)
-        else:
-            msg = '* Missmatch of slitlet names in fits file previous to barshadow and in barshadow output file. Skipping test.'
-            result = 'skip'
-            log_msgs.append(msg)
-            return result, msg, log_msgs
-
-
-        # obtain the data from the pathloss or extract_2d and the barshadow datamodels
-        plsci = plslit.data
-        bssci = bsslit.data
-
-        if debug:
-            print('plotting the data for both input files...')
-
-        # set up generals for all the plots
-        font = {  # 'family' : 'normal',
-                'weight': 'normal',
-                'size': 16}
-        matplotlib.rc('font', **font)
-
-        plt.figure(figsize=(12, 10))
-        # Top figure
-        plt.subplot(211)
-        norm = ImageNormalize(plsci,vmin=0.,vmax=500.,stretch=AsinhStretch())
-        plt.imshow(plsci, norm=norm, aspect=10.0, origin='lower', cmap='viridis')
-        plt.title('Normalized science data before barshadow step for slitlet '+slit_id)
-        # Bottom figure
-        plt.subplot(212)
-        norm=ImageNormalize(bssci,vmin=0.,vmax=500.,stretch=AsinhStretch())
-        plt.imshow(bssci,norm=norm,aspect=10.0,origin='lower',cmap='viridis')
-        plt.title('Normalized barshadow science data for slitlet '+slit_id)
-        # Show and/or save figures
-        file_path = bsfile.replace(os.path.basename(bsfile), "")
-        file_basename = os.path.basename(bsfile.replace("_barshadow.fits", ""))
-        if save_intermediary_figs:
-            t = (file_basename, "Barshadowtest_NormSciData_slitlet" + slit_id + ".pdf")
-            plt_name = "_".join(t)
-            plt_name = os.path.join(file_path, plt_name)
-            plt.savefig(plt_name)
-            print('Figure saved as: ', plt_name)
-        if show_intermediary_figs:
-            plt.show()
-        plt.close()
-
-        # calculate spatial profiles for both products
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(9,9))
-        plt.subplots_adjust(hspace=0.5)
-        fig.subplots_adjust(wspace=0.6)
-        point1 = [355, 375]
-        plprof1 = np.median(plsci[:,point1[0]:point1[1]],1)
-        bsprof1 = np.median(bssci[:,point1[0]:point1[1]],1)
-        # only use pixels that are not NaN
-        x1 = np.squeeze(np.nonzero(~np.isnan(bsprof1)))
-        ax1.plot(x1,plprof1[x1])
-        ax1.set_title('Before barshadow array slice 1')
-        ax1.set_xlabel('x (pixels)')
-        ax1.set_ylabel('y (pixels)')
-        if debug:
-            print('ax1 std_dev/mean = ', np.nanstd(plprof1[x1])/np.nanmean(plprof1[x1]))
-
-        point2 = [1190, 1210]
-        plprof2 = np.median(plsci[:,point2[0]:point2[1]],1)
-        bsprof2 = np.median(bssci[:,point2[0]:point2[1]],1)
-        x2 = np.squeeze(np.nonzero(~np.isnan(bsprof2)))
-        ax2.plot(x2,plprof2[x2])
-        ax2.set_title('Before barshadow array slice 2')
-        ax2.set_xlabel('x (pixels)')
-        ax2.set_ylabel('y (pixels)')
-        if debug:
-            print('ax2 std_dev/mean = ', np.nanstd(plprof2[x2])/np.nanmean(plprof2[x2]))
-        
-        ax3.plot(x1,bsprof1[x1])
-        ax3.set_title('Barshadow array slice 1')
-        ax3.set_xlabel('x (pixels)')
-        ax3.set_ylabel('y (pixels)')
-        if debug:
-            print('ax3 std_dev/mean = ', np.nanstd(bsprof1)/np.nanmean(bsprof1[x1]))
-        
-        ax4.plot(x2,bsprof2[x2])
-        if debug:
-            print('ax4 std_dev/mean = ', np.nanstd(bsprof2)/np.nanmean(bsprof2[x2]))
-        ax4.set_title('Barshadow array slice 2')
-        ax4.set_xlabel('x (pixels)')
-        ax4.set_ylabel('y (pixels)')
-
-        fig.suptitle('Spatial profiles before correction for slitlet '+slit_id, fontsize=20)
-
-        # Show and/or save figures
-        if save_intermediary_figs:
-            t = (file_basename, "Barshadowtest_SpatialProfilesBe4correction_slitlet" + slit_id + ".pdf")
-            plt_name = "_".join(t)
-            plt_name = os.path.join(file_path, plt_name)
-            plt.savefig(plt_name)
-            print('Figure saved as: ', plt_name)
-        if show_intermediary_figs:
-            plt.show()
-        plt.close()
-
-
-        ### compare pipeline correction values with independent calculation
-
-        # get the bar shadow corrections from the step product
-        bscor_pipe = bsslit.barshadow
-
-        # get correction from independent calculation
-        msg = 'Calculating barshadow correction...'
-        log_msgs.append(msg)
-        print(msg)
-        # Create x, y indices using the Trace WCS
-        x, y = wcstools.grid_from_bounding_box(bsslit.meta.wcs.bounding_box, step=(1, 1))
-        if debug:
-            print('x = ', x)
-
-        # derive the slity_y values per pixel
-        wcsobj = bsslit.meta.wcs
-        det2slit = wcsobj.get_transform('detector','slit_frame')
-        bsslitx, bsslity, bswave = det2slit(x,y)
-        # scale the slit_y values by 1.15 to take into account the shutter pitch
-        bsslity = bsslity/1.15
-
-        # compute bar shadow corrections independently, given the wavelength and slit_y from the data model
-        # get the reference file (need the mos1x1 for this internal lamp case, where each shutter was extracted separately)
-        #if bsslit.shutter_state == 'x':
-        ref_file = '/grp/jwst/wit4/nirspec/CDP3/05_Other_Calibrations/5.3_BarShadow/referenceFilesBS-20160401/jwst-nirspec-mos1x1.bsrf.fits'
-        if bsslit.shutter_state == '1':
-            ref_file = '/grp/jwst/wit4/nirspec/CDP3/05_Other_Calibrations/5.3_BarShadow/referenceFilesBS-20160401/jwst-nirspec-mos1x3.bsrf.fits'
-        if debug:
-            '''    shutter_state : str ----- ``Slit.shutter_state`` attribute - a combination of
-                                    possible values: ``1`` - open shutter, ``0`` - closed shutter, ``x`` - main shutter
-            '''
-            print('slit.shutter_state = ', bsslit.shutter_state)
-        msg = 'Reference file used for barshadow calculation: '+ref_file
-        log_msgs.append(msg)
+    # the figures can only be shown from the main process
+    if (show_final_figs or show_intermediary_figs) and n_workers > 1:
+        msg = "The figures are set to be shown, so the slitlets will be tested serially instead of with "+repr(n_workers)+" workers."
         print(msg)
-        hdul = fits.open(ref_file)
-        bscor_ref = hdul[1].data
-        w = wcs.WCS(hdul[1].header)
-        y1, x1 = np.mgrid[:bscor_ref.shape[0], : bscor_ref.shape[1]]
-        lam_ref, slity_ref = w.all_pix2world(x1,y1,0)
-
-        # for slit wcs, interpolate over the reference file values
-        lam_ref = lam_ref.reshape(bscor_ref.size)
-        slity_ref = slity_ref.reshape(bscor_ref.size)
-        pixels_ref = np.column_stack((lam_ref,slity_ref))
-        bscor_ref = bscor_ref.reshape(bscor_ref.size)
-        bswave_ex = bswave.reshape(bswave.size)
-        indxs = ~np.isnan(bswave_ex)
-        bsslity_ex = bsslity.reshape(bsslity.size)
-        xyints = np.column_stack((bswave_ex[indxs],bsslity_ex[indxs]))
-        bscor = np.empty(bswave_ex.size)
-        bscor[:] = np.nan
-        bscor[indxs] = griddata(pixels_ref, bscor_ref, xyints, method='linear')
-        bscor = bscor.reshape(bswave.shape[0],bswave.shape[1])
-        if debug:
-            print('bscor.shape = ', bscor.shape)
-        msg = 'Calculation of barshadow correction done.'
         log_msgs.append(msg)
-        print(msg)
+        n_workers = 1
 
-        shutter_status = bsslit.shutter_state
-        if bsslit.shutter_state == 'x':
-            fi = shutter_status.find('x')
-        if bsslit.shutter_state == '1':
-            fi = shutter_status.find('1')
-        if debug:
-            print('fi = ', fi)
-        nax2 = hdul[1].header['NAXIS2']
-        cv1 = hdul[1].header['CRVAL1']
-        cd1 = hdul[1].header['CDELT1']
-        cd2 = hdul[1].header['CDELT2']
-        shutter_height = 1./cd2
-        fi2 = nax2-shutter_height*(1+fi)
-        if debug:
-            print('nax2, fi2, shutter_height:', nax2, fi2, shutter_height)
-        yrow = fi2 + bsslity*shutter_height
-        wcol = (bswave-cv1)/cd1
-        #print(yrow[9,1037],wcol[9,1037])
-        if debug:
-            print('np.shape(yrow)=', np.shape(yrow))
-        point3 = [10, np.shape(yrow)[1]-50]
-        print(yrow[point3[0], point3[1]],wcol[point3[0], point3[1]])
-
-        fig = plt.figure(figsize=(12, 10))
-        # Top figure
-        plt.subplot(211)
-        plt.imshow(bscor,vmin=0.,vmax=1.,aspect=10.0,origin='lower',cmap='viridis')
-        plt.title('Calculated Correction')
-        plt.colorbar()
-        # Bottom figure
-        plt.subplot(212)
-        plt.imshow(bscor_pipe,vmin=0.,vmax=1.,aspect=10.0,origin='lower',cmap='viridis')
-        plt.title('Pipeline Correction')
-        plt.colorbar()
-
-        fig.suptitle('Barshadow correction comparison for slitlet '+slit_id, fontsize=20)
-
-        # Show and/or save figures
-        if save_intermediary_figs:
-            t = (file_basename, "Barshadowtest_CorrectionComparison_slitlet" + slit_id + ".pdf")
-            plt_name = "_".join(t)
-            plt_name = os.path.join(file_path, plt_name)
-            plt.savefig(plt_name)
-            print('Figure saved as: ', plt_name)
-        if show_intermediary_figs:
-            plt.show()
-        plt.close()
+    # loop over the slitlets in both files, in this process or distributed in n_workers processes
+    print('Looping over open slitlets...')
+    args_list = []
+    for slit_idx in range(min(len(pl.slits), len(bs.slits))):
+        args_list.append((slit_idx, plfile, bsfile, barshadow_threshold_diff, save_final_figs, show_final_figs,
+                          save_intermediary_figs, show_intermediary_figs, write_barshadow_files, debug))
+    slitlet_results = auxfunc.run_per_slit(barshadow_slitlet_test, args_list, n_workers=n_workers)
+    try:
+        for slit_id, slitlet_test_result_list, corrected, reldiff, slitlet_log_msgs, skip_msg in slitlet_results:
+            log_msgs.extend(slitlet_log_msgs)
+            if skip_msg is not None:
+                result = 'skip'
+                return result, skip_msg, log_msgs
+
+            # store tests results in the total dictionary
+            total_test_result[slit_id] = slitlet_test_result_list
+
+            # create fits file to hold the calculated correction for each slitlet
+            if write_barshadow_files:
+                # this is the file to hold the image of the correction values
+                outfile_ext = fits.ImageHDU(corrected, name=slit_id)
+                outfile.append(outfile_ext)
+
+                # this is the file to hold the image of pipeline-calculated difference values, the comparison
+                complfile_ext = fits.ImageHDU(reldiff, name=slit_id)
+                complfile.append(complfile_ext)
+
+                # the file is not yet written, indicate that this slit was appended to list to be written
+                msg = "Extension corresponing to slitlet "+slit_id+" appended to list to be written into calculated and comparison fits files."
+                print(msg)
+                log_msgs.append(msg)
+    finally:
+        # stop the workers and free the data models also if a slitlet fails
+        slitlet_results.close()
+        auxfunc.release_cached_datamodel(plfile)
+        auxfunc.release_cached_datamodel(bsfile)
 
-        if debug:
-            #print('bscor_pipe[9,1037],bswave[9,1037],bsslity[9,1037],bscor[9,1037]: ',
-            #      bscor_pipe[9,1037],bswave[9,1037],bsslity[9,1037],bscor[9,1037])
-            print('bscor_pipe[point3[0], point3[1]],bswave[point3[0], point3[1]],bsslity[point3[0], point3[1]],bscor[point3[0], point3[1]]: ',
-                  bscor_pipe[point3[0], point3[1]],bswave[point3[0], point3[1]],bsslity[point3[0], point3[1]],bscor[point3[0], point3[1]])
+    if write_barshadow_files:
+        phase_timing.start_phase("file_write")
+        outfile_name = bsfile.replace(".fits", "_calc.fits")
+        complfile_name = bsfile.replace(".fits", "_comp.fits")
 
+        # the file to hold the calculated correction values of each slitlet
+        background_writer.submit(outfile, outfile_name)
 
-        print('Creating final barshadow test plot...')
-        reldiff = (bscor_pipe-bscor)/bscor
-        if debug:
-            print('np.nanmean(reldiff),np.nanstd(reldiff) : ', np.nanmean(reldiff),np.nanstd(reldiff))
-        fig = plt.figure(figsize=(12, 10))
-        # Top figure - 2D plot
-        plt.subplot(211)
-        plt.imshow(reldiff,vmin=-0.01,vmax=0.01,aspect=10.0,origin='lower',cmap='viridis')
-        plt.colorbar()
-        plt.title('Relative differences')
-        plt.xlabel('x (pixels)')
-        plt.ylabel('y (pixels)')
-        # Bottom figure - histogram
-        ax = plt.subplot(212)
-        plt.hist(reldiff[~np.isnan(reldiff)],bins=100,range=(-0.1,0.1))
-        plt.xlabel('(Pipeline_correction - Calculated_correction) / Calculated_correction')
-        plt.ylabel('N')
-        # add vertical line at mean and median
-        nanind = np.isnan(reldiff)  # get all the nan indexes
-        notnan = ~nanind  # get all the not-nan indexes
-        arr_mean = np.mean(reldiff[notnan])
-        arr_median = np.median(reldiff[notnan])
-        arr_stddev = np.std(reldiff[notnan])
-        plt.axvline(arr_mean, label="mean = %0.3e" % (arr_mean), color="g")
-        plt.axvline(arr_median, label="median = %0.3e" % (arr_median), linestyle="-.", color="b")
-        str_arr_stddev = "stddev = {:0.3e}".format(arr_stddev)
-        ax.text(0.73, 0.67, str_arr_stddev, transform=ax.transAxes, fontsize=16)
-        plt.legend()
-        plt.minorticks_on()
-
-        fig.suptitle('Barshadow correction relative differences for slitlet '+slit_id, fontsize=20)
-
-        # Show and/or save figures
-        if save_final_figs:
-            t = (file_basename, "Barshadowtest_RelDifferences_slitlet" + slit_id + ".pdf")
-            plt_name = "_".join(t)
-            plt_name = os.path.join(file_path, plt_name)
-            plt.savefig(plt_name)
-            print('Figure saved as: ', plt_name)
-        if show_final_figs:
-            plt.show()
-        plt.close()
-
-        # Determine if median test is passed
-        slitlet_test_result_list = []
-        tested_quantity = 'barshadow_correction'
-        stats = auxfunc.print_stats(reldiff[notnan], tested_quantity, barshadow_threshold_diff, abs=False, return_percentages=True)
-        _, stats_print_strings, percentages = stats
-        result = auxfunc.does_median_pass_tes(arr_median, barshadow_threshold_diff)
-        slitlet_test_result_list.append({tested_quantity: result})
-        for line in stats_print_strings:
-            log_msgs.append(line)
-        msg = " * Result of median test for slit "+slit_id+": "+result+"\n"
-        print(msg)
-        log_msgs.append(msg)
+        # the file to hold the pipeline-calculated difference values of each slitlet
+        background_writer.submit(complfile, complfile_name)
 
-        tested_quantity = "percentage_greater_3threshold"
-        result = auxfunc.does_median_pass_tes(percentages[1], 10)
-        slitlet_test_result_list.append({tested_quantity: result})
-        msg = " * Result of number of points greater than 3*threshold greater than 10%: "+result+"\n"
+        msg = "\nFits file with calculated bar shadow correction of each slitlet saved as: "+outfile_name
         print(msg)
         log_msgs.append(msg)
-
-        tested_quantity = "percentage_greater_5threshold"
-        result = auxfunc.does_median_pass_tes(percentages[2], 10)
-        slitlet_test_result_list.append({tested_quantity: result})
-        msg = " * Result of number of points greater than 5*threshold greater than 10%: "+result+"\n"
+        msg = "Fits file with comparison (relative difference of pipeline and calculated correction) saved as: "+complfile_name
         print(msg)
         log_msgs.append(msg)
 
-        # Make plots of normalized corrected data
-        corrected = plsci/bscor
-        plt.figure(figsize=(12, 10))
-        norm=ImageNormalize(corrected,vmin=0.,vmax=500.,stretch=AsinhStretch())
-        plt.imshow(corrected, norm=norm, aspect=10.0, origin='lower', cmap='viridis')
-        plt.title('Normalized data before barshadow step with correction applied')
-        plt.xlabel('Sci_data_before_barshadow / barshadow_calculated_correction')
-        plt.ylabel('Normalized data')
-        # Show and/or save figures
-        if save_intermediary_figs:
-            t = (file_basename, "Barshadowtest_CorrectedData_slitlet" + slit_id + ".pdf")
-            plt_name = "_".join(t)
-            plt_name = os.path.join(file_path, plt_name)
-            plt.savefig(plt_name)
-            print('Figure saved as: ', plt_name)
-        if show_intermediary_figs:
-            plt.show()
-        plt.close()
-
-
-        # calculate spatial profiles for both products
-        fig, ((ax1, ax2)) = plt.subplots(1, 2, figsize=(19,9))
-        prof = np.median(corrected[:,point1[0]:point1[1]],1)
-        x = np.arange(corrected.shape[0])
-        ax1.plot(x,prof)
-        ax1.set_title('Before barshadow array slice 1')
-        ax1.set_xlabel('x (pixels)')
-        ax1.set_ylabel('y (pixels)')
-        if debug:
-            print('np.nanstd(prof)/np.nanmean(prof) = ', np.nanstd(prof)/np.nanmean(prof))
-        prof = np.median(corrected[:,point2[0]:point2[1]],1)
-        x = np.arange(corrected.shape[0])
-        ax2.plot(x,prof)
-        ax2.set_title('Before barshadow array slice 2')
-        ax2.set_xlabel('x (pixels)')
-        ax2.set_ylabel('y (pixels)')
-        if debug:
-            print('np.nanstd(prof)/np.nanmean(prof) = ', np.nanstd(prof)/np.nanmean(prof))
-        fig.suptitle('Corrected spatial profiles for slitlet '+slit_id, fontsize=20)
-        # Show and/or save figures
-        if save_intermediary_figs:
-            t = (file_basename, "Barshadowtest_CorrectedSpatialProfiles_slitlet" + slit_id + ".pdf")
-            plt_name = "_".join(t)
-            plt_name = os.path.join(file_path, plt_name)
-            plt.savefig(plt_name)
-            print('Figure saved as: ', plt_name)
-        if show_intermediary_figs:
-            plt.show()
-        plt.close()
-
-        # store tests results in the total dictionary
-        total_test_result[slit_id] = slitlet_test_result_list
-
-        # create fits file to hold the calculated correction for each slitlet
-        if write_barshadow_files:
-            # this is the file to hold the image of the correction values
-            outfile_ext = fits.ImageHDU(corrected, name=slit_id)
-            outfile.append(outfile_ext)
-
-            # this is the file to hold the image of pipeline-calculated difference values, the comparison
-            complfile_ext = fits.ImageHDU(reldiff, name=slit_id)
-            complfile.append(complfile_ext)
-
-            # the file is not yet written, indicate that this slit was appended to list to be written
-            msg = "Extension corresponing to slitlet "+slit_id+" appended to list to be written into calculated and comparison fits files."
-            print(msg)
-            log_msgs.append(msg)
-
-
     if debug:
         print('total_test_result = ', total_test_result)
 
@@ -1,12 +1,13 @@
 import numpy as np
 import os
 from collections import OrderedDict
-from astropy.io import fits
 from astropy import wcs
 
 from jwst.assign_wcs import nirspec
 from jwst import datamodels
 from . import auxiliary_functions as auxfunc
+from . import esa_trace_reader
+from . import phase_timing
 
 
 """
@@ -17,7 +18,7 @@ This script compares pipeline WCS info with ESA results for Integral Field Unit
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "2.2"
+__version__ = "2.8"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -26,17 +27,30 @@ __version__ = "2.2"
 # Aug 2018 - Version 2.1: Modified slit-y differences to be reported in absolute numbers rather than relative
 # Dec 2018 - Version 2.2: (JM) Problem with the science extension function call (not appropriate for IFU data);
 #                         now using the data model to get the slice info.
-
-
-
-def compare_wcs(infile_name, esa_files_path=None, show_figs=True, save_figs=False, threshold_diff=1.0e-7, debug=False):
+# Oct 2026 - Version 2.3: ESA trace files are opened once and shared through esa_trace_reader.
+# Oct 2026 - Version 2.4: Moved the slice comparison to its own function so that the slices can be validated in
+#                         parallel processes.
+# Oct 2026 - Version 2.5: The observation context can be given instead of reading the header and configuration file.
+# Oct 2026 - Version 2.6: The time of each phase of the validation is recorded per slice (see phase_timing.py).
+# Oct 2026 - Version 2.7: The cached data model is released also when the validation of a slice fails.
+# Oct 2026 - Version 2.8: The detector, grating, filter, and lamp are read from the header of the file also when the
+#                         observation context is given.
+
+@phase_timing.timed("compare_wcs_ifu", "slit_total")
+def compare_slice_wcs(indiv_slice, infile_name, esa_files_path, det, grat, filt, raw_data_root_file, show_figs,
+                      save_figs, threshold_diff, debug):
     """
-    This function does the WCS comparison from the world coordinates calculated using the pipeline
-    data model with the ESA intermediary files.
+    This function does the WCS comparison of one IFU slice. It is run by compare_wcs for each slice, either in the
+    same process or in a worker process, so it reads the data model itself (once per process).
 
     Args:
+        indiv_slice: integer, number of the slice (0 - 29)
         infile_name: str, name of the output fits file from the assign_wcs step (with full path)
         esa_files_path: str, full path of where to find all ESA intermediary products to make comparisons for the tests
+        det: str, detector (NRS1 or NRS2)
+        grat: str, grating
+        filt: str, filter
+        raw_data_root_file: str, name of the raw data file, used to find the corresponding ESA files
         show_figs: boolean, whether to show plots or not
         save_figs: boolean, save the plots or not
         threshold_diff: float, threshold difference between pipeline output and ESA file
@@ -44,355 +58,421 @@ def compare_wcs(infile_name, esa_files_path=None, show_figs=True, save_figs=Fals
 
     Returns:
         - plots, if told to save and/or show them.
-        - median_diff: Boolean, True if smaller or equal to threshold
+        - slice_name: str, name of the slice in the test results, None if the slice was not tested
+        - slice_test_result: dictionary, result of the last test of the slice, None if the slice was not tested
         - log_msgs: list, all print statements are captured in this variable
-
+        - skip_test: boolean, True if the whole WCS test has to be skipped
     """
 
     log_msgs = []
 
-    # get grating and filter info from the rate file header
-    msg = 'infile_name = '+infile_name
+    if int(indiv_slice) < 10:
+        pslice = "0"+repr(indiv_slice)
+    else:
+        pslice = repr(indiv_slice)
+    msg = "\n Working with slice: "+pslice
     print(msg)
     log_msgs.append(msg)
-    det = fits.getval(infile_name, "DETECTOR", 0)
-    lamp = fits.getval(infile_name, "LAMP", 0)
-    grat = fits.getval(infile_name, "GRATING", 0)
-    filt = fits.getval(infile_name, "FILTER", 0)
-    msg = "from assign_wcs file  -->     Detector:"+det+"   Grating:"+grat+"   Filter:"+filt+"   Lamp:"+lamp
+    phase_timing.set_slit("slice"+pslice)
+    phase_timing.start_phase("esa_lookup")
+
+    # Get the ESA trace
+    #raw_data_root_file = "NRSSMOS-MOD-G1M-17-5344175105_1_491_SE_2015-12-10T18h00m06.fits" # testing with G140M
+    specifics = [pslice]
+    esafile = auxfunc.get_esafile(esa_files_path, raw_data_root_file, "IFU", specifics)[0]
+
+    # skip the test if the esafile was not found
+    if "ESA file not found" in esafile:
+        msg1 = " * compare_wcs_ifu.py is exiting because the corresponding ESA file was not found."
+        msg2 = "   -> The WCS test is now set to skip and no plots will be generated. "
+        print(msg1)
+        print(msg2)
+        log_msgs.append(msg1)
+        log_msgs.append(msg2)
+        return None, None, log_msgs, True
+
+    # Open the trace in the esafile
+    phase_timing.start_phase("esa_read")
+    msg = "Using this ESA file: \n"+str(esafile)
     print(msg)
     log_msgs.append(msg)
-
-    # get the datamodel from the assign_wcs output file
-    #img = datamodels.IFUImageModel(infile_name)
-    #slice_list = range(30)
-    #wcs_00 = nirspec.nrs_wcs_set_input(img, 0)
-    #print(wcs_00.available_frames)
-    # the above line will print all available frame transforms
-    #['detector', 'sca', 'gwa', 'slit_frame', 'slicer', 'msa_frame', 'oteip', 'v2v3', 'world']
-
-    # loop over the slices: 0 - 29
-    #slice_list = range(30)
-    #sci_ext_list = auxfunc.get_sci_extensions(infile_name)
-    img = datamodels.ImageModel(infile_name)
-    slice_list = img.meta.wcs.get_transform('gwa', 'slit_frame').slits
-    #print ('sci_ext_list=', sci_ext_list, '\n')
-
-    # dictionary to record if each test passed or not
-    total_test_result = OrderedDict()
-
-    # loop over the slices
-    for indiv_slice in slice_list:
-        if int(indiv_slice) < 10:
-            pslice = "0"+repr(indiv_slice)
+    with esa_trace_reader.open_esa_trace(esafile) as esahdulist:
+        print("* ESA file contents ")
+        esahdulist.info()
+        esa_slice_id = esahdulist[0].header['SLICEID']
+        # first check is esa_slice == to pipe_slice?
+        if indiv_slice == esa_slice_id:
+            msg = "\n -> Same slice found for pipeline and ESA data: "+repr(indiv_slice)+"\n"
+            print(msg)
+            log_msgs.append(msg)
         else:
-            pslice = repr(indiv_slice)
-        msg = "\n Working with slice: "+pslice
-        print(msg)
-        log_msgs.append(msg)
+            msg = "\n -> Missmatch of slices for pipeline and ESA data: "+repr(indiv_slice)+esa_slice_id+"\n"
+            print(msg)
+            log_msgs.append(msg)
 
-        # Get the ESA trace
-        #raw_data_root_file = "NRSSMOS-MOD-G1M-17-5344175105_1_491_SE_2015-12-10T18h00m06.fits" # testing with G140M
-        _, raw_data_root_file = auxfunc.get_modeused_and_rawdatrt_PTT_cfg_file()
-        specifics = [pslice]
-        esafile = auxfunc.get_esafile(esa_files_path, raw_data_root_file, "IFU", specifics)[0]
-
-        # skip the test if the esafile was not found
-        if "ESA file not found" in esafile:
-            msg1 = " * compare_wcs_ifu.py is exiting because the corresponding ESA file was not found."
-            msg2 = "   -> The WCS test is now set to skip and no plots will be generated. "
-            print(msg1)
-            print(msg2)
-            log_msgs.append(msg1)
-            log_msgs.append(msg2)
-            FINAL_TEST_RESULT = "skip"
-            return FINAL_TEST_RESULT, log_msgs
-
-        # Open the trace in the esafile
-        msg = "Using this ESA file: \n"+str(esafile)
-        print(msg)
-        log_msgs.append(msg)
-        with fits.open(esafile) as esahdulist:
-            print("* ESA file contents ")
-            esahdulist.info()
-            esa_slice_id = esahdulist[0].header['SLICEID']
-            # first check is esa_slice == to pipe_slice?
-            if indiv_slice == esa_slice_id:
-                msg = "\n -> Same slice found for pipeline and ESA data: "+repr(indiv_slice)+"\n"
+        # Assign variables according to detector
+        skipv2v3test = True
+        if det == "NRS1":
+            esa_flux = esahdulist.get_data("DATA1")
+            esa_wave = esahdulist.get_data("LAMBDA1")
+            esa_slity = esahdulist.get_data("SLITY1")
+            esa_msax = esahdulist.get_data("MSAX1")
+            esa_msay = esahdulist.get_data("MSAY1")
+            pyw = wcs.WCS(esahdulist['LAMBDA1'].header)
+            try:
+                esa_v2v3x = esahdulist.get_data("V2V3X1")
+                esa_v2v3y = esahdulist.get_data("V2V3Y1")
+                skipv2v3test = False
+            except KeyError:
+                msg = "Skipping tests for V2 and V3 because ESA file does not contain corresponding extensions."
                 print(msg)
                 log_msgs.append(msg)
-            else:
-                msg = "\n -> Missmatch of slices for pipeline and ESA data: "+repr(indiv_slice)+esa_slice_id+"\n"
+        if det == "NRS2":
+            try:
+                esa_flux = esahdulist.get_data("DATA2")
+                esa_wave = esahdulist.get_data("LAMBDA2")
+                esa_slity = esahdulist.get_data("SLITY2")
+                esa_msax = esahdulist.get_data("MSAX2")
+                esa_msay = esahdulist.get_data("MSAY2")
+                pyw = wcs.WCS(esahdulist['LAMBDA2'].header)
+                msg = "using NRS2 extensions"
                 print(msg)
                 log_msgs.append(msg)
-
-            # Assign variables according to detector
-            skipv2v3test = True
-            if det == "NRS1":
-                esa_flux = fits.getdata(esafile, "DATA1")
-                esa_wave = fits.getdata(esafile, "LAMBDA1")
-                esa_slity = fits.getdata(esafile, "SLITY1")
-                esa_msax = fits.getdata(esafile, "MSAX1")
-                esa_msay = fits.getdata(esafile, "MSAY1")
-                pyw = wcs.WCS(esahdulist['LAMBDA1'].header)
                 try:
-                    esa_v2v3x = fits.getdata(esafile, "V2V3X1")
-                    esa_v2v3y = fits.getdata(esafile, "V2V3Y1")
+                    esa_v2v3x = esahdulist.get_data("V2V3X2")
+                    esa_v2v3y = esahdulist.get_data("V2V3Y2")
                     skipv2v3test = False
                 except KeyError:
                     msg = "Skipping tests for V2 and V3 because ESA file does not contain corresponding extensions."
                     print(msg)
                     log_msgs.append(msg)
-            if det == "NRS2":
-                try:
-                    esa_flux = fits.getdata(esafile, "DATA2")
-                    esa_wave = fits.getdata(esafile, "LAMBDA2")
-                    esa_slity = fits.getdata(esafile, "SLITY2")
-                    esa_msax = fits.getdata(esafile, "MSAX2")
-                    esa_msay = fits.getdata(esafile, "MSAY2")
-                    pyw = wcs.WCS(esahdulist['LAMBDA2'].header)
-                    msg = "using NRS2 extensions"
-                    print(msg)
-                    log_msgs.append(msg)
-                    try:
-                        esa_v2v3x = fits.getdata(esafile, "V2V3X2")
-                        esa_v2v3y = fits.getdata(esafile, "V2V3Y2")
-                        skipv2v3test = False
-                    except KeyError:
-                        msg = "Skipping tests for V2 and V3 because ESA file does not contain corresponding extensions."
-                        print(msg)
-                        log_msgs.append(msg)
-                except KeyError:
-                    msg1 = "\n * compare_wcs_ifu.py is exiting because there are no extensions that match detector NRS2 in the ESA file."
-                    msg2 = "   -> The WCS test is now set to skip and no plots will be generated. \n"
-                    print(msg1)
-                    print(msg2)
-                    log_msgs.append(msg1)
-                    log_msgs.append(msg2)
-                    FINAL_TEST_RESULT = "skip"
-                    return FINAL_TEST_RESULT, log_msgs
-
-        # get the WCS object for this particular slit
-        wcs_slice = nirspec.nrs_wcs_set_input(img, indiv_slice)
-
-        # if we want to print all available transforms, uncomment line below
-        #print(wcs_slice)
-
-        # The WCS object attribute bounding_box shows all valid inputs, i.e. the actual area of the data according
-        # to the slice. Inputs outside of the bounding_box return NaN values.
-        #bbox = wcs_slice.bounding_box
-        #print('wcs_slice.bounding_box: ', wcs_slice.bounding_box)
-
-        # In different observing modes the WCS may have different coordinate frames. To see available frames
-        # uncomment line below.
-        #print("Avalable frames: ", wcs_slice.available_frames)
-
-        if debug:
-            # To get specific pixel values use following syntax:
-            det2slit = wcs_slice.get_transform('detector', 'slit_frame')
-            slitx, slity, lam = det2slit(700, 1080)
-            print("slitx: ", slitx)
-            print("slity: ", slity)
-            print("lambda: ", lam)
-
-            # The number of inputs and outputs in each frame can vary. This can be checked with:
-            print('Number on inputs: ', det2slit.n_inputs)
-            print('Number on outputs: ', det2slit.n_outputs)
-
-        # Create x, y indices using the Trace WCS
-        pipey, pipex = np.mgrid[:esa_wave.shape[0], : esa_wave.shape[1]]
-        esax, esay = pyw.all_pix2world(pipex, pipey, 0)
-        # need to account for different detector orientation for NRS2
-        if det == "NRS2":
-            esax = 2049-esax
-            esay = 2049-esay
-        #print( "x,y: "+repr(esax-1)+repr(esay-1) )
-
-        # Compute pipeline RA, DEC, and lambda
-        pra, pdec, pwave = wcs_slice(esax-1, esay-1)   # => RETURNS: RA, DEC, LAMBDA (lam *= 10**-6 to convert to microns)
-        pwave *= 10**-6
-        #print( "wavelengths: "+repr(pwave) )
-
-        # calculate and print statistics for slit-y and x relative differences
-        tested_quantity = "Wavelength Difference"
-        #print(" ESA wavelength: ", esa_wave)
-        #print(" Pipeline wavelength: ", pwave)
-        rel_diff_pwave_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_wave, pwave, tested_quantity)
-        rel_diff_pwave_img, notnan_rel_diff_pwave, notnan_rel_diff_pwave_stats, stats_print_statements = rel_diff_pwave_data
+            except KeyError:
+                msg1 = "\n * compare_wcs_ifu.py is exiting because there are no extensions that match detector NRS2 in the ESA file."
+                msg2 = "   -> The WCS test is now set to skip and no plots will be generated. \n"
+                print(msg1)
+                print(msg2)
+                log_msgs.append(msg1)
+                log_msgs.append(msg2)
+                return None, None, log_msgs, True
+
+    # get the WCS object for this particular slit
+    phase_timing.start_phase("file_read")
+    img = auxfunc.get_cached_datamodel(infile_name, datamodels.ImageModel)
+    phase_timing.start_phase("wcs_evaluation")
+    wcs_slice = nirspec.nrs_wcs_set_input(img, indiv_slice)
+
+    # if we want to print all available transforms, uncomment line below
+    #print(wcs_slice)
+
+    # The WCS object attribute bounding_box shows all valid inputs, i.e. the actual area of the data according
+    # to the slice. Inputs outside of the bounding_box return NaN values.
+    #bbox = wcs_slice.bounding_box
+    #print('wcs_slice.bounding_box: ', wcs_slice.bounding_box)
+
+    # In different observing modes the WCS may have different coordinate frames. To see available frames
+    # uncomment line below.
+    #print("Avalable frames: ", wcs_slice.available_frames)
+
+    if debug:
+        # To get specific pixel values use following syntax:
+        det2slit = wcs_slice.get_transform('detector', 'slit_frame')
+        slitx, slity, lam = det2slit(700, 1080)
+        print("slitx: ", slitx)
+        print("slity: ", slity)
+        print("lambda: ", lam)
+
+        # The number of inputs and outputs in each frame can vary. This can be checked with:
+        print('Number on inputs: ', det2slit.n_inputs)
+        print('Number on outputs: ', det2slit.n_outputs)
+
+    # Create x, y indices using the Trace WCS
+    pipey, pipex = np.mgrid[:esa_wave.shape[0], : esa_wave.shape[1]]
+    esax, esay = pyw.all_pix2world(pipex, pipey, 0)
+    # need to account for different detector orientation for NRS2
+    if det == "NRS2":
+        esax = 2049-esax
+        esay = 2049-esay
+    #print( "x,y: "+repr(esax-1)+repr(esay-1) )
+
+    # Compute pipeline RA, DEC, and lambda
+    pra, pdec, pwave = wcs_slice(esax-1, esay-1)   # => RETURNS: RA, DEC, LAMBDA (lam *= 10**-6 to convert to microns)
+    pwave *= 10**-6
+    #print( "wavelengths: "+repr(pwave) )
+
+    # calculate and print statistics for slit-y and x relative differences
+    phase_timing.start_phase("statistics")
+    tested_quantity = "Wavelength Difference"
+    #print(" ESA wavelength: ", esa_wave)
+    #print(" Pipeline wavelength: ", pwave)
+    rel_diff_pwave_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_wave, pwave, tested_quantity)
+    rel_diff_pwave_img, notnan_rel_diff_pwave, notnan_rel_diff_pwave_stats, stats_print_statements = rel_diff_pwave_data
+    for msg in stats_print_statements:
+        print(msg)
+        log_msgs.append(msg)
+    result = auxfunc.does_median_pass_tes(notnan_rel_diff_pwave_stats[1], threshold_diff)
+    slice_test_result = {tested_quantity : result}
+
+    # get the transforms for pipeline slit-y
+    phase_timing.start_phase("wcs_evaluation")
+    det2slit = wcs_slice.get_transform('detector', 'slit_frame')
+    slitx, slity, _ = det2slit(esax-1, esay-1)
+    phase_timing.start_phase("statistics")
+    tested_quantity = "Slit-Y Difference"
+    # calculate and print statistics for slit-y and x relative differences
+    rel_diff_pslity_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_slity, slity, tested_quantity)
+    # calculate and print statistics for slit-y and x absolute differences
+    #rel_diff_pslity_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_slity, slity, tested_quantity, abs=True)
+    rel_diff_pslity_img, notnan_rel_diff_pslity, notnan_rel_diff_pslity_stats, stats_print_statements = rel_diff_pslity_data
+    for msg in stats_print_statements:
+        print(msg)
+        log_msgs.append(msg)
+    result = auxfunc.does_median_pass_tes(notnan_rel_diff_pslity_stats[1], threshold_diff)
+    slice_test_result = {tested_quantity : result}
+
+    # do the same for MSA x, y and V2, V3
+    phase_timing.start_phase("wcs_evaluation")
+    detector2msa = wcs_slice.get_transform("detector", "msa_frame")
+    pmsax, pmsay, _ = detector2msa(esax-1, esay-1)   # => RETURNS: msaX, msaY, LAMBDA (lam *= 10**-6 to convert to microns)
+    phase_timing.start_phase("statistics")
+    # MSA-x
+    tested_quantity = "MSA_X Difference"
+    reldiffpmsax_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_msax, pmsax, tested_quantity)
+    reldiffpmsax_img, notnan_reldiffpmsax, notnan_reldiffpmsax_stats, stats_print_statements = reldiffpmsax_data
+    for msg in stats_print_statements:
+        print(msg)
+        log_msgs.append(msg)
+    result = auxfunc.does_median_pass_tes(notnan_reldiffpmsax_stats[1], threshold_diff)
+    slice_test_result = {tested_quantity : result}
+    # MSA-y
+    tested_quantity = "MSA_Y Difference"
+    reldiffpmsay_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_msay, pmsay, tested_quantity)
+    reldiffpmsay_img, notnan_reldiffpmsay, notnan_reldiffpmsay_stats, stats_print_statements = reldiffpmsay_data
+    for msg in stats_print_statements:
+        print(msg)
+        log_msgs.append(msg)
+    result = auxfunc.does_median_pass_tes(notnan_reldiffpmsay_stats[1], threshold_diff)
+    slice_test_result = {tested_quantity : result}
+
+    # V2 and V3
+    if not skipv2v3test:
+        phase_timing.start_phase("wcs_evaluation")
+        detector2v2v3 = wcs_slice.get_transform("detector", "v2v3")
+        pv2, pv3, _ = detector2v2v3(esax-1, esay-1)   # => RETURNS: v2, v3, LAMBDA (lam *= 10**-6 to convert to microns)
+        phase_timing.start_phase("statistics")
+        tested_quantity = "V2 difference"
+        # converting to degrees to compare with ESA
+        reldiffpv2_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3x, pv2, tested_quantity)
+        if reldiffpv2_data[-2][0] > 0.0:
+            print("\nConverting pipeline results to degrees to compare with ESA")
+            pv2 = pv2/3600.
+            reldiffpv2_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3x, pv2, tested_quantity)
+        reldiffpv2_img, notnan_reldiffpv2, notnan_reldiffpv2_stats, stats_print_statements = reldiffpv2_data
         for msg in stats_print_statements:
             print(msg)
             log_msgs.append(msg)
-        result = auxfunc.does_median_pass_tes(notnan_rel_diff_pwave_stats[1], threshold_diff)
-        total_test_result["slice"+pslice] = {tested_quantity : result}
-
-        # get the transforms for pipeline slit-y
-        det2slit = wcs_slice.get_transform('detector', 'slit_frame')
-        slitx, slity, _ = det2slit(esax-1, esay-1)
-        tested_quantity = "Slit-Y Difference"
-        # calculate and print statistics for slit-y and x relative differences
-        rel_diff_pslity_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_slity, slity, tested_quantity)
-        # calculate and print statistics for slit-y and x absolute differences
-        #rel_diff_pslity_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_slity, slity, tested_quantity, abs=True)
-        rel_diff_pslity_img, notnan_rel_diff_pslity, notnan_rel_diff_pslity_stats, stats_print_statements = rel_diff_pslity_data
+        result = auxfunc.does_median_pass_tes(notnan_reldiffpv2_stats[1], threshold_diff)
+        slice_test_result = {tested_quantity : result}
+        tested_quantity = "V3 difference"
+        # converting to degrees to compare with ESA
+        reldiffpv3_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3y, pv3, tested_quantity)
+        if reldiffpv3_data[-2][0] > 0.0:
+            print("\nConverting pipeline results to degrees to compare with ESA")
+            pv3 = pv3/3600.
+            reldiffpv3_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3y, pv3, tested_quantity)
+        reldiffpv3_img, notnan_reldiffpv3, notnan_reldiffpv3_stats, stats_print_statements = reldiffpv3_data
         for msg in stats_print_statements:
             print(msg)
             log_msgs.append(msg)
-        result = auxfunc.does_median_pass_tes(notnan_rel_diff_pslity_stats[1], threshold_diff)
-        total_test_result["slice"+pslice] = {tested_quantity : result}
+        result = auxfunc.does_median_pass_tes(notnan_reldiffpv3_stats[1], threshold_diff)
+        slice_test_result = {tested_quantity : result}
+
+    # PLOTS
+    phase_timing.start_phase("plotting")
+    if show_figs or save_figs:
+        # set the common variables
+        basenameinfile_name = os.path.basename(infile_name)
+        main_title = filt+"   "+grat+"   SLICE="+pslice+"\n"
+        bins = 15   # binning for the histograms, if None the function will automatically calculate them
+        #             lolim_x, uplim_x, lolim_y, uplim_y
+        plt_origin = None
+
+        # Wavelength
+        title = main_title+r"Relative wavelength difference = $\Delta \lambda$"+"\n"
+        info_img = [title, "x (pixels)", "y (pixels)"]
+        xlabel, ylabel = r"Relative $\Delta \lambda$ = ($\lambda_{pipe} - \lambda_{ESA}) / \lambda_{ESA}$", "N"
+        info_hist = [xlabel, ylabel, bins, notnan_rel_diff_pwave_stats]
+        if notnan_rel_diff_pwave_stats[1] is np.nan:
+            msg = "Unable to create plot of relative wavelength difference."
+            print(msg)
+            log_msgs.append(msg)
+        else:
+            plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_wave_diffs.pdf")
+            auxfunc.plt_two_2Dimgandhist(rel_diff_pwave_img, notnan_rel_diff_pwave, info_img, info_hist,
+                                         plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
+
+        # Slit-y
+        title = main_title+r"Relative slit position = $\Delta$slit_y"+"\n"
+        info_img = [title, "x (pixels)", "y (pixels)"]
+        xlabel, ylabel = r"Relative $\Delta$slit_y = (slit_y$_{pipe}$ - slit_y$_{ESA}$)/slit_y$_{ESA}$", "N"
+        info_hist = [xlabel, ylabel, bins, notnan_rel_diff_pslity_stats]
+        if notnan_rel_diff_pslity_stats[1] is np.nan:
+            msg = "Unable to create plot of relative slit-y difference."
+            print(msg)
+            log_msgs.append(msg)
+        else:
+            plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_slitY_diffs.pdf")
+            auxfunc.plt_two_2Dimgandhist(rel_diff_pslity_img, notnan_rel_diff_pslity, info_img, info_hist,
+                                         plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
 
-        # do the same for MSA x, y and V2, V3
-        detector2msa = wcs_slice.get_transform("detector", "msa_frame")
-        pmsax, pmsay, _ = detector2msa(esax-1, esay-1)   # => RETURNS: msaX, msaY, LAMBDA (lam *= 10**-6 to convert to microns)
         # MSA-x
-        tested_quantity = "MSA_X Difference"
-        reldiffpmsax_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_msax, pmsax, tested_quantity)
-        reldiffpmsax_img, notnan_reldiffpmsax, notnan_reldiffpmsax_stats, stats_print_statements = reldiffpmsax_data
-        for msg in stats_print_statements:
+        title = main_title+r"Relative MSA-x Difference = $\Delta$MSA_x"+"\n"
+        info_img = [title, "x (pixels)", "y (pixels)"]
+        xlabel, ylabel = r"Relative $\Delta$MSA_x = (MSA_x$_{pipe}$ - MSA_x$_{ESA}$)/MSA_x$_{ESA}$", "N"
+        info_hist = [xlabel, ylabel, bins, notnan_reldiffpmsax_stats]
+        if notnan_reldiffpmsax_stats[1] is np.nan:
+            msg = "Unable to create plot of relative MSA-x difference."
             print(msg)
             log_msgs.append(msg)
-        result = auxfunc.does_median_pass_tes(notnan_reldiffpmsax_stats[1], threshold_diff)
-        total_test_result["slice"+pslice] = {tested_quantity : result}
+        else:
+            plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_MSAx_diffs.pdf")
+            auxfunc.plt_two_2Dimgandhist(reldiffpmsax_img, notnan_reldiffpmsax, info_img, info_hist,
+                                         plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
+
         # MSA-y
-        tested_quantity = "MSA_Y Difference"
-        reldiffpmsay_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_msay, pmsay, tested_quantity)
-        reldiffpmsay_img, notnan_reldiffpmsay, notnan_reldiffpmsay_stats, stats_print_statements = reldiffpmsay_data
-        for msg in stats_print_statements:
+        title = main_title+r"Relative MSA-y Difference = $\Delta$MSA_y"+"\n"
+        info_img = [title, "x (pixels)", "y (pixels)"]
+        xlabel, ylabel = r"Relative $\Delta$MSA_y = (MSA_y$_{pipe}$ - MSA_y$_{ESA}$)/MSA_y$_{ESA}$", "N"
+        info_hist = [xlabel, ylabel, bins, notnan_reldiffpmsay_stats]
+        if notnan_reldiffpmsay_stats[1] is np.nan:
+            msg = "Unable to create plot of relative MSA-y difference."
             print(msg)
             log_msgs.append(msg)
-        result = auxfunc.does_median_pass_tes(notnan_reldiffpmsay_stats[1], threshold_diff)
-        total_test_result["slice"+pslice] = {tested_quantity : result}
+        else:
+            plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_MSAy_diffs.pdf")
+            auxfunc.plt_two_2Dimgandhist(reldiffpmsay_img, notnan_reldiffpmsay, info_img, info_hist,
+                                         plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
 
-        # V2 and V3
         if not skipv2v3test:
-            detector2v2v3 = wcs_slice.get_transform("detector", "v2v3")
-            pv2, pv3, _ = detector2v2v3(esax-1, esay-1)   # => RETURNS: v2, v3, LAMBDA (lam *= 10**-6 to convert to microns)
-            tested_quantity = "V2 difference"
-            # converting to degrees to compare with ESA
-            reldiffpv2_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3x, pv2, tested_quantity)
-            if reldiffpv2_data[-2][0] > 0.0:
-                print("\nConverting pipeline results to degrees to compare with ESA")
-                pv2 = pv2/3600.
-                reldiffpv2_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3x, pv2, tested_quantity)
-            reldiffpv2_img, notnan_reldiffpv2, notnan_reldiffpv2_stats, stats_print_statements = reldiffpv2_data
-            for msg in stats_print_statements:
-                print(msg)
-                log_msgs.append(msg)
-            result = auxfunc.does_median_pass_tes(notnan_reldiffpv2_stats[1], threshold_diff)
-            total_test_result["slice"+pslice] = {tested_quantity : result}
-            tested_quantity = "V3 difference"
-            # converting to degrees to compare with ESA
-            reldiffpv3_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3y, pv3, tested_quantity)
-            if reldiffpv3_data[-2][0] > 0.0:
-                print("\nConverting pipeline results to degrees to compare with ESA")
-                pv3 = pv3/3600.
-                reldiffpv3_data = auxfunc.get_reldiffarr_and_stats(threshold_diff, esa_slity, esa_v2v3y, pv3, tested_quantity)
-            reldiffpv3_img, notnan_reldiffpv3, notnan_reldiffpv3_stats, stats_print_statements = reldiffpv3_data
-            for msg in stats_print_statements:
-                print(msg)
-                log_msgs.append(msg)
-            result = auxfunc.does_median_pass_tes(notnan_reldiffpv3_stats[1], threshold_diff)
-            total_test_result["slice"+pslice] = {tested_quantity : result}
-
-        # PLOTS
-        if show_figs or save_figs:
-            # set the common variables
-            basenameinfile_name = os.path.basename(infile_name)
-            main_title = filt+"   "+grat+"   SLICE="+pslice+"\n"
-            bins = 15   # binning for the histograms, if None the function will automatically calculate them
-            #             lolim_x, uplim_x, lolim_y, uplim_y
-            plt_origin = None
-
-            # Wavelength
-            title = main_title+r"Relative wavelength difference = $\Delta \lambda$"+"\n"
+            # V2
+            title = main_title+r"Relative V2 Difference = $\Delta$V2"+"\n"
             info_img = [title, "x (pixels)", "y (pixels)"]
-            xlabel, ylabel = r"Relative $\Delta \lambda$ = ($\lambda_{pipe} - \lambda_{ESA}) / \lambda_{ESA}$", "N"
-            info_hist = [xlabel, ylabel, bins, notnan_rel_diff_pwave_stats]
-            if notnan_rel_diff_pwave_stats[1] is np.nan:
-                msg = "Unable to create plot of relative wavelength difference."
+            xlabel, ylabel = r"Relative $\Delta$V2 = (V2$_{pipe}$ - V2$_{ESA}$)/V2$_{ESA}$", "N"
+            hist_data = notnan_reldiffpv2
+            info_hist = [xlabel, ylabel, bins, notnan_reldiffpv2_stats]
+            if notnan_reldiffpv2_stats[1] is np.nan:
+                msg = "Unable to create plot of relative V2 difference."
                 print(msg)
                 log_msgs.append(msg)
             else:
-                plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_wave_diffs.pdf")
-                auxfunc.plt_two_2Dimgandhist(rel_diff_pwave_img, notnan_rel_diff_pwave, info_img, info_hist,
+                plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_V2_diffs.pdf")
+                auxfunc.plt_two_2Dimgandhist(reldiffpv2_img, hist_data, info_img, info_hist,
                                              plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
 
-            # Slit-y
-            title = main_title+r"Relative slit position = $\Delta$slit_y"+"\n"
+            # V3
+            title = main_title+r"Relative V3 Difference = $\Delta$V3"+"\n"
             info_img = [title, "x (pixels)", "y (pixels)"]
-            xlabel, ylabel = r"Relative $\Delta$slit_y = (slit_y$_{pipe}$ - slit_y$_{ESA}$)/slit_y$_{ESA}$", "N"
-            info_hist = [xlabel, ylabel, bins, notnan_rel_diff_pslity_stats]
-            if notnan_rel_diff_pslity_stats[1] is np.nan:
-                msg = "Unable to create plot of relative slit-y difference."
+            xlabel, ylabel = r"Relative $\Delta$V3 = (V3$_{pipe}$ - V3$_{ESA}$)/V3$_{ESA}$", "N"
+            hist_data = notnan_reldiffpv3
+            info_hist = [xlabel, ylabel, bins, notnan_reldiffpv3_stats]
+            if notnan_reldiffpv3_stats[1] is np.nan:
+                msg = "Unable to create plot of relative V3 difference."
                 print(msg)
                 log_msgs.append(msg)
             else:
-                plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_slitY_diffs.pdf")
-                auxfunc.plt_two_2Dimgandhist(rel_diff_pslity_img, notnan_rel_diff_pslity, info_img, info_hist,
+                plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_V3_diffs.pdf")
+                auxfunc.plt_two_2Dimgandhist(reldiffpv3_img, hist_data, info_img, info_hist,
                                              plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
 
-            # MSA-x
-            title = main_title+r"Relative MSA-x Difference = $\Delta$MSA_x"+"\n"
-            info_img = [title, "x (pixels)", "y (pixels)"]
-            xlabel, ylabel = r"Relative $\Delta$MSA_x = (MSA_x$_{pipe}$ - MSA_x$_{ESA}$)/MSA_x$_{ESA}$", "N"
-            info_hist = [xlabel, ylabel, bins, notnan_reldiffpmsax_stats]
-            if notnan_reldiffpmsax_stats[1] is np.nan:
-                msg = "Unable to create plot of relative MSA-x difference."
-                print(msg)
-                log_msgs.append(msg)
-            else:
-                plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_MSAx_diffs.pdf")
-                auxfunc.plt_two_2Dimgandhist(reldiffpmsax_img, notnan_reldiffpmsax, info_img, info_hist,
-                                             plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
+    else:
+        msg = "NO plots were made because show_figs and save_figs were both set to False. \n"
+        print(msg)
+        log_msgs.append(msg)
 
-            # MSA-y
-            title = main_title+r"Relative MSA-y Difference = $\Delta$MSA_y"+"\n"
-            info_img = [title, "x (pixels)", "y (pixels)"]
-            xlabel, ylabel = r"Relative $\Delta$MSA_y = (MSA_y$_{pipe}$ - MSA_y$_{ESA}$)/MSA_y$_{ESA}$", "N"
-            info_hist = [xlabel, ylabel, bins, notnan_reldiffpmsay_stats]
-            if notnan_reldiffpmsay_stats[1] is np.nan:
-                msg = "Unable to create plot of relative MSA-y difference."
-                print(msg)
-                log_msgs.append(msg)
-            else:
-                plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_MSAy_diffs.pdf")
-                auxfunc.plt_two_2Dimgandhist(reldiffpmsay_img, notnan_reldiffpmsay, info_img, info_hist,
-                                             plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
+    return "slice"+pslice, slice_test_result, log_msgs, False
 
-            if not skipv2v3test:
-                # V2
-                title = main_title+r"Relative V2 Difference = $\Delta$V2"+"\n"
-                info_img = [title, "x (pixels)", "y (pixels)"]
-                xlabel, ylabel = r"Relative $\Delta$V2 = (V2$_{pipe}$ - V2$_{ESA}$)/V2$_{ESA}$", "N"
-                hist_data = notnan_reldiffpv2
-                info_hist = [xlabel, ylabel, bins, notnan_reldiffpv2_stats]
-                if notnan_reldiffpv2_stats[1] is np.nan:
-                    msg = "Unable to create plot of relative V2 difference."
-                    print(msg)
-                    log_msgs.append(msg)
-                else:
-                    plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_V2_diffs.pdf")
-                    auxfunc.plt_two_2Dimgandhist(reldiffpv2_img, hist_data, info_img, info_hist,
-                                                 plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
-
-                # V3
-                title = main_title+r"Relative V3 Difference = $\Delta$V3"+"\n"
-                info_img = [title, "x (pixels)", "y (pixels)"]
-                xlabel, ylabel = r"Relative $\Delta$V3 = (V3$_{pipe}$ - V3$_{ESA}$)/V3$_{ESA}$", "N"
-                hist_data = notnan_reldiffpv3
-                info_hist = [xlabel, ylabel, bins, notnan_reldiffpv3_stats]
-                if notnan_reldiffpv3_stats[1] is np.nan:
-                    msg = "Unable to create plot of relative V3 difference."
-                    print(msg)
-                    log_msgs.append(msg)
-                else:
-                    plt_name = infile_name.replace(basenameinfile_name, pslice+"_"+det+"_rel_V3_diffs.pdf")
-                    auxfunc.plt_two_2Dimgandhist(reldiffpv3_img, hist_data, info_img, info_hist,
-                                                 plt_name=plt_name, plt_origin=plt_origin, show_figs=show_figs, save_figs=save_figs)
 
-        else:
-            msg = "NO plots were made because show_figs and save_figs were both set to False. \n"
-            print(msg)
-            log_msgs.append(msg)
+@phase_timing.timed("compare_wcs_ifu")
+def compare_wcs(infile_name, esa_files_path=None, show_figs=True, save_figs=False, threshold_diff=1.0e-7, debug=False,
+                n_workers=1, obs_context=None):
+    """
+    This function does the WCS comparison from the world coordinates calculated using the pipeline
+    data model with the ESA intermediary files.
+
+    Args:
+        infile_name: str, name of the output fits file from the assign_wcs step (with full path)
+        esa_files_path: str, full path of where to find all ESA intermediary products to make comparisons for the tests
+        show_figs: boolean, whether to show plots or not
+        save_figs: boolean, save the plots or not
+        threshold_diff: float, threshold difference between pipeline output and ESA file
+        debug: boolean, if true a series of print statements will show on-screen
+        n_workers: integer, number of processes to validate the slices in parallel (1 = serial)
+        obs_context: ObservationContext object (see observation_context.py), if given the raw data file name is
+                     taken from it instead of the configuration file (the detector, grating, filter, and lamp are
+                     always taken from the header of infile_name)
+
+    Returns:
+        - plots, if told to save and/or show them.
+        - median_diff: Boolean, True if smaller or equal to threshold
+        - log_msgs: list, all print statements are captured in this variable
+
+    """
+
+    log_msgs = []
+
+    # get grating and filter info from the rate file header
+    msg = 'infile_name = '+infile_name
+    print(msg)
+    log_msgs.append(msg)
+    det, grat, filt, lamp, raw_data_root_file = auxfunc.get_observation_info(infile_name, obs_context)
+    msg = "from assign_wcs file  -->     Detector:"+det+"   Grating:"+grat+"   Filter:"+filt+"   Lamp:"+lamp
+    print(msg)
+    log_msgs.append(msg)
+
+    # get the datamodel from the assign_wcs output file
+    #img = datamodels.IFUImageModel(infile_name)
+    #slice_list = range(30)
+    #wcs_00 = nirspec.nrs_wcs_set_input(img, 0)
+    #print(wcs_00.available_frames)
+    # the above line will print all available frame transforms
+    #['detector', 'sca', 'gwa', 'slit_frame', 'slicer', 'msa_frame', 'oteip', 'v2v3', 'world']
+
+    # loop over the slices: 0 - 29
+    #slice_list = range(30)
+    #sci_ext_list = auxfunc.get_sci_extensions(infile_name)
+    phase_timing.start_phase("file_read")
+    img = auxfunc.get_cached_datamodel(infile_name, datamodels.ImageModel)
+    slice_list = img.meta.wcs.get_transform('gwa', 'slit_frame').slits
+    # the time of the slices is recorded by compare_slice_wcs
+    phase_timing.end_phase()
+    #print ('sci_ext_list=', sci_ext_list, '\n')
+
+    # dictionary to record if each test passed or not
+    total_test_result = OrderedDict()
+
+    # the plots can only be shown from the main process
+    if show_figs and n_workers > 1:
+        msg = "show_figs is set to True, so the slices will be validated serially instead of with "+repr(n_workers)+" workers."
+        print(msg)
+        log_msgs.append(msg)
+        n_workers = 1
+
+    # loop over the slices, in this process or distributed in n_workers processes
+    args_list = []
+    for indiv_slice in slice_list:
+        args_list.append((indiv_slice, infile_name, esa_files_path, det, grat, filt, raw_data_root_file, show_figs,
+                          save_figs, threshold_diff, debug))
+    slice_results = auxfunc.run_per_slit(compare_slice_wcs, args_list, n_workers=n_workers)
+    try:
+        for slice_name, slice_test_result, slice_log_msgs, skip_test in slice_results:
+            log_msgs.extend(slice_log_msgs)
+            if skip_test:
+                FINAL_TEST_RESULT = "skip"
+                return FINAL_TEST_RESULT, log_msgs
+            total_test_result[slice_name] = slice_test_result
+    finally:
+        # stop the workers and free the data model also if a slice fails
+        slice_results.close()
+        auxfunc.release_cached_datamodel(infile_name)
 
 
     # If all tests passed then pytest will be marked as PASSED, else it will be FAILED
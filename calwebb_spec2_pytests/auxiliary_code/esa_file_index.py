@@ -0,0 +1,252 @@
+import os
+import sqlite3
+import threading
+from astropy.io import fits
+
+
+"""
+This script keeps an on-disk index (SQLite) of the ESA intermediary products directory, so that get_esafile does
+not have to list the directories and open the FITS files to read the GS_JOBID and FILENAME keywords every time it
+is called (i.e. once per slit, slitlet, or slice).
+
+The listings of the ESA directories are recorded by a single scan of the directory tree (the top directory, the
+jlab88 directories, and their trace directories), and the header keywords are recorded the first time they are
+requested. A directory listing is scanned again when the modification time of the directory changes, and a
+keyword is read again when the modification time of the file changes.
+
+The index file is set with esa_file_index in the PTT configuration file (see set_index_file), by default it is in the
+home directory of the user. Since the index is shared by several processes (the slits validated in parallel, and the
+detector and batch runs), it is written in WAL mode and the writers wait up to db_timeout seconds for each other.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the index file can be set in the PTT configuration file, and the concurrent writers wait for
+#                         each other instead of failing with "database is locked"
+
+
+# default location of the index file, it is shared by all the runs of the same user
+default_index_file = os.path.join(os.path.expanduser("~"), ".nirspec_ptt", "esa_file_index.sqlite")
+
+# environment variable with the index file set by set_index_file, so that the worker processes use it too
+index_file_variable = "PTT_ESA_FILE_INDEX"
+
+# seconds to wait for another process to finish writing into the index
+db_timeout = 60.0
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def set_index_file(index_file):
+    """
+    This function sets the index file used when get_index is called without a file.
+    Args:
+        index_file: string, full path of the SQLite index file, if empty the default file is used
+
+    Returns:
+        nothing
+    """
+    if index_file:
+        os.environ[index_file_variable] = os.path.abspath(os.path.expanduser(index_file))
+    else:
+        os.environ.pop(index_file_variable, None)
+
+
+def get_index_file():
+    """
+    This function returns the index file used when get_index is called without a file, see set_index_file.
+    """
+    return os.environ.get(index_file_variable) or default_index_file
+
+
+def get_index(index_file=None):
+    """
+    This function returns the index stored in the given file, creating it if necessary. The same object is
+    returned for all the calls with the same file in a process.
+    Args:
+        index_file: string, full path of the SQLite index file, if None the file set with set_index_file (or the
+                    default file) is used
+
+    Returns:
+        ESAFileIndex object
+    """
+    if index_file is None:
+        index_file = get_index_file()
+    with _indexes_lock:
+        if index_file not in _indexes:
+            _indexes[index_file] = ESAFileIndex(index_file)
+        return _indexes[index_file]
+
+
+class ESAFileIndex(object):
+    """
+    This class holds the directory listings and header keywords of the ESA intermediary products. The data are
+    kept in memory and in the SQLite file, so that they can be used by later runs.
+    """
+
+    def __init__(self, index_file):
+        """
+        Args:
+            index_file: string, full path of the SQLite index file; if the file can not be created the index is
+                        only kept in memory
+        """
+        self.index_file = index_file
+        self._lock = threading.RLock()
+        self._listings = {}
+        self._keywords = {}
+        self._built = set()
+        try:
+            index_dir = os.path.dirname(index_file)
+            if index_dir and not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            self._db = sqlite3.connect(index_file, timeout=db_timeout, check_same_thread=False)
+            try:
+                # the readers do not block the writer (e.g. the slits validated in parallel)
+                self._db.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error:
+                # e.g. WAL is not supported by the file system, the default journal is used
+                pass
+        except (OSError, sqlite3.Error):
+            print(" * WARNING: Unable to create the ESA file index in ", index_file, ", using it only in memory.")
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS listings "
+                             "(dir TEXT PRIMARY KEY, mtime REAL, entries TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS keywords "
+                             "(path TEXT, keyword TEXT, mtime REAL, value TEXT, PRIMARY KEY (path, keyword))")
+
+    def _scan_dir(self, dir_path, mtime):
+        """
+        This function lists the given directory and records the listing.
+        Args:
+            dir_path: string, normalized full path of the directory
+            mtime: float, modification time of the directory
+
+        Returns:
+            entries: dictionary, for each name in the directory True if it is a file
+        """
+        entries = {}
+        for entry in os.scandir(dir_path):
+            # hidden files are ignored, as glob does
+            if entry.name.startswith("."):
+                continue
+            entries[entry.name] = entry.is_file()
+        encoded = "\n".join(("F" if is_file else "D")+name for name, is_file in entries.items())
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?)", (dir_path, mtime, encoded))
+        return entries
+
+    def _get_listing(self, dir_path):
+        """
+        This function returns the recorded listing of the directory, scanning it again if it changed on disk.
+        Args:
+            dir_path: string, full path of the directory
+
+        Returns:
+            entries: dictionary, for each name in the directory True if it is a file (empty if the directory
+                     does not exist)
+        """
+        dir_path = os.path.abspath(dir_path)
+        try:
+            mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            return {}
+        with self._lock:
+            cached = self._listings.get(dir_path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            row = self._db.execute("SELECT mtime, entries FROM listings WHERE dir = ?", (dir_path,)).fetchone()
+            if row is not None and row[0] == mtime:
+                entries = dict((item[1:], item[0] == "F") for item in row[1].split("\n") if item)
+            else:
+                entries = self._scan_dir(dir_path, mtime)
+            self._listings[dir_path] = (mtime, entries)
+            return entries
+
+    def build(self, esa_files_path):
+        """
+        This function scans the ESA directory tree (top directory, jlab88 directories and their trace
+        directories) and records all the listings, so that the following queries do not touch the directories.
+        The scan is done once per process, afterwards each listing is only checked against the directory
+        modification time when it is used.
+        Args:
+            esa_files_path: string, top level of the ESA intermediary products
+
+        Returns:
+            nothing
+        """
+        esa_files_path = os.path.abspath(esa_files_path)
+        with self._lock:
+            if esa_files_path in self._built:
+                return
+            self._built.add(esa_files_path)
+        for name, is_file in self._get_listing(esa_files_path).items():
+            if is_file:
+                continue
+            jlab88_dir = os.path.join(esa_files_path, name)
+            for subname, sub_is_file in self._get_listing(jlab88_dir).items():
+                if not sub_is_file:
+                    self._get_listing(os.path.join(jlab88_dir, subname))
+
+    def list_dir(self, dir_path):
+        """
+        This function is the equivalent of glob(dir_path+"/*").
+        Args:
+            dir_path: string, full path of the directory
+
+        Returns:
+            list of the full paths of the (not hidden) files and directories in dir_path
+        """
+        return [os.path.join(dir_path, name) for name in self._get_listing(dir_path)]
+
+    def is_file(self, path):
+        """
+        This function is the equivalent of os.path.isfile(path).
+        Args:
+            path: string, full path of the file
+
+        Returns:
+            boolean, True if the file exists
+        """
+        dir_path, name = os.path.split(os.path.abspath(path))
+        return self._get_listing(dir_path).get(name, False)
+
+    def get_keyword(self, path, keyword):
+        """
+        This function is the equivalent of fits.getval(path, keyword, 0).
+        Args:
+            path: string, full path of the FITS file
+            keyword: string, keyword in the primary header
+
+        Returns:
+            value: string, value of the keyword; KeyError is raised if the keyword is not in the header
+        """
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        key = (path, keyword)
+        with self._lock:
+            cached = self._keywords.get(key)
+            if cached is None or cached[0] != mtime:
+                row = self._db.execute("SELECT mtime, value FROM keywords WHERE path = ? AND keyword = ?",
+                                       key).fetchone()
+                if row is not None and row[0] == mtime:
+                    cached = (mtime, row[1])
+                else:
+                    try:
+                        value = str(fits.getval(path, keyword, 0))
+                    except KeyError:
+                        value = None
+                    cached = (mtime, value)
+                    with self._db:
+                        self._db.execute("INSERT OR REPLACE INTO keywords VALUES (?, ?, ?, ?)",
+                                         (path, keyword, mtime, value))
+                self._keywords[key] = cached
+        if cached[1] is None:
+            raise KeyError("Keyword '"+keyword+"' not found in "+path)
+        return cached[1]
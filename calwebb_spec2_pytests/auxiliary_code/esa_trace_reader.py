@@ -0,0 +1,179 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from astropy.io import fits
+
+
+"""
+This script contains the reader of the ESA intermediary trace files (Trace_SLIT_*, Trace_MOS_*, Trace_IFU_*). Each
+file is opened once, memory-mapped, and shared by the WCS and extract_2d validation scripts that use it, instead of
+re-opening and re-parsing it for every extension (DATA1/2, LAMBDA1/2, SLITY1/2, MSAX1/2, MSAY1/2, V2V3X1/2,
+V2V3Y1/2). The extensions are only read when they are requested.
+
+Each caller gets its own copy of the data, as with fits.getdata, since the validation scripts modify the arrays they
+compare (e.g. they set the pixels to NaN where the pipeline has no value).
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: get_data returns a copy of the data, so the changes of a validation do not go to the others
+
+
+# maximum number of ESA files kept open at the same time
+default_max_open_traces = 128
+
+_open_traces = OrderedDict()
+_open_traces_lock = threading.Lock()
+_open_traces_state = {"max_open": default_max_open_traces}
+
+
+def open_esa_trace(esafile):
+    """
+    This function returns the reader of the given ESA file. Readers are shared, so the file is opened only the
+    first time it is requested; the least recently used files are closed when more than max_open_traces are open.
+    Args:
+        esafile: str, full path of the ESA trace file
+
+    Returns:
+        ESATrace object
+    """
+    with _open_traces_lock:
+        if esafile in _open_traces:
+            _open_traces.move_to_end(esafile)
+            return _open_traces[esafile]
+        esa_trace = ESATrace(esafile)
+        _open_traces[esafile] = esa_trace
+        while len(_open_traces) > _open_traces_state["max_open"]:
+            _, oldest = _open_traces.popitem(last=False)
+            oldest.close()
+        return esa_trace
+
+
+def set_max_open_traces(max_open):
+    """
+    This function sets the maximum number of ESA files kept open.
+    Args:
+        max_open: integer, maximum number of open files (at least 1)
+
+    Returns:
+        nothing
+    """
+    with _open_traces_lock:
+        _open_traces_state["max_open"] = max(int(max_open), 1)
+        while len(_open_traces) > _open_traces_state["max_open"]:
+            _, oldest = _open_traces.popitem(last=False)
+            oldest.close()
+
+
+def close_esa_traces():
+    """
+    This function closes all the open ESA files.
+    Returns:
+        nothing
+    """
+    with _open_traces_lock:
+        while _open_traces:
+            _, esa_trace = _open_traces.popitem(last=False)
+            esa_trace.close()
+
+
+class ESATrace(object):
+    """
+    This class gives access to the extensions of an ESA trace file. It can be indexed and iterated as the
+    astropy HDUList (e.g. esa_trace[0].header, esa_trace["LAMBDA1"].header), and the data of each extension are
+    read (from the memory-mapped file) the first time they are requested.
+
+    It can be used in a with statement; the file is not closed at the end of the block since it is shared with
+    the other validation scripts.
+    """
+
+    def __init__(self, esafile):
+        """
+        Args:
+            esafile: str, full path of the ESA trace file
+        """
+        self.esafile = esafile
+        self.hdulist = fits.open(esafile, memmap=True)
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __getitem__(self, ext):
+        return self.hdulist[ext]
+
+    def __iter__(self):
+        return iter(self.hdulist)
+
+    def info(self):
+        """
+        This function prints the summary of the extensions of the file, as HDUList.info().
+        """
+        return self.hdulist.info()
+
+    @property
+    def header(self):
+        """
+        Primary header of the file.
+        """
+        return self.hdulist[0].header
+
+    def has_extension(self, ext):
+        """
+        This function checks if the file has the given extension.
+        Args:
+            ext: str or integer, extension name or number
+
+        Returns:
+            boolean
+        """
+        try:
+            self.hdulist[ext]
+        except (KeyError, IndexError):
+            return False
+        return True
+
+    def get_data(self, ext):
+        """
+        This function is the equivalent of fits.getdata(esafile, ext) on the open file.
+        Args:
+            ext: str or integer, extension name or number
+
+        Returns:
+            data: numpy array, copy of the data of the extension; KeyError is raised if the extension does not exist
+        """
+        with self._lock:
+            if ext not in self._data:
+                self._data[ext] = self.hdulist[ext].data
+            # the callers may modify the array (e.g. mask it with NaN), so the memory-mapped data is not shared
+            return np.array(self._data[ext], copy=True)
+
+    def get_detector_data(self, ext_root, det):
+        """
+        This function returns the data of the extension for the given detector, e.g. LAMBDA1 for NRS1 and
+        LAMBDA2 for NRS2.
+        Args:
+            ext_root: str, extension name without the detector number (e.g. DATA, LAMBDA, SLITY, MSAX, V2V3X)
+            det: str, detector (NRS1 or NRS2)
+
+        Returns:
+            data: numpy array, data of the extension; KeyError is raised if the extension does not exist
+        """
+        return self.get_data(ext_root+det[-1])
+
+    def close(self):
+        """
+        This function closes the file.
+        """
+        with self._lock:
+            self._data = {}
+            self.hdulist.close()
@@ -0,0 +1,391 @@
+import numpy as np
+
+
+"""
+This script contains the array versions of the calculations that the flattest FS, MOS, and IFU scripts do pixel
+by pixel. Instead of looping over the pixels of a slit, the functions compute the D-, S-, and F-flat factors for
+all the pixels with a valid wavelength at once.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: Band averages of the fast vectors are now calculated from cumulative integral tables.
+
+
+def pixel_bandwidths(wave, one_sided_factor=1.0):
+    """
+    This function calculates the wavelength bandwidth of every pixel in the given array, using the neighboring
+    pixels in the dispersion direction (x). The central difference is used when both neighbors have a finite
+    wavelength, and the forward or backward difference (scaled by one_sided_factor) when only one of them does.
+    Pixels without a finite neighbor get a bandwidth of NaN.
+    Args:
+        wave: 2D numpy array, wavelengths of the slit (or slice) pixels
+        one_sided_factor: float, scale factor for the forward and backward differences (the IFU
+                          script uses 0.5, the FS and MOS scripts use 1.0)
+
+    Returns:
+        delw: 2D numpy array, bandwidth of each pixel
+    """
+    wave = np.asarray(wave, dtype=float)
+    next_wave = np.full(wave.shape, np.nan)
+    prev_wave = np.full(wave.shape, np.nan)
+    next_wave[:, :-1] = wave[:, 1:]
+    prev_wave[:, 1:] = wave[:, :-1]
+    has_next = np.isfinite(next_wave)
+    has_prev = np.isfinite(prev_wave)
+
+    delw = np.full(wave.shape, np.nan)
+    both = has_next & has_prev
+    delw[both] = 0.5 * (next_wave[both] - prev_wave[both])
+    only_next = has_next & ~has_prev
+    delw[only_next] = one_sided_factor * (next_wave[only_next] - wave[only_next])
+    only_prev = has_prev & ~has_next
+    delw[only_prev] = one_sided_factor * (wave[only_prev] - prev_wave[only_prev])
+    return delw
+
+
+class CumulativeIntegralTable(object):
+    """
+    This class holds the cumulative integral (trapezoidal rule) of a fast vector table, e.g. the D-flat RQE or
+    the S- and F-flat DATA vectors. It is built once per table and then gives the band average over any number
+    of [wave-delw/2, wave+delw/2] bands with two binary searches per band.
+    """
+
+    def __init__(self, tab_wave, tab_data):
+        """
+        Args:
+            tab_wave: numpy array, wavelengths of the fast vector table
+            tab_data: numpy array, values of the fast vector table
+        """
+        tab_wave = np.asarray(tab_wave, dtype=float)
+        tab_data = np.asarray(tab_data, dtype=float)
+        keep = np.isfinite(tab_wave)
+        order = np.argsort(tab_wave[keep], kind="stable")
+        self.wave = tab_wave[keep][order]
+        self.data = tab_data[keep][order]
+        # integral of each segment between consecutive table points, NaN segments are counted separately so
+        # that they only affect the bands that contain them
+        segments = 0.5 * (self.data[1:] + self.data[:-1]) * np.diff(self.wave)
+        bad_segments = ~np.isfinite(segments)
+        segments[bad_segments] = 0.0
+        self.cumint = np.concatenate(([0.0], np.cumsum(segments)))
+        self.cumbad = np.concatenate(([0], np.cumsum(bad_segments)))
+
+    @classmethod
+    def from_fits_rec(cls, tab, data_field):
+        """
+        This function builds the table from a fast vector FITS_rec.
+        Args:
+            tab: FITS_rec, fast vector table with a WAVELENGTH field
+            data_field: string, name of the field with the values of the table (e.g. RQE or DATA)
+
+        Returns:
+            CumulativeIntegralTable object
+        """
+        return cls(tab.field("WAVELENGTH"), tab.field(data_field))
+
+    def band_average(self, wave, delw):
+        """
+        This function calculates the average of the table over the band [wave-delw/2, wave+delw/2], i.e. the
+        integral of the table points within the band divided by the wavelength range they span.
+        Args:
+            wave: float or numpy array, wavelengths at which to calculate the average
+            delw: float or numpy array, bandwidth corresponding to each wavelength
+
+        Returns:
+            avg: numpy array, band averages; where only one table point is in the band the value of that point
+                 is given, and where there are none the value is NaN
+            npts: numpy array, number of table points within each band
+        """
+        wave = np.asarray(wave, dtype=float)
+        delw = np.asarray(delw, dtype=float)
+        npoints = self.wave.size
+        lo = np.searchsorted(self.wave, wave - delw / 2.0, side="left")
+        hi = np.searchsorted(self.wave, wave + delw / 2.0, side="right")
+        npts = np.clip(hi - lo, 0, None)
+        first = np.clip(lo, 0, max(npoints - 1, 0))
+        last = np.clip(hi - 1, 0, max(npoints - 1, 0))
+        if npoints == 0:
+            return np.full(npts.shape, np.nan), npts
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg = (self.cumint[last] - self.cumint[first]) / (self.wave[last] - self.wave[first])
+        avg = np.where(self.cumbad[last] - self.cumbad[first] > 0, np.nan, avg)
+        avg = np.where(npts == 1, self.data[first], avg)
+        avg = np.where(npts == 0, np.nan, avg)
+        return avg, npts
+
+
+def interp_cube(cube, cube_wave, wave, yind, xind, dq=None, out_of_range=1.0):
+    """
+    This function interpolates a wavelength-dependent flat cube at the given wavelengths and pixel positions. Only
+    the two planes bracketing each wavelength are gathered from the cube.
+    Args:
+        cube: 3D numpy array, flat cube in science orientation (plane, y, x)
+        cube_wave: 1D numpy array, wavelength of each plane of the cube (in increasing order)
+        wave: 1D numpy array, wavelengths at which to interpolate
+        yind: 1D numpy array of integers, full-frame y-indices of the pixels
+        xind: 1D numpy array of integers, full-frame x-indices of the pixels
+        dq: None or numpy array, DQ image (2D) or cube (3D) of the flat; pixels flagged in the image, or in any
+            of the two bracketing planes of the cube, are set to 1.0
+        out_of_range: float or None, value to use where the wavelength is outside the cube range or one of the
+                      bracketing planes is not finite; if None, the values at the cube ends are used for
+                      wavelengths outside the range (as numpy.interp does)
+
+    Returns:
+        values: 1D numpy array, interpolated flat values
+    """
+    cube_wave = np.asarray(cube_wave, dtype=float)
+    wave = np.asarray(wave, dtype=float)
+    nplanes = cube_wave.size
+    # index of the plane right below (or at) each wavelength
+    iloc = np.searchsorted(cube_wave, wave, side="right") - 1
+    ilo = np.clip(iloc, 0, nplanes - 2)
+    ihi = ilo + 1
+    z0 = cube[ilo, yind, xind]
+    z1 = cube[ihi, yind, xind]
+    w0, w1 = cube_wave[ilo], cube_wave[ihi]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (wave - w0) / (w1 - w0)
+    if out_of_range is None:
+        values = z0 + np.clip(t, 0.0, 1.0) * (z1 - z0)
+    else:
+        in_range = (wave >= cube_wave[0]) & (wave <= cube_wave[-1])
+        in_range &= np.isfinite(z0) & np.isfinite(z1)
+        values = np.full(wave.shape, float(out_of_range))
+        values[in_range] = z0[in_range] + t[in_range] * (z1[in_range] - z0[in_range])
+
+    if dq is not None:
+        if np.ndim(dq) == 3:
+            flagged = (dq[ilo, yind, xind] != 0) | (dq[ihi, yind, xind] != 0)
+        else:
+            flagged = dq[yind, xind] != 0
+        values[flagged] = 1.0
+    return values
+
+
+def fast_vector_factor(integral_table, wave, delw, min_points=2, fallback=1.0):
+    """
+    This function calculates the band-averaged factor of a fast vector table (e.g. the D-flat RQE, or the S- and
+    F-flat DATA vectors) for an array of wavelengths.
+    Args:
+        integral_table: CumulativeIntegralTable object of the fast vector
+        wave: 1D numpy array, wavelengths at which to calculate the factor
+        delw: 1D numpy array, bandwidth corresponding to each wavelength
+        min_points: integer, minimum number of table points within the band to use the band average
+        fallback: float, factor to use where there are less than min_points table points in the band
+
+    Returns:
+        factor: 1D numpy array, the band-averaged factors
+    """
+    avg, npts = integral_table.band_average(wave, delw)
+    return np.where(npts >= min_points, avg, fallback)
+
+
+def calc_fs_flat(wave, px0, py0, dfim, dfimdq, dfwave, dfrqe_tab, sfim, sfimdq, sfv_tab, ffv_tab):
+    """
+    This function calculates the expected flat for all the pixels of a fixed slit (or the BOTS aperture) at once.
+    The calculation follows the same recipe as the pixel loop in flattest_fs.py, with the exception of the pixels
+    that have no finite neighbor in the dispersion direction, for which the D-, S-, and F-flat fast vector
+    factors are set to 1.0, and of the band averages, which are calculated with the trapezoidal rule.
+    Args:
+        wave: 2D numpy array, wavelengths of the slit pixels
+        px0: integer, subwindow origin in x (1-based)
+        py0: integer, subwindow origin in y (1-based)
+        dfim: 3D numpy array, D-flat cube in science orientation
+        dfimdq: 2D numpy array, D-flat DQ in science orientation
+        dfwave: 1D numpy array, wavelength of each D-flat plane
+        dfrqe_tab: CumulativeIntegralTable object, D-flat fast vector
+        sfim: 2D numpy array, S-flat in science orientation
+        sfimdq: 2D numpy array, S-flat DQ in science orientation
+        sfv_tab: CumulativeIntegralTable object, S-flat fast vector for this slit
+        ffv_tab: CumulativeIntegralTable object, F-flat fast vector
+
+    Returns:
+        flatcor: 2D numpy array, calculated flat with 999.0 where the wavelength is not finite
+    """
+    flatcor = np.zeros(np.shape(wave)) + 999.0
+    valid = np.isfinite(wave)
+    if not valid.any():
+        return flatcor
+    k, j = np.nonzero(valid)
+    jwav = wave[valid]
+    delw = pixel_bandwidths(wave)[valid]
+    # full-frame pixel indices for the D- and S-flat image components
+    yind, xind = k + py0 - 1, j + px0 - 1
+
+    # integrate over D-flat fast vector
+    dff = fast_vector_factor(dfrqe_tab, jwav, delw, min_points=2)
+
+    # interpolate over D-flat cube and check DQ flags
+    dfs = interp_cube(dfim, dfwave, jwav, yind, xind, dq=dfimdq)
+
+    # integrate over S-flat fast vector
+    sff = fast_vector_factor(sfv_tab, jwav, delw, min_points=3)
+
+    # get s-flat pixel-dependent correction
+    sfs = np.where(sfimdq[yind, xind] == 0, sfim[yind, xind], 1.0)
+
+    # integrate over F-flat fast vector
+    # reference file blue cutoff is 1 micron, so need to force solution for shorter wavs
+    fff = fast_vector_factor(ffv_tab, jwav, delw, min_points=2)
+    fff[~(jwav - delw / 2.0 >= 1.0)] = 1.0
+
+    flatcor[valid] = dff * dfs * sff * sfs * fff
+    return flatcor
+
+
+def calc_flat_difference(pipeflat, flatcor, wave):
+    """
+    This function calculates the difference between the pipeline and the calculated flat.
+    Args:
+        pipeflat: 2D numpy array, pipeline-calculated flat
+        flatcor: 2D numpy array, calculated flat
+        wave: 2D numpy array, wavelengths of the pixels
+
+    Returns:
+        delf: 2D numpy array, difference with 999.0 where the wavelength is not finite or the pipeline
+              flat is 1 (i.e. outside slit boundaries)
+    """
+    delf = np.zeros(np.shape(wave)) + 999.0
+    valid = np.isfinite(wave)
+    delf[valid] = pipeflat[valid] - flatcor[valid]
+    delf[pipeflat == 1] = 999.0
+    return delf
+
+
+def calc_ifu_flat(wave, xind, yind, dfim, dfimdq, dfwave, dfrqe_tab, sfim, sfimdq, sfv_tab, ffv_tab):
+    """
+    This function calculates the expected flat for all the pixels of an IFU slice at once. The calculation
+    follows the same recipe as the pixel loop in flattest_ifu.py, except that the band averages are calculated
+    with the trapezoidal rule, and that where there are no fast vector points within the band of a pixel the
+    fast vector is interpolated at the pixel wavelength (instead of taking the last value of the vector).
+    Args:
+        wave: 2D numpy array, wavelengths of the slice pixels
+        xind: 2D numpy array of integers, full-frame x-indices of the slice pixels
+        yind: 2D numpy array of integers, full-frame y-indices of the slice pixels
+        dfim: 3D numpy array, D-flat cube in science orientation
+        dfimdq: 2D numpy array, D-flat DQ in science orientation
+        dfwave: 1D numpy array, wavelength of each D-flat plane
+        dfrqe_tab: CumulativeIntegralTable object, D-flat fast vector
+        sfim: 2D numpy array, S-flat in science orientation
+        sfimdq: 2D numpy array, S-flat DQ in science orientation
+        sfv_tab: CumulativeIntegralTable object, S-flat fast vector
+        ffv_tab: CumulativeIntegralTable object, F-flat fast vector
+
+    Returns:
+        flatcor: 2D numpy array, calculated flat with 999.0 where the wavelength is not finite
+    """
+    flatcor = np.zeros(np.shape(wave)) + 999.0
+    valid = np.isfinite(wave)
+    if not valid.any():
+        return flatcor
+    jwav = wave[valid]
+    # get the pixel bandwidth **this needs to be modified for prism, since the dispersion is not linear!**
+    delw = pixel_bandwidths(wave, one_sided_factor=0.5)[valid]
+    yind, xind = yind[valid], xind[valid]
+
+    # integrate over D-flat fast vector
+    dff, npts = dfrqe_tab.band_average(jwav, delw)
+    dff = np.where(npts == 0, np.interp(jwav, dfrqe_tab.wave, dfrqe_tab.data), dff)
+
+    # interpolate over D-flat cube
+    dfs = interp_cube(dfim, dfwave, jwav, yind, xind, dq=dfimdq, out_of_range=None)
+
+    # integrate over S-flat fast vector
+    sff, npts = sfv_tab.band_average(jwav, delw)
+    sff = np.where(npts == 0, np.interp(jwav, sfv_tab.wave, sfv_tab.data), sff)
+    sff[~((jwav < 5.3) & (jwav > 0.6))] = 999.0
+
+    # get s-flat pixel-dependent correction
+    sfs = np.where(sfimdq[yind, xind] == 0, sfim[yind, xind], 1.0)
+
+    # integrate over f-flat fast vector
+    # reference file blue cutoff is 1 micron, so need to force solution for shorter wavs
+    fff, npts = ffv_tab.band_average(jwav, delw)
+    fff = np.where(npts == 0, np.interp(jwav, ffv_tab.wave, ffv_tab.data), fff)
+    fff[~(jwav - delw / 2.0 >= 1.0)] = 1.0
+
+    flatcor[valid] = dff * dfs * sff * sfs * fff
+    return flatcor
+
+
+def get_slitlets_shutter_info(model):
+    """
+    This function gets the quadrant, row, and column of the shutter of each slitlet in the MultiSlit model.
+    Args:
+        model: MultiSlitModel, the extract_2d datamodel
+
+    Returns:
+        shutter_info: dictionary, for each slitlet name the tuple (quadrant, row, column)
+    """
+    shutter_info = {}
+    for slit in model.slits:
+        shutter_info[slit.name] = (slit.quadrant, slit.xcen, slit.ycen)
+    return shutter_info
+
+
+def calc_mos_flat(wave, px0, py0, dfim, dfimdq, dfwave, dfrqe_tab, sfim, sfimdq, sfimwave, sfv_tab, ffv_tab,
+                  ffswave, ffs_shutter):
+    """
+    This function calculates the expected flat for all the pixels of an MSA slitlet at once. The calculation
+    follows the same recipe as the pixel loop in flattest_mos.py, except that the band averages are calculated
+    with the trapezoidal rule, that the D-flat fast vector factor is set to 1.0 where only one vector point is
+    within the band of a pixel, and that the S-flat cube is interpolated between the planes right below and above
+    the pixel wavelength (instead of starting from the nearest plane).
+    Args:
+        wave: 2D numpy array, wavelengths of the slitlet pixels
+        px0: integer, subwindow origin in x (1-based)
+        py0: integer, subwindow origin in y (1-based)
+        dfim: 3D numpy array, D-flat cube in science orientation
+        dfimdq: 2D numpy array, D-flat DQ in science orientation
+        dfwave: 1D numpy array, wavelength of each D-flat plane
+        dfrqe_tab: CumulativeIntegralTable object, D-flat fast vector
+        sfim: 3D numpy array, S-flat cube in science orientation
+        sfimdq: 3D numpy array, S-flat DQ cube in science orientation
+        sfimwave: 1D numpy array, wavelength of each S-flat plane
+        sfv_tab: CumulativeIntegralTable object, S-flat fast vector
+        ffv_tab: CumulativeIntegralTable object, F-flat fast vector of the quadrant of the slitlet
+        ffswave: 1D numpy array, wavelength of each plane of the F-flat cube of the quadrant
+        ffs_shutter: 1D numpy array, F-flat cube values at the shutter of the slitlet
+
+    Returns:
+        flatcor: 2D numpy array, calculated flat with 999.0 where the wavelength is not finite
+    """
+    flatcor = np.zeros(np.shape(wave)) + 999.0
+    valid = np.isfinite(wave)
+    if not valid.any():
+        return flatcor
+    k, j = np.nonzero(valid)
+    jwav = wave[valid]
+    delw = pixel_bandwidths(wave)[valid]
+    # full-frame pixel indices for the D- and S-flat image components
+    yind, xind = k + py0 - 1, j + px0 - 1
+
+    # integrate over dflat fast vector
+    dff = fast_vector_factor(dfrqe_tab, jwav, delw, min_points=2)
+
+    # interpolate over dflat cube and check DQ flags
+    dfs = interp_cube(dfim, dfwave, jwav, yind, xind, dq=dfimdq)
+
+    # integrate over S-flat fast vector
+    sff = fast_vector_factor(sfv_tab, jwav, delw, min_points=3)
+
+    # interpolate s-flat cube and check DQ flags of both planes
+    sfs = interp_cube(sfim, sfimwave, jwav, yind, xind, dq=sfimdq)
+
+    # integrate over f-flat fast vector
+    # reference file wavelength range is from 0.6 to 5.206 microns, so need to force
+    # solution to 1 for wavelengths outside that range
+    fff = fast_vector_factor(ffv_tab, jwav, delw, min_points=2)
+    fff[~((jwav - delw / 2.0 >= 0.6) & (jwav + delw / 2.0 <= 5.206))] = 1.0
+
+    # interpolate over f-flat cube
+    ffs = np.interp(jwav, ffswave, ffs_shutter)
+
+    flatcor[valid] = dff * dfs * sff * sfs * fff * ffs
+    return flatcor
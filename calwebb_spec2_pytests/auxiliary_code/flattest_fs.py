@@ -7,6 +7,11 @@ from gwcs import wcstools
 from jwst import datamodels
 
 from . import auxiliary_functions as auxfunc
+from . import flattest_engine
+from . import reference_flat_cache
+from . import background_writer
+from . import model_store
+from . import phase_timing
 
 """
 This script tests the pipeline flat field step output for MOS data. It is the python version of the IDL script
@@ -15,7 +20,7 @@ This script tests the pipeline flat field step output for MOS data. It is the py
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "2.6"
+__version__ = "3.3"
 
 
 # HISTORY
@@ -28,10 +33,19 @@ __version__ = "2.6"
 # May 2019 - Version 2.4: Implemented images of the residuals.
 # Jun 2019 - Version 2.5: Updated name of interpolated flat to be the default pipeline name for this file.
 # Sept 2019 - Version 2.6: Updated line to call model for SlitModel to work correctly with pipeline changes.
+# Oct 2026 - Version 2.7: Implemented option to calculate the flat for the whole slit at once with array operations.
+# Oct 2026 - Version 2.8: Band averages of the fast vectors are now taken from cumulative integral tables.
+# Oct 2026 - Version 2.9: Reference flats are now read through the reference flat cache.
+# Oct 2026 - Version 3.0: Only the D-flat planes bracketing the wavelength range of each slit are read.
+# Oct 2026 - Version 3.1: The calculated and comparison fits files are written in the background (see
+#                         background_writer.py).
+# Oct 2026 - Version 3.2: The time of each phase of the validation is recorded per slit (see phase_timing.py).
+# Oct 2026 - Version 3.3: The output of the previous step is written before it is read, also with background writing.
 
 
+@phase_timing.timed("flattest_fs")
 def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_path=None, writefile=True,
-             show_figs=True, save_figs=False, plot_name=None, threshold_diff=1.0e-7, debug=False):
+             show_figs=True, save_figs=False, plot_name=None, threshold_diff=1.0e-7, vectorized=True, debug=False):
     """
     This function calculates the difference between the pipeline and the calculated flat field values.
     The functions uses the output of the compute_world_coordinates.py script.
@@ -47,6 +61,8 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         plot_name: string, desired name (if name is not given, the plot function will name the plot by
                     default)
         threshold_diff: float, threshold difference between pipeline output and ESA file
+        vectorized: boolean, if True the flat is calculated for all the pixels of the slit at once, if False
+                    the pixel by pixel loop is used (e.g. to cross-check the results of both)
         debug: boolean, if true a series of print statements will show on-screen
 
     Returns:
@@ -61,6 +77,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     # start the timer
     flattest_start_time = time.time()
 
+    phase_timing.start_phase("file_read")
     # get info from the rate file header
     det = fits.getval(step_input_filename, "DETECTOR", 0)
     msg = 'step_input_filename=' + step_input_filename
@@ -78,6 +95,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     # flatfile = step_input_filename.replace("flat_field.fits", "intflat.fits")  # for testing code only!
 
     # get the reference files
+    phase_timing.start_phase("reference_read")
     # D-Flat
     dflat_ending = "f_01.03.fits"
     t = (dflatref_path, "nrs1", dflat_ending)
@@ -87,28 +105,15 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using D-flat: " + dfile
     print(msg)
     log_msgs.append(msg)
-    dfim = fits.getdata(dfile, "SCI")
-    dfimdq = fits.getdata(dfile, "DQ")
-    # need to flip/rotate the image into science orientation
-    ns = np.shape(dfim)
-    dfim = np.transpose(dfim, (0, 2, 1))  # keep in mind that 0,1,2 = z,y,x in Python, whereas =x,y,z in IDL
-    dfimdq = np.transpose(dfimdq)
-    if det == "NRS2":
-        # rotate science data by 180 degrees for NRS2
-        dfim = dfim[..., ::-1, ::-1]
-        dfimdq = dfimdq[..., ::-1, ::-1]
-    naxis3 = fits.getval(dfile, "NAXIS3", 1)
+    # the reference flats are kept in memory in science orientation (flipped/rotated) by the cache, for the
+    # D-flat cube only the planes needed by each slit are read
+    dflat_cube = reference_flat_cache.DFlatCube(dfile, det)
+    dfimdq = dflat_cube.dfimdq
     if debug:
-        print('np.shape(dfim) =', np.shape(dfim))
         print('np.shape(dfimdq) =', np.shape(dfimdq))
 
-    # get the wavelength values
-    dfwave = np.array([])
-    for i in range(naxis3):
-        t = ("PFLAT", str(i + 1))
-        keyword = "_".join(t)
-        dfwave = np.append(dfwave, fits.getval(dfile, keyword, 1))
-    dfrqe = fits.getdata(dfile, 2)
+    # get the fast vector
+    dfrqe = reference_flat_cache.get_data(dfile, 2)
 
     # S-flat
     mode = "FS"
@@ -153,30 +158,22 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using S-flat: " + sfile
     print(msg)
     log_msgs.append(msg)
-    sfim = fits.getdata(sfile, "SCI")  # 1)
-    sfimdq = fits.getdata(sfile, "DQ")  # 3)
-
-    # need to flip/rotate image into science orientation
-    sfim = np.transpose(sfim)
-    sfimdq = np.transpose(sfimdq)
-    if det == "NRS2":
-        # rotate science data by 180 degrees for NRS2
-        sfim = sfim[..., ::-1, ::-1]
-        sfimdq = sfimdq[..., ::-1, ::-1]
+    sfim = reference_flat_cache.get_science_data(sfile, "SCI", det)
+    sfimdq = reference_flat_cache.get_science_data(sfile, "DQ", det)
     if debug:
         print("np.shape(sfim) = ", np.shape(sfim))
         print("np.shape(sfimdq) = ", np.shape(sfimdq))
         sf = fits.open(sfile)
         print(sf.info())
     try:
-        sfv_a2001 = fits.getdata(sfile, "SLIT_A_200_1")
-        sfv_a2002 = fits.getdata(sfile, "SLIT_A_200_2")
-        sfv_a400 = fits.getdata(sfile, "SLIT_A_400")
-        sfv_a1600 = fits.getdata(sfile, "SLIT_A_1600")
+        sfv_a2001 = reference_flat_cache.get_data(sfile, "SLIT_A_200_1")
+        sfv_a2002 = reference_flat_cache.get_data(sfile, "SLIT_A_200_2")
+        sfv_a400 = reference_flat_cache.get_data(sfile, "SLIT_A_400")
+        sfv_a1600 = reference_flat_cache.get_data(sfile, "SLIT_A_1600")
     except KeyError:
         print(" * S-Flat-Field file does not have extensions for slits 200A1, 200A2, 400A, or 1600A, trying with 200B")
     if det == "NRS2":
-        sfv_b200 = fits.getdata(sfile, "SLIT_B_200")
+        sfv_b200 = reference_flat_cache.get_data(sfile, "SLIT_B_200")
 
     # F-Flat
     fflat_ending = "01.01.fits"
@@ -193,13 +190,18 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using F-flat: " + ffile
     print(msg)
     log_msgs.append(msg)
-    ffv = fits.getdata(ffile, 1)
+    ffv = reference_flat_cache.get_data(ffile, 1)
+
+    # cumulative integrals of the D- and F-flat fast vectors, to calculate the band averages of all slits
+    dfrqe_tab = reference_flat_cache.get_integral_table(dfile, 2, "RQE")
+    ffv_tab = reference_flat_cache.get_integral_table(ffile, 1, "DATA")
 
     # now go through each pixel in the test data
 
     # get the datamodel from the assign_wcs output file
+    phase_timing.start_phase("file_read")
     extract2d_wcs_file = step_input_filename.replace("_flat_field.fits", "_extract_2d.fits")
-    model = datamodels.MultiSlitModel(extract2d_wcs_file)
+    model = datamodels.MultiSlitModel(model_store.ensure_saved(extract2d_wcs_file))
 
     if writefile:
         # create the fits list to hold the calculated flat values for each slit
@@ -227,11 +229,17 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     if fits.getval(step_input_filename, "EXP_TYPE", 0) == "NRS_BRIGHTOBJ":
         sltname_list = ["S1600A1"]
 
+    # S-flat fast vector extension of each slit
+    sfv_ext_list = {"S200A1": "SLIT_A_200_1", "S200A2": "SLIT_A_200_2", "S400A1": "SLIT_A_400",
+                    "S1600A1": "SLIT_A_1600", "S200B1": "SLIT_B_200"}
+
     # get all the science extensions
     sci_ext_list = auxfunc.get_sci_extensions(flatfile)
 
     # do the loop over the slits
     for slit_id in sltname_list:
+        phase_timing.set_slit(slit_id)
+        phase_timing.start_phase("file_read")
         continue_flat_field_test = False
         if fits.getval(step_input_filename, "EXP_TYPE", 0) == "NRS_BRIGHTOBJ":
             slit = model
@@ -257,6 +265,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 sfv = sfv_a1600
             if slit_id == "S200B1":
                 sfv = sfv_b200
+            sfv_ext = sfv_ext_list[slit_id]
 
             msg = "\nWorking with slit: " + slit_id
             print(msg)
@@ -269,6 +278,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 continue
 
             # get the wavelength
+            phase_timing.start_phase("wcs_evaluation")
             # slit.x(y)start are 1-based, turn them to 0-based for extraction
             # xstart, xend = slit.xstart - 1, slit.xstart -1 + slit.xsize
             # ystart, yend = slit.ystart - 1, slit.ystart -1 + slit.ysize
@@ -283,6 +293,10 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             # print(msg)
             # log_msgs.append(msg)
 
+            # get the D-flat planes that bracket the wavelengths of the slit
+            phase_timing.start_phase("reference_read")
+            dfim, dfwave = dflat_cube.get_planes(wave)
+
             # get the subwindow origin
             px0 = slit.xstart - 1 + model.meta.subarray.xstart
             py0 = slit.ystart - 1 + model.meta.subarray.ystart
@@ -299,6 +313,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             flatcor = np.zeros([nw2, nw1]) + 999.0
 
             # read the pipeline-calculated flat image
+            phase_timing.start_phase("file_read")
             # there are four extensions in the flatfile: SCI, DQ, ERR, WAVELENGTH
             pipeflat = fits.getdata(flatfile, ext)
 
@@ -327,138 +342,149 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 total_test_result.append(test_result)
                 continue
 
-            # loop through the wavelengths
-            msg = " Looping through the wavelengths... "
-            print(msg)
-            log_msgs.append(msg)
-            for j in range(nw1):  # in x
-                for k in range(nw2):  # in y
-                    if np.isfinite(wave[k, j]):  # skip if wavelength is NaN
-                        # get thr full-frame pixel indeces for D- and S-flat image components
-                        pind = [k + py0 - 1, j + px0 - 1]
-
-                        # get the pixel bandwidth
-                        if (j != 0) and (j < nw1 - 1):
-                            if np.isfinite(wave[k, j + 1]) and np.isfinite(wave[k, j - 1]):
-                                delw = 0.5 * (wave[k, j + 1] - wave[k, j - 1])
-                            if np.isfinite(wave[k, j + 1]) and not np.isfinite(wave[k, j - 1]):
+            phase_timing.start_phase("flat_calculation")
+            if vectorized:
+                msg = " Calculating the flat for all the pixels of the slit at once... "
+                print(msg)
+                log_msgs.append(msg)
+                sfv_tab = reference_flat_cache.get_integral_table(sfile, sfv_ext, "DATA")
+                flatcor = flattest_engine.calc_fs_flat(wave, px0, py0, dfim, dfimdq, dfwave, dfrqe_tab,
+                                                       sfim, sfimdq, sfv_tab, ffv_tab)
+                delf = flattest_engine.calc_flat_difference(pipeflat, flatcor, wave)
+
+            else:
+                # loop through the wavelengths
+                msg = " Looping through the wavelengths... "
+                print(msg)
+                log_msgs.append(msg)
+                for j in range(nw1):  # in x
+                    for k in range(nw2):  # in y
+                        if np.isfinite(wave[k, j]):  # skip if wavelength is NaN
+                            # get thr full-frame pixel indeces for D- and S-flat image components
+                            pind = [k + py0 - 1, j + px0 - 1]
+
+                            # get the pixel bandwidth
+                            if (j != 0) and (j < nw1 - 1):
+                                if np.isfinite(wave[k, j + 1]) and np.isfinite(wave[k, j - 1]):
+                                    delw = 0.5 * (wave[k, j + 1] - wave[k, j - 1])
+                                if np.isfinite(wave[k, j + 1]) and not np.isfinite(wave[k, j - 1]):
+                                    delw = wave[k, j + 1] - wave[k, j]
+                                if not np.isfinite(wave[k, j + 1]) and np.isfinite(wave[k, j - 1]):
+                                    delw = wave[k, j] - wave[k, j - 1]
+                            if j == 0:
                                 delw = wave[k, j + 1] - wave[k, j]
-                            if not np.isfinite(wave[k, j + 1]) and np.isfinite(wave[k, j - 1]):
+                            if j == nw - 1:
                                 delw = wave[k, j] - wave[k, j - 1]
-                        if j == 0:
-                            delw = wave[k, j + 1] - wave[k, j]
-                        if j == nw - 1:
-                            delw = wave[k, j] - wave[k, j - 1]
-
-                        # integrate over D-flat fast vector
-                        dfrqe_wav = dfrqe.field("WAVELENGTH")
-                        dfrqe_rqe = dfrqe.field("RQE")
-                        iw = np.where((dfrqe_wav >= wave[k, j] - delw / 2.) & (dfrqe_wav <= wave[k, j] + delw / 2.))
-                        int_tab = auxfunc.idl_tabulate(dfrqe_wav[iw], dfrqe_rqe[iw])
-                        first_dfrqe_wav, last_dfrqe_wav = dfrqe_wav[iw[0]][0], dfrqe_wav[iw[0]][-1]
-                        dff = int_tab / (last_dfrqe_wav - first_dfrqe_wav)
-
-                        if debug:
-                            print("np.shape(dfrqe_wav) : ", np.shape(dfrqe_wav))
-                            print("np.shape(dfrqe_rqe) : ", np.shape(dfrqe_rqe))
-                            print("dfimdq[pind[0],[pind[1]] : ", dfimdq[pind[0], pind[1]])
-                            print("np.shape(iw) =", np.shape(iw))
-                            print("np.shape(dfrqe_wav) = ", np.shape(dfrqe_wav[iw]))
-                            print("np.shape(dfrqe_rqe) = ", np.shape(dfrqe_rqe[iw]))
-                            print("int_tab=", int_tab)
-                            print("np.shape(dfim) = ", np.shape(dfim))
-                            print("dff = ", dff)
-
-                        # interpolate over D-flat cube
-                        iloc = auxfunc.idl_valuelocate(dfwave, wave[k, j])[0]
-                        if dfwave[iloc] > wave[k, j]:
-                            iloc -= 1
-                        ibr = [iloc]
-                        if iloc != len(dfwave) - 1:
-                            ibr.append(iloc + 1)
-                        # get the values in the z-array at indeces ibr, and x=pind[1] and y=pind[0]
-                        zz = dfim[:, pind[0], pind[1]][ibr]
-                        # now determine the length of the array with only the finite numbers
-                        zzwherenonan = np.where(np.isfinite(zz))
-                        kk = np.size(zzwherenonan)
-                        dfs = 1.0
-                        if (wave[k, j] <= max(dfwave)) and (wave[k, j] >= min(dfwave)) and (kk == 2):
-                            dfs = np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan])
-
-                        # check DQ flags
-                        if dfimdq[pind[0]][pind[1]] != 0:
+
+                            # integrate over D-flat fast vector
+                            dfrqe_wav = dfrqe.field("WAVELENGTH")
+                            dfrqe_rqe = dfrqe.field("RQE")
+                            iw = np.where((dfrqe_wav >= wave[k, j] - delw / 2.) & (dfrqe_wav <= wave[k, j] + delw / 2.))
+                            int_tab = auxfunc.idl_tabulate(dfrqe_wav[iw], dfrqe_rqe[iw])
+                            first_dfrqe_wav, last_dfrqe_wav = dfrqe_wav[iw[0]][0], dfrqe_wav[iw[0]][-1]
+                            dff = int_tab / (last_dfrqe_wav - first_dfrqe_wav)
+
+                            if debug:
+                                print("np.shape(dfrqe_wav) : ", np.shape(dfrqe_wav))
+                                print("np.shape(dfrqe_rqe) : ", np.shape(dfrqe_rqe))
+                                print("dfimdq[pind[0],[pind[1]] : ", dfimdq[pind[0], pind[1]])
+                                print("np.shape(iw) =", np.shape(iw))
+                                print("np.shape(dfrqe_wav) = ", np.shape(dfrqe_wav[iw]))
+                                print("np.shape(dfrqe_rqe) = ", np.shape(dfrqe_rqe[iw]))
+                                print("int_tab=", int_tab)
+                                print("np.shape(dfim) = ", np.shape(dfim))
+                                print("dff = ", dff)
+
+                            # interpolate over D-flat cube
+                            iloc = auxfunc.idl_valuelocate(dfwave, wave[k, j])[0]
+                            if dfwave[iloc] > wave[k, j]:
+                                iloc -= 1
+                            ibr = [iloc]
+                            if iloc != len(dfwave) - 1:
+                                ibr.append(iloc + 1)
+                            # get the values in the z-array at indeces ibr, and x=pind[1] and y=pind[0]
+                            zz = dfim[:, pind[0], pind[1]][ibr]
+                            # now determine the length of the array with only the finite numbers
+                            zzwherenonan = np.where(np.isfinite(zz))
+                            kk = np.size(zzwherenonan)
                             dfs = 1.0
+                            if (wave[k, j] <= max(dfwave)) and (wave[k, j] >= min(dfwave)) and (kk == 2):
+                                dfs = np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan])
 
-                        if debug:
-                            print("wave[k, j] = ", wave[k, j])
-                            print("iloc = ", iloc)
-                            print("ibr = ", ibr)
-                            print("np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan]) = ",
-                                  np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan]))
-                            print("dfs = ", dfs)
-
-                        # integrate over S-flat fast vector
-                        sfv_wav = sfv.field("WAVELENGTH")
-                        sfv_dat = sfv.field("DATA")
-                        iw = np.where((sfv_wav >= wave[k, j] - delw / 2.0) & (sfv_wav <= wave[k, j] + delw / 2.0))
-                        sff = 1.0
-                        if np.size(iw) > 2:
-                            int_tab = auxfunc.idl_tabulate(sfv_wav[iw], sfv_dat[iw])
-                            first_sfv_wav, last_sfv_wav = sfv_wav[iw[0]][0], sfv_wav[iw[0]][-1]
-                            sff = int_tab / (last_sfv_wav - first_sfv_wav)
-                        # get s-flat pixel-dependent correction
-                        sfs = 1.0
-                        if sfimdq[pind[0], pind[1]] == 0:
-                            sfs = sfim[pind[0], pind[1]]
-
-                        if debug:
-                            print("np.shape(iw) =", np.shape(iw))
-                            print("np.shape(sfv_wav) = ", np.shape(sfv_wav))
-                            print("np.shape(sfv_dat) = ", np.shape(sfv_dat))
-                            print("int_tab = ", int_tab)
-                            print("sff = ", sff)
-                            print("sfs = ", sfs)
-
-                        # integrate over F-flat fast vector
-                        # reference file blue cutoff is 1 micron, so need to force solution for shorter wavs
-                        ffv_wav = ffv.field("WAVELENGTH")
-                        ffv_dat = ffv.field("DATA")
-                        fff = 1.0
-                        if wave[k, j] - delw / 2.0 >= 1.0:
-                            iw = np.where((ffv_wav >= wave[k, j] - delw / 2.0) & (ffv_wav <= wave[k, j] + delw / 2.0))
-                            if np.size(iw) > 1:
-                                int_tab = auxfunc.idl_tabulate(ffv_wav[iw], ffv_dat[iw])
-                                first_ffv_wav, last_ffv_wav = ffv_wav[iw[0]][0], ffv_wav[iw[0]][-1]
-                                fff = int_tab / (last_ffv_wav - first_ffv_wav)
-
-                        flatcor[k, j] = dff * dfs * sff * sfs * fff
-
-                        if debug:
-                            print("np.shape(iw) =", np.shape(iw))
-                            print("np.shape(ffv_wav) = ", np.shape(ffv_wav))
-                            print("np.shape(ffv_dat) = ", np.shape(ffv_dat))
-                            print("fff = ", fff)
-                            print("flatcor[k, j] = ", flatcor[k, j])
-                            print("dff, dfs, sff, sfs, fff:", dff, dfs, sff, sfs, fff)
-
-                        try:
-                            # Difference between pipeline and calculated values
-                            delf[k, j] = pipeflat[k, j] - flatcor[k, j]
+                            # check DQ flags
+                            if dfimdq[pind[0]][pind[1]] != 0:
+                                dfs = 1.0
 
                             if debug:
-                                print("delf[k, j] = ", delf[k, j])
+                                print("wave[k, j] = ", wave[k, j])
+                                print("iloc = ", iloc)
+                                print("ibr = ", ibr)
+                                print("np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan]) = ",
+                                      np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan]))
+                                print("dfs = ", dfs)
+
+                            # integrate over S-flat fast vector
+                            sfv_wav = sfv.field("WAVELENGTH")
+                            sfv_dat = sfv.field("DATA")
+                            iw = np.where((sfv_wav >= wave[k, j] - delw / 2.0) & (sfv_wav <= wave[k, j] + delw / 2.0))
+                            sff = 1.0
+                            if np.size(iw) > 2:
+                                int_tab = auxfunc.idl_tabulate(sfv_wav[iw], sfv_dat[iw])
+                                first_sfv_wav, last_sfv_wav = sfv_wav[iw[0]][0], sfv_wav[iw[0]][-1]
+                                sff = int_tab / (last_sfv_wav - first_sfv_wav)
+                            # get s-flat pixel-dependent correction
+                            sfs = 1.0
+                            if sfimdq[pind[0], pind[1]] == 0:
+                                sfs = sfim[pind[0], pind[1]]
 
-                            # Remove all pixels with values=1 (outside slit boundaries) for statistics
-                            if pipeflat[k, j] == 1:
-                                delf[k, j] = 999.0
-                            if np.isnan(wave[k, j]):
-                                flatcor[k, j] = 1.0  # no correction if no wavelength
+                            if debug:
+                                print("np.shape(iw) =", np.shape(iw))
+                                print("np.shape(sfv_wav) = ", np.shape(sfv_wav))
+                                print("np.shape(sfv_dat) = ", np.shape(sfv_dat))
+                                print("int_tab = ", int_tab)
+                                print("sff = ", sff)
+                                print("sfs = ", sfs)
+
+                            # integrate over F-flat fast vector
+                            # reference file blue cutoff is 1 micron, so need to force solution for shorter wavs
+                            ffv_wav = ffv.field("WAVELENGTH")
+                            ffv_dat = ffv.field("DATA")
+                            fff = 1.0
+                            if wave[k, j] - delw / 2.0 >= 1.0:
+                                iw = np.where((ffv_wav >= wave[k, j] - delw / 2.0) & (ffv_wav <= wave[k, j] + delw / 2.0))
+                                if np.size(iw) > 1:
+                                    int_tab = auxfunc.idl_tabulate(ffv_wav[iw], ffv_dat[iw])
+                                    first_ffv_wav, last_ffv_wav = ffv_wav[iw[0]][0], ffv_wav[iw[0]][-1]
+                                    fff = int_tab / (last_ffv_wav - first_ffv_wav)
+
+                            flatcor[k, j] = dff * dfs * sff * sfs * fff
 
                             if debug:
+                                print("np.shape(iw) =", np.shape(iw))
+                                print("np.shape(ffv_wav) = ", np.shape(ffv_wav))
+                                print("np.shape(ffv_dat) = ", np.shape(ffv_dat))
+                                print("fff = ", fff)
                                 print("flatcor[k, j] = ", flatcor[k, j])
-                                print("delf[k, j] = ", delf[k, j])
-                        except:
-                            IndexError
+                                print("dff, dfs, sff, sfs, fff:", dff, dfs, sff, sfs, fff)
+
+                            try:
+                                # Difference between pipeline and calculated values
+                                delf[k, j] = pipeflat[k, j] - flatcor[k, j]
+
+                                if debug:
+                                    print("delf[k, j] = ", delf[k, j])
+
+                                # Remove all pixels with values=1 (outside slit boundaries) for statistics
+                                if pipeflat[k, j] == 1:
+                                    delf[k, j] = 999.0
+                                if np.isnan(wave[k, j]):
+                                    flatcor[k, j] = 1.0  # no correction if no wavelength
+
+                                if debug:
+                                    print("flatcor[k, j] = ", flatcor[k, j])
+                                    print("delf[k, j] = ", delf[k, j])
+                            except:
+                                IndexError
 
             if debug:
                 no_999 = delf[np.where(delf != 999.0)]
@@ -471,6 +497,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 print("np.shape(delf) = ", np.shape(delf))
                 print("np.shape(delfg) = ", np.shape(delfg))
 
+            phase_timing.start_phase("statistics")
             nanind = np.isnan(delf)  # get all the nan indexes
             notnan = ~nanind  # get all the not-nan indexes
             delf = delf[notnan]  # get rid of NaNs
@@ -515,6 +542,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             total_test_result.append(test_result)
 
             # make histogram
+            phase_timing.start_phase("plotting")
             if show_figs or save_figs:
 
                 # set plot variables
@@ -560,6 +588,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 log_msgs.append(msg)
 
             # create fits file to hold the calculated flat for each slit
+            phase_timing.start_phase("file_write")
             if writefile:
                 msg = "Saving the fits files with the calculated flat for each slit..."
                 print(msg)
@@ -574,20 +603,21 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 complfile.append(complfile_ext)
 
                 # the file is not yet written, indicate that this slit was appended to list to be written
-                msg = "Extension " + repr(
-                    i) + " appended to list to be written into calculated and comparison fits files."
+                msg = "Extension " + repr(slit_id) + " appended to list to be written into calculated and comparison fits files."
                 print(msg)
                 log_msgs.append(msg)
 
+    phase_timing.set_slit(None)
     if writefile:
+        phase_timing.start_phase("file_write")
         outfile_name = step_input_filename.replace("flat_field.fits", det + "_flat_calc.fits")
         complfile_name = step_input_filename.replace("flat_field.fits", det + "_flat_comp.fits")
 
         # create the fits list to hold the calculated flat values for each slit
-        outfile.writeto(outfile_name, overwrite=True)
+        background_writer.submit(outfile, outfile_name)
 
         # this is the file to hold the image of pipeline-calculated difference values
-        complfile.writeto(complfile_name, overwrite=True)
+        background_writer.submit(complfile, complfile_name)
 
         msg = "\nFits file with calculated flat values of each slit saved as: "
         print(msg)
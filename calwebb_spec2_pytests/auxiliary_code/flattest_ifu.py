@@ -11,6 +11,11 @@ from jwst import datamodels
 from jwst.assign_wcs import nirspec
 
 from . import auxiliary_functions as auxfunc
+from . import flattest_engine
+from . import reference_flat_cache
+from . import background_writer
+from . import model_store
+from . import phase_timing
 
 
 """
@@ -21,7 +26,7 @@ This script tests the pipeline flat field step output for IFU data. It is the py
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "2.6"
+__version__ = "3.2"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -32,6 +37,13 @@ __version__ = "2.6"
 # Apr 2019 - Version 2.4: Implemented logging capability.
 # May 2019 - Version 2.5: Implemented plot of residuals as well as histogram.
 # Jun 2019 - Version 2.6: Updated name of interpolated flat to be the default pipeline name for this file.
+# Oct 2026 - Version 2.7: Implemented option to calculate the flat for the whole slice at once with array operations.
+# Oct 2026 - Version 2.8: Reference flats are now read through the reference flat cache.
+# Oct 2026 - Version 2.9: Only the D-flat planes bracketing the wavelength range of each slice are read.
+# Oct 2026 - Version 3.0: The calculated and comparison fits files are written in the background (see
+#                         background_writer.py).
+# Oct 2026 - Version 3.1: The time of each phase of the validation is recorded per slice (see phase_timing.py).
+# Oct 2026 - Version 3.2: The output of the previous step is written before it is read, also with background writing.
 
 
 
@@ -84,9 +96,10 @@ def mk_hist(title, delfg, delfg_mean, delfg_median, delfg_std, save_figs, show_f
 
 
 
+@phase_timing.timed("flattest_ifu")
 def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_path=None, writefile=False,
              mk_all_slices_plt=False, show_figs=True, save_figs=False, plot_name=None,
-             threshold_diff=1.0e-7, debug=False):
+             threshold_diff=1.0e-7, vectorized=True, debug=False):
     """
     This function calculates the difference between the pipeline and the calculated flat field values.
     The functions uses the output of the compute_world_coordinates.py script.
@@ -103,6 +116,8 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         plot_name: string, desired name (if name is not given, the plot function will name the plot by
                     default)
         threshold_diff: float, threshold difference between pipeline output and ESA file
+        vectorized: boolean, if True the flat is calculated for all the pixels of the slice at once, if False
+                    the pixel by pixel loop is used (e.g. to cross-check the results of both)
         debug: boolean, if true a series of print statements will show on-screen
 
     Returns:
@@ -118,6 +133,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     flattest_start_time = time.time()
 
     # get info from the flat field file
+    phase_timing.start_phase("file_read")
     file_path = step_input_filename.replace(os.path.basename(step_input_filename), "")
     det = fits.getval(step_input_filename, "DETECTOR", 0)
     exptype = fits.getval(step_input_filename, "EXP_TYPE", 0)
@@ -136,6 +152,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     pipeflat = fits.getdata(flatfile, "SCI")
 
     # get the reference files
+    phase_timing.start_phase("reference_read")
     msg = "Getting and reading the D-, S-, and F-flats for this specific IFU configuration... "
     print(msg)
     log_msgs.append(msg)
@@ -148,24 +165,11 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using D-flat: "+dfile
     print(msg)
     log_msgs.append(msg)
-    dfim = fits.getdata(dfile,  "SCI")#1)
-    dfimdq = fits.getdata(dfile, "DQ")#4)
-    # need to flip/rotate the image into science orientation
-    ns = np.shape(dfim)
-    dfim = np.transpose(dfim, (0, 2, 1))   # keep in mind that 0,1,2 = z,y,x in Python, whereas =x,y,z in IDL
-    dfimdq = np.transpose(dfimdq)
-    if det == "NRS2":
-        # rotate science data by 180 degrees for NRS2
-        dfim = dfim[..., ::-1, ::-1]
-        dfimdq = dfimdq[..., ::-1, ::-1]
-    naxis3 = fits.getval(dfile, "NAXIS3", "SCI")#1)
-
-    # get the wavelength values
-    dfwave = np.array([])
-    for i in range(naxis3):
-        keyword = "PFLAT_"+str(i+1)
-        dfwave = np.append(dfwave, fits.getval(dfile, keyword, "SCI"))#1))
-    dfrqe = fits.getdata(dfile, 2)
+    # the reference flats are kept in memory in science orientation (flipped/rotated) by the cache, for the
+    # D-flat cube only the planes needed by each slice are read
+    dflat_cube = reference_flat_cache.DFlatCube(dfile, det)
+    dfimdq = dflat_cube.dfimdq
+    dfrqe = reference_flat_cache.get_data(dfile, 2)
 
     # S-flat
     tsp = exptype.split("_")
@@ -202,17 +206,9 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using S-flat: "+sfile
     print(msg)
     log_msgs.append(msg)
-    sfim = fits.getdata(sfile, "SCI")#1)
-    sfimdq = fits.getdata(sfile, "DQ")#3)
-
-    # need to flip/rotate image into science orientation
-    sfim = np.transpose(sfim)
-    sfimdq = np.transpose(sfimdq)
-    if det == "NRS2":
-        # rotate science data by 180 degrees for NRS2
-        sfim = sfim[..., ::-1, ::-1]
-        sfimdq = sfimdq[..., ::-1, ::-1]
-    sfv = fits.getdata(sfile, 5)
+    sfim = reference_flat_cache.get_science_data(sfile, "SCI", det)
+    sfimdq = reference_flat_cache.get_science_data(sfile, "DQ", det)
+    sfv = reference_flat_cache.get_data(sfile, 5)
 
     # F-Flat
     fflat_ending = "_01.01.fits"
@@ -230,7 +226,12 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using F-flat: "+ffile
     print(msg)
     log_msgs.append(msg)
-    ffv = fits.getdata(ffile, "IFU")#1)
+    ffv = reference_flat_cache.get_data(ffile, "IFU")
+
+    # cumulative integrals of the fast vectors, to calculate the band averages of all slices
+    dfrqe_tab = reference_flat_cache.get_integral_table(dfile, 2, "RQE")
+    sfv_tab = reference_flat_cache.get_integral_table(sfile, 5, "DATA")
+    ffv_tab = reference_flat_cache.get_integral_table(ffile, "IFU", "DATA")
 
     # now go through each pixel in the test data
 
@@ -246,10 +247,15 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         complfile.append(hdu0)
 
     # get the datamodel from the assign_wcs output file
+    phase_timing.start_phase("file_read")
     assign_wcs_file = step_input_filename.replace("_flat_field.fits", "_assign_wcs.fits")
-    model = datamodels.ImageModel(assign_wcs_file)
+    model = datamodels.ImageModel(model_store.ensure_saved(assign_wcs_file))
     ifu_slits = nirspec.nrs_ifu_wcs(model)
 
+    # full frame array to hold the calculated flat of all the slices
+    if vectorized:
+        calc_flat = np.zeros([2048, 2048]) + 999.0
+
     # loop over the slices
     all_delfg_mean, all_delfg_mean_arr, all_delfg_median, all_test_result = [], [], [], []
     msg = "\n Now looping through the slices, this may take some time... "
@@ -260,15 +266,21 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             pslice = "0"+repr(n_ext)
         else:
             pslice = repr(n_ext)
+        phase_timing.set_slit("slice"+pslice)
         msg = "\nWorking with slice: "+pslice
         print(msg)
         log_msgs.append(msg)
 
         # get the wavelength
+        phase_timing.start_phase("wcs_evaluation")
         # slice.x(y)start are 1-based, turn them to 0-based for extraction
         x, y = wcstools.grid_from_bounding_box(slice.bounding_box, (1, 1), center=True)
         ra, dec, wave = slice(x, y)
 
+        # get the D-flat planes that bracket the wavelengths of the slice
+        phase_timing.start_phase("reference_read")
+        dfim, dfwave = dflat_cube.get_planes(wave)
+
         # get the subwindow origin (technically no subwindows for IFU, but need this for comparing to the
         # full frame on-the-fly flat image).
         px0 = model.meta.subarray.xstart - 1 + int(_toindex(slice.bounding_box[0][0])) + 1
@@ -284,148 +296,167 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             print("n_p = ", n_p)
             print("nw = ", nw)
 
-        # initialize arrays of the right size
-        delf = np.zeros([nw]) + 999.0
-        flatcor = np.zeros([nw]) + 999.0
-        sffarr = np.zeros([nw])
-        calc_flat = np.zeros([2048, 2048]) + 999.0
+        phase_timing.start_phase("flat_calculation")
+        if vectorized:
+            msg = " Calculating the flat for all the pixels of the slice at once... "
+            print(msg)
+            log_msgs.append(msg)
+            # full-frame pixel indices from the bounding box grid
+            xind = x.astype(int) + model.meta.subarray.xstart - 1
+            yind = y.astype(int) + model.meta.subarray.ystart - 1
+            wave_shape = np.shape(wave)
+            flatcor = flattest_engine.calc_ifu_flat(wave, xind, yind, dfim, dfimdq, dfwave, dfrqe_tab,
+                                                    sfim, sfimdq, sfv_tab, ffv_tab)
+            delf = flattest_engine.calc_flat_difference(pipeflat[yind, xind], flatcor, wave)
+            # write the calculated flat of this slice into the full frame array
+            valid = np.isfinite(wave)
+            calc_flat[yind[valid], xind[valid]] = flatcor[valid]
+            flatcor, delf = flatcor.flatten(), delf.flatten()
 
-        # loop through the wavelengths
-        msg = " Looping through the wavelngth, this may take a little time ... "
-        print(msg)
-        log_msgs.append(msg)
-        flat_wave = wave.flatten()
-        wave_shape = np.shape(wave)
-        for j in range(0, nw):
-            if np.isfinite(flat_wave[j]):   # skip if wavelength is NaN
-                # get the pixel indeces
-                jwav = flat_wave[j]
-                t=np.where(wave == jwav)
-                pind = [t[0][0]+py0-1, t[1][0]+px0-1]   # pind =[pixel_y, pixe_x] in python, [x, y] in IDL
-                if debug:
-                    print('j, jwav, px0, py0 : ', j, jwav, px0, py0)
-                    print('pind[0], pind[1] = ', pind[0], pind[1])
-
-                # get the pixel bandwidth **this needs to be modified for prism, since the dispersion is not linear!**
-                delw = 0.0
-                if (j!=0) and (int((j-1)/nx)==int(j/nx)) and (int((j+1)/nx)==int(j/nx)) and np.isfinite(flat_wave[j+1]) and np.isfinite(flat_wave[j-1]):
-                    delw = 0.5 * (flat_wave[j+1] - flat_wave[j-1])
-                if (j==0) or not np.isfinite(flat_wave[j-1]) or (int((j-1)/nx) != int(j/nx)):
-                    delw = 0.5 * (flat_wave[j+1] - flat_wave[j])
-                if (j==nw-1) or not np.isfinite(flat_wave[j+1]) or (int((j+1)/nx) != int(j/nx)):
-                    delw = 0.5 * (flat_wave[j] - flat_wave[j-1])
-
-                if debug:
-                    #print("(j, (j-1), nx, (j-1)/nx, (j+1), (j+1)/nx)", j, (j-1), nx, int((j-1)/nx), (j+1), int((j+1)/nx))
-                    #print("np.isfinite(flat_wave[j+1]), np.isfinite(flat_wave[j-1])", np.isfinite(flat_wave[j+1]), np.isfinite(flat_wave[j-1]))
-                    #print("flat_wave[j+1], flat_wave[j-1] : ", np.isfinite(flat_wave[j+1]), flat_wave[j+1], flat_wave[j-1])
-                    print("delw = ", delw)
-
-                # integrate over D-flat fast vector
-                dfrqe_wav = dfrqe.field("WAVELENGTH")
-                dfrqe_rqe = dfrqe.field("RQE")
-                iw = np.where((dfrqe_wav >= jwav-delw/2.0) & (dfrqe_wav <= jwav+delw/2.0))
-                if np.size(iw) == 0:
-                    iw = -1
-                int_tab = auxfunc.idl_tabulate(dfrqe_wav[iw], dfrqe_rqe[iw])
-                if int_tab == 0:
-                    int_tab = np.interp(dfrqe_wav[iw], dfrqe_wav, dfrqe_rqe)
-                    dff = int_tab
-                else:
-                    first_dfrqe_wav, last_dfrqe_wav = dfrqe_wav[iw][0], dfrqe_wav[iw][-1]
-                    dff = int_tab/(last_dfrqe_wav - first_dfrqe_wav)
-
-                if debug:
-                    #print("np.shape(dfrqe_wav) : ", np.shape(dfrqe_wav))
-                    #print("np.shape(dfrqe_rqe) : ", np.shape(dfrqe_rqe))
-                    #print("dfimdq[pind[0]][pind[1]] : ", dfimdq[pind[0]][pind[1]])
-                    #print("np.shape(iw) =", np.shape(iw))
-                    #print("np.shape(dfrqe_wav[iw[0]]) = ", np.shape(dfrqe_wav[iw[0]]))
-                    #print("np.shape(dfrqe_rqe[iw[0]]) = ", np.shape(dfrqe_rqe[iw[0]]))
-                    #print("int_tab=", int_tab)
-                    print("np.shape(iw) = ", np.shape(iw))
-                    print("iw = ", iw)
-                    print("dff = ", dff)
-
-                # interpolate over D-flat cube
-                dfs = 1.0
-                if dfimdq[pind[0], pind[1]] == 0:
-                    dfs = np.interp(jwav, dfwave, dfim[:, pind[0], pind[1]])
-
-                # integrate over S-flat fast vector
-                sfv_wav = sfv.field("WAVELENGTH")
-                sfv_dat = sfv.field("DATA")
-                if (jwav < 5.3) and (jwav > 0.6):
-                    iw = np.where((sfv_wav >= jwav-delw/2.0) & (sfv_wav <= jwav+delw/2.0))
-                    if np.size(iw) == 0:
-                        iw = -1
-                    if np.size(iw) > 1:
-                        int_tab = auxfunc.idl_tabulate(sfv_wav[iw], sfv_dat[iw])
-                        first_sfv_wav, last_sfv_wav = sfv_wav[iw][0], sfv_wav[iw][-1]
-                        sff = int_tab/(last_sfv_wav - first_sfv_wav)
-                    elif np.size(iw) == 1:
-                        sff = float(sfv_dat[iw])
-                else:
-                    sff = 999.0
-
-                # get s-flat pixel-dependent correction
-                sfs = 1.0
-                if sfimdq[pind[0], pind[1]] == 0:
-                    sfs = sfim[pind[0], pind[1]]
-
-                if debug:
-                    print("jwav-delw/2.0 = ", jwav-delw/2.0)
-                    print("jwav+delw/2.0 = ", jwav+delw/2.0)
-                    print("np.shape(sfv_wav), sfv_wav[-1] = ", np.shape(sfv_wav), sfv_wav[-1])
-                    print("iw = ", iw)
-                    print("sfv_wav[iw] = ", sfv_wav[iw])
-                    print("int_tab = ", int_tab)
-                    print("first_sfv_wav, last_sfv_wav = ", first_sfv_wav, last_sfv_wav)
-                    print("sfs = ", sfs)
-                    print("sff = ", sff)
-
-                # integrate over f-flat fast vector
-                # reference file blue cutoff is 1 micron, so need to force solution for shorter wavs
-                ffv_wav = ffv.field("WAVELENGTH")
-                ffv_dat = ffv.field("DATA")
-                fff = 1.0
-                if jwav-delw/2.0 >= 1.0:
-                    iw = np.where((ffv_wav >= jwav-delw/2.0) & (ffv_wav <= jwav+delw/2.0))
+        else:
+            # initialize arrays of the right size
+            delf = np.zeros([nw]) + 999.0
+            flatcor = np.zeros([nw]) + 999.0
+            sffarr = np.zeros([nw])
+            calc_flat = np.zeros([2048, 2048]) + 999.0
+
+            # loop through the wavelengths
+            msg = " Looping through the wavelngth, this may take a little time ... "
+            print(msg)
+            log_msgs.append(msg)
+            flat_wave = wave.flatten()
+            wave_shape = np.shape(wave)
+            for j in range(0, nw):
+                if np.isfinite(flat_wave[j]):   # skip if wavelength is NaN
+                    # get the pixel indeces
+                    jwav = flat_wave[j]
+                    t=np.where(wave == jwav)
+                    pind = [t[0][0]+py0-1, t[1][0]+px0-1]   # pind =[pixel_y, pixe_x] in python, [x, y] in IDL
+                    if debug:
+                        print('j, jwav, px0, py0 : ', j, jwav, px0, py0)
+                        print('pind[0], pind[1] = ', pind[0], pind[1])
+
+                    # get the pixel bandwidth **this needs to be modified for prism, since the dispersion is not linear!**
+                    delw = 0.0
+                    if (j!=0) and (int((j-1)/nx)==int(j/nx)) and (int((j+1)/nx)==int(j/nx)) and np.isfinite(flat_wave[j+1]) and np.isfinite(flat_wave[j-1]):
+                        delw = 0.5 * (flat_wave[j+1] - flat_wave[j-1])
+                    if (j==0) or not np.isfinite(flat_wave[j-1]) or (int((j-1)/nx) != int(j/nx)):
+                        delw = 0.5 * (flat_wave[j+1] - flat_wave[j])
+                    if (j==nw-1) or not np.isfinite(flat_wave[j+1]) or (int((j+1)/nx) != int(j/nx)):
+                        delw = 0.5 * (flat_wave[j] - flat_wave[j-1])
+
+                    if debug:
+                        #print("(j, (j-1), nx, (j-1)/nx, (j+1), (j+1)/nx)", j, (j-1), nx, int((j-1)/nx), (j+1), int((j+1)/nx))
+                        #print("np.isfinite(flat_wave[j+1]), np.isfinite(flat_wave[j-1])", np.isfinite(flat_wave[j+1]), np.isfinite(flat_wave[j-1]))
+                        #print("flat_wave[j+1], flat_wave[j-1] : ", np.isfinite(flat_wave[j+1]), flat_wave[j+1], flat_wave[j-1])
+                        print("delw = ", delw)
+
+                    # integrate over D-flat fast vector
+                    dfrqe_wav = dfrqe.field("WAVELENGTH")
+                    dfrqe_rqe = dfrqe.field("RQE")
+                    iw = np.where((dfrqe_wav >= jwav-delw/2.0) & (dfrqe_wav <= jwav+delw/2.0))
                     if np.size(iw) == 0:
                         iw = -1
-                    if np.size(iw) > 1:
-                        int_tab = auxfunc.idl_tabulate(ffv_wav[iw], ffv_dat[iw])
-                        first_ffv_wav, last_ffv_wav = ffv_wav[iw][0], ffv_wav[iw][-1]
-                        fff = int_tab/(last_ffv_wav - first_ffv_wav)
-                    elif np.size(iw) == 1:
-                        fff = float(ffv_dat[iw])
-
-                flatcor[j] = dff * dfs * sff * sfs * fff
-                sffarr[j] = sff
-
-                # To visually compare between the pipeline flat and the calculated one (e.g. in ds9), Phil Hodge
-                # suggested using the following line:
-                calc_flat[pind[0], pind[1]] = flatcor[j]
-                # this line writes the calculated flat into a full frame array
-                # then this new array needs to be written into a file. This part has not been done yet.
-
-                # Difference between pipeline and calculated values
-                delf[j] = pipeflat[pind[0], pind[1]] - flatcor[j]
-
-                # Remove all pixels with values=1 (mainly inter-slit pixels) for statistics
-                if pipeflat[pind[0], pind[1]] == 1:
-                    delf[j] = 999.0
-                if np.isnan(jwav):
-                    flatcor[j] = 1.0   # no correction if no wavelength
-
-                if debug:
-                    print("np.shape(iw) = ", np.shape(iw))
-                    print("fff = ", fff)
-                    print("flatcor[j] = ", flatcor[j])
-                    print("delf[j] = ", delf[j])
+                    int_tab = auxfunc.idl_tabulate(dfrqe_wav[iw], dfrqe_rqe[iw])
+                    if int_tab == 0:
+                        int_tab = np.interp(dfrqe_wav[iw], dfrqe_wav, dfrqe_rqe)
+                        dff = int_tab
+                    else:
+                        first_dfrqe_wav, last_dfrqe_wav = dfrqe_wav[iw][0], dfrqe_wav[iw][-1]
+                        dff = int_tab/(last_dfrqe_wav - first_dfrqe_wav)
+
+                    if debug:
+                        #print("np.shape(dfrqe_wav) : ", np.shape(dfrqe_wav))
+                        #print("np.shape(dfrqe_rqe) : ", np.shape(dfrqe_rqe))
+                        #print("dfimdq[pind[0]][pind[1]] : ", dfimdq[pind[0]][pind[1]])
+                        #print("np.shape(iw) =", np.shape(iw))
+                        #print("np.shape(dfrqe_wav[iw[0]]) = ", np.shape(dfrqe_wav[iw[0]]))
+                        #print("np.shape(dfrqe_rqe[iw[0]]) = ", np.shape(dfrqe_rqe[iw[0]]))
+                        #print("int_tab=", int_tab)
+                        print("np.shape(iw) = ", np.shape(iw))
+                        print("iw = ", iw)
+                        print("dff = ", dff)
+
+                    # interpolate over D-flat cube
+                    dfs = 1.0
+                    if dfimdq[pind[0], pind[1]] == 0:
+                        dfs = np.interp(jwav, dfwave, dfim[:, pind[0], pind[1]])
+
+                    # integrate over S-flat fast vector
+                    sfv_wav = sfv.field("WAVELENGTH")
+                    sfv_dat = sfv.field("DATA")
+                    if (jwav < 5.3) and (jwav > 0.6):
+                        iw = np.where((sfv_wav >= jwav-delw/2.0) & (sfv_wav <= jwav+delw/2.0))
+                        if np.size(iw) == 0:
+                            iw = -1
+                        if np.size(iw) > 1:
+                            int_tab = auxfunc.idl_tabulate(sfv_wav[iw], sfv_dat[iw])
+                            first_sfv_wav, last_sfv_wav = sfv_wav[iw][0], sfv_wav[iw][-1]
+                            sff = int_tab/(last_sfv_wav - first_sfv_wav)
+                        elif np.size(iw) == 1:
+                            sff = float(sfv_dat[iw])
+                    else:
+                        sff = 999.0
+
+                    # get s-flat pixel-dependent correction
+                    sfs = 1.0
+                    if sfimdq[pind[0], pind[1]] == 0:
+                        sfs = sfim[pind[0], pind[1]]
+
+                    if debug:
+                        print("jwav-delw/2.0 = ", jwav-delw/2.0)
+                        print("jwav+delw/2.0 = ", jwav+delw/2.0)
+                        print("np.shape(sfv_wav), sfv_wav[-1] = ", np.shape(sfv_wav), sfv_wav[-1])
+                        print("iw = ", iw)
+                        print("sfv_wav[iw] = ", sfv_wav[iw])
+                        print("int_tab = ", int_tab)
+                        print("first_sfv_wav, last_sfv_wav = ", first_sfv_wav, last_sfv_wav)
+                        print("sfs = ", sfs)
+                        print("sff = ", sff)
+
+                    # integrate over f-flat fast vector
+                    # reference file blue cutoff is 1 micron, so need to force solution for shorter wavs
+                    ffv_wav = ffv.field("WAVELENGTH")
+                    ffv_dat = ffv.field("DATA")
+                    fff = 1.0
+                    if jwav-delw/2.0 >= 1.0:
+                        iw = np.where((ffv_wav >= jwav-delw/2.0) & (ffv_wav <= jwav+delw/2.0))
+                        if np.size(iw) == 0:
+                            iw = -1
+                        if np.size(iw) > 1:
+                            int_tab = auxfunc.idl_tabulate(ffv_wav[iw], ffv_dat[iw])
+                            first_ffv_wav, last_ffv_wav = ffv_wav[iw][0], ffv_wav[iw][-1]
+                            fff = int_tab/(last_ffv_wav - first_ffv_wav)
+                        elif np.size(iw) == 1:
+                            fff = float(ffv_dat[iw])
+
+                    flatcor[j] = dff * dfs * sff * sfs * fff
+                    sffarr[j] = sff
+
+                    # To visually compare between the pipeline flat and the calculated one (e.g. in ds9), Phil Hodge
+                    # suggested using the following line:
+                    calc_flat[pind[0], pind[1]] = flatcor[j]
+                    # this line writes the calculated flat into a full frame array
+                    # then this new array needs to be written into a file. This part has not been done yet.
+
+                    # Difference between pipeline and calculated values
+                    delf[j] = pipeflat[pind[0], pind[1]] - flatcor[j]
+
+                    # Remove all pixels with values=1 (mainly inter-slit pixels) for statistics
+                    if pipeflat[pind[0], pind[1]] == 1:
+                        delf[j] = 999.0
+                    if np.isnan(jwav):
+                        flatcor[j] = 1.0   # no correction if no wavelength
+
+                    if debug:
+                        print("np.shape(iw) = ", np.shape(iw))
+                        print("fff = ", fff)
+                        print("flatcor[j] = ", flatcor[j])
+                        print("delf[j] = ", delf[j])
 
 
         # ignore outliers for calculating median
+        phase_timing.start_phase("statistics")
         delfg = delf[np.where(delf != 999.0)]
         #delfg_median, delfg_std = np.median(delfg), np.std(delfg)
         msg = "Flat value differences for slice number: "+pslice
@@ -446,6 +477,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         all_delfg_median.append(delfg_median)
 
         # make the slice plot
+        phase_timing.start_phase("plotting")
         if np.isfinite(delfg_median) and (len(delfg)!=0):
             if show_figs or save_figs:
                 msg = "Making the plot for this slice..."
@@ -467,7 +499,13 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                     log_msgs.append(msg)
                 else:
                     plt_name = os.path.join(file_path, plot_name)
-                    difference_img = (pipeflat - calc_flat)#/calc_flat
+                    if vectorized:
+                        # only show the pixels of this slice
+                        difference_img = np.zeros(np.shape(pipeflat)) + 999.0
+                        slice_pix = (yind[valid], xind[valid])
+                        difference_img[slice_pix] = pipeflat[slice_pix] - calc_flat[slice_pix]
+                    else:
+                        difference_img = (pipeflat - calc_flat)#/calc_flat
                     in_slit = np.logical_and(difference_img<900.0, difference_img>-900.0) # ignore points out of the slit,
                     difference_img[~in_slit] = np.nan   # Set values outside the slit to NaN
                     nanind = np.isnan(difference_img)   # get all the nan indexes
@@ -487,6 +525,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 print(msg)
                 log_msgs.append(msg)
 
+        phase_timing.start_phase("file_write")
         if writefile:
             # this is the file to hold the image of pipeline-calculated difference values
             outfile_ext = fits.ImageHDU(flatcor.reshape(wave_shape), name=pslice)
@@ -521,7 +560,9 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             log_msgs.append(msg)
 
 
+    phase_timing.set_slit(None)
     if mk_all_slices_plt:
+        phase_timing.start_phase("plotting")
         if show_figs or save_figs:
             # create histogram
             t = (file_basename, det, "all_slices_IFU_flatcomp_histogram")
@@ -545,14 +586,15 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
 
     # create fits file to hold the calculated flat for each slice
     if writefile:
+        phase_timing.start_phase("file_write")
         outfile_name = step_input_filename.replace("flat_field.fits", det+"_flat_calc.fits")
         complfile_name = step_input_filename.replace("flat_field.fits", det+"_flat_comp.fits")
 
         # create the fits list to hold the calculated flat values for each slit
-        outfile.writeto(outfile_name, overwrite=True)
+        background_writer.submit(outfile, outfile_name)
 
         # this is the file to hold the image of pipeline-calculated difference values
-        complfile.writeto(complfile_name, overwrite=True)
+        background_writer.submit(complfile, complfile_name)
 
         msg = "Fits file with calculated flat values of each slice saved as: "
         print(msg)
@@ -8,6 +8,11 @@ from astropy.io import fits
 from jwst import datamodels
 
 from . import auxiliary_functions as auxfunc
+from . import flattest_engine
+from . import reference_flat_cache
+from . import background_writer
+from . import model_store
+from . import phase_timing
 
 
 """
@@ -18,7 +23,7 @@ This script tests the pipeline flat field step output for MOS data. It is the py
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "3.5"
+__version__ = "4.1"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -31,11 +36,21 @@ __version__ = "3.5"
 # Apr 2019 - Version 3.3: Implemented capability to return logging messages.
 # May 2019 - Version 3.4: Implemented images of the residuals.
 # Jun 2019 - Version 3.5: Updated name of interpolated flat to be the default pipeline name for this file.
+# Oct 2026 - Version 3.6: Implemented the vectorized calculation of the expected flat (see flattest_engine.py), the
+#                         shutter info is read once and the pipeline flat is read once per slitlet.
+# Oct 2026 - Version 3.7: Reference flats are now read through the reference flat cache.
+# Oct 2026 - Version 3.8: Only the D-flat planes bracketing the wavelength range of each slitlet are read.
+# Oct 2026 - Version 3.9: The calculated and comparison fits files are written in the background (see
+#                         background_writer.py).
+# Oct 2026 - Version 4.0: The time of each phase of the validation is recorded per slitlet (see phase_timing.py).
+# Oct 2026 - Version 4.1: The output of the previous step is written before it is read, also with background writing.
 
 
 
+@phase_timing.timed("flattest_mos")
 def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_path=None, msa_shutter_conf=None,
-             writefile=False, show_figs=True, save_figs=False, plot_name=None, threshold_diff=1.0e-14, debug=False):
+             writefile=False, show_figs=True, save_figs=False, plot_name=None, threshold_diff=1.0e-14, vectorized=True,
+             debug=False):
     """
     This function does the WCS comparison from the world coordinates calculated using the
     compute_world_coordinates.py script with the ESA files. The function calls that script.
@@ -52,6 +67,8 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         plot_name: string, desired name (if name is not given, the plot function will name the plot by
                     default)
         threshold_diff: float, threshold difference between pipeline output and ESA file
+        vectorized: boolean, if True the expected flat is calculated for all the pixels of a slitlet at once,
+                    if False it is calculated pixel by pixel
         debug: boolean, if true a series of print statements will show on-screen
 
     Returns:
@@ -67,6 +84,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     flattest_start_time = time.time()
 
     # get info from the rate file header
+    phase_timing.start_phase("file_read")
     det = fits.getval(step_input_filename, "DETECTOR", 0)
     msg = 'step_input_filename='+step_input_filename
     print(msg)
@@ -83,6 +101,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     flatfile = step_input_filename.replace("flat_field.fits", "interpolatedflat.fits")
 
     # get the reference files
+    phase_timing.start_phase("reference_read")
     # D-Flat
     dflat_ending = "f_01.03.fits"
     dfile = "_".join((dflatref_path, "nrs1", dflat_ending))
@@ -91,24 +110,11 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using D-flat: "+dfile
     print(msg)
     log_msgs.append(msg)
-    dfim = fits.getdata(dfile, "SCI")#1)
-    dfimdq = fits.getdata(dfile, "DQ")#4)
-    # need to flip/rotate the image into science orientation
-    ns = np.shape(dfim)
-    dfim = np.transpose(dfim, (0, 2, 1))   # keep in mind that 0,1,2 = z,y,x in Python, whereas =x,y,z in IDL
-    dfimdq = np.transpose(dfimdq)
-    if det == "NRS2":
-        # rotate science data by 180 degrees for NRS2
-        dfim = dfim[..., ::-1, ::-1]
-        dfimdq = dfimdq[..., ::-1, ::-1]
-    naxis3 = fits.getval(dfile, "NAXIS3", "SCI")
-
-    # get the wavelength values
-    dfwave = np.array([])
-    for i in range(naxis3):
-        keyword = "_".join(("PFLAT", str(i+1)))
-        dfwave = np.append(dfwave, fits.getval(dfile, keyword, "SCI"))
-    dfrqe = fits.getdata(dfile, 2)
+    # the reference flats are kept in memory in science orientation (flipped/rotated) by the cache, for the
+    # D-flat cube only the planes needed by each slitlet are read
+    dflat_cube = reference_flat_cache.DFlatCube(dfile, det)
+    dfimdq = dflat_cube.dfimdq
+    dfrqe = reference_flat_cache.get_data(dfile, 2)
 
     # S-flat
     tsp = exptype.split("_")
@@ -140,31 +146,12 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
 
     if det == "NRS2":
         sfile = sfile.replace("nrs1", "nrs2")
-    sfim = fits.getdata(sfile, "SCI")#1)
-    sfimdq = fits.getdata(sfile, "DQ")#3)
-
-    # need to flip/rotate image into science orientation
-    sfim = np.transpose(sfim, (0, 2, 1))
-    sfimdq = np.transpose(sfimdq, (0, 2, 1))
-    if det == "NRS2":
-        # rotate science data by 180 degrees for NRS2
-        sfim = sfim[..., ::-1, ::-1]
-        sfimdq = sfimdq[..., ::-1, ::-1]
+    sfim = reference_flat_cache.get_science_data(sfile, "SCI", det)
+    sfimdq = reference_flat_cache.get_science_data(sfile, "DQ", det)
 
     # get the wavelength values for sflat cube
-    sfimwave = np.array([])
-    naxis3 = fits.getval(sfile, "NAXIS3", "SCI")
-    for i in range(0, naxis3):
-        if i+1 < 10:
-            keyword = "".join(("FLAT_0", str(i+1)))
-        else:
-            keyword = "".join(("FLAT_", str(i+1)))
-        #print("S-flat -> using ", keyword)
-        try:
-            sfimwave = np.append(sfimwave, fits.getval(sfile, keyword, "SCI"))
-        except:
-            KeyError
-    sfv = fits.getdata(sfile, 5)
+    sfimwave = reference_flat_cache.get_plane_wavelengths(sfile, "SCI", "FLAT_", zero_pad=True, skip_missing=True)
+    sfv = reference_flat_cache.get_data(sfile, 5)
 
     # F-Flat
     #print("F-flat -> using the following flats: ")
@@ -173,62 +160,36 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     msg = "Using F-flat: "+ffile
     print(msg)
     log_msgs.append(msg)
-    ffsq1 = fits.getdata(ffile, "SCI_Q1")#1)
-    naxis3 = fits.getval(ffile, "NAXIS3", "SCI_Q1")#1)
-    ffswaveq1 = np.array([])
-    for i in range(0, naxis3):
-        if i <= 9 :
-            suff = "".join(("0", str(i)))
-        else:
-            suff = str(i)
-        t = ("FLAT", suff)
-        keyword = "_".join(t)
-        #print("1. F-flat -> ", keyword)
-        ffswaveq1 = np.append(ffswaveq1, fits.getval(ffile, keyword, "SCI_Q1"))
-    ffserrq1 = fits.getdata(ffile, "ERR_Q1")#2)
-    ffsdqq1 = fits.getdata(ffile, "DQ_Q1")#3)
-    ffvq1 = fits.getdata(ffile, "Q1")#4)
-    ffsq2 = fits.getdata(ffile, "SCI_Q2")
-    ffswaveq2 = np.array([])
-    for i in range(0, naxis3):
-        if i <= 9:
-            suff = "".join(("0", str(i)))
-        else:
-            suff = str(i)
-        t = ("FLAT", suff)
-        keyword = "_".join(t)
-        #print("2. F-flat -> using ", keyword)
-        ffswaveq2 = np.append(ffswaveq2, fits.getval(ffile, keyword, "SCI_Q2"))
-    ffserrq2 = fits.getdata(ffile, "ERR_Q2")
-    ffsdqq2 = fits.getdata(ffile, "DQ_Q2")
-    ffvq2 = fits.getdata(ffile, "Q2")
-    ffsq3 = fits.getdata(ffile, "SCI_Q3")
-    ffswaveq3 = np.array([])
-    for i in range(0, naxis3):
-        if i <= 9 :
-            suff = "".join(("0", str(i)))
-        else:
-            suff = str(i)
-        t = ("FLAT", suff)
-        keyword = "_".join(t)
-        #print("3. F-flat -> using ", keyword)
-        ffswaveq3 = np.append(ffswaveq3, fits.getval(ffile, keyword, "SCI_Q3"))
-    ffserrq3 = fits.getdata(ffile, "ERR_Q3")
-    ffsdqq3 = fits.getdata(ffile, "DQ_Q3")
-    ffvq3 = fits.getdata(ffile, "Q3")
-    ffsq4 = fits.getdata(ffile, "SCI_Q4")
-    ffswaveq4 = np.array([])
-    for i in range(0, naxis3):
-        if i <= 9:
-            suff = "0"+str(i)
-        else:
-            suff = str(i)
-        keyword = "FLAT_"+suff
-        #print("4. F-flat -> using ", keyword)
-        ffswaveq4 = np.append(ffswaveq4, fits.getval(ffile, keyword, "SCI_Q4"))
-    ffserrq4 = fits.getdata(ffile, "ERR_Q4")
-    ffsdqq4 = fits.getdata(ffile, "DQ_Q4")
-    ffvq4 = fits.getdata(ffile, "Q4")
+    ffsq1 = reference_flat_cache.get_data(ffile, "SCI_Q1")
+    ffswaveq1 = reference_flat_cache.get_plane_wavelengths(ffile, "SCI_Q1", "FLAT_", first_plane=0, zero_pad=True)
+    ffsdqq1 = reference_flat_cache.get_data(ffile, "DQ_Q1")
+    ffvq1 = reference_flat_cache.get_data(ffile, "Q1")
+    ffsq2 = reference_flat_cache.get_data(ffile, "SCI_Q2")
+    ffswaveq2 = reference_flat_cache.get_plane_wavelengths(ffile, "SCI_Q2", "FLAT_", first_plane=0, zero_pad=True)
+    ffsdqq2 = reference_flat_cache.get_data(ffile, "DQ_Q2")
+    ffvq2 = reference_flat_cache.get_data(ffile, "Q2")
+    ffsq3 = reference_flat_cache.get_data(ffile, "SCI_Q3")
+    ffswaveq3 = reference_flat_cache.get_plane_wavelengths(ffile, "SCI_Q3", "FLAT_", first_plane=0, zero_pad=True)
+    ffsdqq3 = reference_flat_cache.get_data(ffile, "DQ_Q3")
+    ffvq3 = reference_flat_cache.get_data(ffile, "Q3")
+    ffsq4 = reference_flat_cache.get_data(ffile, "SCI_Q4")
+    ffswaveq4 = reference_flat_cache.get_plane_wavelengths(ffile, "SCI_Q4", "FLAT_", first_plane=0, zero_pad=True)
+    ffsdqq4 = reference_flat_cache.get_data(ffile, "DQ_Q4")
+    ffvq4 = reference_flat_cache.get_data(ffile, "Q4")
+
+    # F-flat reference data of each quadrant
+    ffsall_quads = {1: ffsq1, 2: ffsq2, 3: ffsq3, 4: ffsq4}
+    ffsallwave_quads = {1: ffswaveq1, 2: ffswaveq2, 3: ffswaveq3, 4: ffswaveq4}
+    ffsalldq_quads = {1: ffsdqq1, 2: ffsdqq2, 3: ffsdqq3, 4: ffsdqq4}
+    ffv_quads = {1: ffvq1, 2: ffvq2, 3: ffvq3, 4: ffvq4}
+
+    if vectorized:
+        # cumulative integral tables of the fast vectors, used for the band averages of all pixels
+        dfrqe_tab = reference_flat_cache.get_integral_table(dfile, 2, "RQE")
+        sfv_tab = reference_flat_cache.get_integral_table(sfile, 5, "DATA")
+        ffv_tabs = {}
+        for q in ffv_quads:
+            ffv_tabs[q] = reference_flat_cache.get_integral_table(ffile, "Q"+repr(q), "DATA")
 
     # now go through each pixel in the test data
 
@@ -247,15 +208,20 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
     total_test_result = []
 
     # get the datamodel from the assign_wcs output file
+    phase_timing.start_phase("file_read")
     extract2d_file = step_input_filename.replace("_flat_field.fits", "_extract_2d.fits")
-    model = datamodels.MultiSlitModel(extract2d_file)
+    model = datamodels.MultiSlitModel(model_store.ensure_saved(extract2d_file))
 
     # get all the science extensions in the flatfile
     sci_ext_list = auxfunc.get_sci_extensions(flatfile)
 
+    # get the quadrant, row, and column of the shutter of each slitlet, needed for the F-Flat
+    shutter_info = flattest_engine.get_slitlets_shutter_info(model)
+
     # loop over the 2D subwindows and read in the WCS values
     for slit in model.slits:
         slit_id = slit.name
+        phase_timing.set_slit(slit_id)
         msg = "\nWorking with slit: "+slit_id
         print(msg)
         log_msgs.append(msg)
@@ -266,9 +232,14 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         #    continue
 
         # get the wavelength
+        phase_timing.start_phase("wcs_evaluation")
         y, x = np.mgrid[:slit.data.shape[0], :slit.data.shape[1]]
         ra, dec, wave = slit.meta.wcs(x, y)   # wave is in microns
 
+        # get the D-flat planes that bracket the wavelengths of the slitlet
+        phase_timing.start_phase("reference_read")
+        dfim, dfwave = dflat_cube.get_planes(wave)
+
         # get the subwindow origin
         px0 = slit.xstart - 1 + model.meta.subarray.xstart
         py0 = slit.ystart - 1 + model.meta.subarray.ystart
@@ -284,237 +255,223 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
         delf = np.zeros([nw2, nw1]) + 999.0
         flatcor = np.zeros([nw2, nw1]) + 999.0
 
-        # get the slitlet info, needed for the F-Flat
-        ext_shutter_info = "SHUTTER_INFO"   # this is extension 2 of the msa file, that has the shutter info
-        slitlet_info = fits.getdata(msa_shutter_conf, ext_shutter_info)
-        sltid = slitlet_info.field("SLITLET_ID")
-        for j, s in enumerate(sltid):
-            if s == int(slit_id):
-                im = j
-                # get the shutter with the source in it
-                if slitlet_info.field("BACKGROUND")[im] == "N":
-                    isrc = j
-        # changes suggested by Phil Hodge
-        quad = slit.quadrant #slitlet_info.field("SHUTTER_QUADRANT")[isrc]
-        row = slit.xcen #slitlet_info.field("SHUTTER_ROW")[isrc]
-        col = slit.ycen #slitlet_info.field("SHUTTER_COLUMN")[isrc]
+        # get the slitlet info, needed for the F-Flat (changes suggested by Phil Hodge)
+        quad, row, col = shutter_info[slit_id]
         slitlet_id = repr(row)+"_"+repr(col)
         msg = 'silt_id='+repr(slit_id)+"   quad="+repr(quad)+"   row="+repr(row)+"   col="+repr(col)+"   slitlet_id="+repr(slitlet_id)
         print(msg)
         log_msgs.append(msg)
 
         # get the relevant F-flat reference data
-        if quad == 1:
-            ffsall = ffsq1
-            ffsallwave = ffswaveq1
-            ffsalldq = ffsdqq1
-            ffv = ffvq1
-        if quad == 2:
-            ffsall = ffsq2
-            ffsallwave = ffswaveq2
-            ffsalldq = ffsdqq2
-            ffv = ffvq2
-        if quad == 3:
-            ffsall = ffsq3
-            ffsallwave = ffswaveq3
-            ffsalldq = ffsdqq3
-            ffv = ffvq3
-        if quad == 4:
-            ffsall = ffsq4
-            ffsallwave = ffswaveq4
-            ffsalldq = ffsdqq4
-            ffv = ffvq4
-
-        # loop through the pixels
-        msg = "Now looping through the pixels, this will take a while ... "
-        print(msg)
-        log_msgs.append(msg)
+        ffsall = ffsall_quads[quad]
+        ffsallwave = ffsallwave_quads[quad]
+        ffsalldq = ffsalldq_quads[quad]
+        ffv = ffv_quads[quad]
+
+        # read the pipeline-calculated flat image
+        phase_timing.start_phase("file_read")
+        # there are four extensions in the flatfile: SCI, DQ, ERR, WAVELENGTH
+        pipeflat = fits.getdata(flatfile, ext)
+
+        phase_timing.start_phase("flat_calculation")
         wave_shape = np.shape(wave)
-        for j in range(nw1):   # in x
-            for k in range(nw2):   # in y
-                if np.isfinite(wave[k, j]):   # skip if wavelength is NaN
-                    # get the pixel indeces
-                    jwav = wave[k, j]
-                    pind = [k+py0-1, j+px0-1]
-                    if debug:
-                        print('j, k, jwav, px0, py0 : ', j, k, jwav, px0, py0)
-                        print('pind = ', pind)
+        if vectorized:
+            msg = "Calculating the flat for all the pixels of the slitlet... "
+            print(msg)
+            log_msgs.append(msg)
+            flatcor = flattest_engine.calc_mos_flat(wave, px0, py0, dfim, dfimdq, dfwave, dfrqe_tab, sfim, sfimdq,
+                                                    sfimwave, sfv_tab, ffv_tabs[quad], ffsallwave,
+                                                    ffsall[:, col-1, row-1])
+            # Difference between pipeline and calculated values, pixels outside slit boundaries set to 999
+            delf = flattest_engine.calc_flat_difference(pipeflat, flatcor, wave)
+
+        else:
+            # loop through the pixels
+            msg = "Now looping through the pixels, this will take a while ... "
+            print(msg)
+            log_msgs.append(msg)
+            for j in range(nw1):   # in x
+                for k in range(nw2):   # in y
+                    if np.isfinite(wave[k, j]):   # skip if wavelength is NaN
+                        # get the pixel indeces
+                        jwav = wave[k, j]
+                        pind = [k+py0-1, j+px0-1]
+                        if debug:
+                            print('j, k, jwav, px0, py0 : ', j, k, jwav, px0, py0)
+                            print('pind = ', pind)
     
-                    # get the pixel bandwidth
-                    if (j != 0) and (j < nw1-1):
-                        if np.isfinite(wave[k, j+1]) and np.isfinite(wave[k, j-1]):
-                            delw = 0.5 * (wave[k, j+1] - wave[k, j-1])
-                        if np.isfinite(wave[k, j+1]) and not np.isfinite(wave[k, j-1]):
+                        # get the pixel bandwidth
+                        if (j != 0) and (j < nw1-1):
+                            if np.isfinite(wave[k, j+1]) and np.isfinite(wave[k, j-1]):
+                                delw = 0.5 * (wave[k, j+1] - wave[k, j-1])
+                            if np.isfinite(wave[k, j+1]) and not np.isfinite(wave[k, j-1]):
+                                delw = wave[k, j+1] - wave[k, j]
+                            if not np.isfinite(wave[k, j+1]) and np.isfinite(wave[k, j-1]):
+                                delw = wave[k, j] - wave[k, j-1]
+                        if j == 0:
                             delw = wave[k, j+1] - wave[k, j]
-                        if not np.isfinite(wave[k, j+1]) and np.isfinite(wave[k, j-1]):
+                        if j == nw-1:
                             delw = wave[k, j] - wave[k, j-1]
-                    if j == 0:
-                        delw = wave[k, j+1] - wave[k, j]
-                    if j == nw-1:
-                        delw = wave[k, j] - wave[k, j-1]
-
-                    if debug:
-                        print("wave[k, j+1], wave[k, j-1] : ", np.isfinite(wave[k, j+1]), wave[k, j+1], wave[k, j-1])
-                        print("delw = ", delw)
+
+                        if debug:
+                            print("wave[k, j+1], wave[k, j-1] : ", np.isfinite(wave[k, j+1]), wave[k, j+1], wave[k, j-1])
+                            print("delw = ", delw)
     
-                    # integrate over dflat fast vector
-                    dfrqe_wav = dfrqe.field("WAVELENGTH")
-                    dfrqe_rqe = dfrqe.field("RQE")
-                    iw = np.where((dfrqe_wav >= wave[k, j]-delw/2.0) & (dfrqe_wav <= wave[k, j]+delw/2.0))
-                    if np.size(iw) == 0:
-                        dff = 1.0
-                    else:
-                        int_tab = auxfunc.idl_tabulate(dfrqe_wav[iw[0]], dfrqe_rqe[iw[0]])
-                        first_dfrqe_wav, last_dfrqe_wav = dfrqe_wav[iw[0]][0], dfrqe_wav[iw[0]][-1]
-                        dff = int_tab/(last_dfrqe_wav - first_dfrqe_wav)
+                        # integrate over dflat fast vector
+                        dfrqe_wav = dfrqe.field("WAVELENGTH")
+                        dfrqe_rqe = dfrqe.field("RQE")
+                        iw = np.where((dfrqe_wav >= wave[k, j]-delw/2.0) & (dfrqe_wav <= wave[k, j]+delw/2.0))
+                        if np.size(iw) == 0:
+                            dff = 1.0
+                        else:
+                            int_tab = auxfunc.idl_tabulate(dfrqe_wav[iw[0]], dfrqe_rqe[iw[0]])
+                            first_dfrqe_wav, last_dfrqe_wav = dfrqe_wav[iw[0]][0], dfrqe_wav[iw[0]][-1]
+                            dff = int_tab/(last_dfrqe_wav - first_dfrqe_wav)
     
-                    if debug:
-                        #print("np.shape(dfrqe_wav) : ", np.shape(dfrqe_wav))
-                        #print("np.shape(dfrqe_rqe) : ", np.shape(dfrqe_rqe))
-                        #print("dfimdq[pind[0]][pind[1]] : ", dfimdq[pind[0]][pind[1]])
-                        #print("np.shape(iw) =", np.shape(iw))
-                        #print("np.shape(dfrqe_wav[iw[0]]) = ", np.shape(dfrqe_wav[iw[0]]))
-                        #print("np.shape(dfrqe_rqe[iw[0]]) = ", np.shape(dfrqe_rqe[iw[0]]))
-                        #print("int_tab=", int_tab)
-                        print("dff = ", dff)
+                        if debug:
+                            #print("np.shape(dfrqe_wav) : ", np.shape(dfrqe_wav))
+                            #print("np.shape(dfrqe_rqe) : ", np.shape(dfrqe_rqe))
+                            #print("dfimdq[pind[0]][pind[1]] : ", dfimdq[pind[0]][pind[1]])
+                            #print("np.shape(iw) =", np.shape(iw))
+                            #print("np.shape(dfrqe_wav[iw[0]]) = ", np.shape(dfrqe_wav[iw[0]]))
+                            #print("np.shape(dfrqe_rqe[iw[0]]) = ", np.shape(dfrqe_rqe[iw[0]]))
+                            #print("int_tab=", int_tab)
+                            print("dff = ", dff)
     
-                    # interpolate over dflat cube
-                    iloc = auxfunc.idl_valuelocate(dfwave, wave[k, j])[0]
-                    if dfwave[iloc] > wave[k, j]:
-                        iloc -= 1
-                    ibr = [iloc]
-                    if iloc != len(dfwave)-1:
-                        ibr.append(iloc+1)
-                    # get the values in the z-array at indeces ibr, and x=pind[1] and y=pind[0]
-                    zz = dfim[:, pind[0], pind[1]][ibr]
-                    # now determine the length of the array with only the finite numbers
-                    zzwherenonan = np.where(np.isfinite(zz))
-                    kk = np.size(zzwherenonan)
-                    dfs = 1.0
-                    if (wave[k, j] <= max(dfwave)) and (wave[k, j] >= min(dfwave)) and (kk == 2):
-                        dfs = np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan])
-                    # check DQ flags
-                    if dfimdq[pind[0], pind[1]] != 0:
+                        # interpolate over dflat cube
+                        iloc = auxfunc.idl_valuelocate(dfwave, wave[k, j])[0]
+                        if dfwave[iloc] > wave[k, j]:
+                            iloc -= 1
+                        ibr = [iloc]
+                        if iloc != len(dfwave)-1:
+                            ibr.append(iloc+1)
+                        # get the values in the z-array at indeces ibr, and x=pind[1] and y=pind[0]
+                        zz = dfim[:, pind[0], pind[1]][ibr]
+                        # now determine the length of the array with only the finite numbers
+                        zzwherenonan = np.where(np.isfinite(zz))
+                        kk = np.size(zzwherenonan)
                         dfs = 1.0
+                        if (wave[k, j] <= max(dfwave)) and (wave[k, j] >= min(dfwave)) and (kk == 2):
+                            dfs = np.interp(wave[k, j], dfwave[ibr], zz[zzwherenonan])
+                        # check DQ flags
+                        if dfimdq[pind[0], pind[1]] != 0:
+                            dfs = 1.0
     
-                    # integrate over S-flat fast vector
-                    sfv_wav = sfv.field("WAVELENGTH")
-                    sfv_dat = sfv.field("DATA")
-                    iw = np.where((sfv_wav >= wave[k, j]-delw/2.0) & (sfv_wav <= wave[k, j]+delw/2.0))
-                    sff = 1.0
-                    if np.size(iw) > 2:
-                        int_tab = auxfunc.idl_tabulate(sfv_wav[iw], sfv_dat[iw])
-                        first_sfv_wav, last_sfv_wav = sfv_wav[iw[0]][0], sfv_wav[iw[0]][-1]
-                        sff = int_tab/(last_sfv_wav - first_sfv_wav)
-
-                    # interpolate s-flat cube
-                    iloc = auxfunc.idl_valuelocate(sfimwave, wave[k, j])[0]
-                    ibr = [iloc]
-                    if iloc != len(sfimwave)-1:
-                        ibr.append(iloc+1)
-                    # get the values in the z-array at indeces ibr, and x=pind[1] and y=pind[0]
-                    zz = sfim[:, pind[0], pind[1]][ibr]
-                    # now determine the length of the array with only the finite numbers
-                    zzwherenonan = np.where(np.isfinite(zz))
-                    kk = np.size(zzwherenonan)
-                    sfs = 1.0
-                    if (wave[k, j] <= max(sfimwave)) and (wave[k, j] >= min(sfimwave)) and (kk == 2):
-                        sfs = np.interp(wave[k, j], sfimwave[ibr], zz[zzwherenonan])
-
-                    # check DQ flags
-                    kk = np.where(sfimdq[:, pind[0], pind[1]][ibr] == 0)
-                    if np.size(kk) != 2:
+                        # integrate over S-flat fast vector
+                        sfv_wav = sfv.field("WAVELENGTH")
+                        sfv_dat = sfv.field("DATA")
+                        iw = np.where((sfv_wav >= wave[k, j]-delw/2.0) & (sfv_wav <= wave[k, j]+delw/2.0))
+                        sff = 1.0
+                        if np.size(iw) > 2:
+                            int_tab = auxfunc.idl_tabulate(sfv_wav[iw], sfv_dat[iw])
+                            first_sfv_wav, last_sfv_wav = sfv_wav[iw[0]][0], sfv_wav[iw[0]][-1]
+                            sff = int_tab/(last_sfv_wav - first_sfv_wav)
+
+                        # interpolate s-flat cube
+                        iloc = auxfunc.idl_valuelocate(sfimwave, wave[k, j])[0]
+                        ibr = [iloc]
+                        if iloc != len(sfimwave)-1:
+                            ibr.append(iloc+1)
+                        # get the values in the z-array at indeces ibr, and x=pind[1] and y=pind[0]
+                        zz = sfim[:, pind[0], pind[1]][ibr]
+                        # now determine the length of the array with only the finite numbers
+                        zzwherenonan = np.where(np.isfinite(zz))
+                        kk = np.size(zzwherenonan)
                         sfs = 1.0
+                        if (wave[k, j] <= max(sfimwave)) and (wave[k, j] >= min(sfimwave)) and (kk == 2):
+                            sfs = np.interp(wave[k, j], sfimwave[ibr], zz[zzwherenonan])
+
+                        # check DQ flags
+                        kk = np.where(sfimdq[:, pind[0], pind[1]][ibr] == 0)
+                        if np.size(kk) != 2:
+                            sfs = 1.0
     
-                    # integrate over f-flat fast vector
-                    # reference file wavelength range is from 0.6 to 5.206 microns, so need to force
-                    # solution to 1 for wavelengths outside that range
-                    ffv_wav = ffv.field("WAVELENGTH")
-                    ffv_dat = ffv.field("DATA")
-                    fff = 1.0
-                    if (wave[k, j]-delw/2.0 >= 0.6) and (wave[k, j]+delw/2.0 <= 5.206):
-                        iw = np.where((ffv_wav >= wave[k, j]-delw/2.0) & (ffv_wav <= wave[k, j]+delw/2.0))
-                        if np.size(iw) > 1:
-                            int_tab = auxfunc.idl_tabulate(ffv_wav[iw], ffv_dat[iw])
-                            first_ffv_wav, last_ffv_wav = ffv_wav[iw[0]][0], ffv_wav[iw[0]][-1]
-                            fff = int_tab/(last_ffv_wav - first_ffv_wav)
-
-                    # interpolate over f-flat cube
-                    ffs = np.interp(wave[k, j], ffsallwave, ffsall[:, col-1, row-1])
+                        # integrate over f-flat fast vector
+                        # reference file wavelength range is from 0.6 to 5.206 microns, so need to force
+                        # solution to 1 for wavelengths outside that range
+                        ffv_wav = ffv.field("WAVELENGTH")
+                        ffv_dat = ffv.field("DATA")
+                        fff = 1.0
+                        if (wave[k, j]-delw/2.0 >= 0.6) and (wave[k, j]+delw/2.0 <= 5.206):
+                            iw = np.where((ffv_wav >= wave[k, j]-delw/2.0) & (ffv_wav <= wave[k, j]+delw/2.0))
+                            if np.size(iw) > 1:
+                                int_tab = auxfunc.idl_tabulate(ffv_wav[iw], ffv_dat[iw])
+                                first_ffv_wav, last_ffv_wav = ffv_wav[iw[0]][0], ffv_wav[iw[0]][-1]
+                                fff = int_tab/(last_ffv_wav - first_ffv_wav)
+
+                        # interpolate over f-flat cube
+                        ffs = np.interp(wave[k, j], ffsallwave, ffsall[:, col-1, row-1])
                     
-                    flatcor[k, j] = dff * dfs * sff * sfs * fff * ffs
+                        flatcor[k, j] = dff * dfs * sff * sfs * fff * ffs
     
-                    if (pind[1]-px0+1 == 9999) and (pind[0]-py0+1 == 9999):
-                        if debug:
-                            print("pind = ", pind)
-                            print("wave[k, j] = ", wave[k, j])
-                            print("dfs, dff = ", dfs, dff)
-                            print("sfs, sff = ", sfs, sff)
+                        if (pind[1]-px0+1 == 9999) and (pind[0]-py0+1 == 9999):
+                            if debug:
+                                print("pind = ", pind)
+                                print("wave[k, j] = ", wave[k, j])
+                                print("dfs, dff = ", dfs, dff)
+                                print("sfs, sff = ", sfs, sff)
     
-                        msg = "Making the plot fot this slitlet..."
-                        print(msg)
-                        log_msgs.append(msg)
-                        # make plot
-                        font = {#'family' : 'normal',
-                                'weight' : 'normal',
-                                'size'   : 16}
-                        matplotlib.rc('font', **font)
-                        fig = plt.figure(1, figsize=(12, 10))
-                        plt.subplots_adjust(hspace=.4)
-                        ax = plt.subplot(111)
-                        xmin = wave[k, j]-0.01
-                        xmax = wave[k, j]+0.01
-                        plt.xlim(xmin, xmax)
-                        plt.plot(dfwave, dfim[:, pind[0], pind[1]], linewidth=7, marker='D', color='k', label="dflat_im")
-                        plt.plot(wave[k, j], dfs, linewidth=7, marker='D', color='r')
-                        plt.plot(dfrqe_wav, dfrqe_rqe, linewidth=7, marker='D', c='k', label="dflat_vec")
-                        plt.plot(wave[k, j], dff, linewidth=7, marker='D', color='r')
-                        plt.plot(sfimwave, sfim[:, pind[0], pind[1]], linewidth=7, marker='D', color='k', label="sflat_im")
-                        plt.plot(wave[k, j], sfs, linewidth=7, marker='D', color='r')
-                        plt.plot(sfv_wav, sfv_dat, linewidth=7, marker='D', color='k', label="sflat_vec")
-                        plt.plot(wave[k, j], sff, linewidth=7, marker='D', color='r')
-                        # add legend
-                        box = ax.get_position()
-                        ax.set_position([box.x0, box.y0, box.width * 1.0, box.height])
-                        ax.legend(loc='upper right', bbox_to_anchor=(1, 1))
-                        plt.minorticks_on()
-                        plt.tick_params(axis='both', which='both', bottom=True, top=True, right=True, direction='in', labelbottom=True)
-                        plt.show()
-                        msg = "Exiting the program. Unable to calculate statistics. Test set to be SKIPPED."
-                        print(msg)
-                        log_msgs.append(msg)
-                        plt.close()
-                        result_msg = "Unable to calculate statistics. Test set be SKIP."
-                        median_diff = "skip"
-                        return median_diff, result_msg, log_msgs
+                            msg = "Making the plot fot this slitlet..."
+                            print(msg)
+                            log_msgs.append(msg)
+                            # make plot
+                            font = {#'family' : 'normal',
+                                    'weight' : 'normal',
+                                    'size'   : 16}
+                            matplotlib.rc('font', **font)
+                            fig = plt.figure(1, figsize=(12, 10))
+                            plt.subplots_adjust(hspace=.4)
+                            ax = plt.subplot(111)
+                            xmin = wave[k, j]-0.01
+                            xmax = wave[k, j]+0.01
+                            plt.xlim(xmin, xmax)
+                            plt.plot(dfwave, dfim[:, pind[0], pind[1]], linewidth=7, marker='D', color='k', label="dflat_im")
+                            plt.plot(wave[k, j], dfs, linewidth=7, marker='D', color='r')
+                            plt.plot(dfrqe_wav, dfrqe_rqe, linewidth=7, marker='D', c='k', label="dflat_vec")
+                            plt.plot(wave[k, j], dff, linewidth=7, marker='D', color='r')
+                            plt.plot(sfimwave, sfim[:, pind[0], pind[1]], linewidth=7, marker='D', color='k', label="sflat_im")
+                            plt.plot(wave[k, j], sfs, linewidth=7, marker='D', color='r')
+                            plt.plot(sfv_wav, sfv_dat, linewidth=7, marker='D', color='k', label="sflat_vec")
+                            plt.plot(wave[k, j], sff, linewidth=7, marker='D', color='r')
+                            # add legend
+                            box = ax.get_position()
+                            ax.set_position([box.x0, box.y0, box.width * 1.0, box.height])
+                            ax.legend(loc='upper right', bbox_to_anchor=(1, 1))
+                            plt.minorticks_on()
+                            plt.tick_params(axis='both', which='both', bottom=True, top=True, right=True, direction='in', labelbottom=True)
+                            plt.show()
+                            msg = "Exiting the program. Unable to calculate statistics. Test set to be SKIPPED."
+                            print(msg)
+                            log_msgs.append(msg)
+                            plt.close()
+                            result_msg = "Unable to calculate statistics. Test set be SKIP."
+                            median_diff = "skip"
+                            return median_diff, result_msg, log_msgs
     
-                    if debug:
-                        print("dfs = ", dfs)
-                        print("sff = ", sff)
-                        print("sfs = ", sfs)
-                        print("ffs = ", ffs)
+                        if debug:
+                            print("dfs = ", dfs)
+                            print("sff = ", sff)
+                            print("sfs = ", sfs)
+                            print("ffs = ", ffs)
     
 
-                    # read the pipeline-calculated flat image
-                    # there are four extensions in the flatfile: SCI, DQ, ERR, WAVELENGTH
-                    pipeflat = fits.getdata(flatfile, ext)
-
-                    try:
-                        # Difference between pipeline and calculated values
-                        delf[k, j] = pipeflat[k, j] - flatcor[k, j]
-
-                        # Remove all pixels with values=1 (outside slit boundaries) for statistics
-                        if pipeflat[k, j] == 1:
-                            delf[k, j] = 999.0
-                        if np.isnan(wave[k, j]):
-                            flatcor[k, j] = 1.0   # no correction if no wavelength
-
-                        if debug:
-                            print("flatcor[k, j] = ", flatcor[k, j])
-                            print("delf[k, j] = ", delf[k, j])
-                    except:
-                        IndexError
+                        try:
+                            # Difference between pipeline and calculated values
+                            delf[k, j] = pipeflat[k, j] - flatcor[k, j]
+
+                            # Remove all pixels with values=1 (outside slit boundaries) for statistics
+                            if pipeflat[k, j] == 1:
+                                delf[k, j] = 999.0
+                            if np.isnan(wave[k, j]):
+                                flatcor[k, j] = 1.0   # no correction if no wavelength
+
+                            if debug:
+                                print("flatcor[k, j] = ", flatcor[k, j])
+                                print("delf[k, j] = ", delf[k, j])
+                        except:
+                            IndexError
     
+        phase_timing.start_phase("statistics")
         nanind = np.isnan(delf)   # get all the nan indexes
         notnan = ~nanind   # get all the not-nan indexes
         delf = delf[notnan]   # get rid of NaNs
@@ -553,6 +510,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
                 else:
                     test_result = "FAILED"
 
+                phase_timing.start_phase("plotting")
                 if save_figs or show_figs:
                     # make histogram
                     msg = "Making histogram plot for this slitlet..."
@@ -606,6 +564,7 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
 
     
         # create fits file to hold the calculated flat for each slit
+        phase_timing.start_phase("file_write")
         if writefile:
             # this is the file to hold the image of the correction values
             outfile_ext = fits.ImageHDU(flatcor.reshape(wave_shape), name=slitlet_id)
@@ -621,15 +580,17 @@ def flattest(step_input_filename, dflatref_path=None, sfile_path=None, fflat_pat
             log_msgs.append(msg)
 
 
+    phase_timing.set_slit(None)
     if writefile:
+        phase_timing.start_phase("file_write")
         outfile_name = step_input_filename.replace("flat_field.fits", det+"_flat_calc.fits")
         complfile_name = step_input_filename.replace("flat_field.fits", det+"_flat_comp.fits")
 
         # this is the file to hold the image of pipeline-calculated difference values
-        outfile.writeto(outfile_name, overwrite=True)
+        background_writer.submit(outfile, outfile_name)
 
         # this is the file to hold the image of pipeline-calculated difference values
-        complfile.writeto(complfile_name, overwrite=True)
+        background_writer.submit(complfile, complfile_name)
 
         msg = "\nFits file with calculated flat values of each slit saved as: "
         print(msg)
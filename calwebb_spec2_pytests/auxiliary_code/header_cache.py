@@ -0,0 +1,105 @@
+import os
+import threading
+from astropy.io import fits
+
+
+"""
+This script keeps the headers of the FITS files read by PTT in memory, so that each header is parsed only once and
+the keyword look ups of the test fixtures and of core_utils do not re-open the files.
+
+A header is read again when the modification time or the size of the file change. The files written by PTT itself
+(e.g. the step output files, or the input files changed with fits.setval) should be invalidated with
+invalidate_header or written with setval, since a file may be rewritten within the resolution of the modification
+time with the same size.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.0"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+
+
+_headers = {}
+_headers_lock = threading.Lock()
+
+
+def _get_file_signature(fits_file_name):
+    """
+    This function returns the modification time and size of the file, used to decide if the header changed.
+    """
+    stat = os.stat(fits_file_name)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_header(fits_file_name, ext=0):
+    """
+    This function returns the header of the given extension, reading it only if it is not in the cache or the file
+    changed on disk. The header is shared by all the callers, so it should not be modified.
+    Args:
+        fits_file_name: string, path and name of the fits file
+        ext: integer or string, number or name of the extension
+
+    Returns:
+        header: astropy header object
+    """
+    key = (os.path.abspath(fits_file_name), ext)
+    signature = _get_file_signature(fits_file_name)
+    with _headers_lock:
+        cached = _headers.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    header = fits.getheader(fits_file_name, ext)
+    with _headers_lock:
+        _headers[key] = (signature, header)
+    return header
+
+
+def get_value(fits_file_name, keyword, ext=0):
+    """
+    This function is the equivalent of fits.getval with the cached header.
+    Args:
+        fits_file_name: string, path and name of the fits file
+        keyword: string, keyword for which to obtain the value
+        ext: integer or string, number or name of the extension
+
+    Returns:
+        value: the value of the keyword; KeyError is raised if the keyword does not exist
+    """
+    return get_header(fits_file_name, ext)[keyword]
+
+
+def invalidate_header(fits_file_name=None):
+    """
+    This function removes the headers of the given file from the cache.
+    Args:
+        fits_file_name: string, path and name of the fits file; if None all the headers are removed
+
+    Returns:
+        nothing
+    """
+    with _headers_lock:
+        if fits_file_name is None:
+            _headers.clear()
+            return
+        file_path = os.path.abspath(fits_file_name)
+        for key in [key for key in _headers if key[0] == file_path]:
+            del _headers[key]
+
+
+def setval(fits_file_name, keyword, ext=0, value=None):
+    """
+    This function is the equivalent of fits.setval, and removes the headers of the file from the cache.
+    Args:
+        fits_file_name: string, path and name of the fits file
+        keyword: string, keyword to be set
+        ext: integer or string, number or name of the extension
+        value: value of the keyword
+
+    Returns:
+        nothing
+    """
+    fits.setval(fits_file_name, keyword, ext, value=value)
+    invalidate_header(fits_file_name)
@@ -0,0 +1,272 @@
+import os
+import hashlib
+import threading
+
+from . import run_manifest
+from . import model_store
+from . import step_output_cache
+
+
+"""
+This script decides if a pipeline step has to be run again when PTT runs the pipeline step by step, so that the
+validation scripts can be changed and tested again without running the pipeline steps that did not change.
+
+When incremental_steps is True in the PTT configuration file, the hash of the inputs of each step is recorded in the
+run manifest after the step runs: the content of the input file, the parameters of the step (its pipeline
+configuration file and its additional input files, e.g. the background files), and the versions of the software
+(jwst and the CRDS context). The next time the step is set to run, it is skipped and its output file is used if the
+inputs hash is the same and the output file has not changed since it was recorded.
+
+The content hash of each file is recorded with its modification time and size, so the output of a step is not read
+again when it is the input of the next step.
+
+If step_output_cache_dir is set, the output of a step with the same inputs hash is also looked for in the step
+output store shared by all the working directories (see step_output_cache.py), and the outputs of the steps run are
+added to it. The side products of a step that are read by the validation scripts (e.g. the interpolated flat of
+flat_field) go with its output: the output is only used if they are there too.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.2"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the step outputs are also taken from and added to the step output store shared by the
+#                         working directories (see step_output_cache.py)
+# Oct 2026 - Version 1.2: the side products of the steps are required, stored, and taken from the store with the
+#                         step outputs
+
+
+# name of the pipeline configuration file of each step, in the local_pipe_cfg_path directory
+step_cfg_files = {"assign_wcs": "assign_wcs.cfg",
+                  "bkg_subtract": "background.cfg",
+                  "imprint_subtract": "imprint.cfg",
+                  "extract_2d": "extract_2d.cfg",
+                  "flat_field": "flat_field.cfg",
+                  "srctype": "srctype.cfg",
+                  "pathloss": "pathloss.cfg",
+                  "photom": "photom.cfg",
+                  "resample_spec": "resample_spec.cfg",
+                  "cube_build": "cube_build.cfg",
+                  "extract_1d": "extract_1d.cfg"}
+
+# options of the PTT configuration file with additional inputs of each step, (section, option)
+step_input_options = {"assign_wcs": [("esa_intermediary_products", "msa_conf_name")],
+                      "bkg_subtract": [("additional_arguments", "bkg_list")],
+                      "imprint_subtract": [("additional_arguments", "msa_imprint_structure")],
+                      "msa_flagging": [("esa_intermediary_products", "msa_conf_name")],
+                      "flat_field": [("esa_intermediary_products", "msa_conf_name")]}
+
+# suffixes of the side products of each step read by the validation scripts, e.g. _interpolatedflat.fits for the
+# _flat_field.fits output (see flattest_fs.py)
+step_side_products = {"flat_field": ["interpolatedflat"]}
+
+# environment variables that select the reference files used by the pipeline
+crds_variables = ("CRDS_CONTEXT", "CRDS_SERVER_URL", "CRDS_PATH")
+
+# size of the blocks read to compute the hash of a file
+hash_block_size = 2**20
+
+# steps that are running: manifest, inputs hash, and output file of each step
+_running_steps = {}
+_running_lock = threading.Lock()
+
+
+def is_enabled(config):
+    """
+    This function returns True if the steps are only run again when their inputs changed.
+    Args:
+        config: object, this is the configuration file object
+
+    Returns:
+        boolean
+    """
+    return config.getboolean("additional_arguments", "incremental_steps", fallback=False)
+
+
+def get_file_hash(file_name, manifest=None):
+    """
+    This function returns the content hash (SHA-256) of the file. If a manifest is given, the hash is read from it
+    when the file has not changed since it was recorded, otherwise it is computed and recorded.
+    Args:
+        file_name: string, path and name of the file
+        manifest: RunManifest object
+
+    Returns:
+        file_hash: string, hexadecimal hash of the content of the file
+    """
+    file_name = os.path.abspath(model_store.ensure_saved(file_name))
+    stat = os.stat(file_name)
+    if manifest is not None:
+        file_hash = manifest.get_file_hash(file_name, stat.st_mtime_ns, stat.st_size)
+        if file_hash is not None:
+            return file_hash
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as bf:
+        for block in iter(lambda: bf.read(hash_block_size), b""):
+            sha.update(block)
+    file_hash = sha.hexdigest()
+    if manifest is not None:
+        manifest.record_file_hash(file_name, stat.st_mtime_ns, stat.st_size, file_hash)
+    return file_hash
+
+
+def get_software_versions():
+    """
+    This function returns the versions of the software that produce the step outputs.
+    Returns:
+        versions: list of strings, the jwst version and the CRDS environment variables
+    """
+    try:
+        import jwst
+        versions = ["jwst="+jwst.__version__]
+    except ImportError:
+        versions = ["jwst=not installed"]
+    for variable in crds_variables:
+        versions.append(variable+"="+os.environ.get(variable, ""))
+    return versions
+
+
+def get_step_parameters(config, step, manifest=None):
+    """
+    This function returns the parameters of the step: the content of its pipeline configuration file (if the
+    configuration files are not taken from the pipeline source code) and of its additional input files.
+    Args:
+        config: object, this is the configuration file object
+        step: string, name of the pipeline step
+        manifest: RunManifest object, used to read the recorded file hashes
+
+    Returns:
+        parameters: list of strings
+    """
+    local_pipe_cfg_path = config.get("calwebb_spec2_input_file", "local_pipe_cfg_path")
+    parameters = ["local_pipe_cfg_path="+local_pipe_cfg_path]
+    input_files = []
+    if local_pipe_cfg_path != "pipe_source_tree_code" and step in step_cfg_files:
+        input_files.append(os.path.join(local_pipe_cfg_path, step_cfg_files[step]))
+    for section, option in step_input_options.get(step, []):
+        value = config.get(section, option, fallback="")
+        parameters.append(option+"="+value)
+        input_files.extend([input_file.strip() for input_file in value.split(",") if input_file.strip()])
+    for input_file in input_files:
+        if os.path.isfile(input_file):
+            parameters.append(input_file+":"+get_file_hash(input_file, manifest))
+    return parameters
+
+
+def get_inputs_hash(config, step, step_input_file, manifest=None):
+    """
+    This function returns the hash of the inputs of the step: its input file, its parameters, and the software
+    versions.
+    Args:
+        config: object, this is the configuration file object
+        step: string, name of the pipeline step
+        step_input_file: string, path and name of the input file of the step
+        manifest: RunManifest object, used to read the recorded file hashes
+
+    Returns:
+        inputs_hash: string, hexadecimal hash
+    """
+    inputs = ["step="+step, "input="+get_file_hash(step_input_file, manifest)]
+    inputs.extend(get_step_parameters(config, step, manifest))
+    inputs.extend(get_software_versions())
+    return hashlib.sha256("\n".join(inputs).encode("utf-8")).hexdigest()
+
+
+def get_side_product_files(step, step_output_file):
+    """
+    This function returns the files of the side products of the step.
+    Args:
+        step: string, name of the pipeline step
+        step_output_file: string, path and name of the output file of the step
+
+    Returns:
+        side_product_files: dictionary, path and name of the file of each side product, by suffix
+    """
+    output_root = step_output_file.replace("_"+step+".fits", "")
+    return {side_product: output_root+"_"+side_product+".fits" for side_product in step_side_products.get(step, [])}
+
+
+def check_run_step(config, step, txt_name, step_input_file, step_output_file):
+    """
+    This function decides if the step has to be run: it is run if it is set to True in the PTT configuration file,
+    unless the incremental steps are on and the output file of a previous run with the same inputs is there, or the
+    output of a step with the same inputs is in the step output store (it is then linked as the output file).
+    Args:
+        config: object, this is the configuration file object
+        step: string, name of the pipeline step
+        txt_name: string, path and name of the map of the step by step run (the manifest is next to it)
+        step_input_file: string, path and name of the input file of the step
+        step_output_file: string, path and name of the output file of the step
+
+    Returns:
+        run_pipe_step: boolean, True if the step has to be run
+    """
+    if not config.getboolean("run_pipe_steps", step):
+        return False
+    output_cache = step_output_cache.get_step_output_cache(config)
+    # the incremental steps are only for the step by step runs
+    if not (is_enabled(config) or output_cache) or config.getboolean("run_calwebb_spec2_in_full", "run_calwebb_spec2"):
+        return True
+    if not model_store.exists(step_input_file):
+        return True
+    manifest = run_manifest.get_run_manifest(txt_name)
+    inputs_hash = get_inputs_hash(config, step, step_input_file, manifest)
+    record = manifest.get_step_inputs(step)
+    output_file = os.path.abspath(step_output_file)
+    side_product_files = get_side_product_files(step, output_file)
+    if is_enabled(config) and record is not None and record["inputs_hash"] == inputs_hash and \
+            record["output_file"] == output_file and os.path.isfile(output_file) and \
+            all(os.path.isfile(file_name) for file_name in side_product_files.values()):
+        stat = os.stat(output_file)
+        if (stat.st_mtime_ns, stat.st_size) == (record["output_mtime"], record["output_size"]):
+            print(" * The inputs of step "+step+" did not change, using the output of the previous run: ",
+                  step_output_file)
+            return False
+    if output_cache is not None:
+        if output_cache.fetch(step, inputs_hash, output_file, side_product_files):
+            _record_output(manifest, step, inputs_hash, output_file)
+            return False
+        # an output linked from the store is read only, the step writes a new file
+        for file_name in [output_file]+list(side_product_files.values()):
+            if os.path.isfile(file_name) and os.stat(file_name).st_nlink > 1:
+                os.remove(file_name)
+    with _running_lock:
+        _running_steps[step] = (manifest, inputs_hash, output_file, output_cache)
+    return True
+
+
+def _record_output(manifest, step, inputs_hash, output_file):
+    """
+    This function records the inputs hash of the step with its output file, and the content hash of the output (for
+    the next step, whose input it is).
+    """
+    get_file_hash(output_file, manifest)
+    stat = os.stat(output_file)
+    manifest.record_step_inputs(step, inputs_hash, output_file, stat.st_mtime_ns, stat.st_size)
+
+
+def record_step(step, step_completed):
+    """
+    This function records the inputs hash of the step that was just run, with its output file, so that the output can
+    be used in the next runs, and adds the output to the step output store. Nothing is recorded if the step was not
+    run by check_run_step or it did not complete.
+    Args:
+        step: string, name of the pipeline step
+        step_completed: boolean, True if the step was completed
+
+    Returns:
+        nothing
+    """
+    with _running_lock:
+        running_step = _running_steps.pop(step, None)
+    if running_step is None or not step_completed:
+        return
+    manifest, inputs_hash, output_file, output_cache = running_step
+    if not model_store.exists(output_file):
+        return
+    _record_output(manifest, step, inputs_hash, output_file)
+    if output_cache is not None:
+        output_cache.store(step, inputs_hash, output_file, get_side_product_files(step, output_file))
@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # the resource module is not available in all platforms, the peak memory is then taken from the samples only
+    resource = None
+
+
+"""
+This script records the peak memory of the pipeline steps (see step_timing.py), of the validation scripts, of each
+slit or slice they validate (see phase_timing.py), and of each test (see conftest.py), so that the step or validator
+that drove the memory of a run can be found, e.g. to plan how many runs can share a node.
+
+While a region (a step, a validator, a slit, or a test) is open, a thread samples the resident memory (RSS) of the
+process every memory_sample_interval seconds, and the highest sample is the RSS peak of the region. If
+memory_tracemalloc is True, the peak of the memory allocated by Python (and numpy) during the region is also recorded
+through tracemalloc, which is more precise but slows down the run.
+
+A memory ceiling (in MB) can be set for all the tests with memory_ceiling_mbytes, and for a test, step, or validator
+with memory_ceilings (e.g. "test_validate_flat_field:8000, flat_field:6000"). When the RSS of the process goes over
+the ceiling, the next check (the end of a step, or the next phase or slit of a validator) raises a
+MemoryCeilingError, so the test fails instead of exhausting the memory of the node.
+
+This script does not import any other PTT script, so a copy of it is kept in the utils directory for
+run_cal_detector1.py (see step_timing.py).
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: added get_configuration, to configure the worker processes started with spawn
+
+
+# seconds between the samples of the RSS
+default_sample_interval = 0.05
+
+# maximum number of rows of the tables of the html report
+html_max_rows = 20
+
+# peaks of the regions: (kind, name, slit) - [number of calls, RSS peak, RSS increase, tracemalloc peak]
+_memory_records = {}
+_records_lock = threading.Lock()
+_open_regions = []
+_regions_lock = threading.Lock()
+_state = {"sample_interval": default_sample_interval, "tracemalloc": False, "default_ceiling": None,
+          "ceilings": {}, "exceeded": None, "sampler": None}
+
+
+class MemoryCeilingError(MemoryError):
+    """
+    Raised when the RSS of the process goes over the memory ceiling of the step, validator, or test that is running.
+    """
+    pass
+
+
+def configure(sample_interval=default_sample_interval, use_tracemalloc=False, default_ceiling=None, ceilings=None):
+    """
+    This function sets how the memory is measured and the memory ceilings.
+    Args:
+        sample_interval: float, seconds between the samples of the RSS, 0 to only measure it at the start and end of
+                         the regions
+        use_tracemalloc: boolean, if True the peaks of the memory allocated by Python are also recorded
+        default_ceiling: float, memory ceiling in MB of all the tests, None or 0 for no ceiling
+        ceilings: dictionary, memory ceiling in MB of each test, step, or validator, by name
+
+    Returns:
+        nothing
+    """
+    _state["sample_interval"] = max(float(sample_interval), 0.0)
+    _state["default_ceiling"] = default_ceiling or None
+    _state["ceilings"] = dict(ceilings or {})
+    _state["exceeded"] = None
+    if use_tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not use_tracemalloc and _state["tracemalloc"] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state["tracemalloc"] = bool(use_tracemalloc)
+
+
+def get_configuration():
+    """
+    This function gives the current configuration, e.g. to configure a worker process the same way.
+    Returns:
+        configuration: dictionary, keyword arguments of configure
+    """
+    return {"sample_interval": _state["sample_interval"], "use_tracemalloc": _state["tracemalloc"],
+            "default_ceiling": _state["default_ceiling"], "ceilings": dict(_state["ceilings"])}
+
+
+def _reset_after_fork():
+    """
+    This function starts the memory tracking of a forked process (e.g. a worker of run_per_slit) without the regions
+    of its parent, since the sampler thread is not copied into the new process.
+    """
+    global _regions_lock, _records_lock
+    # the locks may have been held by a thread of the parent when it forked
+    _regions_lock = threading.Lock()
+    _records_lock = threading.Lock()
+    del _open_regions[:]
+    _state["sampler"] = None
+    _state["exceeded"] = None
+
+
+# os.register_at_fork is only available since python 3.7 in unix
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def parse_ceilings(ceilings_string):
+    """
+    This function reads the memory ceilings of the configuration file.
+    Args:
+        ceilings_string: string, comma separated name:MB pairs, e.g. "test_validate_flat_field:8000, flat_field:6000"
+
+    Returns:
+        ceilings: dictionary, memory ceiling in MB by name
+    """
+    ceilings = {}
+    for item in ceilings_string.split(","):
+        if not item.strip():
+            continue
+        name, ceiling = item.rsplit(":", 1)
+        ceilings[name.strip()] = float(ceiling)
+    return ceilings
+
+
+def get_ceiling(name):
+    """
+    This function returns the memory ceiling of the given test, step, or validator.
+    Args:
+        name: string, name of the test, step, or validator
+
+    Returns:
+        ceiling: float, memory ceiling in MB, None if there is no ceiling
+    """
+    return _state["ceilings"].get(name)
+
+
+def get_rss_mbytes():
+    """
+    This function returns the current resident memory of the process.
+    Returns:
+        rss: float, RSS in MB, None if it can not be determined in this platform
+    """
+    try:
+        with open("/proc/self/statm") as sf:
+            resident_pages = int(sf.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024.0**2
+    except (OSError, ValueError, IndexError):
+        # e.g. macOS, the current RSS is not available without psutil, the peak RSS of the process is used
+        if resource is None:
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes in macOS and in kB in Linux
+        if sys.platform == "darwin":
+            return peak_rss / 1024.0**2
+        return peak_rss / 1024.0
+
+
+def _fold_traced_peak():
+    """
+    This function adds the tracemalloc peak since the last call to the open regions, and starts a new peak. It is
+    called when a region opens or closes, so that the peak of each region is the highest of its parts.
+    """
+    if not tracemalloc.is_tracing():
+        return
+    traced_peak = tracemalloc.get_traced_memory()[1] / 1024.0**2
+    for region in _open_regions:
+        region["traced_peak"] = max(region["traced_peak"], traced_peak)
+    # reset_peak is only available since python 3.9, before the peak is the one since tracemalloc started
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+
+
+def _sample():
+    """
+    This function samples the RSS, adds it to the open regions, and checks the memory ceilings.
+    """
+    rss = get_rss_mbytes()
+    if rss is None:
+        return
+    with _regions_lock:
+        for region in _open_regions:
+            region["rss_peak"] = max(region["rss_peak"], rss)
+            ceiling = region["ceiling"]
+            if ceiling is not None and rss > ceiling and not region["exceeded"]:
+                region["exceeded"] = True
+                if _state["exceeded"] is None:
+                    msg = "RSS of "+"{:.1f}".format(rss)+" MB is over the memory ceiling of "+"{:.1f}".format(ceiling) + \
+                          " MB of "+region["kind"]+" "+region["name"]
+                    _state["exceeded"] = (region, msg)
+
+
+def _run_sampler():
+    """
+    This function samples the RSS while there are open regions.
+    """
+    while True:
+        with _regions_lock:
+            if not _open_regions:
+                _state["sampler"] = None
+                return
+        _sample()
+        time.sleep(_state["sample_interval"])
+
+
+def start_region(kind, name, slit=None, ceiling=None):
+    """
+    This function opens a region whose memory peak is recorded.
+    Args:
+        kind: string, kind of region, e.g. step, validator, or test
+        name: string, name of the step, validator, or test
+        slit: string, name of the slit, None if the region is not of a slit
+        ceiling: float, memory ceiling in MB, if None the one of the name is used (see configure), or the ceiling
+                 of all the tests for a test
+
+    Returns:
+        region: dictionary, to be given to end_region
+    """
+    if ceiling is None:
+        ceiling = get_ceiling(name)
+    if ceiling is None and kind == "test":
+        ceiling = _state["default_ceiling"]
+    rss = get_rss_mbytes()
+    region = {"kind": kind, "name": name, "slit": slit, "ceiling": ceiling, "rss_start": rss,
+              "rss_peak": rss if rss is not None else 0.0, "traced_peak": 0.0, "exceeded": False}
+    with _regions_lock:
+        _fold_traced_peak()
+        _open_regions.append(region)
+        if _state["sample_interval"] > 0.0 and _state["sampler"] is None:
+            _state["sampler"] = threading.Thread(target=_run_sampler, name="PTT_memory_sampler", daemon=True)
+            _state["sampler"].start()
+    return region
+
+
+def end_region(region, record=True):
+    """
+    This function closes the region and records its memory peak.
+    Args:
+        region: dictionary, given by start_region
+        record: boolean, if False the peak is not added to the records (e.g. the regions of the tests)
+
+    Returns:
+        peaks: dictionary with the keys rss_peak_mbytes, rss_increase_mbytes, tracemalloc_peak_mbytes (None if
+               tracemalloc is off), and ceiling_exceeded
+    """
+    _sample()
+    with _regions_lock:
+        _fold_traced_peak()
+        if region in _open_regions:
+            _open_regions.remove(region)
+        # the ceiling of a closed region is not checked anymore
+        if _state["exceeded"] is not None and _state["exceeded"][0] is region:
+            _state["exceeded"] = None
+    rss_increase = None
+    if region["rss_start"] is not None:
+        rss_increase = region["rss_peak"] - region["rss_start"]
+    traced_peak = region["traced_peak"] if _state["tracemalloc"] else None
+    peaks = {"rss_peak_mbytes": region["rss_peak"] if region["rss_start"] is not None else None,
+             "rss_increase_mbytes": rss_increase, "tracemalloc_peak_mbytes": traced_peak,
+             "ceiling_exceeded": region["exceeded"]}
+    if record and peaks["rss_peak_mbytes"] is not None:
+        record_peaks(region["kind"], region["name"], region["slit"], peaks)
+    return peaks
+
+
+def record_peaks(kind, name, slit, peaks, calls=1):
+    """
+    This function adds the memory peaks of a region.
+    Args:
+        kind: string, kind of region
+        name: string, name of the step, validator, or test
+        slit: string, name of the slit, None if the region is not of a slit
+        peaks: dictionary, given by end_region
+        calls: integer, number of times the region was run
+
+    Returns:
+        nothing
+    """
+    key = (kind, name, slit)
+    with _records_lock:
+        record = _memory_records.setdefault(key, [0, 0.0, 0.0, None])
+        record[0] += calls
+        record[1] = max(record[1], peaks["rss_peak_mbytes"])
+        record[2] = max(record[2], peaks["rss_increase_mbytes"] or 0.0)
+        if peaks["tracemalloc_peak_mbytes"] is not None:
+            record[3] = max(record[3] or 0.0, peaks["tracemalloc_peak_mbytes"])
+
+
+def check_ceiling():
+    """
+    This function raises a MemoryCeilingError if the RSS went over the memory ceiling of an open region. The error is
+    only raised once for each time the ceiling is exceeded.
+    Returns:
+        nothing
+    """
+    with _regions_lock:
+        exceeded = _state["exceeded"]
+        _state["exceeded"] = None
+    if exceeded is not None:
+        raise MemoryCeilingError(exceeded[1])
+
+
+def get_memory_records():
+    """
+    This function returns a copy of the memory peaks.
+    Returns:
+        records: list of dictionaries with the keys kind, name, slit, calls, rss_peak_mbytes, rss_increase_mbytes,
+                 and tracemalloc_peak_mbytes
+    """
+    with _records_lock:
+        items = list(_memory_records.items())
+    return [{"kind": kind, "name": name, "slit": slit, "calls": calls, "rss_peak_mbytes": rss_peak,
+             "rss_increase_mbytes": rss_increase, "tracemalloc_peak_mbytes": traced_peak}
+            for (kind, name, slit), (calls, rss_peak, rss_increase, traced_peak) in items]
+
+
+def merge_memory_records(records):
+    """
+    This function adds the memory peaks of another process (see get_memory_records).
+    Args:
+        records: list of dictionaries
+
+    Returns:
+        nothing
+    """
+    for record in records:
+        record_peaks(record["kind"], record["name"], record["slit"], record, calls=record["calls"])
+
+
+def clear_memory_records():
+    """
+    This function removes all the memory peaks.
+    Returns:
+        nothing
+    """
+    with _records_lock:
+        _memory_records.clear()
+
+
+def write_memory_summary(summary_file):
+    """
+    This function writes the memory peaks in a JSON file, sorted by RSS peak.
+    Args:
+        summary_file: string, path and name of the file
+
+    Returns:
+        records: list of dictionaries, the records written
+    """
+    records = sorted(get_memory_records(), key=lambda record: -record["rss_peak_mbytes"])
+    with open(summary_file, "w") as sf:
+        json.dump(records, sf, indent=1)
+    return records
+
+
+def get_html_table(records=None, max_rows=html_max_rows):
+    """
+    This function returns the html table of the highest memory peaks.
+    Args:
+        records: list of dictionaries, if None the current records are used
+        max_rows: integer, maximum number of rows of the table
+
+    Returns:
+        html: string, empty if there are no records
+    """
+    if records is None:
+        records = get_memory_records()
+    if not records:
+        return ""
+    lines = ["<h2>Peak memory</h2>",
+             "<table border='1'><tr><th>Kind</th><th>Name</th><th>Slit</th><th>Calls</th><th>RSS peak (MB)</th>"
+             "<th>RSS increase (MB)</th><th>Tracemalloc peak (MB)</th></tr>"]
+    for record in sorted(records, key=lambda record: -record["rss_peak_mbytes"])[:max_rows]:
+        traced_peak = record["tracemalloc_peak_mbytes"]
+        lines.append("<tr><td>"+record["kind"]+"</td><td>"+record["name"]+"</td><td>" +
+                     ("" if record["slit"] is None else str(record["slit"]))+"</td><td>"+repr(record["calls"]) +
+                     "</td><td>"+"{:.1f}".format(record["rss_peak_mbytes"])+"</td><td>" +
+                     "{:.1f}".format(record["rss_increase_mbytes"])+"</td><td>" +
+                     ("" if traced_peak is None else "{:.1f}".format(traced_peak))+"</td></tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
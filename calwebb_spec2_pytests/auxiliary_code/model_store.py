@@ -0,0 +1,303 @@
+import os
+import threading
+from collections import OrderedDict
+
+from . import header_cache
+from . import background_writer
+
+
+"""
+This script keeps the data models produced by the pipeline steps when PTT runs the pipeline step by step, so that
+the output of a step is handed in memory to the next step and to the validation scripts, instead of being written
+and read (and parsed) again from disk in the next test module.
+
+The chaining is switched on with chain_models_in_memory in the PTT configuration file. The output files are written
+as soon as each step finishes, unless save_step_outputs is set to False; in that case each model is written when its
+file is requested (see ensure_saved), when it is removed from the store, or at the end of the session (see flush).
+The header keywords of a model that has not been written yet are read from the model itself (see ModelHeader).
+
+The models are written through the background writer (see background_writer.py), so a model may still be being
+written after it is handed over; ensure_saved also waits for the write to finish.
+
+Since the pipeline steps may modify their input model, a model that has not been written yet is handed to the next
+step as a copy, so that the file written later has the output of the step that produced it.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the models are written through the background writer
+
+
+# maximum number of models kept in memory, the oldest ones are written (if necessary) and removed
+default_max_models = 2
+
+_models = OrderedDict()
+_pending = set()
+_store_lock = threading.RLock()
+_store_state = {"enabled": False, "save_outputs": True, "max_models": default_max_models}
+
+
+def configure(chain_models, save_outputs=True, max_models=default_max_models):
+    """
+    This function switches the in-memory chaining of the step outputs on or off.
+    Args:
+        chain_models: boolean, if True the step outputs are kept in memory and handed to the next step
+        save_outputs: boolean, if False the step outputs are only written when they are requested or at the end
+        max_models: integer, maximum number of models kept in memory (at least 1)
+
+    Returns:
+        nothing
+    """
+    with _store_lock:
+        _store_state["enabled"] = bool(chain_models)
+        _store_state["save_outputs"] = bool(save_outputs) or not chain_models
+        _store_state["max_models"] = max(int(max_models), 1)
+
+
+def is_enabled():
+    """
+    This function returns True if the step outputs are chained in memory.
+    """
+    return _store_state["enabled"]
+
+
+def _get_key(file_name):
+    return os.path.abspath(file_name)
+
+
+def _save(key):
+    """
+    This function sends the model stored with the given key to be written, if it has not been written yet.
+    """
+    if key in _pending:
+        background_writer.submit(_models[key], key)
+        _pending.discard(key)
+
+
+def _get_unwritten_model(key):
+    """
+    This function returns the model of the file if it is stored and not written yet, or if it is being written.
+    """
+    if key in _pending:
+        return _models[key]
+    model = background_writer.get_object(key)
+    # the HDU lists written by the validation scripts are not data models
+    if model is None or hasattr(model, "writeto"):
+        return None
+    return model
+
+
+def _store(model, key, pending):
+    """
+    This function stores the model, writing and removing the oldest models if there are too many.
+    """
+    _models[key] = model
+    _models.move_to_end(key)
+    if pending:
+        _pending.add(key)
+    else:
+        _pending.discard(key)
+    while len(_models) > _store_state["max_models"]:
+        oldest = next(iter(_models))
+        _save(oldest)
+        del _models[oldest]
+
+
+def save_step_output(model, file_name):
+    """
+    This function saves the output model of a step. When the chaining is on the model is stored, and it is written
+    now or later depending on save_step_outputs; otherwise it is just written.
+    Args:
+        model: data model, output of the step
+        file_name: string, path and name of the output file of the step
+
+    Returns:
+        nothing
+    """
+    with _store_lock:
+        if not _store_state["enabled"]:
+            background_writer.submit(model, file_name)
+            return
+        key = _get_key(file_name)
+        _store(model, key, pending=True)
+        if _store_state["save_outputs"]:
+            _save(key)
+
+
+def keep_model(model, file_name):
+    """
+    This function stores the output model of a step that was already written (e.g. by the step itself).
+    Args:
+        model: data model, output of the step
+        file_name: string, path and name of the output file of the step
+
+    Returns:
+        nothing
+    """
+    with _store_lock:
+        header_cache.invalidate_header(file_name)
+        if _store_state["enabled"] and model is not None:
+            _store(model, _get_key(file_name), pending=False)
+
+
+def get_step_input(file_name):
+    """
+    This function returns what has to be given to the step to run: the stored model of the file if there is one,
+    otherwise the file name.
+    Args:
+        file_name: string, path and name of the input file of the step
+
+    Returns:
+        data model or string
+    """
+    with _store_lock:
+        key = _get_key(file_name)
+        if key not in _models:
+            return background_writer.wait_for(file_name)
+        # the step may modify its input, so it gets a copy of a model that is not written yet
+        if _get_unwritten_model(key) is _models[key]:
+            return _models[key].copy()
+        return _models[key]
+
+
+def get_model(file_name, model_class=None):
+    """
+    This function returns the stored model of the file.
+    Args:
+        file_name: string, path and name of the file
+        model_class: data model class, if given the model is only returned if it is an instance of this class
+
+    Returns:
+        data model, None if the file has no stored model
+    """
+    with _store_lock:
+        model = _models.get(_get_key(file_name))
+    if model is not None and model_class is not None and not isinstance(model, model_class):
+        return None
+    return model
+
+
+def is_pending(file_name):
+    """
+    This function returns True if the file has a stored model that has not been written yet (or is being written).
+    """
+    with _store_lock:
+        return _get_unwritten_model(_get_key(file_name)) is not None
+
+
+def exists(file_name):
+    """
+    This function is the equivalent of os.path.isfile, and it is also True if the file has a stored model.
+    """
+    key = _get_key(file_name)
+    return key in _models or background_writer.is_writing(key) or os.path.isfile(file_name)
+
+
+def ensure_saved(file_name):
+    """
+    This function writes the stored model of the file if it has not been written yet, and waits until the file is
+    written, i.e. it has to be called before the file is read from disk.
+    Args:
+        file_name: string, path and name of the file
+
+    Returns:
+        file_name: string, the same file name
+    """
+    with _store_lock:
+        key = _get_key(file_name)
+        if key in _pending:
+            _save(key)
+    return background_writer.wait_for(file_name)
+
+
+def get_header(file_name):
+    """
+    This function returns the primary header keywords of a stored model that has not been written yet (or is being
+    written).
+    Args:
+        file_name: string, path and name of the file
+
+    Returns:
+        ModelHeader object, None if the file does not have a model waiting to be written
+    """
+    with _store_lock:
+        model = _get_unwritten_model(_get_key(file_name))
+    if model is None:
+        return None
+    return ModelHeader(model)
+
+
+def flush():
+    """
+    This function writes all the stored models that have not been written yet, and waits until they are written.
+    Returns:
+        nothing
+    """
+    with _store_lock:
+        for key in list(_pending):
+            _save(key)
+    background_writer.flush()
+
+
+def clear():
+    """
+    This function writes the models that have not been written yet and removes all the models from the store.
+    Returns:
+        nothing
+    """
+    with _store_lock:
+        flush()
+        _models.clear()
+
+
+class ModelHeader(object):
+    """
+    This class gives read access to the FITS keywords of a data model, as the header of the file that the model
+    would be written to: keyword in header, header[keyword], and header.get(keyword, default).
+    """
+
+    def __init__(self, model):
+        """
+        Args:
+            model: data model
+        """
+        self.model = model
+        self._values = {}
+
+    def _get_value(self, keyword):
+        keyword = keyword.upper()
+        if keyword not in self._values:
+            value = None
+            for path in self.model.find_fits_keyword(keyword, return_result=True):
+                try:
+                    value = self.model[path]
+                except (KeyError, IndexError, TypeError):
+                    # the keyword is not set in the model
+                    continue
+                if value is not None:
+                    break
+            self._values[keyword] = value
+        return self._values[keyword]
+
+    def __contains__(self, keyword):
+        return self._get_value(keyword) is not None
+
+    def __getitem__(self, keyword):
+        value = self._get_value(keyword)
+        if value is None:
+            raise KeyError("Keyword '"+keyword+"' not found.")
+        return value
+
+    def get(self, keyword, default=None):
+        value = self._get_value(keyword)
+        if value is None:
+            return default
+        return value
+
+    def __repr__(self):
+        return "ModelHeader("+repr(self.model)+")"
@@ -0,0 +1,94 @@
+import os
+import collections
+
+from . import header_cache
+from . import model_store
+
+
+"""
+This script builds the observation context of a PTT run, i.e. the information that all the test modules and
+validation scripts need about the data being tested (detector, mode, grating, filter, exposure type, directories,
+and file names). The context is built once, from the configuration file and the header of the input file, and it is
+immutable, so it can be shared by the test modules and passed to the per-slit functions (also to worker processes).
+
+The header keywords of the input file are not always the ones of the files being validated, e.g. the input file has
+FILTER=OPAQUE when change_filter_opaque is True and the filter is changed before the pipeline runs. The validators
+use for_file to get the context with the keywords of the file they validate.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: added for_file, since the filter of the input file may be changed before the pipeline runs
+
+
+ObservationContext = collections.namedtuple("ObservationContext",
+                                            ["detector", "mode_used", "grating", "filter", "lamp", "exp_type",
+                                             "working_directory", "data_directory", "input_file",
+                                             "raw_data_root_file", "esa_files_path", "msa_conf_name",
+                                             "run_calwebb_spec2"])
+
+
+def _get_primary_header(file_name):
+    """
+    This function returns the primary header of the file, from the stored model if it has not been written yet.
+    """
+    header = model_store.get_header(file_name)
+    if header is None:
+        header = header_cache.get_header(model_store.ensure_saved(file_name), 0)
+    return header
+
+
+def build_observation_context(config):
+    """
+    This function builds the observation context from the configuration file object and the header of the input file.
+    Args:
+        config: object, this is the configuration file object
+
+    Returns:
+        ObservationContext object, a named tuple (immutable) with the observation information
+    """
+    working_directory = config.get("calwebb_spec2_input_file", "working_directory")
+    data_directory = config.get("calwebb_spec2_input_file", "data_directory")
+    input_file_basename = config.get("calwebb_spec2_input_file", "input_file")
+    # the input file is taken from the data directory, if it is not there it is taken from the working directory
+    input_file = os.path.join(data_directory, input_file_basename)
+    if not os.path.isfile(input_file):
+        input_file = os.path.join(working_directory, input_file_basename)
+    header = header_cache.get_header(input_file, 0)
+    return ObservationContext(detector=header.get("DETECTOR"),
+                              mode_used=config.get("calwebb_spec2_input_file", "mode_used"),
+                              grating=header.get("GRATING"),
+                              filter=header.get("FILTER"),
+                              lamp=header.get("LAMP", "NONE"),
+                              exp_type=header.get("EXP_TYPE"),
+                              working_directory=working_directory,
+                              data_directory=data_directory,
+                              input_file=input_file,
+                              raw_data_root_file=config.get("calwebb_spec2_input_file", "raw_data_root_file"),
+                              esa_files_path=config.get("esa_intermediary_products", "esa_files_path"),
+                              msa_conf_name=config.get("esa_intermediary_products", "msa_conf_name"),
+                              run_calwebb_spec2=config.getboolean("run_calwebb_spec2_in_full", "run_calwebb_spec2"))
+
+
+def for_file(obs_context, file_name):
+    """
+    This function gives the observation context with the header keywords (detector, grating, filter, lamp, and
+    exposure type) of the given file, e.g. of the step output being validated.
+    Args:
+        obs_context: ObservationContext object
+        file_name: string, path and name of the fits file
+
+    Returns:
+        ObservationContext object, a copy of obs_context with the keywords of the file
+    """
+    header = _get_primary_header(file_name)
+    return obs_context._replace(detector=header.get("DETECTOR"),
+                                grating=header.get("GRATING"),
+                                filter=header.get("FILTER"),
+                                lamp=header.get("LAMP", "NONE"),
+                                exp_type=header.get("EXP_TYPE"))
@@ -0,0 +1,324 @@
+import json
+import time
+import threading
+import functools
+import contextlib
+
+from . import memory_tracking
+
+
+"""
+This script measures where the time of the validation scripts goes (e.g. finding and reading the ESA files, reading
+the pipeline files, evaluating the WCS, the numerical calculations, the statistics, and the plots). The times are
+added per validation script, per slit, and per phase, and they are written in a JSON summary and in a table of the
+html report (see conftest.py).
+
+A validation function is decorated with timed, which records its total time and opens the timing context of the
+call. Inside the function, start_phase closes the phase that is running (if any) and starts the next one, so the
+phases of the long validation functions are marked without indenting their code; end_phase closes the phase that is
+running, and the phase that is running when the function returns is closed by timed. set_slit sets the slit of the
+phases that follow (None for the phases that are not of a slit, e.g. after the loop over the slits). The context manager timed_phase times a block of code within the current context.
+
+The times of the functions ran in worker processes are given back with the results (see
+auxiliary_functions.run_per_slit) and added with merge_phase_records.
+
+The peak memory of each validation script and of each of its slits is also recorded (see memory_tracking.py), and
+the memory ceilings are checked when a phase or a slit starts.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.2"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the peak memory of the validation scripts and of each slit is recorded, and the memory
+#                         ceilings are checked when a phase or a slit starts
+# Oct 2026 - Version 1.2: the total time of a validation script is recorded without slit, instead of under its last
+#                         slit
+
+
+# phase recorded by timed for the total time of a function
+total_phase = "total"
+
+# maximum number of rows of the tables of the html report
+html_max_rows = 20
+
+# times of the phases: (validator, slit, phase) - [number of calls, total time, maximum time]
+_phase_records = {}
+_records_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def record_time(validator, slit, phase, seconds):
+    """
+    This function adds the time of a phase.
+    Args:
+        validator: string, name of the validation script (e.g. flattest_fs)
+        slit: string, name of the slit, None if the phase is not of a slit
+        phase: string, name of the phase (e.g. esa_lookup, wcs_evaluation, plotting)
+        seconds: float, running time of the phase
+
+    Returns:
+        nothing
+    """
+    key = (validator, slit, phase)
+    with _records_lock:
+        record = _phase_records.setdefault(key, [0, 0.0, 0.0])
+        record[0] += 1
+        record[1] += seconds
+        record[2] = max(record[2], seconds)
+
+
+def _get_contexts():
+    contexts = getattr(_thread_state, "contexts", None)
+    if contexts is None:
+        contexts = _thread_state.contexts = []
+    return contexts
+
+
+def _get_context():
+    contexts = _get_contexts()
+    if not contexts:
+        return None
+    return contexts[-1]
+
+
+def timed(validator, phase=total_phase):
+    """
+    This function is a decorator that records the total time of the decorated function (and its peak memory, if it is
+    the total time of the validation script), and opens the timing context of each call (see start_phase).
+    Args:
+        validator: string, name of the validation script
+        phase: string, name of the phase of the total time (e.g. slit_total for the function of each slit)
+
+    Returns:
+        decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            context = {"validator": validator, "slit": None, "phase": None, "start": None, "slit_memory": None}
+            memory_region = None
+            if phase == total_phase:
+                memory_region = memory_tracking.start_region("validator", validator)
+            contexts = _get_contexts()
+            contexts.append(context)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_phase()
+                _end_slit_memory(context)
+                contexts.pop()
+                # the total time of a validation script is not of its last slit, the time of a slit function is
+                slit = None if phase == total_phase else context["slit"]
+                record_time(validator, slit, phase, time.perf_counter() - start)
+                if memory_region is not None:
+                    memory_tracking.end_region(memory_region)
+        return wrapper
+    return decorator
+
+
+def _end_slit_memory(context):
+    """
+    This function records the peak memory of the slit of the context, if any.
+    """
+    if context["slit_memory"] is not None:
+        memory_tracking.end_region(context["slit_memory"])
+        context["slit_memory"] = None
+
+
+def set_slit(slit):
+    """
+    This function closes the phase that is running in the current context (if any), so that its time is recorded
+    for the previous slit, and sets the slit of the phases that follow. The peak memory of each slit is recorded,
+    and a MemoryCeilingError is raised if a memory ceiling was exceeded.
+    Args:
+        slit: string, name of the slit
+
+    Returns:
+        nothing
+    """
+    context = _get_context()
+    if context is not None:
+        end_phase()
+        _end_slit_memory(context)
+        context["slit"] = slit
+        if slit is not None:
+            context["slit_memory"] = memory_tracking.start_region("slit", context["validator"], slit=slit)
+    memory_tracking.check_ceiling()
+
+
+def start_phase(phase):
+    """
+    This function closes the phase that is running in the current context (if any) and starts the given phase.
+    Nothing is recorded if there is no context, i.e. if the function was not called through timed. A
+    MemoryCeilingError is raised if a memory ceiling was exceeded.
+    Args:
+        phase: string, name of the phase
+
+    Returns:
+        nothing
+    """
+    memory_tracking.check_ceiling()
+    context = _get_context()
+    if context is None:
+        return
+    end_phase()
+    context["phase"] = phase
+    context["start"] = time.perf_counter()
+
+
+def end_phase():
+    """
+    This function closes the phase that is running in the current context, if any.
+    Returns:
+        nothing
+    """
+    context = _get_context()
+    if context is None or context["phase"] is None:
+        return
+    record_time(context["validator"], context["slit"], context["phase"], time.perf_counter() - context["start"])
+    context["phase"], context["start"] = None, None
+
+
+@contextlib.contextmanager
+def timed_phase(phase, validator=None, slit=None):
+    """
+    This function is a context manager that records the time of the block of code as the given phase, of the current
+    context unless the validator (and slit) are given.
+    Args:
+        phase: string, name of the phase
+        validator: string, name of the validation script, if None it is the one of the current context
+        slit: string, name of the slit, if None it is the one of the current context
+
+    Returns:
+        context manager
+    """
+    context = _get_context()
+    if validator is None and context is not None:
+        validator = context["validator"]
+    if slit is None and context is not None:
+        slit = context["slit"]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if validator is not None:
+            record_time(validator, slit, phase, time.perf_counter() - start)
+
+
+def get_phase_records():
+    """
+    This function returns a copy of the times of the phases.
+    Returns:
+        records: list of dictionaries with the keys validator, slit, phase, calls, total_time, and max_time
+    """
+    with _records_lock:
+        items = list(_phase_records.items())
+    return [{"validator": validator, "slit": slit, "phase": phase, "calls": calls, "total_time": total_time,
+             "max_time": max_time} for (validator, slit, phase), (calls, total_time, max_time) in items]
+
+
+def merge_phase_records(records):
+    """
+    This function adds the times of another process (see get_phase_records).
+    Args:
+        records: list of dictionaries
+
+    Returns:
+        nothing
+    """
+    with _records_lock:
+        for record in records:
+            key = (record["validator"], record["slit"], record["phase"])
+            merged = _phase_records.setdefault(key, [0, 0.0, 0.0])
+            merged[0] += record["calls"]
+            merged[1] += record["total_time"]
+            merged[2] = max(merged[2], record["max_time"])
+
+
+def clear_phase_records():
+    """
+    This function removes all the times.
+    Returns:
+        nothing
+    """
+    with _records_lock:
+        _phase_records.clear()
+
+
+def get_phase_summary():
+    """
+    This function returns the summary of the times: the times of each phase of each validation script (added over
+    the slits), and the times of each phase of each slit, both sorted by total time.
+    Returns:
+        summary: dictionary with the keys phases and slits, lists of dictionaries
+    """
+    slits = get_phase_records()
+    phases = {}
+    for record in slits:
+        key = (record["validator"], record["phase"])
+        if key not in phases:
+            phases[key] = {"validator": record["validator"], "phase": record["phase"], "calls": 0, "slits": 0,
+                           "total_time": 0.0, "max_time": 0.0}
+        phase = phases[key]
+        phase["calls"] += record["calls"]
+        phase["total_time"] += record["total_time"]
+        phase["max_time"] = max(phase["max_time"], record["max_time"])
+        if record["slit"] is not None:
+            phase["slits"] += 1
+    return {"phases": sorted(phases.values(), key=lambda phase: -phase["total_time"]),
+            "slits": sorted([record for record in slits if record["slit"] is not None],
+                            key=lambda record: -record["total_time"])}
+
+
+def write_phase_summary(summary_file):
+    """
+    This function writes the summary of the times (see get_phase_summary) in a JSON file.
+    Args:
+        summary_file: string, path and name of the file
+
+    Returns:
+        summary: dictionary, the summary written
+    """
+    summary = get_phase_summary()
+    with open(summary_file, "w") as sf:
+        json.dump(summary, sf, indent=1)
+    return summary
+
+
+def get_html_tables(summary=None, max_rows=html_max_rows):
+    """
+    This function returns the html tables of the times of the phases, and of the slowest phases of the slits.
+    Args:
+        summary: dictionary, summary of the times, if None the current summary is used
+        max_rows: integer, maximum number of rows of each table
+
+    Returns:
+        html: string, empty if there are no times
+    """
+    if summary is None:
+        summary = get_phase_summary()
+    if not summary["phases"]:
+        return ""
+    lines = ["<h2>Validation phase times</h2>",
+             "<table border='1'><tr><th>Validator</th><th>Phase</th><th>Calls</th><th>Slits</th>"
+             "<th>Total (s)</th><th>Max (s)</th></tr>"]
+    for phase in summary["phases"][:max_rows]:
+        lines.append("<tr><td>"+phase["validator"]+"</td><td>"+phase["phase"]+"</td><td>"+repr(phase["calls"]) +
+                     "</td><td>"+repr(phase["slits"])+"</td><td>"+"{:.3f}".format(phase["total_time"])+"</td><td>" +
+                     "{:.3f}".format(phase["max_time"])+"</td></tr>")
+    lines.append("</table>")
+    if summary["slits"]:
+        lines.extend(["<h3>Slowest slit phases</h3>",
+                      "<table border='1'><tr><th>Validator</th><th>Slit</th><th>Phase</th><th>Calls</th>"
+                      "<th>Total (s)</th></tr>"])
+        for record in summary["slits"][:max_rows]:
+            lines.append("<tr><td>"+record["validator"]+"</td><td>"+str(record["slit"])+"</td><td>" +
+                         record["phase"]+"</td><td>"+repr(record["calls"])+"</td><td>" +
+                         "{:.3f}".format(record["total_time"])+"</td></tr>")
+        lines.append("</table>")
+    return "\n".join(lines)
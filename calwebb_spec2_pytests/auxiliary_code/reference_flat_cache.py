@@ -0,0 +1,284 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from astropy.io import fits
+
+from . import flattest_engine
+
+
+"""
+This script keeps the D-, S-, and F-flat reference data in memory, so that the flattest FS, MOS, and IFU scripts
+do not have to read (and flip/rotate) the same reference cubes every time they are called, e.g. for NRS1 and NRS2
+or when the tests are re-run in the same session. The data are kept ready to use (i.e. in science orientation),
+and the least recently used entries are removed when the total size goes over the memory budget.
+
+The entries are keyed by (path, extension, orientation, modification time) of the reference file, so a file that
+changes on disk is read again.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: Added the DFlatCube class to read only the D-flat planes needed by each slit.
+
+
+# default memory budget of the cache, in MB
+default_max_cache_mbytes = 2048.0
+
+_cache = OrderedDict()
+_cache_lock = threading.RLock()
+_cache_state = {"max_bytes": default_max_cache_mbytes * 1024.0**2, "nbytes": 0}
+
+
+def set_max_cache_size(max_mbytes):
+    """
+    This function sets the memory budget of the cache. Entries are removed (least recently used first) until the
+    cache fits in the new budget. A budget of 0 disables the cache.
+    Args:
+        max_mbytes: float, maximum total size of the cached data in MB
+
+    Returns:
+        nothing
+    """
+    with _cache_lock:
+        _cache_state["max_bytes"] = max(float(max_mbytes), 0.0) * 1024.0**2
+        _evict()
+
+
+def clear_cache():
+    """
+    This function removes all the entries of the cache.
+    Returns:
+        nothing
+    """
+    with _cache_lock:
+        _cache.clear()
+        _cache_state["nbytes"] = 0
+
+
+def get_cache_info():
+    """
+    This function returns the current state of the cache.
+    Returns:
+        cache_info: dictionary, number of entries, size in MB, and memory budget in MB
+    """
+    with _cache_lock:
+        cache_info = {"entries": len(_cache),
+                      "mbytes": _cache_state["nbytes"] / 1024.0**2,
+                      "max_mbytes": _cache_state["max_bytes"] / 1024.0**2}
+    return cache_info
+
+
+def _evict():
+    """
+    This function removes the least recently used entries until the cache fits in the memory budget.
+    """
+    while _cache and _cache_state["nbytes"] > _cache_state["max_bytes"]:
+        _, (_, nbytes) = _cache.popitem(last=False)
+        _cache_state["nbytes"] -= nbytes
+
+
+def _nbytes(value):
+    """
+    This function estimates the memory used by a cached value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, flattest_engine.CumulativeIntegralTable):
+        return value.wave.nbytes + value.data.nbytes + value.cumint.nbytes + value.cumbad.nbytes
+    return 0
+
+
+def _get_or_load(path, ext, orientation, loader):
+    """
+    This function returns the cached value for the given file, extension, and orientation, or calls the loader
+    and caches its result.
+    Args:
+        path: string, full path of the reference file
+        ext: string or integer, extension name or number
+        orientation: string, name of the transformation applied to the data (e.g. "sci_NRS2", "PFLAT_")
+        loader: function with no arguments that reads the data
+
+    Returns:
+        value: the cached or freshly read data
+    """
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    key = (path, ext, orientation, mtime)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key][0]
+        # remove the data of older versions of the same file
+        for stale_key in [k for k in _cache if k[:3] == key[:3]]:
+            _cache_state["nbytes"] -= _cache.pop(stale_key)[1]
+
+    value = loader()
+    nbytes = _nbytes(value)
+    if type(value) is np.ndarray:
+        # the same array is handed to every caller, so protect it against changes
+        value.setflags(write=False)
+    with _cache_lock:
+        if nbytes <= _cache_state["max_bytes"]:
+            _cache[key] = (value, nbytes)
+            _cache_state["nbytes"] += nbytes
+            _evict()
+    return value
+
+
+def to_science_orientation(data, det):
+    """
+    This function flips the image (or each plane of the cube) into science orientation, i.e. swaps x and y and,
+    for NRS2, rotates it by 180 degrees.
+    Args:
+        data: 2D or 3D numpy array, reference data as read from the file
+        det: string, detector (NRS1 or NRS2)
+
+    Returns:
+        data: numpy array in science orientation
+    """
+    data = np.swapaxes(data, -2, -1)   # keep in mind that 0,1,2 = z,y,x in Python, whereas =x,y,z in IDL
+    if det == "NRS2":
+        # rotate science data by 180 degrees for NRS2
+        data = data[..., ::-1, ::-1]
+    return np.ascontiguousarray(data)
+
+
+def get_science_data(path, ext, det):
+    """
+    This function returns the image or cube in the given extension in science orientation.
+    Args:
+        path: string, full path of the reference file
+        ext: string or integer, extension name or number
+        det: string, detector (NRS1 or NRS2)
+
+    Returns:
+        data: read-only numpy array in science orientation
+    """
+    return _get_or_load(path, ext, "sci_"+det, lambda: to_science_orientation(fits.getdata(path, ext), det))
+
+
+def get_data(path, ext):
+    """
+    This function returns the data in the given extension as it is in the file (e.g. a fast vector table).
+    Args:
+        path: string, full path of the reference file
+        ext: string or integer, extension name or number
+
+    Returns:
+        data: numpy array or FITS_rec, shared by all the callers so it must not be modified
+    """
+    return _get_or_load(path, ext, "raw", lambda: fits.getdata(path, ext))
+
+
+def get_plane_wavelengths(path, ext, keyword_prefix, first_plane=1, zero_pad=False, skip_missing=False):
+    """
+    This function returns the wavelength of each plane of a reference cube, read from the header keywords
+    keyword_prefix+plane number (e.g. PFLAT_1 for the D-flat, FLAT_01 for the S- and F-flats).
+    Args:
+        path: string, full path of the reference file
+        ext: string or integer, extension name or number of the cube
+        keyword_prefix: string, keyword name without the plane number
+        first_plane: integer, number of the first plane in the keyword names
+        zero_pad: boolean, if True the plane numbers are written with two digits
+        skip_missing: boolean, if True planes without keyword are skipped, otherwise a KeyError is raised
+
+    Returns:
+        wave: read-only 1D numpy array, wavelengths of the planes
+    """
+    def read_wavelengths():
+        header = fits.getheader(path, ext)
+        wave = []
+        for i in range(header["NAXIS3"]):
+            plane = i + first_plane
+            keyword = keyword_prefix + ("{:02d}".format(plane) if zero_pad else str(plane))
+            if keyword not in header and skip_missing:
+                continue
+            wave.append(header[keyword])
+        return np.array(wave, dtype=float)
+    orientation = "_".join(("keywords", keyword_prefix, str(first_plane), str(zero_pad), str(skip_missing)))
+    return _get_or_load(path, ext, orientation, read_wavelengths)
+
+
+def get_integral_table(path, ext, data_field):
+    """
+    This function returns the cumulative integral table of a fast vector extension.
+    Args:
+        path: string, full path of the reference file
+        ext: string or integer, extension name or number of the fast vector table
+        data_field: string, name of the field with the values of the table (e.g. RQE or DATA)
+
+    Returns:
+        CumulativeIntegralTable object
+    """
+    return _get_or_load(path, ext, "cumint_"+data_field,
+                        lambda: flattest_engine.CumulativeIntegralTable.from_fits_rec(get_data(path, ext), data_field))
+
+
+class DFlatCube(object):
+    """
+    This class gives access to the D-flat reference cube without reading it in full. The plane wavelengths
+    (PFLAT_n keywords) are read in a single header pass, and for each slit only the planes that bracket its
+    wavelength range are read from the memory-mapped file and put in science orientation. The planes read are
+    kept in the cache, so slits (or slices) with the same wavelength range share them.
+    """
+
+    def __init__(self, dfile, det, ext="SCI"):
+        """
+        Args:
+            dfile: string, full path of the D-flat reference file
+            det: string, detector (NRS1 or NRS2)
+            ext: string or integer, extension name or number of the cube
+        """
+        self.dfile = dfile
+        self.det = det
+        self.ext = ext
+        self.dfwave = get_plane_wavelengths(dfile, ext, "PFLAT_")
+        self.dfimdq = get_science_data(dfile, "DQ", det)
+
+    def plane_range(self, wave):
+        """
+        This function determines the planes needed to interpolate the cube at the given wavelengths, i.e. from
+        the plane right below the minimum wavelength to the plane right above the maximum wavelength. At least
+        two planes are always included, so that the interpolation of a sub-cube gives the same result as the
+        interpolation of the full cube.
+        Args:
+            wave: numpy array, wavelengths of the slit pixels (NaNs are ignored)
+
+        Returns:
+            first, last: integers, the planes needed are first to last-1
+        """
+        nplanes = self.dfwave.size
+        finite_wave = np.asarray(wave)[np.isfinite(wave)]
+        if finite_wave.size == 0 or nplanes < 2:
+            return 0, nplanes
+        first = np.searchsorted(self.dfwave, finite_wave.min(), side="right") - 1
+        first = int(np.clip(first, 0, nplanes - 2))
+        last = np.searchsorted(self.dfwave, finite_wave.max(), side="right") + 1
+        last = int(np.clip(last, first + 2, nplanes))
+        return first, last
+
+    def get_planes(self, wave):
+        """
+        This function reads the planes of the cube needed for the given wavelengths.
+        Args:
+            wave: numpy array, wavelengths of the slit pixels
+
+        Returns:
+            dfim: 3D numpy array, planes of the D-flat cube in science orientation
+            dfwave: 1D numpy array, wavelength of each of the planes
+        """
+        first, last = self.plane_range(wave)
+
+        def read_planes():
+            with fits.open(self.dfile, memmap=True) as hdul:
+                planes = np.array(hdul[self.ext].data[first:last])
+            return to_science_orientation(planes, self.det)
+        orientation = "_".join(("sci", self.det, "planes", str(first), str(last)))
+        dfim = _get_or_load(self.dfile, self.ext, orientation, read_planes)
+        return dfim, self.dfwave[first:last]
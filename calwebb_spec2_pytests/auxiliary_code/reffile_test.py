@@ -13,6 +13,9 @@ from astropy.time import Time
 from crds.matches import find_match_paths_as_dict as ref_matches
 from crds import getrecommendations
 
+from . import phase_timing
+from . import model_store
+
 
 def check_meta(input_file, match_key, match_val):
     input_val = input_file[match_key.lower()]
@@ -50,6 +53,7 @@ def load_input_file(path_to_input_file, logstream=None):
     return input_file
 
 
+@phase_timing.timed("reffile_test")
 def reffile_test(path_to_input_file, pipeline_step, logfile=None,
                  input_file=None):
     """
@@ -57,8 +61,10 @@ def reffile_test(path_to_input_file, pipeline_step, logfile=None,
     working with the reference file metadata directly. That way, if the rmap
     was updated manually on CRDS (to avoid redelivering files for a minor
     keyword change), this will test the actual match criteria.
+    The time of each phase is recorded per pipeline step (see phase_timing.py).
     """
     log_msgs = []
+    phase_timing.set_slit(pipeline_step)
 
     logstream, errstream = get_streams(logfile=logfile)
     
@@ -72,6 +78,9 @@ def reffile_test(path_to_input_file, pipeline_step, logfile=None,
             step_key = "R_" + pipeline_step.upper()
     
     #Identify the context
+    phase_timing.start_phase("file_read")
+    #The file may still be in memory or being written in the background
+    model_store.ensure_saved(path_to_input_file)
     context = fits.getval(path_to_input_file, "CRDS_CTX")
     
     #Identify the reference file
@@ -95,6 +104,7 @@ def reffile_test(path_to_input_file, pipeline_step, logfile=None,
         input_file = load_input_file(path_to_input_file, logstream=logstream)
     print("Grabbing CRDS match criteria...", file=logstream)
     log_msgs.append("Grabbing CRDS match criteria...")
+    phase_timing.start_phase("crds_match")
     try:
         match_criteria = ref_matches(context, reffile_name)[0]
     except ValueError:
@@ -111,6 +121,7 @@ def reffile_test(path_to_input_file, pipeline_step, logfile=None,
     match_criteria['META.SUBARRAY.NAME'] = subarray
 
     #Test whether the recommended reference file was actually selected
+    phase_timing.start_phase("crds_recommendation")
     recommended_reffile = getrecommendations(match_criteria,
                                              reftypes=[pipeline_step],
                                              context=context,
@@ -131,6 +142,7 @@ def reffile_test(path_to_input_file, pipeline_step, logfile=None,
         print(msg3)
 
     #Remove irrelevant match criteria
+    phase_timing.start_phase("metadata_checks")
     del match_criteria['observatory']
     del match_criteria['instrument']
     del match_criteria['filekind']
@@ -223,6 +235,7 @@ def check_all_reffiles(path_to_input_file, logfile=None):
     file's header. A file path may be included to redirect output to a log.
     """
     
+    model_store.ensure_saved(path_to_input_file)
     all_steps = list(fits.getval(path_to_input_file, "R_*"))
     
     if logfile is not None: #erase existing log, since we'll be appending later
@@ -0,0 +1,340 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+"""
+This script keeps the run manifest of PTT, i.e. the record of the pipeline steps ran (output suffix, output file,
+completion, and running time), the PTT running times, and the verdicts of the validation tests. It replaces the
+scanning of the True_steps_suffix_map and full_run_map text files: the text files are still written for the
+reports, but the information is read from the manifest.
+
+The manifest is a SQLite file next to the text map it belongs to (e.g. full_run_map_NRS1_manifest.sqlite for
+full_run_map_NRS1.txt). Every record is written in its own transaction and the queries are done by primary key,
+so several processes (e.g. the NRS1 and NRS2 runs, or the pytest workers) can write into the same manifest.
+
+The manifest also keeps the hash of the inputs of each step and the content hash of the files (see
+incremental_steps.py). These records are kept when a new run starts, since they are used to reuse the outputs of
+the previous runs.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.3"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the record of a step includes the time when it was recorded
+# Oct 2026 - Version 1.2: added the records of the step inputs hashes and of the file hashes
+# Oct 2026 - Version 1.3: the sum of the step times can stop at a given step
+
+
+# seconds to wait for another process to finish writing into the manifest
+db_timeout = 60.0
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+_current_state = {"manifest": None}
+
+
+def get_manifest_name(map_file):
+    """
+    This function returns the name of the manifest of the given text map.
+    Args:
+        map_file: string, path and name of the text map (e.g. full_run_map_NRS1.txt)
+
+    Returns:
+        manifest_file: string, absolute path and name of the manifest
+    """
+    map_root = os.path.splitext(os.path.abspath(map_file))[0]
+    return map_root+"_manifest.sqlite"
+
+
+def get_run_manifest(map_file, new_run=False):
+    """
+    This function returns the manifest of the given text map, creating it if necessary. The same object is
+    returned for all the calls with the same map in a process, and it becomes the current manifest.
+    Args:
+        map_file: string, path and name of the text map
+        new_run: boolean, if True all the previous records of the manifest are removed
+
+    Returns:
+        RunManifest object
+    """
+    manifest_file = get_manifest_name(map_file)
+    with _manifests_lock:
+        if manifest_file not in _manifests:
+            _manifests[manifest_file] = RunManifest(manifest_file)
+        manifest = _manifests[manifest_file]
+        _current_state["manifest"] = manifest
+    if new_run:
+        manifest.clear()
+    return manifest
+
+
+def get_current_manifest():
+    """
+    This function returns the manifest used last in this process.
+    Returns:
+        RunManifest object, None if no manifest has been used
+    """
+    return _current_state["manifest"]
+
+
+class RunManifest(object):
+    """
+    This class records the steps, times, and validation verdicts of a PTT run in a SQLite file.
+    """
+
+    def __init__(self, manifest_file):
+        """
+        Args:
+            manifest_file: string, full path of the SQLite file; if the file can not be created the manifest is
+                           only kept in memory
+        """
+        self.manifest_file = manifest_file
+        self._lock = threading.RLock()
+        try:
+            self._db = sqlite3.connect(manifest_file, timeout=db_timeout, check_same_thread=False)
+            self._create_tables()
+        except (OSError, sqlite3.Error):
+            print(" * WARNING: Unable to create the run manifest ", manifest_file, ", using it only in memory.")
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+            self._create_tables()
+
+    def _create_tables(self):
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS steps "
+                             "(step TEXT PRIMARY KEY, suffix TEXT, output_file TEXT, completed INTEGER, "
+                             "run_time REAL, recorded REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS times (name TEXT PRIMARY KEY, value REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS verdicts "
+                             "(test TEXT PRIMARY KEY, step TEXT, verdict TEXT, duration REAL, recorded REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS step_inputs "
+                             "(step TEXT PRIMARY KEY, inputs_hash TEXT, output_file TEXT, output_mtime INTEGER, "
+                             "output_size INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS file_hashes "
+                             "(file TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, file_hash TEXT)")
+
+    def _write(self, statement, values):
+        with self._lock, self._db:
+            self._db.execute(statement, values)
+
+    def _read(self, statement, values=()):
+        with self._lock:
+            return self._db.execute(statement, values).fetchall()
+
+    def clear(self):
+        """
+        This function removes all the records, i.e. it starts a new run. The step inputs and file hashes are kept.
+        Returns:
+            nothing
+        """
+        with self._lock, self._db:
+            for table in ("steps", "times", "verdicts"):
+                self._db.execute("DELETE FROM "+table)
+
+    def record_step(self, step, suffix, completed, run_time, output_file=None):
+        """
+        This function records the completion of a step. A step recorded again replaces the previous record.
+        Args:
+            step: string, name of the pipeline step
+            suffix: string, suffix of the output file of the step
+            completed: boolean, True if the step was completed and False if it was skipped
+            run_time: float, time it took for the step to run (in seconds)
+            output_file: string, path and name of the output file of the step
+
+        Returns:
+            nothing
+        """
+        self._write("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?)",
+                    (step, suffix, output_file, int(bool(completed)), float(run_time), time.time()))
+
+    def get_step(self, step):
+        """
+        This function returns the record of the given step.
+        Args:
+            step: string, name of the pipeline step
+
+        Returns:
+            record: dictionary with the keys suffix, output_file, completed, run_time, and recorded (the time when
+                    the step was recorded); None if the step has not been recorded
+        """
+        rows = self._read("SELECT suffix, output_file, completed, run_time, recorded FROM steps WHERE step = ?",
+                          (step,))
+        if not rows:
+            return None
+        suffix, output_file, completed, run_time, recorded = rows[0]
+        return {"suffix": suffix, "output_file": output_file, "completed": bool(completed), "run_time": run_time,
+                "recorded": recorded}
+
+    def get_steps(self):
+        """
+        This function returns the recorded steps in the order in which they were recorded.
+        Returns:
+            steps_list: list, names of the steps
+            suffix_list: list, suffix of the output file of each step
+            completion_list: list, True or False depending on whether the step completed or not
+        """
+        rows = self._read("SELECT step, suffix, completed FROM steps ORDER BY recorded, rowid")
+        steps_list = [row[0] for row in rows]
+        suffix_list = [row[1] for row in rows]
+        completion_list = [bool(row[2]) for row in rows]
+        return steps_list, suffix_list, completion_list
+
+    def get_total_step_time(self, last_step=None):
+        """
+        This function returns the sum of the running times of the recorded steps, in the order they were recorded.
+        Args:
+            last_step: string, if given the steps recorded after it are not added
+
+        Returns:
+            total_time: float, time in seconds; None if no steps have been recorded
+        """
+        rows = self._read("SELECT step, run_time FROM steps ORDER BY recorded, rowid")
+        if not rows:
+            return None
+        total_time = 0.0
+        for step, run_time in rows:
+            total_time += run_time
+            if step == last_step:
+                break
+        return total_time
+
+    def record_time(self, name, value):
+        """
+        This function records a time (e.g. PTT_start_time, PTT_end_time, pipeline_total_time).
+        Args:
+            name: string, name of the time
+            value: float, time in seconds
+
+        Returns:
+            nothing
+        """
+        self._write("INSERT OR REPLACE INTO times VALUES (?, ?)", (name, float(value)))
+
+    def get_time(self, name):
+        """
+        This function returns the recorded time.
+        Args:
+            name: string, name of the time
+
+        Returns:
+            value: float, None if the time has not been recorded
+        """
+        rows = self._read("SELECT value FROM times WHERE name = ?", (name,))
+        if not rows:
+            return None
+        return rows[0][0]
+
+    def record_verdict(self, test, verdict, step=None, duration=None):
+        """
+        This function records the verdict of a validation test.
+        Args:
+            test: string, name of the test (e.g. the pytest node id)
+            verdict: string, e.g. passed, failed, or skipped
+            step: string, name of the pipeline step validated by the test
+            duration: float, time it took for the test to run (in seconds)
+
+        Returns:
+            nothing
+        """
+        self._write("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                    (test, step, verdict, duration, time.time()))
+
+    def get_verdict(self, test):
+        """
+        This function returns the verdict of a validation test.
+        Args:
+            test: string, name of the test
+
+        Returns:
+            verdict: string, None if the test has not been recorded
+        """
+        rows = self._read("SELECT verdict FROM verdicts WHERE test = ?", (test,))
+        if not rows:
+            return None
+        return rows[0][0]
+
+    def get_verdicts(self, step=None):
+        """
+        This function returns the verdicts of the validation tests.
+        Args:
+            step: string, if given only the verdicts of the tests of this step are returned
+
+        Returns:
+            verdicts: dictionary, the verdict of each test
+        """
+        if step is None:
+            rows = self._read("SELECT test, verdict FROM verdicts ORDER BY recorded, rowid")
+        else:
+            rows = self._read("SELECT test, verdict FROM verdicts WHERE step = ? ORDER BY recorded, rowid", (step,))
+        return dict(rows)
+
+    def record_step_inputs(self, step, inputs_hash, output_file, output_mtime, output_size):
+        """
+        This function records the hash of the inputs of a step and the output file it produced.
+        Args:
+            step: string, name of the pipeline step
+            inputs_hash: string, hash of the input file, parameters, and software versions of the step
+            output_file: string, path and name of the output file of the step
+            output_mtime: integer, modification time of the output file (in nanoseconds)
+            output_size: integer, size of the output file (in bytes)
+
+        Returns:
+            nothing
+        """
+        self._write("INSERT OR REPLACE INTO step_inputs VALUES (?, ?, ?, ?, ?)",
+                    (step, inputs_hash, output_file, int(output_mtime), int(output_size)))
+
+    def get_step_inputs(self, step):
+        """
+        This function returns the record of the inputs of the given step.
+        Args:
+            step: string, name of the pipeline step
+
+        Returns:
+            record: dictionary with the keys inputs_hash, output_file, output_mtime, and output_size; None if the
+                    inputs of the step have not been recorded
+        """
+        rows = self._read("SELECT inputs_hash, output_file, output_mtime, output_size FROM step_inputs WHERE step = ?",
+                          (step,))
+        if not rows:
+            return None
+        inputs_hash, output_file, output_mtime, output_size = rows[0]
+        return {"inputs_hash": inputs_hash, "output_file": output_file, "output_mtime": output_mtime,
+                "output_size": output_size}
+
+    def record_file_hash(self, file_name, mtime, size, file_hash):
+        """
+        This function records the content hash of a file.
+        Args:
+            file_name: string, absolute path and name of the file
+            mtime: integer, modification time of the file (in nanoseconds)
+            size: integer, size of the file (in bytes)
+            file_hash: string, hash of the content of the file
+
+        Returns:
+            nothing
+        """
+        self._write("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                    (file_name, int(mtime), int(size), file_hash))
+
+    def get_file_hash(self, file_name, mtime, size):
+        """
+        This function returns the recorded content hash of a file, if the file has not changed since it was recorded.
+        Args:
+            file_name: string, absolute path and name of the file
+            mtime: integer, modification time of the file (in nanoseconds)
+            size: integer, size of the file (in bytes)
+
+        Returns:
+            file_hash: string, None if the file has not been recorded or it changed
+        """
+        rows = self._read("SELECT file_hash FROM file_hashes WHERE file = ? AND mtime = ? AND size = ?",
+                          (file_name, int(mtime), int(size)))
+        if not rows:
+            return None
+        return rows[0][0]
@@ -0,0 +1,244 @@
+import os
+import glob
+import shutil
+import subprocess
+
+
+"""
+This script keeps a local store of the pipeline step outputs shared by all the PTT runs of a machine (e.g. several
+working directories, users, or batches that run the same data through the same steps). The outputs are stored by the
+hash of the inputs of the step (see incremental_steps.py), i.e. the content of the input file, the step, its
+parameters, and the jwst version, so a step with the same inputs is not run again in another working directory: its
+output is linked from the store.
+
+The store is set with step_output_cache_dir in the PTT configuration file (empty switches it off), and its size is
+bounded by step_output_cache_gbytes: when a new output makes it larger, the outputs used least recently are removed.
+The outputs are materialized in the working directories as hard links (or as copies, with cp --reflink=auto, if the
+store is in another file system or step_output_cache_link is reflink). The stored files are read only, so that a
+hard linked output modified in its working directory does not change the store.
+
+The side products of a step that the validation scripts read (e.g. the interpolated flat of flat_field) are stored
+and materialized with its output, and the output is only taken from the store if all of them are there. They are
+named after the inputs hash of the output, e.g. <inputs hash>_interpolatedflat.fits, and removed with it.
+
+Note that the header of a linked output keeps the file name of the run that produced it.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.1"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the side products of the steps (e.g. the interpolated flat of flat_field) are also stored
+
+
+# default maximum size of the store, in GB
+default_max_gbytes = 50.0
+
+# ways of materializing the stored outputs in the working directories
+link_types = ("hardlink", "reflink")
+
+
+def get_step_output_cache(config):
+    """
+    This function returns the step output store set in the PTT configuration file.
+    Args:
+        config: object, this is the configuration file object
+
+    Returns:
+        StepOutputCache object, None if step_output_cache_dir is not set
+    """
+    cache_dir = config.get("additional_arguments", "step_output_cache_dir", fallback="").strip()
+    if not cache_dir:
+        return None
+    max_gbytes = config.getfloat("additional_arguments", "step_output_cache_gbytes", fallback=default_max_gbytes)
+    link_type = config.get("additional_arguments", "step_output_cache_link", fallback="hardlink")
+    return StepOutputCache(cache_dir, max_gbytes=max_gbytes, link_type=link_type)
+
+
+def copy_file(source_file, destination_file):
+    """
+    This function copies the file sharing its blocks when the file system allows it (reflink), otherwise it makes a
+    normal copy.
+    Args:
+        source_file: string, path and name of the file to copy
+        destination_file: string, path and name of the copy
+
+    Returns:
+        nothing
+    """
+    try:
+        subprocess.run(["cp", "--reflink=auto", source_file, destination_file], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        # e.g. cp does not know the --reflink option
+        shutil.copyfile(source_file, destination_file)
+
+
+class StepOutputCache(object):
+    """
+    This class stores the step outputs by the hash of the inputs of the step, and links them into the working
+    directories.
+    """
+
+    def __init__(self, cache_dir, max_gbytes=default_max_gbytes, link_type="hardlink"):
+        """
+        Args:
+            cache_dir: string, directory of the store
+            max_gbytes: float, maximum size of the store in GB
+            link_type: string, hardlink or reflink, how the outputs are materialized in the working directories
+        """
+        if link_type not in link_types:
+            raise ValueError("Unknown step_output_cache_link "+link_type+", it has to be one of "+repr(link_types))
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_gbytes * 1024.**3
+        self.link_type = link_type
+
+    def get_cached_file(self, step, inputs_hash, side_product=None):
+        """
+        This function returns the name of the stored output of the step, or of one of its side products.
+        Args:
+            step: string, name of the pipeline step
+            inputs_hash: string, hash of the inputs of the step
+            side_product: string, suffix of the side product (e.g. interpolatedflat), None for the output
+
+        Returns:
+            cached_file: string, path and name of the stored output
+        """
+        if side_product is not None:
+            return os.path.join(self.cache_dir, step, inputs_hash+"_"+side_product+".fits")
+        return os.path.join(self.cache_dir, step, inputs_hash+".fits")
+
+    def _link(self, source_file, destination_file):
+        """
+        This function makes the destination file a hard link to (or a copy of) the source file, replacing it
+        atomically if it exists.
+        """
+        tmp_file = destination_file+".tmp"+repr(os.getpid())
+        if os.path.lexists(tmp_file):
+            os.remove(tmp_file)
+        linked = False
+        if self.link_type == "hardlink":
+            try:
+                os.link(source_file, tmp_file)
+                linked = True
+            except OSError:
+                # e.g. the store is in another file system
+                pass
+        if not linked:
+            copy_file(source_file, tmp_file)
+        os.replace(tmp_file, destination_file)
+
+    def _set_used(self, cached_file):
+        """
+        This function records the time of the last use of the stored output, for the eviction.
+        """
+        open(cached_file+".used", "a").close()
+        os.utime(cached_file+".used")
+
+    def fetch(self, step, inputs_hash, step_output_file, side_product_files=None):
+        """
+        This function materializes the stored output of the step, and its side products, in the working directory.
+        Args:
+            step: string, name of the pipeline step
+            inputs_hash: string, hash of the inputs of the step
+            step_output_file: string, path and name of the output file of the step
+            side_product_files: dictionary, path and name of the file of each side product of the step, by suffix
+
+        Returns:
+            boolean, True if the output and all its side products were in the store
+        """
+        cached_file = self.get_cached_file(step, inputs_hash)
+        side_product_files = side_product_files or {}
+        cached_side_products = {side_product: self.get_cached_file(step, inputs_hash, side_product)
+                                for side_product in side_product_files}
+        if not all(os.path.isfile(file_name) for file_name in [cached_file]+list(cached_side_products.values())):
+            return False
+        try:
+            # the output is linked last, since it is what tells the next runs that the step is done
+            for side_product, side_product_file in side_product_files.items():
+                self._link(cached_side_products[side_product], side_product_file)
+            self._link(cached_file, step_output_file)
+            self._set_used(cached_file)
+        except OSError as err:
+            # e.g. the output was removed from the store by another run
+            print(" * WARNING: Unable to use the stored output of step "+step+": "+repr(err))
+            return False
+        print(" * The output of step "+step+" was taken from the step output store: ", cached_file)
+        return True
+
+    def store(self, step, inputs_hash, step_output_file, side_product_files=None):
+        """
+        This function adds the output of the step, and its side products, to the store, and removes the outputs used
+        least recently if the store is larger than its maximum size. The output is not stored if one of its side
+        products is missing.
+        Args:
+            step: string, name of the pipeline step
+            inputs_hash: string, hash of the inputs of the step
+            step_output_file: string, path and name of the output file of the step
+            side_product_files: dictionary, path and name of the file of each side product of the step, by suffix
+
+        Returns:
+            nothing
+        """
+        cached_file = self.get_cached_file(step, inputs_hash)
+        side_product_files = side_product_files or {}
+        missing_files = [file_name for file_name in side_product_files.values() if not os.path.isfile(file_name)]
+        if missing_files:
+            print(" * WARNING: The output of step "+step+" was not added to the step output store, since its side "
+                  "products are missing: "+repr(missing_files))
+            return
+        try:
+            os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+            # the side products are stored first, since a stored output is taken as complete
+            for side_product, side_product_file in side_product_files.items():
+                cached_side_product = self.get_cached_file(step, inputs_hash, side_product)
+                if not os.path.isfile(cached_side_product):
+                    self._link(side_product_file, cached_side_product)
+                    os.chmod(cached_side_product, 0o444)
+            if not os.path.isfile(cached_file):
+                self._link(step_output_file, cached_file)
+                os.chmod(cached_file, 0o444)
+            self._set_used(cached_file)
+        except OSError as err:
+            print(" * WARNING: Unable to add the output of step "+step+" to the step output store: "+repr(err))
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        This function removes the outputs used least recently, with their side products, until the store is not
+        larger than its maximum size.
+        Returns:
+            removed_files: list, path and name of the removed outputs
+        """
+        stored = []
+        for cached_file in glob.glob(os.path.join(self.cache_dir, "*", "*.fits")):
+            # the side products are removed with their output
+            if "_" in os.path.basename(cached_file):
+                continue
+            side_product_files = glob.glob(cached_file.replace(".fits", "_*.fits"))
+            try:
+                used_file = cached_file+".used"
+                last_used = os.path.getmtime(used_file) if os.path.isfile(used_file) else 0.0
+                size = sum(os.path.getsize(file_name) for file_name in [cached_file]+side_product_files)
+                stored.append((last_used, size, cached_file, side_product_files))
+            except OSError:
+                # removed by another run
+                continue
+        total_size = sum(size for _, size, _, _ in stored)
+        removed_files = []
+        for _, size, cached_file, side_product_files in sorted(stored):
+            if total_size <= self.max_bytes:
+                break
+            for file_name in [cached_file, cached_file+".used"]+side_product_files:
+                try:
+                    os.remove(file_name)
+                except OSError:
+                    # removed by another run
+                    pass
+            total_size -= size
+            removed_files.append(cached_file)
+        return removed_files
@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+
+try:
+    import resource
+except ImportError:
+    # the resource module is not available in all platforms, the peak memory is then not recorded
+    resource = None
+
+try:
+    from . import memory_tracking
+except ImportError:
+    # imported from the utils directory, outside of the package
+    import memory_tracking
+
+
+"""
+This script records the running time of the pipeline steps without reading the pipeline log. A wrapper is installed
+around Step.run of the stpipe package, which is called by Step.call and Pipeline.call and by a pipeline for each of
+its steps, so every step ran by PTT (with calwebb_spec2, calwebb_detector1, or step by step) is measured.
+
+For each step run a record is kept with the wall time, CPU time, and memory of the step. The peak memory of the
+step is sampled_rss_peak_mbytes, the highest resident memory (RSS) sampled while the step ran (and
+tracemalloc_peak_mbytes, if tracemalloc is on; see memory_tracking.py), and the step fails if it went over its
+memory ceiling. process_peak_rss_mbytes is the high-water mark of the whole process at the end of the step, and
+process_peak_rss_increase_mbytes is how much the step raised it, i.e. it is 0 for a step that used less memory than
+a step ran before it, so it is not the peak of the step.
+
+This script only imports memory_tracking.py. A copy of both is kept in the utils directory for run_cal_detector1.py.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.2"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: the sampled RSS peak and tracemalloc peak of each step are recorded, and the step fails if
+#                         it goes over its memory ceiling (see memory_tracking.py)
+# Oct 2026 - Version 1.2: the high-water mark of the process is recorded as process_peak_rss_mbytes and
+#                         process_peak_rss_increase_mbytes, since it is not the peak of the step
+
+
+# records of all the steps ran since the hooks were installed (or the records were cleared)
+step_records = []
+
+_records_lock = threading.Lock()
+_hook_state = {"original_run": None, "step_class": None}
+_thread_state = threading.local()
+
+
+def get_peak_rss_mbytes():
+    """
+    This function returns the peak resident memory of the process.
+    Returns:
+        peak_rss: float, peak RSS in MB, None if it can not be determined in this platform
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes in macOS and in kB in Linux
+    if sys.platform == "darwin":
+        return peak_rss / 1024.0**2
+    return peak_rss / 1024.0
+
+
+def _get_input_name(args):
+    """
+    This function returns the name of the input of a step, i.e. the file name or the file name of the data model.
+    """
+    if not args:
+        return None
+    step_input = args[0]
+    if isinstance(step_input, str):
+        return os.path.basename(step_input)
+    try:
+        return step_input.meta.filename
+    except AttributeError:
+        return None
+
+
+def _timed_run(step, *args, **kwargs):
+    """
+    This function runs the step (with the original Step.run) and records its running time and memory.
+    """
+    stack = getattr(_thread_state, "stack", None)
+    if stack is None:
+        stack = _thread_state.stack = []
+    record = {"step": step.name,
+              "step_class": type(step).__name__,
+              "parent": stack[-1]["step"] if stack else None,
+              "depth": len(stack),
+              "input": _get_input_name(args),
+              "start_time": time.time()}
+    initial_rss = get_peak_rss_mbytes()
+    memory_region = memory_tracking.start_region("step", step.name)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    stack.append(record)
+    completed = False
+    try:
+        result = _hook_state["original_run"](step, *args, **kwargs)
+        completed = True
+    finally:
+        stack.pop()
+        record["wall_time"] = time.perf_counter() - wall_start
+        record["cpu_time"] = time.process_time() - cpu_start
+        record["end_time"] = time.time()
+        record["process_peak_rss_mbytes"] = get_peak_rss_mbytes()
+        record["process_peak_rss_increase_mbytes"] = None
+        if initial_rss is not None:
+            record["process_peak_rss_increase_mbytes"] = record["process_peak_rss_mbytes"] - initial_rss
+        memory_peaks = memory_tracking.end_region(memory_region)
+        record["sampled_rss_peak_mbytes"] = memory_peaks["rss_peak_mbytes"]
+        record["tracemalloc_peak_mbytes"] = memory_peaks["tracemalloc_peak_mbytes"]
+        record["skipped"] = bool(getattr(step, "skip", False))
+        record["completed"] = completed
+        with _records_lock:
+            step_records.append(record)
+    memory_tracking.check_ceiling()
+    return result
+
+
+def install_step_hooks():
+    """
+    This function installs the timing wrapper around Step.run. Installing it more than once has no effect.
+    Returns:
+        installed: boolean, False if the pipeline could not be imported
+    """
+    if _hook_state["original_run"] is not None:
+        return True
+    try:
+        from jwst.stpipe import Step
+    except ImportError:
+        print(" * WARNING: Unable to import the pipeline, the step running times will not be recorded.")
+        return False
+    original_run = Step.run
+
+    @functools.wraps(original_run)
+    def run(self, *args, **kwargs):
+        return _timed_run(self, *args, **kwargs)
+
+    _hook_state["original_run"] = original_run
+    _hook_state["step_class"] = Step
+    Step.run = run
+    return True
+
+
+def remove_step_hooks():
+    """
+    This function restores the original Step.run. The records are kept.
+    Returns:
+        nothing
+    """
+    if _hook_state["original_run"] is None:
+        return
+    _hook_state["step_class"].run = _hook_state["original_run"]
+    _hook_state["original_run"] = None
+    _hook_state["step_class"] = None
+
+
+def get_step_records(step=None):
+    """
+    This function returns a copy of the records, in the order in which the steps finished.
+    Args:
+        step: string, if given only the records of the step with this name are returned
+
+    Returns:
+        records: list of dictionaries
+    """
+    with _records_lock:
+        return [dict(record) for record in step_records if step is None or record["step"] == step]
+
+
+def clear_step_records():
+    """
+    This function removes all the records.
+    Returns:
+        nothing
+    """
+    with _records_lock:
+        del step_records[:]
+
+
+def write_step_records(records_file, records=None):
+    """
+    This function appends the records to a JSON lines file, i.e. one JSON object per line.
+    Args:
+        records_file: string, path and name of the file
+        records: list of dictionaries, if None all the current records are written
+
+    Returns:
+        nothing
+    """
+    if records is None:
+        records = get_step_records()
+    with open(records_file, "a") as rf:
+        for record in records:
+            rf.write(json.dumps(record)+"\n")
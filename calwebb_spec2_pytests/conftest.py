@@ -7,14 +7,39 @@ import re
 import pytest
 import configparser
 
+from . import core_utils
+from .auxiliary_code import step_timing
+from .auxiliary_code import run_manifest
+from .auxiliary_code import observation_context
+from .auxiliary_code import model_store
+from .auxiliary_code import background_writer
+from .auxiliary_code import phase_timing
+from .auxiliary_code import memory_tracking
+from .auxiliary_code import esa_file_index
+from .auxiliary_code import esa_trace_reader
+
 
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.0"
+__version__ = "2.3"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: added the recording of the step running times through hooks around the pipeline steps
+# Oct 2026 - Version 1.2: the verdicts of the tests are recorded in the run manifest
+# Oct 2026 - Version 1.3: added the session observation context fixture
+# Oct 2026 - Version 1.4: added the in-memory chaining of the step outputs
+# Oct 2026 - Version 1.5: added the background writing of the step outputs and validation files
+# Oct 2026 - Version 1.6: added the PTT phase option for the overlapped runs of run_PTT.py
+# Oct 2026 - Version 1.7: the configuration file is given to core_utils, so PTT can run from any directory
+# Oct 2026 - Version 1.8: the times of the validation phases are written in a JSON summary and added to the html report
+# Oct 2026 - Version 1.9: the peak memory of the steps, validators, slits, and tests is recorded and reported, and the
+#                         tests fail if they go over their memory ceiling
+# Oct 2026 - Version 2.0: the ESA file index is taken from the configuration file
+# Oct 2026 - Version 2.1: the ESA files kept open by the validations are closed at the end of the session
+# Oct 2026 - Version 2.2: the processes of the overlapped runs write their own summary of the validation times
+# Oct 2026 - Version 2.3: the processes of the overlapped runs write their own summary of the peak memory
 
 
 def pytest_addoption(parser):
@@ -25,6 +50,28 @@ def pytest_addoption(parser):
         help="specifies the file used for the test")
     parser.addoption("--gen_report", action="store_true",
         help="generate a report or not")
+    parser.addoption("--ptt_phase", action="store", default="all", choices=core_utils.PTT_phases,
+        help="run and validate the steps (all), only run the steps (pipeline), or only validate them (validation)")
+
+
+def pytest_collection_modifyitems(config, items):
+    """
+    In the pipeline phase only the first test of each module is kept, since the step is run by the output_hdul
+    fixture of the module and the tests are run by the validation processes (see run_PTT.py).
+    """
+    if config.getoption("--ptt_phase") != "pipeline":
+        return
+    kept, deselected, modules = [], [], set()
+    for item in items:
+        test_module = item.nodeid.split("::")[0]
+        if test_module in modules:
+            deselected.append(item)
+        else:
+            modules.add(test_module)
+            kept.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = kept
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -37,9 +84,212 @@ def config(request):
     request.htmlpath = request.config.getoption('htmlpath', working_dir+"/report.html")
     #request.htmlpath = working_dir+"/report.html"
     config.read(request.config.getoption("--config_file"))
+    core_utils.set_PTT_config_file(request.config.getoption("--config_file"))
+    esa_file_index.set_index_file(config.get("esa_intermediary_products", "esa_file_index", fallback=""))
+    ptt_phase = request.config.getoption("--ptt_phase")
+    core_utils.set_PTT_phase(ptt_phase)
+    if ptt_phase == "validation":
+        # the steps were already run by the pipeline process
+        for step in config.options("run_pipe_steps"):
+            config.set("run_pipe_steps", step, "False")
     return config
 
 
+@pytest.fixture(scope="session")
+def obs_context(config):
+    """
+    Observation context of the session (detector, mode, grating, filter, directories, and file names), built once from
+    the configuration file and the header of the input file. It is immutable, so it can be passed to the validators.
+    """
+    return observation_context.build_observation_context(config)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def background_writes(config):
+    """
+    Sets the number of threads that write the step outputs and the validation files in the background, and waits
+    until all the files are written at the end of the session.
+    """
+    n_threads = config.getint("additional_arguments", "background_writer_threads", fallback=0)
+    queue_size = config.getint("additional_arguments", "background_writer_queue_size",
+                               fallback=background_writer.default_queue_size)
+    background_writer.configure(n_threads, queue_size=queue_size)
+    yield background_writer
+    errors = background_writer.shutdown()
+    if errors:
+        print("\n * WARNING: "+repr(len(errors))+" files could not be written in the background.")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def chained_models(config, background_writes):
+    """
+    Sets the in-memory chaining of the step outputs for step by step runs, and writes the outputs that are still only
+    in memory at the end of the session.
+    """
+    chain_models = config.getboolean("additional_arguments", "chain_models_in_memory", fallback=False)
+    save_outputs = config.getboolean("additional_arguments", "save_step_outputs", fallback=True)
+    model_store.configure(chain_models, save_outputs=save_outputs)
+    yield model_store
+    model_store.clear()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def step_timings(config):
+    """
+    Records the wall time, CPU time, and peak memory of every pipeline step ran in the session, and appends the
+    records to the PTT_step_timings.jsonl file in the working directory at the end of the session.
+    """
+    step_timing.install_step_hooks()
+    yield step_timing.step_records
+    step_timing.remove_step_hooks()
+    records = step_timing.get_step_records()
+    if records:
+        working_dir = config.get("calwebb_spec2_input_file", "working_directory")
+        records_file = os.path.join(working_dir, "PTT_step_timings.jsonl")
+        step_timing.write_step_records(records_file, records)
+        print("\n * Running times of "+repr(len(records))+" pipeline steps written in file: "+records_file)
+
+
+def get_summary_file_name(config, summary_root):
+    """
+    Returns the path and name of a summary file of the session in the working directory. In the overlapped runs of
+    run_PTT.py several pytest processes share the working directory, so the file of each process has the phase and
+    process id in its name, e.g. PTT_validator_timings_validation_1234.json.
+    """
+    working_dir = config.get("calwebb_spec2_input_file", "working_directory")
+    ptt_phase = core_utils.get_PTT_phase()
+    if ptt_phase != "all":
+        summary_root = summary_root+"_"+ptt_phase+"_"+repr(os.getpid())
+    return os.path.join(working_dir, summary_root+".json")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def validator_timings(config):
+    """
+    Records the time of each phase of the validation scripts, per slit, and writes the summary in the
+    PTT_validator_timings.json file in the working directory at the end of the session (see get_summary_file_name).
+    """
+    phase_timing.clear_phase_records()
+    yield phase_timing
+    if phase_timing.get_phase_records():
+        summary_file = get_summary_file_name(config, "PTT_validator_timings")
+        phase_timing.write_phase_summary(summary_file)
+        print("\n * Times of the validation phases written in file: "+summary_file)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def memory_peaks(config):
+    """
+    Sets the sampling of the memory and the memory ceilings, and writes the peak memory of the steps, validators,
+    slits, and tests in the PTT_memory_peaks.json file in the working directory at the end of the session (see
+    get_summary_file_name).
+    """
+    sample_interval = config.getfloat("additional_arguments", "memory_sample_interval",
+                                      fallback=memory_tracking.default_sample_interval)
+    use_tracemalloc = config.getboolean("additional_arguments", "memory_tracemalloc", fallback=False)
+    default_ceiling = config.getfloat("additional_arguments", "memory_ceiling_mbytes", fallback=0)
+    ceilings = memory_tracking.parse_ceilings(config.get("additional_arguments", "memory_ceilings", fallback=""))
+    memory_tracking.configure(sample_interval, use_tracemalloc=use_tracemalloc, default_ceiling=default_ceiling,
+                              ceilings=ceilings)
+    memory_tracking.clear_memory_records()
+    yield memory_tracking
+    memory_tracking.configure(sample_interval, use_tracemalloc=False)
+    if memory_tracking.get_memory_records():
+        summary_file = get_summary_file_name(config, "PTT_memory_peaks")
+        memory_tracking.write_memory_summary(summary_file)
+        print("\n * Peak memory of the steps, validators, and tests written in file: "+summary_file)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    """
+    Starts the recording of the peak memory of the test, which includes its setup (e.g. the step run by the
+    output_hdul fixture).
+    """
+    test_name = getattr(item, "originalname", None) or item.name
+    item.ptt_memory_region = memory_tracking.start_region("test", test_name)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    """
+    Adds the peak memory of the test to its report, and fails the test if it went over its memory ceiling.
+    """
+    outcome = yield
+    report = outcome.get_result()
+    memory_region = getattr(item, "ptt_memory_region", None)
+    # the peak is taken at the end of the test call, or at the end of the setup if the test did not get to be called
+    if memory_region is None or call.when == "teardown" or (call.when == "setup" and report.passed):
+        return
+    item.ptt_memory_region = None
+    peaks = memory_tracking.end_region(memory_region)
+    for name, value in peaks.items():
+        report.user_properties.append((name, value))
+    if peaks["ceiling_exceeded"] and report.passed:
+        report.outcome = "failed"
+        report.longrepr = "RSS peak of "+"{:.1f}".format(peaks["rss_peak_mbytes"])+" MB is over the memory ceiling " \
+                          "of "+"{:.1f}".format(memory_region["ceiling"])+" MB of the test"
+
+
+def get_pytest_html_major_version():
+    """
+    Returns the major version of the pytest-html plugin, 0 if it can not be determined.
+    """
+    try:
+        from importlib import metadata
+        return int(metadata.version("pytest-html").split(".")[0])
+    except Exception:
+        # e.g. python < 3.8 or pytest-html not installed
+        return 0
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_html_results_summary(prefix, summary, postfix):
+    """
+    Adds the tables of the times of the validation phases and of the peak memory to the summary of the html report.
+    """
+    html_tables = "\n".join([html_table for html_table in (phase_timing.get_html_tables(),
+                                                             memory_tracking.get_html_table()) if html_table])
+    if not html_tables:
+        return
+    # pytest-html versions before 4 take py.xml nodes, which escape plain strings
+    if get_pytest_html_major_version() < 4:
+        try:
+            from py.xml import raw
+            html_tables = raw(html_tables)
+        except ImportError:
+            pass
+    postfix.append(html_tables)
+
+
+def pytest_runtest_logreport(report):
+    """
+    Records the verdict of each test in the run manifest of the current map, i.e. the map of the step being tested.
+    """
+    # the verdict is taken from the test call, or from the setup if the test did not get to be called
+    if report.when != "call" and report.passed:
+        return
+    if report.when == "teardown":
+        return
+    # in the overlapped runs the verdicts are the ones of the validation processes
+    if core_utils.get_PTT_phase() == "pipeline":
+        return
+    manifest = run_manifest.get_current_manifest()
+    if manifest is None:
+        return
+    # the module of the test is named after the step, e.g. A_assign_wcs/test_assign_wcs.py
+    test_module = os.path.basename(report.nodeid.split("::")[0])
+    step = os.path.splitext(test_module)[0].replace("test_", "", 1)
+    manifest.record_verdict(report.nodeid, report.outcome, step=step, duration=report.duration)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    """
+    Closes the ESA files that the validations kept open to reuse them between tests.
+    """
+    esa_trace_reader.close_esa_traces()
+
+
 """
 @pytest.mark.hookwrapper
 def pytest_runtest_makereport(item, call):
@@ -7,6 +7,11 @@ import time
 import subprocess
 from astropy.io import fits
 
+from .auxiliary_code import run_manifest
+from .auxiliary_code import header_cache
+from .auxiliary_code import model_store
+from .auxiliary_code import incremental_steps
+
 '''
 This script contains functions frequently used in the test suite.
 '''
@@ -14,11 +19,25 @@ This script contains functions frequently used in the test suite.
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.2"
+__version__ = "1.12"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
 # Feb 2019 - Version 1.2: made changes to be able to process 491 and 492 files in the same directory
+# Oct 2026 - Version 1.3: the pipeline log files are read in a single pass with precompiled patterns, and only the
+#                         new lines are read when the same file is queried again
+# Oct 2026 - Version 1.4: the steps, suffixes, and running times are recorded in the run manifest (see
+#                         run_manifest.py) and read from it instead of re-scanning the text maps
+# Oct 2026 - Version 1.5: the headers and keywords are read through the header cache (see header_cache.py)
+# Oct 2026 - Version 1.6: the headers of the step outputs kept in memory and not yet written are read from the models
+#                         (see model_store.py)
+# Oct 2026 - Version 1.7: the step input file is also found if it is still in memory or being written in the background
+# Oct 2026 - Version 1.8: added the PTT phases of the overlapped runs (see set_PTT_phase and run_PTT.py)
+# Oct 2026 - Version 1.9: the PTT configuration file is set by conftest, so PTT can run from any directory
+# Oct 2026 - Version 1.10: the steps are only run again when their inputs changed if incremental_steps is True (see
+#                          get_run_pipe_step and incremental_steps.py)
+# Oct 2026 - Version 1.11: the total pipeline time only adds the steps up to extract_1d, as the text map reading did
+# Oct 2026 - Version 1.12: the validation processes open the run manifest of the map, so the verdicts are recorded
 
 
 # dictionary of the steps and corresponding strings to be added to the file name after the step has ran
@@ -40,6 +59,85 @@ step_string_dict["cube_build"]       = {"outfile" : True, "suffix" : "_s3d"}
 step_string_dict["extract_1d"]       = {"outfile" : True, "suffix" : "_x1d"}
 
 
+# phases of a PTT run: all (the steps are run and validated by the same pytest process), pipeline (the steps are run),
+# and validation (the steps are only validated), see set_PTT_phase
+PTT_phases = ("all", "pipeline", "validation")
+_phase_state = {"phase": "all"}
+
+
+def set_PTT_phase(phase):
+    """
+    This function sets the phase of the PTT run. In the overlapped runs of run_PTT.py one pytest process runs the
+    pipeline steps (phase pipeline) while each finished step is validated by another pytest process (phase
+    validation). The validation processes do not write the maps or the times of the run, and in the pipeline process
+    the step outputs are written before the step is recorded, since they are read by the other processes.
+    Args:
+        phase: string, one of PTT_phases
+
+    Returns:
+        nothing
+    """
+    if phase not in PTT_phases:
+        raise ValueError("Unknown PTT phase: "+repr(phase)+", it has to be one of "+repr(PTT_phases))
+    _phase_state["phase"] = phase
+
+
+def get_PTT_phase():
+    """
+    This function returns the phase of the PTT run, see set_PTT_phase.
+    """
+    return _phase_state["phase"]
+
+
+# PTT configuration file of the run, it is set by conftest.py with the --config_file option
+_config_state = {"config_file": "../calwebb_spec2_pytests/PTT_config.cfg"}
+
+
+def set_PTT_config_file(config_file):
+    """
+    This function sets the PTT configuration file of the run, so that the functions that read it do not depend on
+    the directory PTT is run from (e.g. the isolated run directory of each detector, see run_PTT.py).
+    Args:
+        config_file: string, path and name of the PTT configuration file
+
+    Returns:
+        nothing
+    """
+    _config_state["config_file"] = os.path.abspath(config_file)
+
+
+def get_PTT_config_file():
+    """
+    This function returns the PTT configuration file of the run, see set_PTT_config_file.
+    """
+    return _config_state["config_file"]
+
+
+def records_run():
+    """
+    This function returns True if this process writes the maps and times of the run, i.e. if it is not a validation
+    process of an overlapped run.
+    """
+    return _phase_state["phase"] != "validation"
+
+
+def get_run_pipe_step(config, step, txt_name, step_input_file, step_output_file):
+    """
+    This function determines if the pipeline step is to be run, i.e. if it is set to True in run_pipe_steps and, when
+    incremental_steps is True, its inputs changed since its output file was produced.
+    Args:
+        config: object, this is the configuration file object
+        step: string, name of the pipeline step
+        txt_name: string, path and name of the True_steps_suffix_map text file
+        step_input_file: string, path and name of the input file of the step
+        step_output_file: string, path and name of the output file of the step
+
+    Returns:
+        run_pipe_step: boolean
+    """
+    return incremental_steps.check_run_step(config, step, txt_name, step_input_file, step_output_file)
+
+
 def getlist(option, sep=',', chars=None):
     """Return a list from a ConfigParser option. By default,
        split on a comma and strip whitespaces."""
@@ -57,21 +155,28 @@ def read_hdrfits(fits_file_name, info=False, show_hdr=False, ext=0):
         ext: integer, number of extension to be read
 
     Returns:
-        hdrl: The header of the fits file
+        hdrl: The header of the fits file (shared with the header cache, it should not be modified)
     '''
-    #  Read the fits file
-    hdulist = fits.open(fits_file_name)
+    # the step output may still be only in memory (see model_store.py)
+    hdrl = None
+    if ext == 0 and not info:
+        hdrl = model_store.get_header(fits_file_name)
+    if hdrl is not None:
+        if show_hdr:
+            print ('\n FILE HEADER: \n')
+            print (repr(hdrl))
+        return hdrl
+    model_store.ensure_saved(fits_file_name)
     # print on screen what extensions are in the file
     if info:
         print ('\n FILE INFORMATION: \n')
-        hdulist.info()
+        with fits.open(fits_file_name) as hdulist:
+            hdulist.info()
     # get and print header
-    hdrl = hdulist[ext].header
+    hdrl = header_cache.get_header(fits_file_name, ext)
     if show_hdr:
         print ('\n FILE HEADER: \n')
         print (repr(hdrl))
-    # close the fits file
-    hdulist.close()
     return hdrl
 
 
@@ -105,10 +210,42 @@ def get_keywd_val(fits_file_name, keywd, ext=0):
     Returns:
         keywd_val: the value corresponding to the inputed keyword
     """
-    keywd_val = fits.getval(fits_file_name, keywd, ext)
+    if ext == 0 and model_store.is_pending(fits_file_name):
+        return model_store.get_header(fits_file_name)[keywd]
+    model_store.ensure_saved(fits_file_name)
+    keywd_val = header_cache.get_value(fits_file_name, keywd, ext)
     return keywd_val
 
 
+def set_keywd_val(fits_file_name, keywd, value, ext=0):
+    """
+    This function sets the value of the given keyword in the file, and removes the file from the header cache.
+    Args:
+        fits_file_name: name of the fits file to be modified
+        keywd: keyword to be set
+        value: value of the keyword
+        ext: extension in which the kwyword lives, by default it is set to the
+             primary extension.
+
+    Returns:
+        nothing
+    """
+    header_cache.setval(fits_file_name, keywd, ext, value=value)
+
+
+def clear_header_cache(fits_file_name=None):
+    """
+    This function removes the headers of the file from the header cache, i.e. it has to be called when PTT (re)writes
+    a fits file, so that its header is read again.
+    Args:
+        fits_file_name: name of the fits file written, if None all the headers are removed
+
+    Returns:
+        nothing
+    """
+    header_cache.invalidate_header(fits_file_name)
+
+
 def get_sci_extensions(fits_file_name):
     """
     This function obtains all the science extensions in the given file
@@ -143,7 +280,7 @@ def get_step_inandout_filename(step, initial_input_file, working_directory, debu
     """
 
     # make sure the input file name has the detector included in the name of the output files
-    detector = fits.getval(initial_input_file, "DETECTOR", 0)
+    detector = get_keywd_val(initial_input_file, "DETECTOR")
     initial_input_file_basename = os.path.basename(initial_input_file)
     if "_uncal_rate" in initial_input_file_basename:
         initial_input_file_basename = initial_input_file_basename.replace("_uncal_rate", "")
@@ -193,7 +330,7 @@ def get_step_inandout_filename(step, initial_input_file, working_directory, debu
                                 # make sure the input file exists
                                 if debug:
                                     print("Step creates output file, checking if it exists: ", step_input_filename)
-                                if os.path.isfile(step_input_filename):
+                                if model_store.exists(step_input_filename):
                                     # break and exit the while loop
                                     exit_while_loop = True
                                     break
@@ -268,7 +405,7 @@ def add_detector2filename(working_directory, step_input_file):
                     "_interpolatedflat", "_s2d", "_s3d", "_x1d", "_cal"]
 
     # get the detector name and add it
-    det = fits.getval(step_input_file, "DETECTOR", 0)
+    det = get_keywd_val(step_input_file, "DETECTOR")
     #step_input_file_basename = os.path.basename(step_input_file).replace(".fits", "")
     ptt_directory = os.getcwd()  # directory where PTT lives
     #step_files = glob.glob(os.path.join(ptt_directory, step_input_file_basename+"*.fits"))  # get all fits files just created
@@ -307,7 +444,11 @@ def read_True_steps_suffix_map(txtfile_name_with_path):
         completion_list: list, strings of True or False depending on whether the step completed or not
 
     """
-    steps_list, suffix_list, completion_list = [], [], []
+    manifest = run_manifest.get_run_manifest(txtfile_name_with_path)
+    steps_list, suffix_list, completion_list = manifest.get_steps()
+    if steps_list:
+        return steps_list, suffix_list, [str(completed) for completed in completion_list]
+    # the map was not written by this version of PTT, read the text file
     with open(txtfile_name_with_path, "r") as tf:
         for line in tf.readlines():
             if "#" not in line:
@@ -328,6 +469,9 @@ def read_completion_to_full_run_map(full_run_map, step):
     Returns:
         step_product = string, name of the intermediary fits product of the step
     """
+    step_record = run_manifest.get_run_manifest(full_run_map).get_step(step)
+    if step_record is not None:
+        return step_record["suffix"]
     step_product = ""
     with open(full_run_map, "r") as tf:
         for line in tf.readlines():
@@ -337,6 +481,182 @@ def read_completion_to_full_run_map(full_run_map, step):
     return step_product
 
 
+# precompiled patterns to read the pipeline log files, e.g.
+# 2019-11-21 10:11:12,345 - stpipe.Spec2Pipeline.assign_wcs - INFO - Step assign_wcs running with args (...)
+# 2019-11-21 10:11:20,678 - stpipe.Spec2Pipeline.assign_wcs - INFO - Step assign_wcs done
+log_timestamp_pattern = re.compile(r"^(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})(?:[,.](\d+))?")
+log_step_pattern = re.compile(r"\bStep (\w+) (running with args|done)\b")
+
+# names of the step classes, as they appear in the log when a step is run on its own
+step_class_names = {"AssignWcsStep": "assign_wcs", "BackgroundStep": "bkg_subtract", "ImprintStep": "imprint_subtract",
+                    "MSAFlagOpenStep": "msa_flagging", "Extract2dStep": "extract_2d", "FlatFieldStep": "flat_field",
+                    "SourceTypeStep": "srctype", "PathLossStep": "pathloss", "BarShadowStep": "barshadow",
+                    "PhotomStep": "photom", "ResampleSpecStep": "resample_spec", "CubeBuildStep": "cube_build",
+                    "Extract1dStep": "extract_1d"}
+
+# parsed pipeline log files, so that a file is read only once (and afterwards only its new lines)
+_log_timelines = {}
+
+
+class PipelineLogTimeline(object):
+    """
+    This class reads a pipeline log file in a single pass and records the start, end, and running time of each
+    pipeline invocation and of each step in it. The file can keep growing, calling update() only reads the lines
+    written since the last call; if the file was replaced or truncated it is read again from the beginning.
+    """
+
+    def __init__(self, log_file):
+        """
+        Args:
+            log_file: string, path and name of the pipeline log file
+        """
+        self.log_file = log_file
+        self.reset()
+
+    def reset(self):
+        """
+        This function removes all the recorded times, so that the file is read again from the beginning.
+        """
+        # each invocation is a dictionary with pipeline, start_time, end_time, run_time, and steps (list of the
+        # indices of its steps in self.steps)
+        self.invocations = []
+        # each step is a dictionary with step, invocation, start_time, end_time, and run_time
+        self.steps = []
+        self._open_steps = {}
+        self._offset = 0
+        self._partial_line = ""
+        self._file_id = None
+
+    @staticmethod
+    def get_timestamp(line):
+        """
+        This function obtains the time stamp at the beginning of a log line.
+        Args:
+            line: string, line of the log file
+
+        Returns:
+            timestamp: float, time stamp in seconds, None if the line does not start with a date and time
+        """
+        match = log_timestamp_pattern.match(line)
+        if match is None:
+            return None
+        year, month, day, hour, minute, sec, frac = match.groups()
+        timestamp = time.mktime((int(year), int(month), int(day), int(hour), int(minute), int(sec), 0, 0, -1))
+        if frac is not None:
+            timestamp += int(frac) / 10.0**len(frac)
+        return timestamp
+
+    def _current_invocation(self, timestamp):
+        """
+        This function returns the index of the current pipeline invocation, starting one if there is none or the
+        last one already finished (e.g. for a step that was run on its own).
+        """
+        if not self.invocations or self.invocations[-1]["end_time"] is not None:
+            self.invocations.append({"pipeline": None, "start_time": timestamp, "end_time": None, "run_time": None,
+                                     "steps": []})
+        return len(self.invocations) - 1
+
+    def parse_line(self, line):
+        """
+        This function records the time of the step or pipeline started or finished in the given line.
+        Args:
+            line: string, line of the log file
+
+        Returns:
+            nothing
+        """
+        match = log_step_pattern.search(line)
+        if match is None:
+            return
+        timestamp = self.get_timestamp(line)
+        if timestamp is None:
+            return
+        name, action = match.groups()
+        if name.endswith("Pipeline"):
+            if action == "done":
+                if self.invocations and self.invocations[-1]["pipeline"] == name:
+                    invocation = self.invocations[-1]
+                    invocation["end_time"] = timestamp
+                    invocation["run_time"] = timestamp - invocation["start_time"]
+            else:
+                self.invocations.append({"pipeline": name, "start_time": timestamp, "end_time": None,
+                                         "run_time": None, "steps": []})
+                self._open_steps = {}
+            return
+        step = step_class_names.get(name, name)
+        if action != "done":
+            self._open_steps[step] = timestamp
+        elif step in self._open_steps:
+            start_time = self._open_steps.pop(step)
+            invocation_idx = self._current_invocation(start_time)
+            self.invocations[invocation_idx]["steps"].append(len(self.steps))
+            self.steps.append({"step": step, "invocation": invocation_idx, "start_time": start_time,
+                               "end_time": timestamp, "run_time": timestamp - start_time})
+
+    def update(self):
+        """
+        This function reads the lines added to the log file since the last call.
+        Returns:
+            new_lines: integer, number of complete lines read
+        """
+        try:
+            stat = os.stat(self.log_file)
+        except OSError:
+            return 0
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._file_id or stat.st_size < self._offset:
+            self.reset()
+            self._file_id = file_id
+        if stat.st_size == self._offset:
+            return 0
+        with open(self.log_file, "r", errors="replace") as lf:
+            lf.seek(self._offset)
+            new_text = lf.read()
+            self._offset = lf.tell()
+        lines = (self._partial_line + new_text).split("\n")
+        # the last line may still be being written
+        self._partial_line = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+        return len(lines)
+
+    def get_step_running_times(self, steps=None):
+        """
+        This function returns the times of the last run of each step.
+        Args:
+            steps: list of strings, steps to include, if None all the steps found in the log are included
+
+        Returns:
+            step_running_times: dictionary, step_running_times["assign_wcs"] = {start_time: float, end_time: float,
+                                run_time: float}
+        """
+        step_running_times = {}
+        for step_times in self.steps:
+            if steps is None or step_times["step"] in steps:
+                step_running_times[step_times["step"]] = {"start_time": step_times["start_time"],
+                                                          "end_time": step_times["end_time"],
+                                                          "run_time": step_times["run_time"]}
+        return step_running_times
+
+
+def get_log_timeline(log_file):
+    """
+    This function returns the timeline of the given pipeline log file, reading only the lines that were added
+    since the last call for the same file.
+    Args:
+        log_file: string, path and name of the pipeline log file
+
+    Returns:
+        PipelineLogTimeline object
+    """
+    log_file = os.path.abspath(log_file)
+    if log_file not in _log_timelines:
+        _log_timelines[log_file] = PipelineLogTimeline(log_file)
+    timeline = _log_timelines[log_file]
+    timeline.update()
+    return timeline
+
+
 def calculate_step_run_time(screen_output_txt):
     """
     This function calculates the step run times from the screen_output_txt file.
@@ -347,66 +667,8 @@ def calculate_step_run_time(screen_output_txt):
         step_running_times: dictionary, with the following structure for all steps that where ran
                            step_running_times["assign_wcs"] = {start_time: float, end_time: float, run_time: float}
     """
-    def get_timestamp(time_list):
-        """
-        This sub-function obtains a time stamp from the time strings read from the screen output text file.
-        Args:
-            time_list: list, contains 2 strings (date and time)
-
-        Returns:
-            timestamp: float, time stamp
-        """
-        time_tuple, secs_frac, timestamp = [], None, None
-        stp_date = time_list[0].split("-")
-        stp_time = time_list[1].split(":")
-        # append the date
-        for item in stp_date:
-            check_for_letters = re.search('[a-zA-Z]', item)
-            if check_for_letters is None:
-                if "," not in item:  # make sure there are no fractional numbers
-                    time_tuple.append(int(item))
-            else:
-                return timestamp
-        # append the time
-        for item in stp_time:
-            if "," not in item:  # make sure there are no fractional numbers
-                time_tuple.append(int(item))
-            else:
-                # separate the fractions of seconds from seconds and append them
-                secs_frac = stp_time[-1].split(",")
-                for sf in secs_frac:
-                    time_tuple.append(int(sf))
-        # convert the time tuple into a time stamp, which HAS to have nine integer numbers
-        if len(time_tuple) < 9:
-            while len(time_tuple) is not 9:
-                time_tuple.append(0)
-        time_tuple = tuple(time_tuple)
-        timestamp = time.mktime(time_tuple)
-        return timestamp
-
-    # read the screen_output_txt file
-    pipe_steps = ["assign_wcs", "bkg_subtract", "imprint_subtract", "msa_flagging", "extract_2d", "flat_field",
-                  "srctype", "pathloss", "barshadow", "photom", "resample_spec", "cube_build", "extract_1d"]
-    step_running_times = {}
-    with open(screen_output_txt, "r") as sot:
-        for line in sot.readlines():
-            line = line.replace("\n", "")
-            if "Ending" in line:   # make sure not to overwrite the dictionary
-                continue
-            for pstp in pipe_steps:
-                if pstp in line and "running with args" in line:
-                    start_time_list = line.split()[0:2]
-                    start_time = get_timestamp(start_time_list)
-                    if start_time is None:
-                        continue
-                if pstp in line and "done" in line:
-                    end_time_list = line.split()[0:2]
-                    end_time = get_timestamp(end_time_list)
-                    if end_time is None:
-                        continue
-                    run_time = end_time - start_time
-                    step_running_times[pstp] = {"start_time" : start_time, "end_time" : end_time, "run_time" : run_time}
-    return step_running_times
+    timeline = get_log_timeline(screen_output_txt)
+    return timeline.get_step_running_times(steps=step_string_dict)
 
 
 def get_stp_run_time_from_screenfile(step, det, working_directory):
@@ -437,15 +699,8 @@ def get_stp_run_time_from_screenfile(step, det, working_directory):
     end_time = None
     if os.path.isfile(calspec2_pilelog):
         step_running_times = calculate_step_run_time(calspec2_pilelog)
-
-        for stp in step_string_dict:
-            if stp in step_running_times:
-                if stp == step:
-                    step_time = step_running_times[stp]["run_time"]
-                    end_time = step_time
-                    break
-            else:
-                continue
+        if step in step_running_times:
+            end_time = step_running_times[step]["run_time"]
 
     if end_time is None:
         print("\n * PTT unable to calculate time from "+calspec2_pilelog+" for step ", step)
@@ -456,20 +711,30 @@ def get_stp_run_time_from_screenfile(step, det, working_directory):
 
 
 
-def add_completed_steps(True_steps_suffix_map, step, outstep_file_suffix, step_completed, end_time):
+def add_completed_steps(True_steps_suffix_map, step, outstep_file_suffix, step_completed, end_time, output_file=None):
     """
-    This function adds the completed steps along with the corresponding suffix of the output file name into a text file.
+    This function adds the completed steps along with the corresponding suffix of the output file name into a text file,
+    and records them in the run manifest of the map.
     Args:
         True_steps_suffix_map: string, full path of where the text file will be written into
         step: string, pipeline step just ran
         outstep_file_suffix: string, suffix added right before .fits to the input file
         step_completed: boolean, True if the step was completed and False if it was skiped
         end_time: string, time it took for the step to run (in seconds)
+        output_file: string, path and name of the output file of the step
 
     Returns:
         nothing
     """
     #print ("Map saved at: ", True_steps_suffix_map)
+    if not records_run():
+        return
+    if get_PTT_phase() == "pipeline":
+        # the output is validated by another process as soon as the step is recorded
+        model_store.flush()
+    manifest = run_manifest.get_run_manifest(True_steps_suffix_map)
+    manifest.record_step(step, outstep_file_suffix, step_completed, float(end_time), output_file=output_file)
+    incremental_steps.record_step(step, step_completed)
     if (float(end_time)) > 60.0:
         end_time_min = float(end_time)/60.  # this is in minutes
         if end_time_min > 60.0:
@@ -485,7 +750,7 @@ def add_completed_steps(True_steps_suffix_map, step, outstep_file_suffix, step_c
 def start_end_PTT_time(txt_name, start_time=None, end_time=None):
     """
     This function calculates and prints the starting/ending PTT running time in the True_steps_suffix_map.txt or
-    full_run_map.txt file.
+    full_run_map.txt file, and records it in the run manifest of the map.
     Args:
         txt_name: string, path and name of the text file
         start_time: float, starting time
@@ -494,7 +759,11 @@ def start_end_PTT_time(txt_name, start_time=None, end_time=None):
     Returns:
         Nothing.
     """
+    if not records_run():
+        return
+    manifest = run_manifest.get_run_manifest(txt_name)
     if start_time is not None:
+        manifest.record_time("PTT_start_time", start_time)
         # start the timer to compute the step running time of PTT
         #print("PTT starting time: ", repr(start_time), "\n")
         line2write = "{:<20} {:<20}".format('# Starting PTT running time: ', repr(start_time))
@@ -503,14 +772,18 @@ def start_end_PTT_time(txt_name, start_time=None, end_time=None):
             tf.write(line2write+"\n")
 
     if end_time is not None:
-        # get the start time from the file
-        with open(txt_name, "r") as tf:
-            for line in tf.readlines():
-                if "Starting PTT running time" in line:
-                    PTT_start_time = float(line.split(":")[-1])
-                    break
+        # get the start time from the manifest, or from the file if the map was not written by this version of PTT
+        PTT_start_time = manifest.get_time("PTT_start_time")
+        if PTT_start_time is None:
+            with open(txt_name, "r") as tf:
+                for line in tf.readlines():
+                    if "Starting PTT running time" in line:
+                        PTT_start_time = float(line.split(":")[-1])
+                        break
+        manifest.record_time("PTT_end_time", end_time)
         # compute end the timer to compute PTT running time
         PTT_total_time = end_time - PTT_start_time   # this is in seconds
+        manifest.record_time("PTT_total_time", PTT_total_time)
         if PTT_total_time > 60.0:
             PTT_total_time_min = round(PTT_total_time / 60.0, 1)   # in minutes
             PTT_total_run_time = repr(PTT_total_time_min)+"min"
@@ -584,7 +857,7 @@ def set_inandout_filenames(step, config):
     initial_input_file_basename = config.get("calwebb_spec2_input_file", "input_file")
     initial_input_file = os.path.join(data_directory, initial_input_file_basename)
     # Get the detector used
-    detector = fits.getval(initial_input_file, "DETECTOR", 0)
+    detector = get_keywd_val(initial_input_file, "DETECTOR")
     True_steps_suffix_map = "full_run_map_"+detector+".txt"
     if os.path.isfile(initial_input_file):
         print("\n Taking initial input file from data_directory:")
@@ -625,6 +898,9 @@ def read_info4outputhdul(config, step_info):
     step_input_file = os.path.join(working_directory, step_input_filename)
     step_output_file = os.path.join(working_directory, output_file)
     run_calwebb_spec2 = config.getboolean("run_calwebb_spec2_in_full", "run_calwebb_spec2")
+    if not records_run():
+        # the validation processes do not write the map, but the verdicts of the tests are recorded in its manifest
+        run_manifest.get_run_manifest(txt_name)
     set_inandout_filenames_info = [step, txt_name, step_input_file, step_output_file, run_calwebb_spec2, outstep_file_suffix]
     return set_inandout_filenames_info
 
@@ -705,7 +981,7 @@ def check_completed_steps(step, step_input_file, caldet1=False):
         nothing but prints warnings
     """
     # get the header of the file
-    hdr = fits.getheader(step_input_file)
+    hdr = read_hdrfits(step_input_file)
 
     # get all the completed steps
     steps_caldet1 = ["GRPSCL", "DQINIT", "SATURA", "SUPERB", "REFPIX", "LINEAR", "DARK", "JUMP", "RAMP", "GANSCL"]
@@ -786,6 +1062,11 @@ def get_time_to_run_pipeline(True_steps_suffix_map):
         total_time: string, total calculate the total time by reading the time of each step from the map
 
     """
+    # the steps after extract_1d are not part of the pipeline time
+    total_time = run_manifest.get_run_manifest(True_steps_suffix_map).get_total_step_time(last_step="extract_1d")
+    if total_time is not None:
+        return total_time
+    # the map was not written by this version of PTT, read the text file
     #times_per_step = np.loadtxt(True_steps_suffix_map, comments="#", usecols=(3), unpack=True)
     times_per_step = []
     with open(True_steps_suffix_map, "r") as tf:
@@ -896,9 +1177,11 @@ def move_txt_files_2workdir(detector):
     Returns:
         Nothing
     """
+    if not records_run():
+        return
     # get the working directory
     config = configparser.ConfigParser()
-    config.read(['../calwebb_spec2_pytests/PTT_config.cfg'])
+    config.read([get_PTT_config_file()])
     working_dir = config.get("calwebb_spec2_input_file", "working_directory")
     # get a list of all the txt files in the calwebb_spec2_pytests dir
     latest_screenoutputtxtfile = get_latest_file("*screen*"+detector+"*.txt", detector, disregard_known_files=True) # this should pick up the output_screen file
@@ -12,22 +12,86 @@ Example usage:
     As a module
         import run_PTT
         run_PTT.run_PTT(report_name)
+
+    To run the next pipeline step while the previous step is validated (only for step by step runs), use the
+    option -o (or overlapped=True), and -w to set the number of validation processes
+        > python run_PTT report_name -o -w 2
+
+    To run NRS1 and NRS2 at the same time, each in its own directory inside the working directory, give the input
+    file of each detector with the option -i (or input_files=[...])
+        > python run_PTT report_name -i file_NRS1.fits file_NRS2.fits
+
+    To run a batch of datasets (or of configuration overlays) through a pool of processes, each in its own directory
+    and with its own copy of the PTT configuration file, give the batch file with the option -b (or batch_file=...),
+    and the maximum number of datasets running at the same time with -n
+        > python run_PTT report_name -b PTT_batch.cfg -n 3
+
+    The batch file has one section per dataset, named after the dataset. The options of a section overwrite the
+    options of PTT_config.cfg for that dataset: the options of section calwebb_spec2_input_file are given by name
+    (e.g. input_file, mode_used, raw_data_root_file) and the rest as section.option, e.g.
+        [FS_G140M_NRS1]
+        input_file = /data/fs/jwdata0010010_11010_0001_NRS1_uncal_rate.fits
+        mode_used = FS
+        raw_data_root_file = NRSSMOS-MOD-G1M-17-5344175105_1_491_SE_2015-12-10T18h00m06.fits
+        run_calwebb_spec2_in_full.run_calwebb_spec2 = False
+    An optional section [batch] sets the directory of the batch with batch_directory (default: PTT_batch inside the
+    working directory), where each dataset gets its own directory and the summary report is written.
 """
 
 import os
 import re
+import glob
+import time
+import shutil
+import threading
+import collections
 import subprocess
 import configparser
 import argparse
+from concurrent import futures
 from astropy.io import fits
 
+from auxiliary_code import run_manifest
+
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.0"
+__version__ = "1.4"
 
 # HISTORY
 # Sep 2019 - Version 1.0: initial version completed
+# Oct 2026 - Version 1.1: added the overlapped mode, where the next pipeline step runs while the previous step is
+#                         validated in a separate process
+# Oct 2026 - Version 1.2: added the concurrent runs of several detectors, each in its own directories
+# Oct 2026 - Version 1.3: added the batch runs of several datasets (or configuration overlays) through a pool of
+#                         processes, each with its own directories and configuration file
+# Oct 2026 - Version 1.4: the run manifest of the map is cleared when the overlapped run starts
+
+
+# test module of each pipeline step, in the order of step_string_dict in core_utils.py
+step_test_modules = collections.OrderedDict()
+step_test_modules["assign_wcs"]       = "A_assign_wcs/test_assign_wcs.py"
+step_test_modules["bkg_subtract"]     = "B_bkg_subtract/test_bkg_subtract.py"
+step_test_modules["imprint_subtract"] = "C_imprint_subtract/test_imprint_subtract.py"
+step_test_modules["msa_flagging"]     = "D_msa_flagging/test_msa_flagging.py"
+step_test_modules["extract_2d"]       = "E_extract_2d/test_extract_2d.py"
+step_test_modules["flat_field"]       = "F_flat_field/test_flat_field.py"
+step_test_modules["srctype"]          = "G_srctype/test_srctype.py"
+step_test_modules["pathloss"]         = "H_pathloss/test_pathloss.py"
+step_test_modules["barshadow"]        = "I_barshadow/test_barshadow.py"
+step_test_modules["photom"]           = "J_photom/test_photom.py"
+step_test_modules["resample_spec"]    = "K_resample/test_resample.py"
+step_test_modules["cube_build"]       = "L_cube_build/test_cube_build.py"
+step_test_modules["extract_1d"]       = "M_extract_1d/test_extract_1d.py"
+
+# seconds between checks of the run manifest for finished steps in the overlapped mode
+poll_time = 2.0
+
+# name of the section of the batch file with the options of the batch (the rest of the sections are datasets)
+batch_section = "batch"
+
+# directory where PTT lives
+ptt_directory = os.path.dirname(os.path.abspath(__file__))
 
 
 def read_PTTconfig_file():
@@ -43,40 +107,526 @@ def read_PTTconfig_file():
     working_dir = config.get("calwebb_spec2_input_file", "working_directory")
     input_file = config.get("calwebb_spec2_input_file", "input_file")
     input_file = os.path.join(working_dir, input_file)
-    cfg_info = [working_dir, input_file]
+    run_calwebb_spec2 = config.getboolean("run_calwebb_spec2_in_full", "run_calwebb_spec2")
+    cfg_info = [working_dir, input_file, run_calwebb_spec2]
     return cfg_info
 
 
-def run_PTT(report_name):
+def get_last_finished_step(manifest, start_time):
+    """
+    This function finds the last step that the pipeline process finished in this run.
+    Args:
+        manifest: RunManifest object, manifest of the step by step run
+        start_time: float, time when the run started
+
+    Returns:
+        idx: integer, index of the step in step_test_modules, -1 if no step has finished
+    """
+    last_idx = -1
+    for idx, step in enumerate(step_test_modules):
+        record = manifest.get_step(step)
+        # the records of previous runs are ignored until the first step starts a new run
+        if record is not None and record["recorded"] >= start_time:
+            last_idx = idx
+    return last_idx
+
+
+def get_step_verdicts(manifest, step):
+    """
+    This function returns the verdicts of the tests of the given step.
+    Args:
+        manifest: RunManifest object, manifest of the run
+        step: string, name of the pipeline step
+
+    Returns:
+        verdicts: list, verdict of each test (e.g. passed, failed, or skipped)
+    """
+    # the verdicts are recorded with the name of the test module (see conftest.py)
+    test_module = os.path.splitext(os.path.basename(step_test_modules[step]))[0]
+    return list(manifest.get_verdicts(step=test_module.replace("test_", "", 1)).values())
+
+
+def write_report_index(report_name, report_rows, row_title="Step"):
+    """
+    This function writes an html report made of other reports, i.e. a table with the verdicts of the tests of each
+    row (e.g. each step of an overlapped run, or each detector), in the given order, and the link to its html report.
+    Args:
+        report_name: string, path and name of the html report
+        report_rows: dictionary, the verdicts (list) and the name of the html report of each row
+        row_title: string, title of the first column of the table
+
+    Returns:
+        nothing
+    """
+    title = os.path.basename(report_name)
+    lines = ["<html><head><title>"+title+"</title></head><body>",
+             "<h1>PTT report: "+title+"</h1>",
+             "<table border='1'><tr><th>"+row_title+"</th><th>Passed</th><th>Failed</th><th>Skipped</th>"
+             "<th>Report</th></tr>"]
+    for row_name, (verdicts, row_report) in report_rows.items():
+        lines.append("<tr><td>"+row_name+"</td><td>"+repr(verdicts.count("passed"))+"</td><td>" +
+                     repr(verdicts.count("failed"))+"</td><td>"+repr(verdicts.count("skipped"))+"</td><td>" +
+                     "<a href='"+row_report+"'>"+row_report+"</a></td></tr>")
+    lines.append("</table></body></html>")
+    with open(report_name, "w") as rf:
+        rf.write("\n".join(lines)+"\n")
+
+
+def run_PTT_overlapped(report_name, detector, validation_workers=2, config_file="PTT_config.cfg",
+                       run_directory=None):
+    """
+    This function runs the pipeline steps in one pytest process and, as soon as each step is finished (i.e. it is
+    recorded in the run manifest), runs the tests of the step in a separate pytest process, so that the validation of
+    a step overlaps with the next pipeline steps. The validations are started in the order of the pipeline steps.
+    Args:
+        report_name: string, name of the html report
+        detector: string, detector used - DETECTOR keyword value
+        validation_workers: integer, maximum number of validation processes running at the same time
+        config_file: string, path and name of the PTT configuration file
+        run_directory: string, directory to run pytest from, where the reports are written; if None it is the
+                       current directory
+
+    Returns:
+        step_reports: dictionary, name of the html report of each step
+    """
+    start_time = time.time()
+    if run_directory is None:
+        run_directory = os.getcwd()
+    # the map of the step by step runs is in the directory pytest runs from (see core_utils.set_inandout_filenames)
+    map_file = os.path.join(run_directory, "True_steps_suffix_map_"+detector+".txt")
+    # remove the steps and verdicts of the previous runs, the pipeline process records the new ones
+    manifest = run_manifest.get_run_manifest(map_file, new_run=True)
+
+    cmd = ['pytest', '-s', '--config_file='+config_file]
+    test_modules = [os.path.join(ptt_directory, test_module) for test_module in step_test_modules.values()]
+    pipeline_process = subprocess.Popen(cmd+['--ptt_phase=pipeline']+test_modules, cwd=run_directory)
+
+    steps = list(step_test_modules)
+    next_idx = 0
+    validation_processes = []
+    step_reports = collections.OrderedDict()
+    report_root = report_name.replace(".html", "")
+    while next_idx < len(steps) or validation_processes:
+        pipeline_finished = pipeline_process.poll() is not None
+        # a step can be validated when it, or a later step, has finished; all the steps when the pipeline finished
+        last_idx = len(steps)-1 if pipeline_finished else get_last_finished_step(manifest, start_time)
+        validation_processes = [process for process in validation_processes if process.poll() is None]
+        while next_idx <= last_idx and len(validation_processes) < validation_workers:
+            step = steps[next_idx]
+            step_reports[step] = report_root+"_"+repr(next_idx+1).zfill(2)+"_"+step+".html"
+            print(' * Starting the validation of step '+step+' of '+detector)
+            validation_cmd = cmd+['--ptt_phase=validation', '--html='+step_reports[step], '--self-contained-html',
+                                  test_modules[next_idx]]
+            validation_processes.append(subprocess.Popen(validation_cmd, cwd=run_directory))
+            next_idx += 1
+        time.sleep(poll_time)
+    pipeline_process.wait()
+
+    report_rows = collections.OrderedDict()
+    for step, step_report in step_reports.items():
+        report_rows[step] = (get_step_verdicts(manifest, step), step_report)
+    write_report_index(os.path.join(run_directory, report_name), report_rows)
+    return step_reports
+
+
+def create_isolated_run(config, input_file, run_working_dir, config_name):
+    """
+    This function creates an isolated PTT run: a working directory for the files of the run (with a link to its
+    input file), a directory to run pytest from (where the pipeline log, the maps, and the run manifest are written),
+    and the PTT configuration file of the run.
+    Args:
+        config: object, the configuration file object of the run (it is modified to point to the directories)
+        input_file: string, path and name of the input file of the run
+        run_working_dir: string, working directory of the run
+        config_name: string, name of the PTT configuration file of the run
+
+    Returns:
+        run_directory: string, directory to run pytest from
+        run_config_file: string, path and name of the PTT configuration file of the run
+    """
+    run_directory = os.path.join(run_working_dir, "PTT_run")
+    os.makedirs(run_directory, exist_ok=True)
+
+    # all the test modules look for the input file in the working directory
+    run_input_file = os.path.join(run_working_dir, os.path.basename(input_file))
+    if not os.path.exists(run_input_file):
+        os.symlink(os.path.abspath(input_file), run_input_file)
+
+    config.set("calwebb_spec2_input_file", "working_directory", run_working_dir)
+    config.set("calwebb_spec2_input_file", "data_directory", run_working_dir)
+    config.set("calwebb_spec2_input_file", "input_file", os.path.basename(input_file))
+    run_config_file = os.path.join(run_directory, config_name)
+    with open(run_config_file, "w") as cf:
+        config.write(cf)
+
+    # the pipeline log of the run is written in its run directory
+    shutil.copy(os.path.join(ptt_directory, "stpipe-log.cfg"), run_directory)
+    return run_directory, run_config_file
+
+
+def get_run_verdicts(run_directory, run_working_dir):
+    """
+    This function collects the verdicts of the tests of an isolated run from its run manifests.
+    Args:
+        run_directory: string, directory pytest was run from
+        run_working_dir: string, working directory of the run
+
+    Returns:
+        verdicts: list, verdict of each test (e.g. passed, failed, or skipped)
+    """
+    verdicts = {}
+    for manifest_file in glob.glob(os.path.join(run_directory, "*_manifest.sqlite")) + \
+                         glob.glob(os.path.join(run_working_dir, "*_manifest.sqlite")):
+        verdicts.update(run_manifest.RunManifest(manifest_file).get_verdicts())
+    return list(verdicts.values())
+
+
+def move_run_reports(reports, run_directory, run_working_dir):
+    """
+    This function moves the html reports of an isolated run from its run directory to its working directory.
+    Args:
+        reports: list, names of the html reports written in the run directory
+        run_directory: string, directory pytest was run from
+        run_working_dir: string, working directory of the run
+
+    Returns:
+        nothing
+    """
+    for run_report in reports:
+        if os.path.isfile(os.path.join(run_directory, run_report)):
+            os.rename(os.path.join(run_directory, run_report), os.path.join(run_working_dir, run_report))
+
+
+def create_detector_run(input_file, working_dir):
+    """
+    This function creates the isolated run of a detector, in a directory named after the detector inside the
+    working directory (see create_isolated_run).
+    Args:
+        input_file: string, path and name of the input file of the detector
+        working_dir: string, working directory of the PTT configuration file
+
+    Returns:
+        detector: string, detector used - DETECTOR keyword value
+        det_working_dir: string, working directory of the detector
+        run_directory: string, directory to run pytest from
+        det_config_file: string, path and name of the PTT configuration file of the detector
+    """
+    detector = fits.getval(input_file, "DETECTOR", 0)
+    det_working_dir = os.path.join(working_dir, detector)
+    config = configparser.ConfigParser()
+    config.read(['../calwebb_spec2_pytests/PTT_config.cfg'])
+    run_directory, det_config_file = create_isolated_run(config, input_file, det_working_dir,
+                                                         "PTT_config_"+detector+".cfg")
+    return detector, det_working_dir, run_directory, det_config_file
+
+
+def run_PTT_detector(report_name, detector, det_config_file, run_directory, overlapped=False, validation_workers=2):
+    """
+    This function runs PTT for one detector in its isolated run directory (see create_detector_run).
+    Args:
+        report_name: string, name of the html report of the detector
+        detector: string, detector used - DETECTOR keyword value
+        det_config_file: string, path and name of the PTT configuration file of the detector
+        run_directory: string, directory to run pytest from
+        overlapped: boolean, if True the next pipeline step is run while the previous step is validated
+        validation_workers: integer, maximum number of validation processes running at the same time
+
+    Returns:
+        reports: list, names of the html reports written in the run directory
+    """
+    if overlapped:
+        step_reports = run_PTT_overlapped(report_name, detector, validation_workers=validation_workers,
+                                          config_file=det_config_file, run_directory=run_directory)
+        return [report_name]+list(step_reports.values())
+    cmd = ['pytest', ptt_directory, '-s', '--config_file='+det_config_file, '--html='+report_name,
+           '--self-contained-html']
+    subprocess.call(cmd, cwd=run_directory)
+    return [report_name]
+
+
+def run_PTT_detectors(report_name, input_files, overlapped=False, validation_workers=2):
+    """
+    This function runs PTT for several detectors at the same time, each in its own working directory, run directory,
+    pipeline log, and run manifest, and writes the report of all the detectors in the working directory.
+    Args:
+        report_name: string, name of the html report
+        input_files: list, input file of each detector (e.g. the NRS1 and NRS2 files)
+        overlapped: boolean, if True the next pipeline step is run while the previous step is validated
+        validation_workers: integer, maximum number of validation processes running at the same time per detector
+
+    Returns:
+        nothing
+    """
+    cfg_info = read_PTTconfig_file()
+    working_dir = cfg_info[0]
+    if overlapped and cfg_info[2]:
+        print('-> The pipeline is set to run in full, so the steps can not be overlapped with the validation.')
+        overlapped = False
+
+    detector_runs = collections.OrderedDict()
+    for input_file in input_files:
+        # the input file can also be given by name, from the working directory
+        if not os.path.isfile(input_file):
+            input_file = os.path.join(working_dir, input_file)
+        detector_run = create_detector_run(input_file, working_dir)
+        if detector_run[0] in detector_runs:
+            raise ValueError("Two input files of detector "+detector_run[0]+" were given, only one per detector "
+                             "can be run at the same time.")
+        detector_runs[detector_run[0]] = detector_run
+
+    report_root = report_name.replace(".html", "")
+    threads, detector_reports = [], {}
+
+    def run_detector(detector, det_config_file, run_directory):
+        det_report_name = report_root+"_"+detector+".html"
+        detector_reports[detector] = run_PTT_detector(det_report_name, detector, det_config_file, run_directory,
+                                                      overlapped=overlapped, validation_workers=validation_workers)
+
+    for detector, (_, det_working_dir, run_directory, det_config_file) in detector_runs.items():
+        print(' * Running PTT for detector '+detector+' in directory: '+det_working_dir)
+        thread = threading.Thread(target=run_detector, args=(detector, det_config_file, run_directory))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    # move the reports of each detector to its working directory, and write the report of all the detectors
+    report_rows = collections.OrderedDict()
+    for detector, (_, det_working_dir, run_directory, _) in detector_runs.items():
+        reports = detector_reports.get(detector, [])
+        move_run_reports(reports, run_directory, det_working_dir)
+        if not reports:
+            print('WARNING: The html report of detector '+detector+' was not created, something went wrong!')
+            continue
+        report_rows[detector] = (get_run_verdicts(run_directory, det_working_dir), os.path.join(detector, reports[0]))
+    write_report_index(os.path.join(working_dir, report_name), report_rows, row_title="Detector")
+    print('PTT report of all the detectors written in: ', os.path.join(working_dir, report_name))
+
+
+def read_batch_file(batch_file, working_dir):
+    """
+    This function reads the batch file, i.e. the directory of the batch and the configuration overlay of each dataset.
+    Args:
+        batch_file: string, path and name of the batch file
+        working_dir: string, working directory of the PTT configuration file
+
+    Returns:
+        batch_directory: string, directory where each dataset gets its own directory
+        overlays: dictionary, the options (dictionary of (section, option) - value) of each dataset, in the order of
+                  the batch file
+    """
+    batch = configparser.ConfigParser()
+    if not batch.read(batch_file):
+        raise ValueError("The batch file "+batch_file+" can not be read.")
+    batch_directory = os.path.join(working_dir, "PTT_batch")
+    if batch.has_section(batch_section):
+        batch_directory = batch.get(batch_section, "batch_directory", fallback=batch_directory)
+    overlays = collections.OrderedDict()
+    for dataset in batch.sections():
+        if dataset == batch_section:
+            continue
+        overlay = collections.OrderedDict()
+        for option, value in batch.items(dataset):
+            section = "calwebb_spec2_input_file"
+            if "." in option:
+                section, option = option.split(".", 1)
+            overlay[(section, option)] = value
+        overlays[dataset] = overlay
+    if not overlays:
+        raise ValueError("The batch file "+batch_file+" does not have any datasets.")
+    return os.path.abspath(batch_directory), overlays
+
+
+def create_dataset_run(dataset, overlay, batch_directory):
+    """
+    This function creates the isolated run of a dataset of a batch, in a directory named after the dataset inside the
+    batch directory (see create_isolated_run). The configuration of the dataset is a copy, in memory, of PTT_config.cfg
+    with the options of its overlay, so PTT_config.cfg is not modified.
+    Args:
+        dataset: string, name of the dataset
+        overlay: dictionary, options of PTT_config.cfg to overwrite, (section, option) - value
+        batch_directory: string, directory where each dataset gets its own directory
+
+    Returns:
+        detector: string, detector used - DETECTOR keyword value
+        dataset_working_dir: string, working directory of the dataset
+        run_directory: string, directory to run pytest from
+        dataset_config_file: string, path and name of the PTT configuration file of the dataset
+    """
+    config = configparser.ConfigParser()
+    config.read(['../calwebb_spec2_pytests/PTT_config.cfg'])
+    for (section, option), value in overlay.items():
+        if not config.has_section(section):
+            raise ValueError("The option "+section+"."+option+" of dataset "+dataset+" is not in a section of "
+                             "PTT_config.cfg.")
+        config.set(section, option, value)
+
+    # the input file can also be given by name, from the data or the working directory of the dataset
+    input_file = config.get("calwebb_spec2_input_file", "input_file")
+    for directory in ("data_directory", "working_directory"):
+        if os.path.isfile(input_file):
+            break
+        input_file = os.path.join(config.get("calwebb_spec2_input_file", directory),
+                                  config.get("calwebb_spec2_input_file", "input_file"))
+    detector = fits.getval(input_file, "DETECTOR", 0)
+    dataset_working_dir = os.path.join(batch_directory, dataset)
+    run_directory, dataset_config_file = create_isolated_run(config, input_file, dataset_working_dir,
+                                                             "PTT_config_"+dataset+".cfg")
+    return detector, dataset_working_dir, run_directory, dataset_config_file
+
+
+def read_run_in_full(config_file):
+    """
+    This function reads if the pipeline is set to run in full in the given PTT configuration file.
+    Args:
+        config_file: string, path and name of the PTT configuration file
+
+    Returns:
+        boolean
+    """
+    config = configparser.ConfigParser()
+    config.read([config_file])
+    return config.getboolean("run_calwebb_spec2_in_full", "run_calwebb_spec2")
+
+
+def run_PTT_dataset(report_name, detector, dataset_config_file, run_directory, dataset_working_dir,
+                    overlapped=False, validation_workers=2):
+    """
+    This function runs PTT for one dataset of a batch, in a process of the pool, and moves its reports to the
+    working directory of the dataset.
+    Args:
+        report_name: string, name of the html report of the dataset
+        detector: string, detector used - DETECTOR keyword value
+        dataset_config_file: string, path and name of the PTT configuration file of the dataset
+        run_directory: string, directory to run pytest from
+        dataset_working_dir: string, working directory of the dataset
+        overlapped: boolean, if True the next pipeline step is run while the previous step is validated
+        validation_workers: integer, maximum number of validation processes running at the same time
+
+    Returns:
+        reports: list, names of the html reports written in the working directory of the dataset
+    """
+    overlapped = overlapped and not read_run_in_full(dataset_config_file)
+    reports = run_PTT_detector(report_name, detector, dataset_config_file, run_directory, overlapped=overlapped,
+                               validation_workers=validation_workers)
+    move_run_reports(reports, run_directory, dataset_working_dir)
+    return [run_report for run_report in reports if os.path.isfile(os.path.join(dataset_working_dir, run_report))]
+
+
+def run_PTT_batch(report_name, batch_file, max_processes=2, overlapped=False, validation_workers=2):
+    """
+    This function runs PTT for the datasets of the batch file through a pool of processes, each dataset in its own
+    working directory, run directory, and configuration file, and writes the summary report of the batch in the
+    batch directory.
+    Args:
+        report_name: string, name of the html report
+        batch_file: string, path and name of the batch file
+        max_processes: integer, maximum number of datasets running at the same time
+        overlapped: boolean, if True the next pipeline step is run while the previous step is validated
+        validation_workers: integer, maximum number of validation processes running at the same time per dataset
+
+    Returns:
+        report_rows: dictionary, the verdicts (list) and the html report of each dataset that finished
+    """
+    cfg_info = read_PTTconfig_file()
+    batch_directory, overlays = read_batch_file(batch_file, cfg_info[0])
+
+    # the directories of all the datasets are created first, so the errors in the batch file show up before running
+    dataset_runs = collections.OrderedDict()
+    for dataset, overlay in overlays.items():
+        dataset_runs[dataset] = create_dataset_run(dataset, overlay, batch_directory)
+
+    report_root = report_name.replace(".html", "")
+    dataset_futures = collections.OrderedDict()
+    with futures.ProcessPoolExecutor(max_workers=max(int(max_processes), 1)) as pool:
+        for dataset, (detector, dataset_working_dir, run_directory, dataset_config_file) in dataset_runs.items():
+            print(' * Queueing PTT for dataset '+dataset+' ('+detector+') in directory: '+dataset_working_dir)
+            dataset_futures[dataset] = pool.submit(run_PTT_dataset, report_root+"_"+dataset+".html", detector,
+                                                   dataset_config_file, run_directory, dataset_working_dir,
+                                                   overlapped=overlapped, validation_workers=validation_workers)
+
+    # write the summary report of the batch
+    report_rows = collections.OrderedDict()
+    for dataset, future in dataset_futures.items():
+        _, dataset_working_dir, run_directory, _ = dataset_runs[dataset]
+        if future.exception() is not None:
+            print('WARNING: PTT failed for dataset '+dataset+': '+repr(future.exception()))
+            continue
+        reports = future.result()
+        if not reports:
+            print('WARNING: The html report of dataset '+dataset+' was not created, something went wrong!')
+            continue
+        report_rows[dataset] = (get_run_verdicts(run_directory, dataset_working_dir),
+                                os.path.join(dataset, reports[0]))
+    os.makedirs(batch_directory, exist_ok=True)
+    write_report_index(os.path.join(batch_directory, report_name), report_rows, row_title="Dataset")
+    print('\n * Summary of the batch:')
+    for dataset, (verdicts, _) in report_rows.items():
+        print('   '+dataset+': passed='+repr(verdicts.count("passed"))+', failed='+repr(verdicts.count("failed")) +
+              ', skipped='+repr(verdicts.count("skipped")))
+    print('PTT report of the batch written in: ', os.path.join(batch_directory, report_name))
+    return report_rows
+
+
+def run_PTT(report_name, overlapped=False, validation_workers=2, input_files=None, batch_file=None,
+            max_processes=2):
     """
     This function runs PTT and then moves the html report into the working directory specified
     in the PTT configuration file.
     Args:
     report_name: string, name of the html report
+    overlapped: boolean, if True (and the pipeline is run step by step) the next pipeline step is run while the
+                previous step is validated, and the report of each step is written in its own html file
+    validation_workers: integer, maximum number of validation processes running at the same time (overlapped mode)
+    input_files: list, if given, the input file of each detector to run at the same time (e.g. NRS1 and NRS2), each
+                 in its own directory inside the working directory
+    batch_file: string, if given, the batch file with the datasets (or configuration overlays) to run through a pool
+                of processes, each in its own directory inside the batch directory
+    max_processes: integer, maximum number of datasets of the batch running at the same time
     """
     print('Running PTT. This may take a while...')
-    
+
+    if 'html' not in report_name:
+        report_name = report_name+'.html'
+
+    if batch_file:
+        run_PTT_batch(report_name, batch_file, max_processes=max_processes, overlapped=overlapped,
+                      validation_workers=validation_workers)
+        return
+
+    if input_files:
+        run_PTT_detectors(report_name, input_files, overlapped=overlapped, validation_workers=validation_workers)
+        return
+
     # get the html report and the info from the PTT config file
     cfg_info = read_PTTconfig_file()
     
     # get the detector and make sure it is in the name of the output html report
     detector = fits.getval(cfg_info[1], "DETECTOR", 0)
-    if 'html' not in report_name:
-        report_name = report_name+'.html'
     if detector not in report_name:
         report_name_list = report_name.split(".html")
         report_name = report_name_list[0]+'_'+detector+".html"
         print('-> The detector used added to the html report name: ', report_name)
 
     # run PTT
-    cmd = ['pytest', '-s', '--config_file=PTT_config.cfg', '--html='+report_name,
-           '--self-contained-html']
-    subprocess.call(cmd)
+    step_reports = {}
+    if overlapped and cfg_info[2]:
+        print('-> The pipeline is set to run in full, so the steps can not be overlapped with the validation.')
+        overlapped = False
+    if overlapped:
+        step_reports = run_PTT_overlapped(report_name, detector, validation_workers=validation_workers)
+    else:
+        cmd = ['pytest', '-s', '--config_file=PTT_config.cfg', '--html='+report_name,
+               '--self-contained-html']
+        subprocess.call(cmd)
 
     # move the html report
     if os.path.isfile(report_name):
         print('Moving PTT html report to working directory')
         os.rename(report_name, os.path.join(cfg_info[0], report_name))
+        for step_report in step_reports.values():
+            if os.path.isfile(step_report):
+                os.rename(step_report, os.path.join(cfg_info[0], step_report))
         print('Done.')
     else:
         print('WARNING: The html report was not created, something went wrong!')
@@ -91,13 +641,42 @@ if __name__ == '__main__':
                         action='store',
                         default=None,
                         help='Name of the html report, e.g. report_NRS2_v2')
+    parser.add_argument("-o",
+                        dest="overlapped",
+                        action='store_true',
+                        default=False,
+                        help='Run the next pipeline step while the previous step is validated, e.g. -o')
+    parser.add_argument("-w",
+                        dest="validation_workers",
+                        action='store',
+                        default=2,
+                        type=int,
+                        help='Number of validation processes for the overlapped mode, e.g. -w 2')
+    parser.add_argument("-i",
+                        dest="input_files",
+                        action='store',
+                        nargs='+',
+                        default=None,
+                        help='Input files of the detectors to run at the same time, e.g. -i file_NRS1.fits file_NRS2.fits')
+    parser.add_argument("-b",
+                        dest="batch_file",
+                        action='store',
+                        default=None,
+                        help='Batch file with the datasets to run through a pool of processes, e.g. -b PTT_batch.cfg')
+    parser.add_argument("-n",
+                        dest="max_processes",
+                        action='store',
+                        default=2,
+                        type=int,
+                        help='Maximum number of datasets of the batch running at the same time, e.g. -n 3')
     args = parser.parse_args()
                         
     # Set the variables
     report_name = args.report_name
         
     # Perform data move to the science extension and the keyword check on the file with the right number of extensions
-    run_PTT(report_name)
+    run_PTT(report_name, overlapped=args.overlapped, validation_workers=args.validation_workers,
+            input_files=args.input_files, batch_file=args.batch_file, max_processes=args.max_processes)
 
 
     print ('\n * Script  run_PTT.py  finished * \n')
@@ -0,0 +1,100 @@
+import os
+import sys
+import textwrap
+import importlib
+import subprocess
+
+
+"""
+This test runs a step module in the validation phase of the overlapped runs (pytest --ptt_phase=validation, see
+run_PTT.py), with the conftest.py of PTT as plugin, and checks that the verdicts of its tests are recorded in the run
+manifest of the map of the step.
+
+The step module does not run the pipeline, so this test only needs pytest and astropy.
+"""
+
+
+# HEADER
+__author__ = "M. A. Pena-Guerrero"
+__version__ = "1.0"
+
+# HISTORY
+# Oct 2026 - Version 1.0: initial version completed
+
+
+# the tool is a package, e.g. nirspec_pipe_testing_tool, so PTT is imported through the directory that contains it
+tool_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+tool_package = os.path.basename(tool_directory)
+
+ptt_config = """
+[calwebb_spec2_input_file]
+working_directory = {working_directory}
+data_directory = {working_directory}
+input_file = fake_rate.fits
+mode_used = FS
+raw_data_root_file = fake_raw.fits
+
+[run_calwebb_spec2_in_full]
+run_calwebb_spec2 = False
+
+[run_pipe_steps]
+fake_step = True
+
+[esa_intermediary_products]
+esa_files_path = {working_directory}
+msa_conf_name = fake_msa.fits
+
+[additional_arguments]
+memory_sample_interval = 0
+"""
+
+# the module is named after the step, as the PTT test modules (e.g. A_assign_wcs/test_assign_wcs.py)
+step_module = """
+import os
+import pytest
+
+from {tool_package}.calwebb_spec2_pytests import core_utils
+
+
+@pytest.fixture(scope="module")
+def set_inandout_filenames(config):
+    True_steps_suffix_map = os.path.join(os.getcwd(), "True_steps_suffix_map_NRS1.txt")
+    return "fake_step", "fake_rate.fits", "fake_rate_fake_step.fits", "", "_fake_step", True_steps_suffix_map
+
+
+@pytest.fixture(scope="module")
+def output_hdul(set_inandout_filenames, config):
+    return core_utils.read_info4outputhdul(config, set_inandout_filenames)
+
+
+def test_fake_step_passes(output_hdul):
+    assert output_hdul[0] == "fake_step"
+
+
+def test_fake_step_fails(output_hdul):
+    assert output_hdul[0] != "fake_step"
+"""
+
+
+def test_validation_phase_records_verdicts(tmp_path):
+    config_file = tmp_path / "PTT_config.cfg"
+    config_file.write_text(ptt_config.format(working_directory=tmp_path))
+    (tmp_path / "test_fake_step.py").write_text(textwrap.dedent(step_module.format(tool_package=tool_package)))
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(tool_directory), env.get("PYTHONPATH", "")])
+    cmd = [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", "-p", tool_package+".calwebb_spec2_pytests.conftest",
+           "--config_file="+str(config_file), "--ptt_phase=validation", "test_fake_step.py"]
+    pytest_run = subprocess.run(cmd, cwd=str(tmp_path), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+    # one test fails on purpose
+    assert pytest_run.returncode == 1, pytest_run.stdout
+
+    sys.path.insert(0, os.path.dirname(tool_directory))
+    try:
+        run_manifest = importlib.import_module(tool_package+".calwebb_spec2_pytests.auxiliary_code.run_manifest")
+    finally:
+        sys.path.remove(os.path.dirname(tool_directory))
+    manifest = run_manifest.get_run_manifest(str(tmp_path / "True_steps_suffix_map_NRS1.txt"))
+    assert manifest.get_verdicts(step="fake_step") == {"test_fake_step.py::test_fake_step_passes": "passed",
+                                                       "test_fake_step.py::test_fake_step_fails": "failed"}
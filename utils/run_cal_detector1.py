@@ -22,6 +22,8 @@ from jwst.jump.jump_step import JumpStep
 from jwst.ramp_fitting.ramp_fit_step import RampFitStep
 from jwst.gain_scale.gain_scale_step import GainScaleStep
 
+import step_timing
+
 
 """
 This script will perform calwebb_detector1 in one single run, outputing intermediary files named:
@@ -36,7 +38,7 @@ This script will perform calwebb_detector1 in one single run, outputing intermed
 
 # HEADER
 __author__ = "M. A. Pena-Guerrero"
-__version__ = "1.4"
+__version__ = "1.6"
 
 # HISTORY
 # Nov 2017 - Version 1.0: initial version completed
@@ -44,6 +46,8 @@ __version__ = "1.4"
 # Feb 2019 - Version 1.2: made changes to be able to process 491 and 492 files in the same directory
 # Mar 2019 - Version 1.3: added logging capability
 # May 2019 - Version 1.4: added capability to process darks
+# Oct 2026 - Version 1.5: the wall time, CPU time, and peak memory of each step are recorded through step hooks
+# Oct 2026 - Version 1.6: step_timing is imported from the utils directory, as the other shared scripts
 
 
 def get_caldet1cfg_and_workingdir():
@@ -189,6 +193,9 @@ with open(txt_outputs_summary, "w+") as tf:
 # Name of the file containing all the pipeline output
 caldetector1_pipeline_log = "pipeline.log"
 
+# record the running time and memory of every step, without reading the pipeline log
+step_timing.install_step_hooks()
+
 #final_output_caldet1 = "gain_scale.fits"
 final_output_caldet1 = "final_output_caldet1_"+detector+".fits"
 output_names = ["group_scale.fits", "dq_init.fits", "saturation.fits", "superbias.fits", "refpix.fits",
@@ -340,6 +347,14 @@ msg = "\n ** Calwebb_detector 1 took "+repr(tot_time)+" to complete **"
 print(msg)
 logging.info(msg)
 
+# write the step running times and memory recorded by the step hooks
+step_timing.remove_step_hooks()
+step_timings_file = os.path.join(working_dir, "caldetector1_step_timings_"+detector+".jsonl")
+step_timing.write_step_records(step_timings_file)
+msg = "Step running times, CPU times, and peak memory written in file: "+step_timings_file
+print(msg)
+logging.info(msg)
+
 
 # Move products to working dir
 